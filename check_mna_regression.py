@@ -0,0 +1,81 @@
+# check_mna_regression.py
+# -*- coding: utf-8 -*-
+
+"""
+MNA 後端回歸檢查：
+以 Ngspice 模擬擬合 Netlist (CM / NM / CM+NM) 的參考數據 ('data/ngspice_reference/')，
+檢查 M11 的 Netlist 解析、編譯後 stamp 表與伴隨法 Jacobian 是否仍在容許誤差內。
+
+    python check_mna_regression.py                      # 與參考數據比對
+    python check_mna_regression.py --capture            # 以 Ngspice 重新產生參考數據後比對
+    python check_mna_regression.py --capture --ngspice /usr/bin/ngspice --reference-dir /tmp/ref
+
+結束代碼：0 = 全部通過，1 = 超出容許誤差，2 = 缺少參考數據或 Ngspice。
+"""
+
+import os
+import sys
+import shutil
+import argparse
+
+try:
+    from modules import m11_mna_solver as m11
+except ImportError:
+    print("錯誤：無法導入 M11 模組。請確保此腳本位於專案根目錄下。")
+    sys.exit(2)
+
+def _use_ngspice(executable):
+    """讓 M05 使用指定 (或 PATH 上) 的 Ngspice；回傳實際使用的路徑，找不到時回傳 None。"""
+    import modules.m05_ngspice_runner as m05
+    executable = executable or (m05.NGSPICE_EXECUTABLE_PATH if os.path.exists(m05.NGSPICE_EXECUTABLE_PATH)
+                                else shutil.which('ngspice'))
+    if not executable or not os.path.exists(executable):
+        return None
+    m05.NGSPICE_EXECUTABLE_PATH = executable
+    return executable
+
+def main():
+    parser = argparse.ArgumentParser(description="以 Ngspice 參考數據檢查 MNA 後端")
+    parser.add_argument('--capture', action='store_true', help="先以 Ngspice 重新產生參考數據")
+    parser.add_argument('--ngspice', default=None, help="Ngspice 執行檔 (預設為 M05 的設定，不存在時使用 PATH 上的 ngspice)")
+    parser.add_argument('--reference-dir', default=m11.REFERENCE_DIR, help="參考數據目錄")
+    parser.add_argument('--modes', nargs='+', default=list(m11.REFERENCE_MODES), help="要檢查的擬合模式")
+    args = parser.parse_args()
+
+    print("--- MNA 後端回歸檢查 ---")
+    if args.capture:
+        executable = _use_ngspice(args.ngspice)
+        if executable is None:
+            print("錯誤：找不到 Ngspice 執行檔，無法產生參考數據。")
+            return 2
+        print(f"使用 Ngspice: {executable}")
+        for mode in args.modes:
+            path, error = m11.capture_fitting_reference(mode, m11.fitting_reference_path(mode, args.reference_dir))
+            if path is None:
+                print(f"[{mode}] 產生參考數據失敗: {error}")
+                return 2
+            print(f"[{mode}] 已產生參考數據: {path}")
+
+    status = 0
+    for mode in args.modes:
+        path = m11.fitting_reference_path(mode, args.reference_dir)
+        if not os.path.exists(path):
+            print(f"[{mode}] 缺少參考數據: {path} (請以 --capture 產生)")
+            status = max(status, 2)
+            continue
+        report, error = m11.check_fitting_reference(path)
+        if report is None:
+            print(f"[{mode}] {error}")
+            status = max(status, 2)
+            continue
+        verdict = "通過" if not report['failures'] else f"失敗 ({', '.join(report['failures'])})"
+        print(f"[{mode}] {verdict}：{report['points']} 點，Netlist {report['deck']:.2e}，stamp 表 {report['fitting']:.2e}，"
+              f"伴隨法 {report['adjoint']:.2e}，Jacobian {report['jacobian']:.2e}  ({report['ngspice'] or 'Ngspice 版本不明'})")
+        if report['failures']:
+            status = max(status, 1)
+    tolerance = m11.REFERENCE_TOLERANCE
+    print(f"容許誤差：阻抗 {tolerance['impedance']:.0e}，Jacobian {tolerance['jacobian']:.0e}")
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -10,13 +10,26 @@
 3. 使用線性插值將兩組資料對齊到新的頻率軸上。
 4. 將處理完成的資料輸出成單一 CSV 檔案。
 5. 記錄所有操作過程至指定的日誌檔案。
+6. 自適應取樣模式 (adaptive=True)：依量測 |Z| 在對數座標上的斜率與曲率挑出精簡的頻率點集合
+   (共振附近密集、平滑區稀疏)，並附上各點的積分權重 ('Weight' 欄位)，
+   使 M03 / M04 的加權 RMSE 近似原本 401 點頻率軸上的 RMSE。
+7. align_measurement_files()：對齊任意一組量測檔 (例如 M21 工作佇列中的各個元件)，
+   頻率軸取各檔共同的頻率範圍，以 MHz 記錄的量測檔 (如 data/3216CM.txt) 自動換算為 Hz。
 """
 
 import os
+import sys
 import logging
 import numpy as np
 import pandas as pd
 from scipy.interpolate import interp1d
+from typing import List, Dict, Optional
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from modules.m20_frequency_schedule import quadrature_weights
 
 # --- 全域設定 ---
 # 頻率軸規格
@@ -24,6 +37,20 @@ FREQ_START = 1e6  # 1 MHz
 FREQ_STOP = 3e9   # 3 GHz
 NUM_POINTS = 401  # 401 點
 
+# 自適應取樣設定
+ADAPTIVE_SAMPLING = False
+# 自 401 點中挑選的頻率點數
+ADAPTIVE_NUM_POINTS = 101
+# 取樣密度 ∝ 1 + 斜率權重·|dy/dx| / 平均 + 曲率權重·sqrt|d²y/dx²| / 平均 (y = log10|Z|，x = log10 f)；
+# 常數項保留平滑區的基本取樣，sqrt 曲率為分段線性近似誤差最小的取樣密度
+ADAPTIVE_SLOPE_WEIGHT = 1.0
+ADAPTIVE_CURVATURE_WEIGHT = 1.0
+# 計算導數前以此點數的移動平均平滑 log10|Z|，避免量測雜訊被當成曲率
+ADAPTIVE_SMOOTHING = 5
+
+# 量測檔的最高頻率低於此值時視為以 MHz 記錄 (例如 data/3216CM.txt)，讀取時乘上 1e6 換算為 Hz
+MHZ_DETECTION_MAX_FREQ = 1e5
+
 # --- 【新增】定義專案根目錄 ---
 # 取得此腳本檔案所在的目錄的絕對路徑 (例如: /path/to/project/modules)
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -41,6 +68,8 @@ INPUT_FILES = {
     'NM': os.path.join(DATA_DIR, '801NM.txt')
 }
 OUTPUT_CSV_PATH = os.path.join(OUTPUT_DIR, 'm01_interpolated_data.csv')
+# 自適應取樣模式下另存完整的 401 點資料
+OUTPUT_DENSE_CSV_PATH = os.path.join(OUTPUT_DIR, 'm01_interpolated_data_dense.csv')
 
 # --- 日誌設定 ---
 def setup_logging():
@@ -68,10 +97,49 @@ def setup_logging():
 logger = setup_logging()
 
 # --- 核心功能 ---
-def align_and_interpolate():
+def adaptive_frequency_indices(freq_axis: np.ndarray, impedances: List[np.ndarray], num_points: int = ADAPTIVE_NUM_POINTS) -> np.ndarray:
+    """
+    依取樣密度 (見 ADAPTIVE_SLOPE_WEIGHT / ADAPTIVE_CURVATURE_WEIGHT) 在 log10 頻率上的累積量等分挑選頻率點，
+    多組阻抗 (CM、NM) 時取各自密度的最大值。回傳遞增且包含兩端的索引，點數不少於 num_points (不超過頻率點數)。
+    """
+    count = len(freq_axis)
+    if num_points >= count:
+        return np.arange(count)
+    log_f = np.log10(freq_axis)
+    density = np.ones(count)
+    pad = ADAPTIVE_SMOOTHING // 2
+    kernel = np.ones(ADAPTIVE_SMOOTHING) / ADAPTIVE_SMOOTHING
+    for z in impedances:
+        finite = np.isfinite(z) & (z > 0)
+        if finite.sum() < ADAPTIVE_SMOOTHING:
+            continue
+        # 超出量測範圍的 NaN 以最近的有效值補齊，只影響密度估計
+        log_z = np.interp(log_f, log_f[finite], np.log10(z[finite]))
+        smoothed = np.convolve(np.pad(log_z, pad, mode='edge'), kernel, mode='valid')
+        slope = np.abs(np.gradient(smoothed, log_f))
+        curvature = np.sqrt(np.abs(np.gradient(np.gradient(smoothed, log_f), log_f)))
+        candidate = (1 + ADAPTIVE_SLOPE_WEIGHT * slope / max(slope.mean(), 1e-12)
+                     + ADAPTIVE_CURVATURE_WEIGHT * curvature / max(curvature.mean(), 1e-12))
+        density = np.maximum(density, candidate)
+    cumulative = np.concatenate([[0.0], np.cumsum((density[1:] + density[:-1]) / 2 * np.diff(log_f))])
+    # 高密度區可能對應到同一個頻率點，逐步增加等分數直到去除重複後的點數足夠
+    for targets in range(num_points, count + 1):
+        levels = np.linspace(0.0, cumulative[-1], targets)
+        indices = np.unique(np.abs(cumulative[:, None] - levels[None, :]).argmin(axis=0))
+        if len(indices) >= num_points:
+            break
+    return indices
+
+def align_and_interpolate(adaptive: bool = ADAPTIVE_SAMPLING, adaptive_points: int = ADAPTIVE_NUM_POINTS):
     """
     執行阻抗資料的讀取、對齊與插值。
 
+    Args:
+        adaptive (bool): 自適應取樣模式：完整的 401 點資料另存至 OUTPUT_DENSE_CSV_PATH，
+                         輸出檔只保留 adaptive_frequency_indices() 挑出的 adaptive_points 個頻率點，
+                         並加上 'Weight' 欄位 (log10 頻率上的梯形積分權重，總和為 1)。
+        adaptive_points (int): 自適應取樣的頻率點數。
+
     Returns:
         pd.DataFrame: 包含標準頻率軸與兩組插值後阻抗資料的 DataFrame，
                       若處理失敗則返回 None。
@@ -148,6 +216,15 @@ def align_and_interpolate():
     # 6. 儲存結果
     try:
         os.makedirs(OUTPUT_DIR, exist_ok=True)
+        if adaptive:
+            final_df.to_csv(OUTPUT_DENSE_CSV_PATH, index=False, float_format='%.6e')
+            logger.info(f"自適應取樣：完整 {NUM_POINTS} 點資料另存至: {OUTPUT_DENSE_CSV_PATH}")
+            indices = adaptive_frequency_indices(
+                target_freq_axis, [final_df[column].values for column in interpolated_results], adaptive_points
+            )
+            final_df = final_df.iloc[indices].reset_index(drop=True)
+            final_df['Weight'] = quadrature_weights(final_df['Frequency_Hz'].values)
+            logger.info(f"自適應取樣：依 |Z| 的斜率與曲率挑出 {len(final_df)} 個頻率點並附上積分權重。")
         final_df.to_csv(OUTPUT_CSV_PATH, index=False, float_format='%.6e')
         logger.info(f"已成功將結果儲存至: {OUTPUT_CSV_PATH}")
     except Exception as e:
@@ -158,6 +235,60 @@ def align_and_interpolate():
     return final_df
 
 
+def read_measurement_file(file_path: str, freq_scale: Optional[float] = None) -> Optional[pd.DataFrame]:
+    """
+    讀取兩欄 (頻率, 阻抗) 的量測檔，回傳依頻率排序的 'Frequency' (Hz)、'Impedance' 欄位。
+    freq_scale 為頻率欄換算為 Hz 的倍數，None 時依 MHZ_DETECTION_MAX_FREQ 自動判斷 Hz 或 MHz。
+    檔案不存在或內容不是兩欄數值 (例如同目錄下的 Tai_CM.txt 網表) 時回傳 None。
+    """
+    try:
+        source_data = pd.read_csv(file_path, sep=r'\s+', header=None, usecols=[0, 1], names=['Frequency', 'Impedance'],
+                                  engine='python', encoding_errors='replace')
+    except (OSError, ValueError, pd.errors.ParserError) as e:
+        logger.warning(f"無法讀取量測檔 {file_path}: {e}")
+        return None
+    source_data = source_data.apply(pd.to_numeric, errors='coerce')
+    if len(source_data) < 2 or source_data.isnull().values.any():
+        logger.warning(f"量測檔 {file_path} 不是兩欄數值資料，已略過。")
+        return None
+    if freq_scale is None:
+        freq_scale = 1e6 if source_data['Frequency'].max() < MHZ_DETECTION_MAX_FREQ else 1.0
+    source_data['Frequency'] *= freq_scale
+    return source_data.sort_values('Frequency').reset_index(drop=True)
+
+def align_measurement_files(input_files: Dict[str, str], output_csv_path: Optional[str] = None,
+                            freq_scale: Optional[float] = None, num_points: int = NUM_POINTS) -> Optional[pd.DataFrame]:
+    """
+    將一組量測檔 (例如 {'CM': '.../3216CM.txt', 'NM': '.../3216NM.txt'}) 以線性插值對齊到同一個對數頻率軸。
+    與 align_and_interpolate() 的固定頻率軸不同，頻率範圍取各檔共同的範圍 (再限制在 FREQ_START ~ FREQ_STOP 內)，
+    不會產生外插的 NaN。指定 output_csv_path 時一併寫出 CSV。
+
+    Returns:
+        pd.DataFrame: 'Frequency_Hz' 與各來源的 'Z_{來源}' 欄位；任何檔案無法讀取或沒有共同頻率範圍時回傳 None。
+    """
+    sources = {}
+    for source_type, file_path in input_files.items():
+        source_data = read_measurement_file(file_path, freq_scale)
+        if source_data is None:
+            logger.error(f"無法讀取 {source_type} 量測檔: {file_path}")
+            return None
+        sources[source_type] = source_data
+    low = max([FREQ_START] + [data['Frequency'].iloc[0] for data in sources.values()])
+    high = min([FREQ_STOP] + [data['Frequency'].iloc[-1] for data in sources.values()])
+    if low >= high:
+        logger.error(f"量測檔 {list(input_files.values())} 在 {FREQ_START:.3g} ~ {FREQ_STOP:.3g} Hz 內沒有共同的頻率範圍。")
+        return None
+    target_freq_axis = np.logspace(np.log10(low), np.log10(high), num_points)
+    final_df = pd.DataFrame({'Frequency_Hz': target_freq_axis})
+    for source_type, source_data in sources.items():
+        final_df[f'Z_{source_type}'] = np.interp(target_freq_axis, source_data['Frequency'], source_data['Impedance'])
+    logger.info(f"已對齊 {list(input_files)}：{low:.3e} ~ {high:.3e} Hz，共 {num_points} 點。")
+    if output_csv_path:
+        os.makedirs(os.path.dirname(os.path.abspath(output_csv_path)), exist_ok=True)
+        final_df.to_csv(output_csv_path, index=False, float_format='%.6e')
+    return final_df
+
+
 if __name__ == '__main__':
     print("正在執行 M01 模組 (align_interpolate)...")
     
@@ -185,3 +316,9 @@ if __name__ == '__main__':
     else:
         print("\n處理失敗，請檢查日誌檔案獲取詳細資訊。")
         print(f"日誌檔案路徑: {LOG_FILE_PATH}")
+
+    # 自適應取樣模式：較少的頻率點與對應的積分權重
+    adaptive_dataframe = align_and_interpolate(adaptive=True)
+    if adaptive_dataframe is not None:
+        print(f"\n自適應取樣：{len(adaptive_dataframe)} 點 (權重總和 {adaptive_dataframe['Weight'].sum():.6f})，"
+              f"完整資料另存至: {OUTPUT_DENSE_CSV_PATH}")
@@ -3,23 +3,30 @@
 
 """
 模組 M02: 敏感度分析
+
+功能：
+1. 'oat'：逐一將每個參數放大 5%，以與 M01 基準曲線的平均絕對誤差 (MAE) 排序參數。
+2. 'morris' / 'sobol'：全域敏感度分析 (M17)，於參數範圍內 (預設為基準值的 1/1.2 ~ 1.2 倍，對數均勻)
+   一次產生完整樣本矩陣，依區塊批次評估並在信賴區間收斂後提前停止，可看出參數間的交互作用。
+3. 同一份參數化 Netlist 的多組參數以 M15 批次評估 ('ngspice' 後端為 .control 掃描、'numpy' 後端為 M11 批次求解)。
+4. 結果同時輸出為長條圖 (figure/) 與機器可讀的表格 (output/m02_sensitivity_analysis_{mode}.csv)。
 """
 
 import os
 import logging
-import io
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.font_manager as fm
-from typing import Optional
+from typing import Optional, List, Dict, Tuple
 
 # 導入相依的自訂模組
 try:
-    from m06_netlist_generator import generate_netlist
-    from m05_ngspice_runner import run_ngspice_simulation
+    from m06_netlist_generator import generate_netlist, build_parametric_netlist
+    from m15_async_scheduler import run_simulate_netlists, run_simulate_sweep
+    from m17_global_sensitivity import run_sensitivity_study, scale_samples, PRIMARY_INDEX
 except ImportError as e:
-    print(f"錯誤：無法導入相依模組。請確保 m06, m05 模組與此腳本在同一個資料夾下。 {e}")
+    print(f"錯誤：無法導入相依模組。請確保 m06, m15, m17 模組與此腳本在同一個資料夾下。 {e}")
     exit()
 
 # --- 全域設定 ---
@@ -33,6 +40,13 @@ OUTPUT_DIR = os.path.join(BASE_DIR, 'output') # 用於存放數據類型的輸
 FIGURE_DIR = os.path.join(BASE_DIR, 'figure') # 【修改】新增 figure 目錄用於存放圖表
 DATA_DIR = os.path.join(BASE_DIR, 'data')
 
+# 敏感度分析方法：'oat' (逐一擾動)、'morris' (基本效應) 或 'sobol' (變異數分解)
+SENSITIVITY_METHODS = ('oat', 'morris', 'sobol')
+# 全域分析未指定範圍時，參數範圍為 [基準值 / 係數, 基準值 × 係數] (對數均勻)
+GLOBAL_RANGE_FACTOR = 1.2
+# 單一模擬的逾時 (秒)
+SIMULATION_TIMEOUT_SECONDS = 30
+
 # --- 日誌設定 ---
 def setup_logging():
     os.makedirs(LOG_DIR, exist_ok=True)
@@ -48,91 +62,180 @@ def setup_logging():
 
 logger = setup_logging()
 
-# --- 輔助功能：解析 Ngspice 輸出 ---
-def parse_ngspice_output(stdout: str) -> Optional[pd.DataFrame]:
+# --- 批次模擬 ---
+def _is_number(value) -> bool:
     try:
-        lines = stdout.splitlines()
-        data_start_index = -1
-        for i, line in enumerate(lines):
-            if 'Index' in line and 'frequency' in line:
-                data_start_index = i + 1
-                break
-        if data_start_index == -1:
-            logger.error("在 Ngspice 輸出中找不到數據起始行 'Index'。")
-            return None
-        data_block = "\n".join(lines[data_start_index:])
-        df = pd.read_csv(io.StringIO(data_block), delim_whitespace=True)
-        df.columns = ['Index', 'Frequency', 'V_real', 'V_imag']
-        df['Impedance'] = np.sqrt(df['V_real']**2 + df['V_imag']**2)
-        return df[['Frequency', 'Impedance']]
-    except Exception as e:
-        logger.error(f"解析 Ngspice 輸出時發生錯誤: {e}", exc_info=True)
-        return None
-
-# --- 核心功能 ---
-def run_sensitivity_analysis(mode: str, base_params: dict, template_filename: str):
-    logger.info(f"========== 開始 {mode} 模式敏感度分析 ==========")
+        float(value)
+        return True
+    except (TypeError, ValueError):
+        return False
 
-    baseline_data_path = os.path.join(OUTPUT_DIR, 'm01_interpolated_data.csv')
+def _simulate_param_sets(mode: str, base_params: dict, template_filename: str, overrides: List[Dict[str, float]],
+                         backend: Optional[str] = None, max_concurrency: Optional[int] = None) -> list:
+    """
+    模擬以 overrides 取代部分基準參數後的多組電路，依序回傳 (SimulationResult, error)。
+    先以一份參數化 Netlist 交給 M15 批次評估 ('ngspice' 後端為 .control 掃描，'numpy' 後端為 M11 批次求解)；
+    不支援掃描的後端、範本無法參數化或掃描失敗的組別，再各自產生 Netlist 交給 M15 同時執行。
+    """
+    results = [(None, None)] * len(overrides)
+    numeric_names = [name for name, value in base_params.items() if _is_number(value)]
     try:
-        baseline_df = pd.read_csv(baseline_data_path)
-        baseline_z = baseline_df[f'Z_{mode}']
-        freq_axis = baseline_df['Frequency_Hz']
-        logger.info(f"成功讀取基準資料: {baseline_data_path}")
-    except Exception as e:
-        logger.critical(f"無法讀取 M01 基準資料 '{baseline_data_path}'，分析中止。錯誤: {e}")
-        return
+        netlist_text = build_parametric_netlist(template_filename, base_params)
+    except (OSError, KeyError, ValueError) as e:
+        logger.warning(f"無法建立參數化 Netlist，改為逐一模擬: {e}")
+        netlist_text = None
+    if netlist_text is not None and overrides:
+        param_sets = [{name: float(override.get(name, base_params[name])) for name in numeric_names} for override in overrides]
+        logger.info(f"以參數化 Netlist 批次評估 {len(param_sets)} 組參數...")
+        results = run_simulate_sweep(netlist_text, param_sets, max_concurrency=max_concurrency,
+                                     timeout_seconds=SIMULATION_TIMEOUT_SECONDS, label=template_filename, backend=backend)
 
-    sensitivities = {}
-    variation_factor = 1.05
+    netlist_names = {}
+    for i, override in enumerate(overrides):
+        if results[i][0] is not None:
+            continue
+        varied_params = base_params.copy()
+        varied_params.update({name: str(value) for name, value in override.items()})
+        temp_netlist_name = f"temp_sensitivity_{mode}_{i}.cir"
+        if not generate_netlist(template_filename, temp_netlist_name, varied_params):
+            results[i] = (None, f"為第 {i} 組參數產生 Netlist 失敗。")
+            continue
+        netlist_names[i] = temp_netlist_name
+
+    if netlist_names:
+        logger.info(f"同時執行 {len(netlist_names)} 個敏感度模擬...")
+        solved = run_simulate_netlists(list(netlist_names.values()), max_concurrency=max_concurrency,
+                                       timeout_seconds=SIMULATION_TIMEOUT_SECONDS, backend=backend)
+        for i, result in zip(netlist_names, solved):
+            results[i] = result
+    return results
 
+def _mae_against_baseline(results: list, freq_axis: np.ndarray, baseline_z: np.ndarray) -> np.ndarray:
+    """各組模擬結果與基準曲線的平均絕對誤差；失敗的組別為 NaN。"""
+    mae = np.full(len(results), np.nan)
+    for i, (result, _) in enumerate(results):
+        if result is not None:
+            mae[i] = np.mean(np.abs(np.interp(freq_axis, result.frequency, result.magnitude()) - baseline_z))
+    return mae
+
+# --- 分析方法 ---
+def _one_at_a_time(mode: str, base_params: dict, template_filename: str, freq_axis: np.ndarray, baseline_z: np.ndarray,
+                   backend: Optional[str], max_concurrency: Optional[int]) -> Optional[pd.DataFrame]:
+    variation_factor = 1.05
+    overrides = {}
     for param, base_value in base_params.items():
-        logger.info(f"--- 正在分析參數: {param} ---")
-        varied_params = base_params.copy()
+        logger.info(f"--- 正在準備參數: {param} ---")
         try:
-            varied_value = float(base_value) * variation_factor
-            varied_params[param] = str(varied_value)
+            overrides[param] = {param: float(base_value) * variation_factor}
         except ValueError:
              logger.warning(f"參數 '{param}' 的值 '{base_value}' 非純數字，暫時跳過。")
-             continue
+    results = _simulate_param_sets(mode, base_params, template_filename, list(overrides.values()), backend, max_concurrency)
+    mae = _mae_against_baseline(results, freq_axis, baseline_z)
 
-        temp_netlist_name = f"temp_sensitivity_{mode}_{param}.cir"
-        if not generate_netlist(template_filename, temp_netlist_name, varied_params):
-            logger.error(f"為參數 '{param}' 產生 Netlist 失敗，跳過此參數。")
-            continue
-        
-        stdout, stderr = run_ngspice_simulation(temp_netlist_name, timeout_seconds=30)
-        if stderr or not stdout:
-            logger.error(f"執行參數 '{param}' 的模擬失敗，跳過此參數。")
+    sensitivities = {}
+    for param, (result, error), value in zip(overrides, results, mae):
+        if result is None:
+            logger.error(f"執行參數 '{param}' 的模擬失敗，跳過此參數。{error}")
             continue
+        sensitivities[param] = value
+        logger.info(f"參數 '{param}' 的敏感度 (MAE) 為: {value:.4f}")
+    if not sensitivities:
+        return None
+    return pd.DataFrame({'parameter': list(sensitivities), 'sensitivity': list(sensitivities.values()),
+                         'evaluations': len(results)})
 
-        sim_df = parse_ngspice_output(stdout)
-        if sim_df is None:
-            logger.error(f"解析參數 '{param}' 的模擬結果失敗，跳過此參數。")
-            continue
-            
-        sim_z_interp = np.interp(freq_axis, sim_df['Frequency'], sim_df['Impedance'])
-        mae = np.mean(np.abs(sim_z_interp - baseline_z))
-        sensitivities[param] = mae
-        logger.info(f"參數 '{param}' 的敏感度 (MAE) 為: {mae:.4f}")
+def _global_study(method: str, mode: str, base_params: dict, template_filename: str, freq_axis: np.ndarray,
+                  baseline_z: np.ndarray, backend: Optional[str], max_concurrency: Optional[int],
+                  param_bounds: Optional[Dict[str, Tuple[float, float]]], max_samples: Optional[int],
+                  tolerance: Optional[float], seed: Optional[int]) -> Optional[pd.DataFrame]:
+    if param_bounds is None:
+        param_bounds = {name: (float(value) / GLOBAL_RANGE_FACTOR, float(value) * GLOBAL_RANGE_FACTOR)
+                        for name, value in base_params.items() if _is_number(value)}
+    names = list(param_bounds)
+    bounds = [param_bounds[name] for name in names]
+    if not names:
+        logger.error("沒有可分析的數值參數。")
+        return None
 
-    if not sensitivities:
+    def evaluate(unit: np.ndarray) -> np.ndarray:
+        values = scale_samples(unit, bounds)
+        overrides = [dict(zip(names, row)) for row in values]
+        return _mae_against_baseline(_simulate_param_sets(mode, base_params, template_filename, overrides, backend, max_concurrency),
+                                     freq_axis, baseline_z)
+
+    kwargs = {} if tolerance is None else {'tolerance': tolerance}
+    indices, summary = run_sensitivity_study(method, len(names), evaluate, max_samples=max_samples, seed=seed, **kwargs)
+    primary = PRIMARY_INDEX[method]
+    for j, name in enumerate(names):
+        logger.info(f"參數 '{name}' 的 {primary} 為: {indices[primary][j]:.4f} ± {indices[f'{primary}_conf'][j]:.4f}")
+    table = pd.DataFrame({'parameter': names, 'sensitivity': indices[primary], 'sensitivity_conf': indices[f'{primary}_conf']})
+    for key, values in indices.items():
+        table[key] = values
+    table['evaluations'] = int(summary['evaluations'])
+    table['converged'] = bool(summary['converged'])
+    return table
+
+# --- 核心功能 ---
+def run_sensitivity_analysis(mode: str, base_params: dict, template_filename: str, backend: Optional[str] = None,
+                             max_concurrency: Optional[int] = None, method: str = 'oat',
+                             param_bounds: Optional[Dict[str, Tuple[float, float]]] = None,
+                             max_samples: Optional[int] = None, tolerance: Optional[float] = None,
+                             seed: Optional[int] = None) -> Optional[pd.DataFrame]:
+    """
+    max_concurrency: 同時執行的模擬數上限 (M15 非同步排程器)，預設為 CPU 核心數。
+    'ngspice' 後端 (M05 NGSPICE_SWEEP_ENABLED) 時同一批參數由一份參數化 Netlist 的 .control 掃描評估，
+    不必為每組參數各產生一個 Netlist 與程序。
+    method: 'oat'、'morris' 或 'sobol'。全域方法另可指定 param_bounds (預設為基準值 ÷/× GLOBAL_RANGE_FACTOR)、
+            max_samples (Morris 軌跡數 / Sobol 基底樣本數上限)、tolerance (提前停止門檻) 與 seed。
+
+    Returns:
+        Optional[pd.DataFrame]: 敏感度表格 (依 'sensitivity' 由大到小排序)，失敗時回傳 None。
+    """
+    logger.info(f"========== 開始 {mode} 模式敏感度分析 ({method}) ==========")
+    if method not in SENSITIVITY_METHODS:
+        logger.error(f"不支援的敏感度分析方法 '{method}'，可用方法: {list(SENSITIVITY_METHODS)}")
+        return None
+
+    baseline_data_path = os.path.join(OUTPUT_DIR, 'm01_interpolated_data.csv')
+    try:
+        baseline_df = pd.read_csv(baseline_data_path)
+        baseline_z = baseline_df[f'Z_{mode}'].values
+        freq_axis = baseline_df['Frequency_Hz'].values
+        logger.info(f"成功讀取基準資料: {baseline_data_path}")
+    except Exception as e:
+        logger.critical(f"無法讀取 M01 基準資料 '{baseline_data_path}'，分析中止。錯誤: {e}")
+        return None
+
+    if method == 'oat':
+        table = _one_at_a_time(mode, base_params, template_filename, freq_axis, baseline_z, backend, max_concurrency)
+    else:
+        table = _global_study(method, mode, base_params, template_filename, freq_axis, baseline_z, backend,
+                              max_concurrency, param_bounds, max_samples, tolerance, seed)
+    if table is None or not np.any(np.isfinite(table['sensitivity'])):
         logger.error("沒有任何參數成功完成分析，無法產生圖表。")
-        return
+        return None
+
+    table.insert(1, 'method', method)
+    table = table.sort_values('sensitivity', ascending=False, na_position='last').reset_index(drop=True)
+    table.insert(3, 'relative', table['sensitivity'] / table['sensitivity'].max())
+    table_path = os.path.join(OUTPUT_DIR, f'm02_sensitivity_analysis_{mode}.csv')
+    table.to_csv(table_path, index=False)
+    logger.info(f"敏感度表格已儲存至: {table_path}")
 
     try:
         plt.rcParams['font.sans-serif'] = ['Microsoft JhengHei']
         plt.rcParams['axes.unicode_minus'] = False
 
-        params_sorted = sorted(sensitivities.items(), key=lambda item: item[1], reverse=True)
-        names = [item[0] for item in params_sorted]
-        values = [item[1] for item in params_sorted]
+        names = list(table['parameter'])
+        values = list(table['sensitivity'])
+        errors = table['sensitivity_conf'].values if 'sensitivity_conf' in table else None
+        ylabels = {'oat': '敏感度指標 (平均絕對誤差)', 'morris': 'Morris μ* (平均絕對基本效應)', 'sobol': 'Sobol 總效應指標 ST'}
 
         plt.figure(figsize=(10, 6))
-        bars = plt.bar(names, values, color='deepskyblue')
+        bars = plt.bar(names, values, yerr=errors, capsize=3 if errors is not None else 0, color='deepskyblue')
         plt.bar_label(bars, fmt='%.4f')
         plt.xlabel('元件參數')
-        plt.ylabel('敏感度指標 (平均絕對誤差)')
+        plt.ylabel(ylabels[method])
         plt.title(f'{mode} 模式：各元件參數對阻抗影響之敏感度分析')
         plt.xticks(rotation=45, ha='right')
         plt.tight_layout()
@@ -147,6 +250,7 @@ def run_sensitivity_analysis(mode: str, base_params: dict, template_filename: st
         logger.error(f"繪製或儲存圖表時發生錯誤: {e}")
 
     logger.info(f"========== {mode} 模式敏感度分析完成 ==========")
+    return table
 
 # --- 主程式 (用於示範) ---
 if __name__ == '__main__':
@@ -182,5 +286,16 @@ if __name__ == '__main__':
         base_params=nm_base_params,
         template_filename='nm_template.cir'
     )
+    # 全域敏感度分析 (Sobol)：樣本矩陣分區塊批次評估，信賴區間收斂後提前停止
+    sobol_table = run_sensitivity_analysis(
+        mode='CM',
+        base_params=cm_base_params,
+        template_filename='cm_template.cir',
+        method='sobol',
+        max_samples=256,
+        seed=0
+    )
+    if sobol_table is not None:
+        print(sobol_table[['parameter', 'S1', 'ST', 'ST_conf']].to_string(index=False))
     # 【修改】更新最終的提示訊息
     print(f"分析完成，請查看 '{LOG_DIR}/m02_sensitivity_analysis.log' 和 '{FIGURE_DIR}' 資料夾中的圖檔。")
@@ -9,16 +9,23 @@ project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
-from modules.m06_netlist_generator import generate_netlist
-from modules.m05_ngspice_runner import run_ngspice_simulation
-from modules.m07_plot_results import parse_ngspice_output # 假設 M07 有此函式
+from modules.m05_ngspice_runner import (simulate_impedance, simulate_impedance_batch, result_cache_summary, curve_to_array,
+                                         measured_impedance, fitting_weights, stacked_indices, simulate_mode_errors,
+                                         missing_measured_columns, uses_remote_workers, JOINT_MODE_WEIGHTS)
+from modules.m06_netlist_generator import fitting_modes
+from modules.m15_async_scheduler import uses_ngspice_sweep
+from modules.m16_scratch_space import prepare_scratch, cleanup_scratch
+from modules.m18_surrogate import SurrogateModel, select_promising, SURROGATE_EVAL_FRACTION
+from modules.m19_global_optimizers import create_optimizer, GLOBAL_OPTIMIZERS, NSGA2Optimizer, NSGA2_ARCHIVE_SIZE
+from modules.m20_frequency_schedule import FrequencySchedule, quadrature_weights, peak_region_indices
+from modules.m23_history_store import HistoryWriter
 # ... 其他 import 維持不變 ...
 import logging
 import re
 import time
+import json
 import numpy as np
 import pandas as pd
-from scipy.optimize import differential_evolution
 from typing import Optional, List, Dict, Tuple, Any
 from datetime import datetime
 
@@ -36,45 +43,72 @@ logger = logging.getLogger(__name__) # 假設 setup_logging 已被呼叫
 
 # *** 修改 ***: 調整 Callback 類別以相容多核心
 class OptimizationCallback:
-    def __init__(self, param_names: List[str], measured_data: pd.DataFrame, mode: str = 'CM'):
-        self.param_names_with_headers = ['iteration', 'error'] + param_names
+    def __init__(self, param_names: List[str], measured_data: pd.DataFrame, mode: str = 'CM', backend: Optional[str] = None,
+                 fixed_params: Optional[Dict[str, float]] = None, history_path: Optional[str] = None,
+                 history_tag: Optional[str] = None):
+        # fixed_params: 凍結於固定值、不參與搜尋的參數，仍會一併寫入歷史紀錄
+        # history_path: 從檢查點續跑時沿用的歷史紀錄目錄 (M23)，之後以 restore_history() 捨棄檢查點之後的紀錄
+        # history_tag: 附加在歷史檔名後的標籤，多個搜尋同時執行 (例如 M21 的工作程序) 時避免檔名相同
+        self.fixed_params = dict(fixed_params or {})
+        self.param_names_with_headers = ['iteration', 'error'] + param_names + list(self.fixed_params)
         self.param_names_only = param_names
-        self.measured_z = measured_data[f'Z_{mode}'].values
+        # 聯合模式 (如 'CM+NM') 的 measured_z / weights 與模擬曲線皆為各治具依序串接的 (K·F,)
+        self.measured_z = measured_impedance(measured_data, mode)
         self.freq_points = measured_data['Frequency_Hz'].values
+        # 完整頻率軸；多階解析度模式 (M20) 下 freq_points / measured_z 只是其中的子集
+        self.full_freq_points = self.freq_points
+        self.full_measured_z = self.measured_z
+        # M01 自適應取樣的各頻率點權重 ('Weight' 欄位)；沒有此欄位時為等權重
+        self.weighted = 'Weight' in measured_data.columns
+        freq_weights = measured_data['Weight'].values if self.weighted else None
+        self.weights = fitting_weights(mode, freq_weights, len(self.freq_points))
+        self.mode = mode
+        self.backend = backend
         self.iteration = 0
         self.start_time = time.time()
         
-        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
-        os.makedirs(RESULTS_DIR, exist_ok=True)
-        self.csv_path = os.path.join(RESULTS_DIR, f'history_params_{timestamp}.csv')
-        self.npz_path = os.path.join(RESULTS_DIR, f'history_curves_{timestamp}.npz')
+        if history_path:
+            self.history_path = history_path
+            self.history = HistoryWriter(history_path, self.param_names_with_headers, resume=True)
+        else:
+            timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+            if history_tag:
+                timestamp = f'{timestamp}_{history_tag}'
+            self.history_path = os.path.join(RESULTS_DIR, f'history_{timestamp}')
+            # 參數與曲線歷史寫入 M23 的分塊歷史紀錄：緩衝後整塊寫入，不再每代重開 CSV 或把全部曲線留在記憶體
+            self.history = HistoryWriter(self.history_path, self.param_names_with_headers, meta={'mode': mode, 'source': 'M03'})
         
-        # *** 修改 ***: 不再保持檔案開啟。建立檔案並只寫入標頭，然後立刻關閉。
-        pd.DataFrame(columns=self.param_names_with_headers).to_csv(self.csv_path, index=False)
-        
-        self.curves_data = {}
         self.last_params = None
         self.last_error = None
         self.last_curve = None
+        # 代理模型篩選 (僅 vectorized 模式)：由 global_search_optimization 指定 surrogate
+        self.surrogate: Optional[SurrogateModel] = None
+        self.surrogate_fraction = SURROGATE_EVAL_FRACTION
+        self.parent_errors = None
+        # 最近一代的族群 (S, D)，與 parent_errors 對應，供 M04 多起點局部優化使用
+        self.population = None
+        self.screened_out = 0
+        # vectorized 模式下的真實模擬次數 (此模式的 DE nfev 只計算呼叫次數)
+        self.batch_evaluations = 0
+        # 每一代結束時的最佳誤差與累計真實模擬次數
+        self.error_trace: List[float] = []
+        self.evaluation_trace: List[int] = []
+        # Pareto 搜尋的 (目標名稱, 串接曲線中的索引)，見 set_objectives()
+        self.objective_indices: List[Tuple[str, np.ndarray]] = []
         
-        logger.info(f"Callback 初始化完成。參數歷史將儲存至: {self.csv_path}")
-        logger.info(f"曲線歷史將儲存至: {self.npz_path}")
+        logger.info(f"Callback 初始化完成。參數與曲線歷史將儲存至: {self.history_path}")
 
     def objective(self, params: np.ndarray) -> float:
         if self.last_params is not None and np.array_equal(params, self.last_params):
             return self.last_error
 
         param_dict = dict(zip(self.param_names_only, params))
-        netlist_path = generate_netlist(param_dict=param_dict)
-
-        stdout, _ = run_ngspice_simulation(netlist_path)
-        if not stdout: return 1e10
-
-        sim_data = parse_ngspice_output(stdout)
+        param_dict.update(self.fixed_params)
+        sim_data, _ = simulate_impedance(param_dict, self.freq_points, mode=self.mode, backend=self.backend)
         if sim_data is None: return 1e10
 
         sim_z = np.abs(sim_data[:, 1] + 1j * sim_data[:, 2])
-        error = np.sqrt(np.mean((np.log10(sim_z) - np.log10(self.measured_z))**2))
+        error = np.sqrt(np.average((np.log10(sim_z) - np.log10(self.measured_z))**2, weights=self.weights))
         
         self.last_params = np.copy(params)
         self.last_curve = sim_data
@@ -82,23 +116,184 @@ class OptimizationCallback:
         
         return error
 
-    def callback(self, xk: np.ndarray, convergence: float):
-        # *** 修改 ***: 每次 callback 時，以附加模式(append)開啟、寫入、然後立刻關閉檔案。
-        row = pd.DataFrame([[self.iteration, self.last_error] + list(xk)], columns=self.param_names_with_headers)
-        row.to_csv(self.csv_path, mode='a', header=False, index=False)
-        
-        self.curves_data[f'iter_{self.iteration}'] = self.last_curve
+    def objective_batch(self, population: np.ndarray) -> np.ndarray:
+        """
+        DE vectorized 模式的目標函式：population 形狀為 (D, S)，回傳 S 個誤差。
+        last_* 紀錄目前為止最佳的候選解，供 callback 寫入歷史。
+        """
+        population = np.asarray(population, dtype=float)
+        if population.ndim == 1:
+            population = population[:, None]
+        count = population.shape[1]
+        selected = np.arange(count)
+        # 有代理模型時只模擬最有希望的候選解；第一代與收尾的 polish 沒有對應的父代誤差，一律全部模擬
+        if self.surrogate is not None and self.parent_errors is not None and len(self.parent_errors) == count:
+            predicted = self.surrogate.predict(population.T)
+            if predicted is not None:
+                selected = select_promising(predicted, self.parent_errors, self.surrogate_fraction)
+                self.screened_out += count - len(selected)
+        candidates = population[:, selected]
+        simulated, _ = self._simulate_candidates(candidates)
+        if self.surrogate is not None:
+            self.surrogate.add(candidates.T, simulated)
+        # 未模擬的候選解視為未改善，DE 會保留其父代
+        errors = np.full(count, np.inf)
+        errors[selected] = simulated
+        return errors
+
+    def _simulate_candidates(self, candidates: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """批次模擬 (D, S) 的候選解 (補上凍結參數)，回傳 (誤差, 複數曲線)，並更新目前為止最佳解的紀錄。"""
+        fixed = np.tile(list(self.fixed_params.values()), (candidates.shape[1], 1))
+        errors, curves = simulate_impedance_batch(
+            np.hstack([candidates.T, fixed]), self.param_names_only + list(self.fixed_params), self.freq_points, self.measured_z,
+            mode=self.mode, return_curves=True, backend=self.backend, weights=self.weights
+        )
+        self.batch_evaluations += candidates.shape[1]
+        best = int(np.argmin(errors))
+        if self.last_error is None or errors[best] <= self.last_error:
+            self.last_params = np.copy(candidates[:, best])
+            self.last_error = float(errors[best])
+            self.last_curve = curve_to_array(self.freq_points, curves[best])
+        return errors, curves
+
+    def set_objectives(self, resonance: bool = False) -> List[str]:
+        """
+        Pareto 搜尋的目標：各治具各自的 log-RMSE，resonance=True 時另加量測阻抗峰值 / 共振區附近
+        (M20 的 peak_region_indices，各治具的聯集) 的 log-RMSE。回傳目標名稱。
+        """
+        num_points = len(self.freq_points)
+        modes = fitting_modes(self.mode)
+        self.objective_indices = [(name, np.arange(k * num_points, (k + 1) * num_points)) for k, name in enumerate(modes)]
+        if resonance:
+            measured = self.measured_z.reshape(len(modes), num_points)
+            regions = [peak_region_indices(self.freq_points, row) + k * num_points for k, row in enumerate(measured)]
+            self.objective_indices.append(('resonance', np.concatenate(regions).astype(int)))
+        return [name for name, _ in self.objective_indices]
+
+    def objective_matrix(self, population: np.ndarray) -> np.ndarray:
+        """
+        多目標 (NSGA-II) 的目標函式：population 形狀為 (D, S)，回傳 (S, M) 的目標值 (見 set_objectives())。
+        所有目標都取自同一次批次模擬的曲線，額外成本只有誤差計算。
+        """
+        population = np.asarray(population, dtype=float)
+        if population.ndim == 1:
+            population = population[:, None]
+        _, curves = self._simulate_candidates(population)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            squared = (np.log10(np.abs(curves)) - np.log10(self.measured_z))**2
+            objectives = np.column_stack([
+                np.sqrt(np.average(squared[:, indices], axis=1, weights=None if self.weights is None else self.weights[indices]))
+                for _, indices in self.objective_indices
+            ])
+        objectives[~np.isfinite(objectives)] = 1e10
+        return objectives
+
+    def set_frequency_indices(self, indices: np.ndarray):
+        """改在完整頻率軸的 indices 子集上模擬與計算誤差；先前的最佳解紀錄以舊頻率軸計算，一併捨棄。"""
+        self.freq_points = self.full_freq_points[indices]
+        self.measured_z = self.full_measured_z[stacked_indices(self.mode, indices, len(self.full_freq_points))]
+        # 非等間距的子集依自身的頻率間距重新計算積分權重
+        freq_weights = quadrature_weights(self.freq_points) if self.weighted else None
+        self.weights = fitting_weights(self.mode, freq_weights, len(self.freq_points))
+        self.last_params = None
+        self.last_error = None
+
+    def callback(self, intermediate_result):
+        # intermediate_result 為 DE 每代結束時的 OptimizeResult (x、fun、convergence、population 等)；
+        # 誤差取自 fun 而非 last_error，workers=-1 時目標函式在子程序中執行，主程序的 last_error 不會更新
+        xk, convergence = intermediate_result.x, intermediate_result.convergence
+        error = float(intermediate_result.fun)
+        self.history.append([self.iteration, error] + list(xk) + list(self.fixed_params.values()), self.last_curve)
+        self.parent_errors = np.asarray(intermediate_result.population_energies, dtype=float)
+        self.population = np.asarray(intermediate_result.population, dtype=float)
+        self.error_trace.append(error)
+        # workers=-1 時目標函式在子程序中執行，改以 DE 的 nfev 計算
+        self.evaluation_trace.append(self.batch_evaluations or int(intermediate_result.nfev))
         
         elapsed_time = time.time() - self.start_time
-        print(f"Iteration: {self.iteration:4d}, Error: {self.last_error:.6f}, Convergence: {convergence:.4f}, Time: {elapsed_time:.2f}s")
+        print(f"Iteration: {self.iteration:4d}, Error: {error:.6f}, Convergence: {convergence:.4f}, Time: {elapsed_time:.2f}s")
         
         self.iteration += 1
 
+    def flush_history(self):
+        """將緩衝中的歷史紀錄寫入磁碟 (寫檢查點前呼叫，確保檢查點記錄的歷史位置都已落地)。"""
+        self.history.flush()
+
+    def restore_history(self, offset: int):
+        """從檢查點續跑：保留前 offset 代的參數與曲線歷史，捨棄檢查點之後 (中斷前) 才寫入的紀錄。"""
+        self.history.truncate(offset)
+        self.iteration = offset
+
+    def restore_counters(self, batch_evaluations: int, screened_out: int):
+        """從檢查點續跑時接續真實模擬與代理模型篩除的累計次數。"""
+        self.batch_evaluations, self.screened_out = batch_evaluations, screened_out
+
     def save_and_close(self):
-        # *** 修改 ***: 不再需要關閉 CSV 檔案，因為它已經是關閉的。
-        np.savez_compressed(self.npz_path, **self.curves_data)
-        logger.info("NPZ 檔案已儲存。歷史紀錄儲存完畢。")
+        self.history.close()
+        logger.info(f"歷史紀錄儲存完畢 ({len(self.history)} 筆)。")
+
 
+# --- 全域搜尋檢查點 ---
+# 預設每隔幾代寫入一次檢查點 (None 或 0 表示不寫入)
+CHECKPOINT_INTERVAL = 10
+CHECKPOINT_VERSION = 2
+
+def save_checkpoint(path: str, state: Dict[str, Any]) -> Optional[str]:
+    """
+    以 JSON 寫入檢查點 (先寫暫存檔再以 os.replace 取代)，中途當機時仍保留上一個完整的檢查點。
+
+    Returns:
+        Optional[str]: 失敗時的錯誤訊息，成功時為 None。
+    """
+    partial_path = f"{path}.partial"
+    try:
+        with open(partial_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(partial_path, path)
+    except (OSError, TypeError, ValueError) as e:
+        return f"無法寫入檢查點 '{path}': {e}"
+    return None
+
+def load_checkpoint(path: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """讀取 save_checkpoint() 寫入的檢查點，回傳 (狀態, 錯誤訊息)。"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError) as e:
+        return None, f"無法讀取檢查點 '{path}': {e}"
+    if state.get('version') != CHECKPOINT_VERSION:
+        return None, f"檢查點 '{path}' 的版本 {state.get('version')} 不受支援 (預期 {CHECKPOINT_VERSION})。"
+    return state, None
+
+# --- 依敏感度縮減搜尋空間 ---
+# 預設讀取的 M02 敏感度表格 (依模式)
+SENSITIVITY_TABLE_TEMPLATE = os.path.join(OUTPUT_DIR, 'm02_sensitivity_analysis_{mode}.csv')
+
+def select_active_parameters(param_names: List[str], mode: str, threshold: float,
+                             sensitivity_path: Optional[str] = None) -> Tuple[List[str], List[str]]:
+    """
+    讀取 M02 的敏感度表格，將相對敏感度 ('relative' 欄，最大值為 1) 低於 threshold 的參數凍結。
+    表格中沒有的參數一律保留為搜尋參數；讀不到表格時不凍結任何參數。
+
+    Returns:
+        Tuple[List[str], List[str]]: (搜尋參數, 凍結參數)，各自維持 param_names 的順序。
+    """
+    sensitivity_path = sensitivity_path or SENSITIVITY_TABLE_TEMPLATE.format(mode=mode)
+    try:
+        table = pd.read_csv(sensitivity_path)
+        relative = dict(zip(table['parameter'].astype(str), table['relative'].astype(float)))
+    except (OSError, KeyError, ValueError) as e:
+        logger.warning(f"無法讀取敏感度表格 '{sensitivity_path}'，不凍結任何參數: {e}")
+        return list(param_names), []
+    frozen = [name for name in param_names if name in relative and relative[name] < threshold]
+    active = [name for name in param_names if name not in frozen]
+    if not active:
+        logger.warning("所有參數的敏感度都低於門檻，不凍結任何參數。")
+        return list(param_names), []
+    return active, frozen
+
+# 最近一次全域搜尋的逐代統計，見 last_search_statistics()
+_LAST_SEARCH_STATS: Dict[str, Any] = {}
 
 # --- 主功能函式 (維持不變) ---
 def global_search_optimization(
@@ -106,55 +301,424 @@ def global_search_optimization(
     mode: str = 'CM',
     maxiter: int = 1000,
     popsize: int = 15,
-    tol: float = 0.01
+    tol: float = 0.01,
+    backend: Optional[str] = None,
+    vectorized: Optional[bool] = None,
+    freeze_threshold: Optional[float] = None,
+    nominal_params: Optional[Dict[str, float]] = None,
+    sensitivity_path: Optional[str] = None,
+    release_frozen: bool = True,
+    seed: Optional[int] = None,
+    checkpoint_every: Optional[int] = CHECKPOINT_INTERVAL,
+    checkpoint_path: Optional[str] = None,
+    resume_from: Optional[str] = None,
+    surrogate: bool = False,
+    surrogate_fraction: float = SURROGATE_EVAL_FRACTION,
+    measured_data_path: Optional[str] = None,
+    optimizer: str = 'de',
+    multi_fidelity: bool = False,
+    history_tag: Optional[str] = None,
+    local_options: Optional[Dict[str, Any]] = None
 ) -> Optional[Dict[str, float]]:
+    """
+    mode: 'CM'、'NM' 或聯合模式 'CM+NM'：同一組參數同時擬合兩條量測曲線 (需要 'Z_CM' 與 'Z_NM' 欄位)，
+          每次評估以一次模擬得到兩個治具的阻抗，誤差為 sqrt(Σ w_m·E_m² / Σ w_m) (權重見 M05 的 JOINT_MODE_WEIGHTS)。
+    backend: 模擬後端 ('ngspice' 或 'numpy')，未指定時使用 M05 的 SIMULATION_BACKEND。
+    vectorized: 以 DE 的 vectorized 模式將每一代整個族群一次交給批次評估 (搭配 'numpy' 後端效益最大；
+                'ngspice' 後端則由 M15 將整個族群分成少數幾個 .control 掃描程序執行；
+                'remote' 後端由 M22 協調者分給遠端工作程序，一律使用此模式)。
+                None 時依後端決定：使用 .control 掃描的 'ngspice' 後端與 'remote' 後端自動啟用，其餘維持逐一評估。
+    freeze_threshold: 指定時讀取 M02 敏感度表格 (sensitivity_path，預設 output/m02_sensitivity_analysis_{mode}.csv)，
+                      相對敏感度低於此值的參數凍結於 nominal_params (未提供時取範圍的幾何中點)，
+                      DE 只搜尋其餘參數；DE 的族群大小與所需代數都隨維度增加，縮減維度可大幅縮短時間。
+    release_frozen: 有凍結參數時，DE 結束後以 M04 局部優化同時調整全部參數 (包含凍結參數)。
+                    局部優化沿用本次搜尋的 multi_fidelity 設定。
+    seed: DE 隨機數產生器的種子。
+    checkpoint_every: 每隔幾代將 DE 的完整狀態 (族群、能量、隨機狀態、代數與歷史紀錄位置) 寫入檢查點，
+                      寫入前先將歷史紀錄落地 (M23)；None 或 0 表示不寫入。正常結束後會刪除檢查點。
+    checkpoint_path: 檢查點路徑，預設為 results/de_checkpoint_{時間戳}.json (與歷史檔同一時間戳)。
+    resume_from: 從此檢查點續跑，沿用原本的歷史檔與凍結參數，並得到與未中斷執行相同的結果；
+                 其餘設定 (bounds、popsize、maxiter、tol) 應與原本的執行相同。
+    surrogate: 代理模型輔助模式 (M18)：以 RBF 代理模型預篩每一代的候選解，只把 surrogate_fraction 比例最有希望的
+               交給真實模擬器，其餘視為未改善。需要 vectorized 模式；代理模型在背景訓練，結果不保證可重現。
+    measured_data_path: 量測數據 CSV，預設為 output/m01_interpolated_data.csv。
+    optimizer: 全域最佳化引擎 (M19)：'de' 為差分演化；'cmaes' 在正規化的 log10 參數空間以 CMA-ES 搜尋，
+               每代將整批樣本交給批次評估 (不使用 vectorized 設定與代理模型)，popsize 為每代樣本數的下限。
+               兩者寫出相同格式的歷史紀錄與檢查點。
+    multi_fidelity: 多階解析度模式 (M20)：前期只在稀疏的頻率子集 (保留共振區) 上模擬與計算誤差，
+                    族群逐漸收斂或到達代數上限時再提高到完整頻率軸；.AC DEC 的點數隨頻率點數縮減。
+                    切換時以新的頻率軸重新評估引擎保留的解，引擎只會在完整頻率軸上判定收斂。
+                    歷史紀錄中的誤差與曲線為當代所用頻率軸的結果。從檢查點續跑時沿用檢查點的設定。
+    history_tag: 附加在歷史檔與預設檢查點檔名後的標籤 (如 'job12')，多個搜尋同時執行時避免檔名相同。
+    local_options: release_frozen 時傳給 M04 local_optimization_log_scale() 的其他設定
+                   (如 {'analytic_gradient': False, 'solver': 'least_squares'})，使釋放後的調整與整個流程的設定一致。
+    """
     
     # ... 此函式內部邏輯完全不變，此處省略 ...
     logger.info(f"--- 開始 {mode} 模式全域搜尋 ---")
     
-    measured_data_path = os.path.join(OUTPUT_DIR, 'm01_interpolated_data.csv')
+    measured_data_path = measured_data_path or os.path.join(OUTPUT_DIR, 'm01_interpolated_data.csv')
     try:
         measured_data = pd.read_csv(measured_data_path)
     except FileNotFoundError:
         logger.error(f"找不到量測數據檔案: {measured_data_path}")
         return None
+    try:
+        missing = missing_measured_columns(measured_data, mode)
+    except ValueError as e:
+        logger.error(str(e))
+        return None
+    if missing:
+        logger.error(f"量測數據 '{measured_data_path}' 缺少 {mode} 模式所需的欄位: {missing}")
+        return None
 
     param_names = list(param_bounds.keys())
-    bounds = list(param_bounds.values())
+    fixed_params = {}
+    resume_state = None
+    if optimizer not in GLOBAL_OPTIMIZERS:
+        logger.error(f"未知的全域最佳化引擎 '{optimizer}'，可用: {sorted(GLOBAL_OPTIMIZERS)}")
+        return None
+    if resume_from:
+        resume_state, error = load_checkpoint(resume_from)
+        if resume_state is None:
+            logger.error(error)
+            return None
+        if resume_state.get('optimizer', 'de') != optimizer:
+            logger.error(f"檢查點 '{resume_from}' 由 '{resume_state.get('optimizer', 'de')}' 引擎寫入，無法以 '{optimizer}' 續跑。")
+            return None
+        if resume_state['bounds'] != {name: list(bound) for name, bound in param_bounds.items()}:
+            logger.error(f"檢查點 '{resume_from}' 的參數範圍與本次設定不同，無法續跑。")
+            return None
+        # 沿用原本執行的搜尋參數與凍結值，避免敏感度表格更新後搜尋空間改變
+        param_names, fixed_params = resume_state['param_names'], resume_state['fixed_params']
+        multi_fidelity = resume_state.get('fidelity_level') is not None
+        logger.info(f"從檢查點 '{resume_from}' 續跑，已完成 {resume_state['generation']} 代。")
+    elif freeze_threshold is not None:
+        param_names, frozen = select_active_parameters(param_names, mode, freeze_threshold, sensitivity_path)
+        nominal_params = nominal_params or {}
+        for name in frozen:
+            low, high = param_bounds[name]
+            fixed_params[name] = float(nominal_params.get(name, np.sqrt(low * high)))
+        if frozen:
+            logger.info(f"依 M02 敏感度凍結 {len(frozen)} 個參數 (門檻 {freeze_threshold})：{fixed_params}")
+            logger.info(f"搜尋維度由 {len(param_bounds)} 降為 {len(param_names)}：{param_names}")
+    bounds = [param_bounds[name] for name in param_names]
+
+    if resume_state:
+        try:
+            callback_handler = OptimizationCallback(param_names, measured_data, mode, backend, fixed_params,
+                                                    history_path=resume_state['history_path'])
+        except (OSError, ValueError) as e:
+            logger.error(f"無法開啟檢查點的歷史紀錄: {e}")
+            return None
+        callback_handler.restore_history(resume_state['history_offset'])
+        callback_handler.restore_counters(resume_state.get('batch_evaluations', 0), resume_state.get('screened_out', 0))
+        checkpoint_path = resume_from
+    else:
+        callback_handler = OptimizationCallback(param_names, measured_data, mode, backend, fixed_params, history_tag=history_tag)
+        checkpoint_path = checkpoint_path or os.path.join(
+            RESULTS_DIR, os.path.basename(callback_handler.history_path).replace('history_', f'{optimizer}_checkpoint_', 1) + '.json')
+    if surrogate and optimizer != 'de':
+        logger.warning("代理模型模式目前僅支援 'de' 引擎，本次不使用代理模型。")
+        surrogate = False
+    if vectorized is None:
+        vectorized = uses_ngspice_sweep(backend) or uses_remote_workers(backend) or surrogate
+    elif surrogate and not vectorized:
+        logger.warning("代理模型模式需要逐代取得整個族群，改用 vectorized 模式。")
+        vectorized = True
+    elif uses_remote_workers(backend) and not vectorized:
+        # 非 vectorized 模式的 DE 以 workers=-1 在多個子程序評估，各子程序無法共用同一個協調者
+        logger.warning("'remote' 後端需要逐代將整個族群交給 M22 協調者，改用 vectorized 模式。")
+        vectorized = True
+    if surrogate:
+        lower, upper = np.array(bounds, dtype=float).T
+        callback_handler.surrogate = SurrogateModel(lower, upper)
+        callback_handler.surrogate_fraction = surrogate_fraction
+        logger.info(f"代理模型模式：每代只將 {surrogate_fraction:.0%} 的候選解交給真實模擬器。")
+    start_generation = resume_state['generation'] if resume_state else 0
+    schedule = None
+    if multi_fidelity:
+        full_measured_z = callback_handler.full_measured_z.reshape(-1, len(callback_handler.full_freq_points))
+        schedule = FrequencySchedule(callback_handler.full_freq_points, full_measured_z, maxiter, tol)
+        if resume_state:
+            error = schedule.set_level(resume_state['fidelity_level'], resume_state['fidelity_start'])
+            if error:
+                logger.error(error)
+                return None
+        callback_handler.set_frequency_indices(schedule.indices)
+        logger.info(f"多階解析度模式：頻率點數 {schedule.describe()}，目前 {len(schedule.indices)} 點。")
+    rng = np.random.default_rng(seed)
 
-    callback_handler = OptimizationCallback(param_names, measured_data, mode)
+    def on_generation(intermediate_result):
+        callback_handler.callback(intermediate_result)
+        generation = start_generation + intermediate_result.nit
+        if schedule is not None and schedule.update(generation, intermediate_result.population_energies):
+            callback_handler.set_frequency_indices(schedule.indices)
+            if callback_handler.surrogate is not None:
+                # 代理模型以舊頻率軸的誤差訓練，改以新的模型重新累積資料
+                callback_handler.surrogate.close()
+                lower, upper = np.array(bounds, dtype=float).T
+                callback_handler.surrogate = SurrogateModel(lower, upper)
+            engine.rescore()
+        if checkpoint_every and callback_handler.iteration % checkpoint_every == 0:
+            # 先寫歷史紀錄再寫檢查點，確保檢查點記錄的歷史位置都已落地
+            callback_handler.flush_history()
+            state = {
+                'version': CHECKPOINT_VERSION,
+                'optimizer': optimizer,
+                'mode': mode,
+                'bounds': {name: list(bound) for name, bound in param_bounds.items()},
+                'param_names': param_names,
+                'fixed_params': fixed_params,
+                'settings': {'maxiter': maxiter, 'popsize': popsize, 'tol': tol},
+                'generation': generation,
+                'history_offset': callback_handler.iteration,
+                'batch_evaluations': callback_handler.batch_evaluations,
+                'screened_out': callback_handler.screened_out,
+                'history_path': callback_handler.history_path,
+                'fidelity_level': schedule.level if schedule else None,
+                'fidelity_start': schedule.level_start if schedule else 0,
+            }
+            state.update(engine.capture_state())
+            error = save_checkpoint(checkpoint_path, state)
+            if error:
+                logger.warning(error)
 
-    logger.info(f"開始執行 Differential Evolution... Max iterations: {maxiter}")
+    # 先建立暫存根目錄，DE 的工作程序 (workers=-1) 會繼承並各自建立私有子目錄
+    prepare_scratch()
+    engine, _ = create_optimizer(
+        optimizer, callback_handler.objective_batch, bounds,
+        maxiter=max(maxiter - start_generation, 0), popsize=popsize, tol=tol, rng=rng,
+        callback=on_generation, objective=callback_handler.objective, vectorized=vectorized
+    )
+    logger.info(f"開始執行 {engine.display_name}... Max iterations: {maxiter}")
+    if checkpoint_every:
+        logger.info(f"每 {checkpoint_every} 代寫入檢查點: {checkpoint_path}")
     start_t = time.time()
     
-    result = differential_evolution(
-        func=callback_handler.objective,
-        bounds=bounds,
-        strategy='best1bin',
-        maxiter=maxiter,
-        popsize=popsize,
-        tol=tol,
-        mutation=(0.5, 1),
-        recombination=0.7,
-        updating='deferred',
-        workers=-1,
-        callback=callback_handler.callback
-    )
+    with engine:
+        if resume_state:
+            error = engine.restore_state(resume_state)
+            if error:
+                logger.error(error)
+                return None
+        try:
+            result = engine.solve()
+        finally:
+            if callback_handler.surrogate is not None:
+                callback_handler.surrogate.close()
+        if schedule is not None and not schedule.is_full:
+            # 引擎在粗略頻率軸上就停止 (例如步長過小)：最終誤差改以完整頻率軸計算
+            logger.warning(f"全域搜尋在 {len(schedule.indices)} 點的頻率子集上結束，以完整頻率軸重新計算最終誤差。")
+            callback_handler.set_frequency_indices(np.arange(len(callback_handler.full_freq_points)))
+            result.fun = callback_handler.objective(result.x)
 
     callback_handler.save_and_close()
+    global _LAST_SEARCH_STATS
+    _LAST_SEARCH_STATS = {
+        'errors': list(callback_handler.error_trace),
+        'evaluations': list(callback_handler.evaluation_trace),
+        'screened_out': callback_handler.screened_out,
+        'history_path': callback_handler.history_path,
+        'population': [],
+        'population_errors': [],
+    }
+    if callback_handler.population is not None:
+        order = np.argsort(callback_handler.parent_errors, kind='stable')
+        _LAST_SEARCH_STATS['population'] = [
+            {name: float(value) for name, value in zip(param_names, callback_handler.population[i])} | fixed_params
+            for i in order
+        ]
+        _LAST_SEARCH_STATS['population_errors'] = callback_handler.parent_errors[order].tolist()
+    if surrogate and callback_handler.batch_evaluations:
+        simulated = callback_handler.batch_evaluations
+        total = simulated + callback_handler.screened_out
+        logger.info(f"代理模型：DE 共 {total} 個候選解，真實模擬 {simulated} 次，篩除 {callback_handler.screened_out} 次 "
+                    f"({callback_handler.screened_out / total:.0%})。")
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+        logger.info(f"全域搜尋已完成，刪除檢查點: {checkpoint_path}")
+    # 一次清除本次執行 (含 DE 工作程序) 的模擬暫存目錄
+    cleanup_scratch()
 
     end_t = time.time()
     logger.info(f"全域搜尋完成，耗時: {end_t - start_t:.2f} 秒")
+    cache_summary = result_cache_summary()
+    if cache_summary:
+        logger.info(cache_summary)
 
     if result.success:
         logger.info(f"成功找到解。最終誤差: {result.fun:.6f}")
         final_params = dict(zip(param_names, result.x))
+        final_params.update(fixed_params)
+        final_params = {name: final_params[name] for name in param_bounds}
         logger.info(f"最佳化參數: {final_params}")
+        if len(fitting_modes(mode)) > 1:
+            errors = simulate_mode_errors(final_params, measured_data, mode, backend)
+            if errors:
+                logger.info("聯合擬合各治具誤差: " + ', '.join(f"{name} {error:.6f}" for name, error in errors.items()))
+        if fixed_params and release_frozen:
+            final_params = _release_frozen(final_params, mode, backend, multi_fidelity, local_options,
+                                           measured_data_path, history_tag)
         return final_params
     else:
         logger.error(f"全域搜尋未成功收斂。Message: {result.message}")
         return None
 
+def last_search_statistics() -> Dict[str, Any]:
+    """
+    最近一次 global_search_optimization() 的逐代統計：每代結束時的最佳誤差 ('errors')、
+    累計真實模擬次數 ('evaluations'，含初始族群、不含收尾的 polish)、被代理模型篩除的候選解數與歷史檔路徑。
+    'population' 為最後一代的族群 (含凍結參數的完整參數字典，依誤差由小到大排列)，'population_errors' 為對應誤差，
+    可交給 M04 的 multi_start_local_optimization() 從多個盆地同時精化。
+    pareto_search_optimization() 也會更新此統計 (誤差為合併誤差)。
+    """
+    return dict(_LAST_SEARCH_STATS)
+
+def _release_frozen(params: Dict[str, float], mode: str, backend: Optional[str], multi_fidelity: bool = False,
+                    local_options: Optional[Dict[str, Any]] = None, measured_data_path: Optional[str] = None,
+                    history_tag: Optional[str] = None) -> Dict[str, float]:
+    """
+    以 M04 局部優化同時調整全部參數 (含先前凍結者)，沿用呼叫端的局部優化設定、量測數據與歷史檔標籤。
+    M04 未收斂但誤差已低於 DE 的結果時仍採用其最後的參數；只有未改善時才沿用 DE 的結果。
+    """
+    from modules.m04_local_optimize import local_optimization_log_scale
+    logger.info("釋放凍結參數，以 M04 局部優化調整全部參數...")
+    polished = local_optimization_log_scale(params, mode=mode, backend=backend, multi_fidelity=multi_fidelity,
+                                            measured_data_path=measured_data_path, history_tag=history_tag,
+                                            **(local_options or {}))
+    if polished is None:
+        logger.warning("M04 局部優化未改善 DE 的結果，沿用 DE 的結果。")
+        return params
+    return polished
+
+# --- 多目標 Pareto 搜尋 ---
+def save_pareto_archive(path: str, archive_params: np.ndarray, archive_objectives: np.ndarray, errors: np.ndarray,
+                        objective_names: List[str], param_names: List[str]) -> Optional[str]:
+    """
+    將 Pareto 存檔寫成 CSV (先寫暫存檔再以 os.replace 取代)：'error' 為合併誤差，'err_{目標}' 為各目標值，
+    其後為參數，依合併誤差由小到大排列。M07 的 plot_pareto_front() 讀取此格式。
+
+    Returns:
+        Optional[str]: 失敗時的錯誤訊息，成功時為 None。
+    """
+    table = pd.DataFrame(archive_params, columns=param_names)
+    for j, name in reversed(list(enumerate(objective_names))):
+        table.insert(0, f'err_{name}', archive_objectives[:, j])
+    table.insert(0, 'error', errors)
+    partial_path = f"{path}.partial"
+    try:
+        table.sort_values('error', kind='stable').to_csv(partial_path, index=False)
+        os.replace(partial_path, path)
+    except OSError as e:
+        return f"無法寫入 Pareto 存檔 '{path}': {e}"
+    return None
+
+def pareto_search_optimization(
+    param_bounds: Dict[str, Tuple[float, float]],
+    mode: str = 'CM+NM',
+    maxiter: int = 200,
+    popsize: int = 15,
+    backend: Optional[str] = None,
+    resonance_objective: bool = False,
+    seed: Optional[int] = None,
+    measured_data_path: Optional[str] = None,
+    archive_size: int = NSGA2_ARCHIVE_SIZE
+) -> Optional[Dict[str, Any]]:
+    """
+    多目標 Pareto 搜尋 (M19 的 NSGA-II)：不把各治具的誤差合併成單一 RMSE，而是同時最小化
+    各治具各自的 log-RMSE (聯合模式 'CM+NM' 即 CM 與 NM 兩個目標)，resonance_objective=True 時再加上
+    量測阻抗峰值 (共振區) 附近的 log-RMSE。每代整個族群一次交給 M05 批次評估，所有目標取自同一次模擬的曲線。
+    單一模式 (如 'CM') 只有一個治具目標，需搭配 resonance_objective=True。
+
+    歷史紀錄 (M23 的 history_*/ 目錄) 與 global_search_optimization() 格式相同，
+    誤差為合併誤差 (聯合模式依 JOINT_MODE_WEIGHTS 加權)；Pareto 存檔每代寫入 results/pareto_archive_{時間戳}.csv，
+    可用 M07 的 plot_pareto_front() 繪製前緣。不支援檢查點、代理模型與多階解析度模式。
+
+    Returns:
+        Optional[Dict[str, Any]]: 'front' 為 Pareto 存檔中的參數字典 (依合併誤差由小到大)，'objectives' 為對應的
+        各目標值，'best' 為合併誤差最小的解，另含 'objective_names'、'archive_csv' 與 'history_path'；失敗時回傳 None。
+    """
+    logger.info(f"--- 開始 {mode} 模式多目標 Pareto 搜尋 ---")
+    measured_data_path = measured_data_path or os.path.join(OUTPUT_DIR, 'm01_interpolated_data.csv')
+    try:
+        measured_data = pd.read_csv(measured_data_path)
+    except FileNotFoundError:
+        logger.error(f"找不到量測數據檔案: {measured_data_path}")
+        return None
+    try:
+        missing = missing_measured_columns(measured_data, mode)
+    except ValueError as e:
+        logger.error(str(e))
+        return None
+    if missing:
+        logger.error(f"量測數據 '{measured_data_path}' 缺少 {mode} 模式所需的欄位: {missing}")
+        return None
+
+    param_names = list(param_bounds.keys())
+    callback_handler = OptimizationCallback(param_names, measured_data, mode, backend)
+    objective_names = callback_handler.set_objectives(resonance_objective)
+    if len(objective_names) < 2:
+        logger.error(f"Pareto 搜尋至少需要兩個目標，目前只有 {objective_names}；單一模式請設定 resonance_objective=True。")
+        return None
+    archive_path = os.path.join(RESULTS_DIR, os.path.basename(callback_handler.history_path).replace('history_', 'pareto_archive_', 1) + '.csv')
+    # 合併誤差只涵蓋各治具的目標 (前 K 欄)，與單目標搜尋的 sqrt(Σ w_m·E_m² / Σ w_m) 相同
+    mode_weights = np.array([JOINT_MODE_WEIGHTS.get(name, 1.0) for name in fitting_modes(mode)])
+
+    def combined_error(objectives: np.ndarray) -> np.ndarray:
+        return np.sqrt(objectives[:, :len(mode_weights)]**2 @ mode_weights / mode_weights.sum())
+
+    def on_generation(intermediate_result):
+        callback_handler.callback(intermediate_result)
+        error = save_pareto_archive(archive_path, intermediate_result.archive_x, intermediate_result.archive_f,
+                                    combined_error(intermediate_result.archive_f), objective_names, param_names)
+        if error:
+            logger.warning(error)
+
+    prepare_scratch()
+    engine = NSGA2Optimizer(callback_handler.objective_matrix, [param_bounds[name] for name in param_names],
+                            maxiter=maxiter, popsize=popsize, tol=0.0, rng=np.random.default_rng(seed),
+                            callback=on_generation, scalarize=combined_error, archive_size=archive_size)
+    logger.info(f"開始執行 {engine.display_name}... 目標: {objective_names}，族群 {engine.size}，Max iterations: {maxiter}")
+    logger.info(f"Pareto 存檔將儲存至: {archive_path}")
+    start_t = time.time()
+    with engine:
+        result = engine.solve()
+    callback_handler.save_and_close()
+    cleanup_scratch()
+    logger.info(f"Pareto 搜尋完成，耗時: {time.time() - start_t:.2f} 秒，真實模擬 {callback_handler.batch_evaluations} 次。")
+    cache_summary = result_cache_summary()
+    if cache_summary:
+        logger.info(cache_summary)
+
+    errors = combined_error(result.archive_f)
+    error = save_pareto_archive(archive_path, result.archive_x, result.archive_f, errors, objective_names, param_names)
+    if error:
+        logger.warning(error)
+    order = np.argsort(errors, kind='stable')
+    front = [dict(zip(param_names, map(float, result.archive_x[i]))) for i in order]
+    objectives = [dict(zip(objective_names, map(float, result.archive_f[i]))) for i in order]
+    global _LAST_SEARCH_STATS
+    population_errors = np.asarray(combined_error(engine.objectives))
+    population_order = np.argsort(population_errors, kind='stable')
+    _LAST_SEARCH_STATS = {
+        'errors': list(callback_handler.error_trace),
+        'evaluations': list(callback_handler.evaluation_trace),
+        'screened_out': 0,
+        'history_path': callback_handler.history_path,
+        'population': [dict(zip(param_names, map(float, row))) for row in result.population[population_order]],
+        'population_errors': population_errors[population_order].tolist(),
+    }
+    logger.info(f"Pareto 前緣共 {len(front)} 個解；合併誤差最小者: {objectives[0]}")
+    return {
+        'front': front,
+        'objectives': objectives,
+        'objective_names': objective_names,
+        'best': front[0],
+        'archive_csv': archive_path,
+        'history_path': callback_handler.history_path,
+    }
+
 # --- 主程式 (if __name__ == '__main__') (維持不變) ---
 if __name__ == '__main__':
     # ... (示範區塊維持不變) ...
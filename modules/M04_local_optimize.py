@@ -7,11 +7,11 @@ import logging
 import time
 import numpy as np
 import pandas as pd
-from scipy.optimize import minimize
-from scipy.interpolate import interp1d
+from scipy.optimize import minimize, least_squares
 import matplotlib.pyplot as plt
 from pathlib import Path
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 from typing import Optional, List, Dict, Tuple, Any
 
 # --- 路徑修正 ---
@@ -21,8 +21,14 @@ if project_root not in sys.path:
 
 # --- 導入相依模組 ---
 try:
-    from modules.m05_ngspice_runner import run_ngspice_simulation
-    from modules.m06_netlist_generator import generate_netlist
+    from modules.m05_ngspice_runner import (simulate_impedance, simulate_impedance_batch, simulate_error_with_gradient,
+                                             simulate_impedance_with_jacobian, supports_gradient, result_cache_summary,
+                                             curve_to_array, measured_impedance, fitting_weights, simulate_mode_errors,
+                                             missing_measured_columns, uses_remote_workers)
+    from modules.m06_netlist_generator import fitting_modes
+    from modules.m16_scratch_space import cleanup_scratch, prepare_scratch
+    from modules.m20_frequency_schedule import FrequencySchedule, quadrature_weights
+    from modules.m23_history_store import HistoryWriter
 except ImportError:
     # 在獨立測試模式下，這些模組可能不存在，但我們會在 __main__ 中繞過它們
     pass
@@ -34,6 +40,32 @@ OUTPUT_DIR = PROJECT_ROOT / 'output'
 RESULTS_DIR = PROJECT_ROOT / 'results'
 FIGURE_DIR = PROJECT_ROOT / 'figure'
 
+# --- 多起點局部優化設定 ---
+# 從 M03 最後一代族群中挑選的起點數
+MULTISTART_TOP_K = 4
+# 兩個起點在 log10 參數空間的 RMS 距離 (單位：decade) 小於此值時視為同一盆地，只保留誤差較小者
+MULTISTART_MIN_SEPARATION = 0.05
+# 兩個收斂結果的 RMS log10 距離小於此值時視為同一個局部最佳解
+MULTISTART_DEDUP_TOLERANCE = 0.01
+
+# --- 有限差分設定 (無解析梯度的後端) ---
+# 'forward' 每次梯度 D 次模擬並沿用目標函式在同一點的評估；'central' 需 2D 次，截斷誤差較小
+FD_SCHEMES = ('forward', 'central')
+FD_SCHEME_NAMES = {'forward': '前向', 'central': '中央'}
+FD_SCHEME = 'forward'
+# log10 參數空間的步長，相當於相對步長 FD_STEP·ln10；模擬結果精度有限 (如文字輸出) 時應加大
+FD_STEP = 1e-6
+
+# --- 最小平方模式設定 ---
+# scipy.optimize.least_squares 的信賴域演算法：'trf' 或 'dogbox'
+LSQ_METHOD = 'trf'
+# 信賴域子問題的解法：'lsmr' 附帶正則化，對近乎奇異 (部分參數幾乎不影響阻抗) 的 Jacobian 比 'exact' 穩定得多
+LSQ_TR_SOLVER = 'lsmr'
+# 殘差平方和的相對下降量低於此值時停止 (與 SLSQP 模式的 ftol 相同)
+LSQ_FTOL = 1e-6
+# 相位殘差 (弳度) 的權重；1/ln10 使 ln Z = ln|Z| + j∠Z 的虛部與 log10|Z| 殘差同一尺度
+LSQ_PHASE_WEIGHT = 1 / np.log(10)
+
 # --- 日誌設定 ---
 def setup_logging():
     LOG_DIR.mkdir(exist_ok=True)
@@ -53,92 +85,207 @@ def setup_logging():
     )
 setup_logging()
 
-# --- 標準解析器 ---
-def parse_full_output(stdout: str) -> Optional[np.ndarray]:
-    if not stdout: return None
-    lines = stdout.strip().split('\n')
-    data = []
-    try:
-        start_index = next(i for i, line in enumerate(lines) if 'Values' in line) + 1
-    except StopIteration:
-        logging.error("在 Ngspice 輸出中找不到 'Values' 標頭，無法解析。")
-        return None
-
-    for line in lines[start_index:]:
-        line = line.strip()
-        if not line or 'Total analysis time' in line: break
-        try:
-            freq_str, complex_val_str = line.split(maxsplit=1)
-            real_str, imag_str = complex_val_str.split(',')
-            data.append([float(freq_str), float(real_str), float(imag_str)])
-        except (ValueError, IndexError): continue
-            
-    return np.array(data) if data else None
-
 # --- Callback 處理類別 ---
 class OptimizationCallback:
-    def __init__(self, param_names: List[str], measured_data: pd.DataFrame, mode: str = 'CM'):
+    def __init__(self, param_names: List[str], measured_data: pd.DataFrame, mode: str = 'CM', backend: Optional[str] = None,
+                 history_tag: Optional[str] = None):
+        # history_tag: 附加在歷史檔名後的標籤，多起點同時執行時區分各起點的歷史紀錄
         self.param_names_with_headers = ['iteration', 'error'] + param_names
         self.param_names_only = param_names
-        self.measured_z = measured_data[f'Z_{mode}'].values
+        # 聯合模式 (如 'CM+NM') 的 measured_z / weights 與模擬曲線皆為各治具依序串接的 (K·F,)
+        self.measured_z = measured_impedance(measured_data, mode)
         self.freq_points = measured_data['Frequency_Hz'].values
+        # M01 自適應取樣的各頻率點權重 ('Weight' 欄位)；最小平方模式將殘差乘上 sqrt(w / mean(w))，
+        # 使殘差的 RMS 等於加權 RMSE
+        freq_weights = measured_data['Weight'].values if 'Weight' in measured_data.columns else None
+        self.weights = fitting_weights(mode, freq_weights, len(self.freq_points))
+        self.residual_scale = None if self.weights is None else np.sqrt(self.weights / np.mean(self.weights))
+        self.mode = mode
+        self.backend = backend
         self.iteration = 0
         self.start_time = time.time()
+        # 最近一次評估 (log 參數, 誤差)，callback 可直接沿用而不必重新模擬
+        self.last_log_params = None
+        self.last_error = None
         
         timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        if history_tag:
+            timestamp = f'{timestamp}_{history_tag}'
         RESULTS_DIR.mkdir(exist_ok=True)
-        self.csv_path = RESULTS_DIR / f'history_params_local_{timestamp}.csv'
-        self.npz_path = RESULTS_DIR / f'history_curves_local_{timestamp}.npz'
-        
-        pd.DataFrame(columns=self.param_names_with_headers).to_csv(self.csv_path, index=False)
-        self.curves_data = {}
+        self.history_path = RESULTS_DIR / f'history_local_{timestamp}'
+        # 參數與曲線歷史寫入 M23 的分塊歷史紀錄 (格式與 M03 相同)
+        self.history = HistoryWriter(self.history_path, self.param_names_with_headers, meta={'mode': mode, 'source': 'M04'})
+        # 最小平方模式：量測相位 (度，欄位 'Phase_{mode}'，選用) 與最近一次評估的殘差向量 / Jacobian
+        self.measured_phase = None
+        self.last_residuals = None
+        self.last_jacobian = None
+        self.analytic_jacobian = False
+        self.recorded_log_params = None
+        # 有限差分設定，由 _run_slsqp / _run_least_squares 指定
+        self.fd_scheme = FD_SCHEME
+        self.fd_step = FD_STEP
         logging.info(f"Callback 初始化完成。歷史將儲存至 'results/' 資料夾。")
 
     def objective_log_scale(self, log_params: np.ndarray) -> float:
         params = 10**log_params
         param_dict = dict(zip(self.param_names_only, params))
-        
-        netlist_path = generate_netlist(param_dict=param_dict)
-        stdout, _ = run_ngspice_simulation(netlist_path)
-        if not stdout: return 1e10
+        # 先記錄為失敗，模擬失敗時 fd_gradient 的前向差分沿用此點才會得到 1e10 而非其他點的誤差
+        self.last_log_params, self.last_error = np.array(log_params, copy=True), 1e10
 
-        sim_data = parse_full_output(stdout)
+        sim_data, _ = simulate_impedance(param_dict, self.freq_points, mode=self.mode, backend=self.backend)
         if sim_data is None: return 1e10
 
-        sim_freq = sim_data[:, 0]
-        sim_z_complex = sim_data[:, 1] + 1j * sim_data[:, 2]
-        
-        interp_func_real = interp1d(sim_freq, sim_z_complex.real, bounds_error=False, fill_value="extrapolate")
-        interp_func_imag = interp1d(sim_freq, sim_z_complex.imag, bounds_error=False, fill_value="extrapolate")
-        aligned_sim_real = interp_func_real(self.freq_points)
-        aligned_sim_imag = interp_func_imag(self.freq_points)
-        aligned_sim_z = np.abs(aligned_sim_real + 1j * aligned_sim_imag)
+        # M05 回傳的曲線已對齊到 freq_points (聯合模式為各治具依序串接)，可直接與量測值比較
+        aligned_sim_z = np.abs(sim_data[:, 1] + 1j * sim_data[:, 2])
         
         self.last_curve = sim_data
-        error = np.sqrt(np.mean((np.log10(aligned_sim_z) - np.log10(self.measured_z))**2))
+        error = np.sqrt(np.average((np.log10(aligned_sim_z) - np.log10(self.measured_z))**2, weights=self.weights))
+        self.last_log_params, self.last_error = np.array(log_params, copy=True), error
         return error
 
+    def objective_and_gradient(self, log_params: np.ndarray) -> Tuple[float, np.ndarray]:
+        """回傳 (誤差, 對 log10 參數的解析梯度)，供 minimize(jac=True) 使用。"""
+        param_dict = dict(zip(self.param_names_only, 10**log_params))
+        result, _ = simulate_error_with_gradient(param_dict, self.freq_points, self.measured_z, mode=self.mode, backend=self.backend,
+                                                 weights=self.weights)
+        if result is None: return 1e10, np.zeros(len(log_params))
+
+        error, gradient, self.last_curve = result
+        self.last_log_params, self.last_error = np.array(log_params, copy=True), error
+        return error, gradient
+
+    def _residual_vector(self, sim_z: np.ndarray) -> np.ndarray:
+        """逐頻率殘差 log10|Z_sim| - log10|Z_meas|；有量測相位時再接上加權的相位差 (已折返至 ±π)。"""
+        residuals = np.log10(np.abs(sim_z)) - np.log10(self.measured_z)
+        if self.measured_phase is not None:
+            phase = np.angle(sim_z * np.exp(-1j * np.deg2rad(self.measured_phase)))
+            residuals = np.concatenate([residuals, LSQ_PHASE_WEIGHT * phase])
+        return residuals * self._row_scale()
+
+    def _row_scale(self):
+        """殘差向量 (含相位段) 各列的權重縮放，等權重時為 1。"""
+        if self.residual_scale is None:
+            return 1.0
+        return np.tile(self.residual_scale, 2) if self.measured_phase is not None else self.residual_scale
+
+    def residuals_log_scale(self, log_params: np.ndarray) -> np.ndarray:
+        """
+        least_squares 的殘差函式。analytic_jacobian 時以伴隨法一次取得阻抗與其導數，
+        Jacobian 暫存於 last_jacobian 供 residual_jacobian() 沿用；模擬失敗時殘差為 1e10、Jacobian 為 0。
+        """
+        param_dict = dict(zip(self.param_names_only, 10**log_params))
+        residual_count = len(self.measured_z) * (2 if self.measured_phase is not None else 1)
+        self.last_log_params = np.array(log_params, copy=True)
+        self.last_residuals = np.full(residual_count, 1e10)
+        self.last_jacobian = np.zeros((residual_count, len(log_params))) if self.analytic_jacobian else None
+        self.last_error = 1e10
+        if self.analytic_jacobian:
+            result, _ = simulate_impedance_with_jacobian(param_dict, self.freq_points, mode=self.mode, backend=self.backend)
+            if result is None:
+                return self.last_residuals
+            sim_z, dz = result
+        else:
+            sim_data, _ = simulate_impedance(param_dict, self.freq_points, mode=self.mode, backend=self.backend)
+            if sim_data is None:
+                return self.last_residuals
+            sim_z, dz = sim_data[:, 1] + 1j * sim_data[:, 2], None
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            residuals = self._residual_vector(sim_z)
+        if not np.all(np.isfinite(residuals)):
+            return self.last_residuals
+        self.last_residuals = residuals
+        # 誤差維持為幅值殘差的 RMS，與 SLSQP 模式及 M03 的歷史紀錄可直接比較
+        self.last_error = float(np.sqrt(np.mean(residuals[:len(self.measured_z)]**2)))
+        self.last_curve = curve_to_array(self.freq_points, sim_z)
+        if dz is not None:
+            # d log10|Z| = Re(dZ/Z) / ln10，d∠Z = Im(dZ/Z)
+            relative = dz / sim_z[:, None]
+            jacobian = relative.real / np.log(10)
+            if self.measured_phase is not None:
+                jacobian = np.vstack([jacobian, LSQ_PHASE_WEIGHT * relative.imag])
+            jacobian = jacobian * np.reshape(self._row_scale(), (-1, 1))
+            self.last_jacobian = np.where(np.isfinite(jacobian), jacobian, 0.0)
+        return residuals
+
+    def residual_jacobian(self, log_params: np.ndarray) -> np.ndarray:
+        """
+        least_squares 的 jac：信賴域法只在接受新的迭代點後才計算 Jacobian，因此同時在此寫入歷史紀錄。
+        有解析 Jacobian 時直接沿用；否則將 D 個前向差分點一次交給 M05 批次評估
+        ('numpy' 後端堆疊求解、'ngspice_pool' 分散至常駐程序池、'ngspice' 由 M15 平行執行)。
+        """
+        if self.last_log_params is None or not np.array_equal(log_params, self.last_log_params):
+            self.residuals_log_scale(log_params)
+        self.callback(log_params)
+        if self.analytic_jacobian:
+            return self.last_jacobian
+
+        _, curves = simulate_impedance_batch(10**self._perturbed_points(log_params), self.param_names_only, self.freq_points,
+                                             mode=self.mode, return_curves=True, backend=self.backend)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            perturbed = np.array([self._residual_vector(curve) for curve in curves])
+            jacobian = self._difference(self.last_residuals, perturbed).T
+        jacobian[~np.isfinite(jacobian)] = 0.0
+        return jacobian
+
+    def _perturbed_points(self, log_params: np.ndarray) -> np.ndarray:
+        """有限差分的擾動點：前向差分為 D 點，中央差分為 2D 點 (先 +h 後 -h)。"""
+        offsets = self.fd_step * np.eye(len(log_params))
+        if self.fd_scheme == 'central':
+            offsets = np.vstack([offsets, -offsets])
+        return log_params + offsets
+
+    def _difference(self, base: Optional[np.ndarray], values: np.ndarray) -> np.ndarray:
+        """由擾動點的值 (第一軸對應 _perturbed_points 的順序) 組成差分商，中央差分不需要 base。"""
+        if self.fd_scheme == 'central':
+            count = len(values) // 2
+            return (values[:count] - values[count:]) / (2 * self.fd_step)
+        return (values - base) / self.fd_step
+
+    def fd_gradient(self, log_params: np.ndarray) -> np.ndarray:
+        """
+        SLSQP 的 jac (無解析梯度時)：全部擾動點一次交給 M05 批次評估，由後端平行執行，
+        取代 scipy 在目標函式內逐一執行的 D+1 次模擬。SLSQP 會先在同一點呼叫目標函式，
+        前向差分直接沿用該次評估，每次梯度只需 D 次模擬 (中央差分 2D 次)。
+        """
+        base = None
+        if self.fd_scheme == 'forward':
+            if self.last_log_params is None or not np.array_equal(log_params, self.last_log_params):
+                self.objective_log_scale(log_params)
+            base = self.last_error
+            if base >= 1e10:
+                return np.zeros(len(log_params))
+        errors, _ = simulate_impedance_batch(10**self._perturbed_points(log_params), self.param_names_only, self.freq_points,
+                                             self.measured_z, mode=self.mode, backend=self.backend, weights=self.weights)
+        gradient = self._difference(base, errors)
+        # 模擬失敗的擾動點 (誤差 1e10) 不提供方向資訊
+        failed = errors >= 1e10
+        if self.fd_scheme == 'central':
+            failed = failed[:len(log_params)] | failed[len(log_params):]
+        gradient[failed | ~np.isfinite(gradient)] = 0.0
+        return gradient
+
     def callback(self, xk: np.ndarray):
-        current_error = self.objective_log_scale(xk)
+        # SLSQP 在呼叫 callback 前已於 xk 評估過目標函式，命中時直接沿用
+        if self.last_log_params is not None and np.array_equal(xk, self.last_log_params):
+            current_error = self.last_error
+        else:
+            current_error = self.objective_log_scale(xk)
         real_params = 10**xk
         
-        row = pd.DataFrame([[self.iteration, current_error] + list(real_params)], columns=self.param_names_with_headers)
-        row.to_csv(self.csv_path, mode='a', header=False, index=False)
-        
-        self.curves_data[f'iter_{self.iteration}'] = self.last_curve
+        self.history.append([self.iteration, current_error] + list(real_params), self.last_curve)
+        self.recorded_log_params = np.array(xk, copy=True)
         
         # 不在 callback 中 print，改由 minimize 的 disp 選項顯示
         self.iteration += 1
 
     def save_and_close(self):
-        np.savez_compressed(self.npz_path, **self.curves_data)
-        logging.info("NPZ 檔案已儲存。歷史紀錄儲存完畢。")
+        self.history.close()
+        logging.info(f"歷史紀錄儲存完畢 ({len(self.history)} 筆): {self.history_path}")
 
 # --- 主功能函式 ---
-def local_optimization_log_scale(initial_guess: Dict[str, float], mode: str = 'CM', maxiter: int = 500) -> Optional[Dict[str, float]]:
-    logging.info(f"--- 開始 {mode} 模式局部優化 (Log Scale) ---")
-    
-    measured_data_path = OUTPUT_DIR / 'm01_interpolated_data.csv'
+def _load_measured_data(mode: str, measured_data_path: Optional[str] = None) -> Optional[pd.DataFrame]:
+    measured_data_path = measured_data_path or OUTPUT_DIR / 'm01_interpolated_data.csv'
     try:
         measured_data = pd.read_csv(measured_data_path)
     except FileNotFoundError:
@@ -147,36 +294,312 @@ def local_optimization_log_scale(initial_guess: Dict[str, float], mode: str = 'C
     # 為了與 M03 的歷史紀錄格式統一，我們使用相同的欄位名
     if 'Impedance' in measured_data.columns:
         measured_data = measured_data.rename(columns={'Impedance': f'Z_{mode}', 'Frequency': 'Frequency_Hz'})
+    try:
+        missing = missing_measured_columns(measured_data, mode)
+    except ValueError as e:
+        logging.error(str(e))
+        return None
+    if missing:
+        logging.error(f"量測數據 '{measured_data_path}' 缺少 {mode} 模式所需的欄位: {missing}")
+        return None
+    return measured_data
+
+def _fitting_error(params: Dict[str, float], measured_data: pd.DataFrame, mode: str, backend: Optional[str]) -> float:
+    """完整頻率軸上的 (加權) log-RMSE，與 OptimizationCallback 的目標函式相同；模擬失敗時為無限大。"""
+    freq_points = measured_data['Frequency_Hz'].values
+    freq_weights = measured_data['Weight'].values if 'Weight' in measured_data.columns else None
+    errors, _ = simulate_impedance_batch(np.array([list(params.values())]), list(params), freq_points,
+                                         measured_impedance(measured_data, mode), mode=mode, backend=backend,
+                                         weights=fitting_weights(mode, freq_weights, len(freq_points)))
+    return float(errors[0]) if errors is not None and np.isfinite(errors[0]) and errors[0] < 1e10 else float('inf')
 
+def _run_slsqp(initial_guess: Dict[str, float], measured_data: pd.DataFrame, mode: str, maxiter: int,
+               backend: Optional[str], analytic_gradient: Optional[bool], history_tag: Optional[str] = None,
+               disp: bool = True, fd_scheme: str = FD_SCHEME, fd_step: float = FD_STEP) -> Dict[str, Any]:
+    """以 SLSQP 精化單一起點，回傳最終參數、誤差、收斂狀態與歷史檔路徑。"""
     param_names = list(initial_guess.keys())
     log_initial_guess = np.log10(np.array(list(initial_guess.values())))
     
-    callback_handler = OptimizationCallback(param_names, measured_data, mode)
+    callback_handler = OptimizationCallback(param_names, measured_data, mode, backend, history_tag)
+    callback_handler.fd_scheme, callback_handler.fd_step = fd_scheme, fd_step
     
-    logging.info(f"開始執行 SLSQP... Max iterations: {maxiter}")
-    start_t = time.time()
+    if analytic_gradient is None:
+        analytic_gradient = supports_gradient(backend)
+    elif analytic_gradient and not supports_gradient(backend):
+        logging.warning("目前的模擬後端不支援解析梯度，改用有限差分。")
+        analytic_gradient = False
 
+    logging.info(f"開始執行 SLSQP... Max iterations: {maxiter}，梯度: "
+                 f"{'伴隨法解析梯度' if analytic_gradient else f'批次{FD_SCHEME_NAMES[fd_scheme]}差分 (步長 {fd_step:g})'}")
     result = minimize(
-        fun=callback_handler.objective_log_scale,
+        fun=callback_handler.objective_and_gradient if analytic_gradient else callback_handler.objective_log_scale,
         x0=log_initial_guess,
         method='SLSQP',
-        options={'maxiter': maxiter, 'disp': True, 'ftol': 1e-6},
+        jac=True if analytic_gradient else callback_handler.fd_gradient,
+        options={'maxiter': maxiter, 'disp': disp, 'ftol': 1e-6},
         callback=callback_handler.callback
     )
+    callback_handler.save_and_close()
+    return {
+        'params': dict(zip(param_names, 10**result.x)),
+        'error': float(result.fun),
+        'success': bool(result.success),
+        'message': str(result.message),
+        'iterations': int(result.nit),
+        'history_path': str(callback_handler.history_path),
+    }
+
+def _run_least_squares(initial_guess: Dict[str, float], measured_data: pd.DataFrame, mode: str, maxiter: int,
+                       backend: Optional[str], analytic_gradient: Optional[bool], history_tag: Optional[str] = None,
+                       disp: bool = True, include_phase: bool = False, fd_scheme: str = FD_SCHEME,
+                       fd_step: float = FD_STEP) -> Dict[str, Any]:
+    """
+    以 scipy.optimize.least_squares 直接最小化逐頻率殘差向量，回傳格式與 _run_slsqp() 相同。
+    maxiter 為殘差函式的評估次數上限 (max_nfev)；Jacobian 另計。
+    """
+    param_names = list(initial_guess.keys())
+    log_initial_guess = np.log10(np.array(list(initial_guess.values())))
 
+    callback_handler = OptimizationCallback(param_names, measured_data, mode, backend, history_tag)
+    callback_handler.fd_scheme, callback_handler.fd_step = fd_scheme, fd_step
+    if include_phase:
+        phase_columns = [f'Phase_{name}' for name in fitting_modes(mode)]
+        if all(column in measured_data.columns for column in phase_columns):
+            callback_handler.measured_phase = np.concatenate([measured_data[column].values for column in phase_columns])
+        else:
+            logging.warning(f"量測數據沒有 {phase_columns} 欄位，只使用幅值殘差。")
+
+    if analytic_gradient is None:
+        analytic_gradient = supports_gradient(backend)
+    elif analytic_gradient and not supports_gradient(backend):
+        logging.warning("目前的模擬後端不支援解析梯度，改用有限差分。")
+        analytic_gradient = False
+
+    callback_handler.analytic_jacobian = analytic_gradient
+    residual_count = len(callback_handler.measured_z) * (2 if callback_handler.measured_phase is not None else 1)
+    logging.info(f"開始執行 least_squares ({LSQ_METHOD})... 殘差數: {residual_count}，Max evaluations: {maxiter}，"
+                 f"Jacobian: {'伴隨法解析 Jacobian' if analytic_gradient else f'批次{FD_SCHEME_NAMES[fd_scheme]}差分 (步長 {fd_step:g})'}")
+    result = least_squares(
+        fun=callback_handler.residuals_log_scale,
+        x0=log_initial_guess,
+        jac=callback_handler.residual_jacobian,
+        method=LSQ_METHOD,
+        tr_solver=LSQ_TR_SOLVER,
+        ftol=LSQ_FTOL,
+        max_nfev=maxiter,
+        verbose=1 if disp else 0
+    )
+    # 收斂時最後接受的點不一定計算過 Jacobian，補寫一筆歷史紀錄
+    if callback_handler.iteration == 0 or not np.array_equal(result.x, callback_handler.recorded_log_params):
+        callback_handler.callback(result.x)
     callback_handler.save_and_close()
+    return {
+        'params': dict(zip(param_names, 10**result.x)),
+        'error': float(np.sqrt(np.mean(result.fun[:len(callback_handler.measured_z)]**2))),
+        'success': bool(result.success),
+        'message': str(result.message),
+        'iterations': callback_handler.iteration,
+        'history_path': str(callback_handler.history_path),
+    }
+
+# 局部優化演算法：名稱 -> 執行函式
+LOCAL_SOLVERS = {'slsqp': _run_slsqp, 'least_squares': _run_least_squares}
+
+def _run_local_solver(solver: str, initial_guess: Dict[str, float], measured_data: pd.DataFrame, mode: str, maxiter: int,
+                      backend: Optional[str], analytic_gradient: Optional[bool], history_tag: Optional[str] = None,
+                      multi_fidelity: bool = False, **options) -> Dict[str, Any]:
+    """
+    執行 LOCAL_SOLVERS[solver]。multi_fidelity 時先依序在 M20 的各粗略頻率子集上優化、逐段接續參數，
+    最後在完整頻率軸上收尾；回傳完整頻率軸那一段的結果 (iterations 為各段總和)。
+    """
+    run = LOCAL_SOLVERS[solver]
+    if not multi_fidelity:
+        return run(initial_guess, measured_data, mode, maxiter, backend, analytic_gradient, history_tag=history_tag, **options)
+    freq_points = measured_data['Frequency_Hz'].values
+    schedule = FrequencySchedule(freq_points, measured_impedance(measured_data, mode).reshape(-1, len(freq_points)))
+    params, iterations = initial_guess, 0
+    for indices in schedule.stages[:-1]:
+        subset = measured_data.iloc[indices].reset_index(drop=True)
+        if 'Weight' in subset.columns:
+            # 非等間距的子集依自身的頻率間距重新計算積分權重
+            subset['Weight'] = quadrature_weights(subset['Frequency_Hz'].values)
+        stage_tag = f'{history_tag}_fidelity{len(indices)}' if history_tag else f'fidelity{len(indices)}'
+        coarse = run(params, subset, mode, maxiter, backend, analytic_gradient, history_tag=stage_tag, **options)
+        logging.info(f"{len(indices)} 點頻率子集：誤差 {coarse['error']:.6f}，{coarse['iterations']} 次迭代。")
+        params, iterations = coarse['params'], iterations + coarse['iterations']
+    result = run(params, measured_data, mode, maxiter, backend, analytic_gradient, history_tag=history_tag, **options)
+    result['iterations'] += iterations
+    return result
+
+def local_optimization_log_scale(initial_guess: Dict[str, float], mode: str = 'CM', maxiter: int = 500, backend: Optional[str] = None,
+                                 analytic_gradient: Optional[bool] = None, solver: str = 'slsqp',
+                                 include_phase: bool = False, fd_scheme: str = FD_SCHEME,
+                                 fd_step: float = FD_STEP, multi_fidelity: bool = False,
+                                 measured_data_path: Optional[str] = None,
+                                 history_tag: Optional[str] = None) -> Optional[Dict[str, float]]:
+    """
+    mode: 'CM'、'NM' 或聯合模式 'CM+NM' (同一組參數同時擬合兩條曲線，每次評估一次模擬得到兩個治具的阻抗)。
+    backend: 模擬後端 ('ngspice' 或 'numpy')，未指定時使用 M05 的 SIMULATION_BACKEND。
+    analytic_gradient: 是否以伴隨法解析梯度作為 jac (僅 'numpy' 後端)；None 時依後端自動決定，
+                       否則以有限差分估計梯度，擾動點一次交給 M05 批次評估平行執行。
+    solver: 'slsqp' 最小化 log-RMSE 純量；'least_squares' 以 scipy 的信賴域最小平方法 (LSQ_METHOD)
+            直接最小化 401 點逐頻率殘差向量，Jacobian 為伴隨法解析解或批次前向差分，通常只需少量模擬即收斂。
+    include_phase: 'least_squares' 模式下，量測數據含 'Phase_{mode}' 欄位 (度，聯合模式需各治具的欄位) 時一併擬合相位。
+    fd_scheme: 有限差分方式 ('forward' 每次 D 次模擬、'central' 2D 次)；fd_step: log10 參數空間的步長。
+    multi_fidelity: 先在 M20 的稀疏頻率子集 (保留共振區) 上優化，再逐段提高到完整頻率軸，
+                    粗略階段每次模擬的 .AC DEC 點數與誤差計算量都較少。
+    measured_data_path: 量測數據 CSV，預設為 output/m01_interpolated_data.csv。
+    history_tag: 附加在歷史檔名後的標籤，多個局部優化同時執行時避免檔名相同。
+
+    回傳最佳化後的參數；未收斂 (例如迭代次數用盡) 時，只要完整頻率軸上的誤差低於起點仍回傳最後的參數，
+    否則 (或設定錯誤) 回傳 None。
+    """
+    logging.info(f"--- 開始 {mode} 模式局部優化 (Log Scale) ---")
+    if solver not in LOCAL_SOLVERS:
+        logging.error(f"未知的局部優化演算法 '{solver}'，可用: {sorted(LOCAL_SOLVERS)}")
+        return None
+    if fd_scheme not in FD_SCHEMES:
+        logging.error(f"未知的有限差分方式 '{fd_scheme}'，可用: {list(FD_SCHEMES)}")
+        return None
+    
+    measured_data = _load_measured_data(mode, measured_data_path)
+    if measured_data is None:
+        return None
+
+    start_t = time.time()
+    options = {'fd_scheme': fd_scheme, 'fd_step': fd_step}
+    if solver == 'least_squares':
+        options['include_phase'] = include_phase
+    result = _run_local_solver(solver, initial_guess, measured_data, mode, maxiter, backend, analytic_gradient,
+                               history_tag=history_tag, multi_fidelity=multi_fidelity, **options)
+    cleanup_scratch()
     
     end_t = time.time()
     logging.info(f"局部優化完成，耗時: {end_t - start_t:.2f} 秒")
+    cache_summary = result_cache_summary()
+    if cache_summary:
+        logging.info(cache_summary)
 
-    if result.success:
-        final_params = dict(zip(param_names, 10**result.x))
-        logging.info(f"成功找到解。最終誤差: {result.fun:.6f}")
-        logging.info(f"最佳化參數: {final_params}")
-        return final_params
+    if result['success']:
+        logging.info(f"成功找到解。最終誤差: {result['error']:.6f}")
+        logging.info(f"最佳化參數: {result['params']}")
+        if len(fitting_modes(mode)) > 1:
+            errors = simulate_mode_errors(result['params'], measured_data, mode, backend)
+            if errors:
+                logging.info("聯合擬合各治具誤差: " + ', '.join(f"{name} {error:.6f}" for name, error in errors.items()))
+        return result['params']
+    # 迭代次數用盡或線搜尋中止時，最後的參數通常已比起點好；誤差確實較低時仍回傳 (例如 M03 釋放凍結參數)
+    final_error = _fitting_error(result['params'], measured_data, mode, backend)
+    initial_error = _fitting_error(initial_guess, measured_data, mode, backend)
+    if final_error < initial_error:
+        logging.warning(f"局部優化未成功收斂 ({result['message']})，但誤差已由 {initial_error:.6f} 降至 "
+                        f"{final_error:.6f}，回傳最後的參數。")
+        return result['params']
+    logging.error(f"局部優化未成功收斂，且未改善起點的誤差。Message: {result['message']}")
+    return None
+
+def _log_distance(a: Dict[str, float], b: Dict[str, float]) -> float:
+    """兩組參數在 log10 空間的 RMS 距離 (單位：decade)。"""
+    return float(np.sqrt(np.mean([(np.log10(a[name]) - np.log10(b[name]))**2 for name in a])))
+
+def select_distinct_starts(population: List[Dict[str, float]], errors: Optional[List[float]] = None,
+                           top_k: int = MULTISTART_TOP_K, min_separation: float = MULTISTART_MIN_SEPARATION) -> List[int]:
+    """
+    依誤差由小到大走訪族群，略過與已選起點距離小於 min_separation 的個體，回傳至多 top_k 個起點的索引。
+    errors 為 None 時依 population 原本的順序 (M03 的族群已依誤差排序)。
+    """
+    order = np.argsort(errors, kind='stable') if errors is not None else np.arange(len(population))
+    chosen: List[int] = []
+    for index in order:
+        if len(chosen) >= top_k:
+            break
+        if not np.isfinite(errors[index] if errors is not None else 0.0):
+            continue
+        if all(_log_distance(population[index], population[other]) >= min_separation for other in chosen):
+            chosen.append(int(index))
+    return chosen
+
+def _refine_start(task: Tuple[int, Dict[str, float], str, int, Optional[str], Optional[bool], str, Dict[str, Any], Optional[str]]) -> Dict[str, Any]:
+    """工作程序：讀取量測數據並精化一個起點 (量測數據在各程序各自讀取，不必經由 pickle 傳遞)。"""
+    start_index, initial_guess, mode, maxiter, backend, analytic_gradient, solver, options, measured_data_path = task
+    measured_data = _load_measured_data(mode, measured_data_path)
+    if measured_data is None:
+        return {'start_index': start_index, 'params': initial_guess, 'error': float('inf'), 'success': False,
+                'message': '找不到量測數據檔案', 'iterations': 0, 'history_path': None}
+    result = _run_local_solver(solver, initial_guess, measured_data, mode, maxiter, backend, analytic_gradient,
+                               history_tag=f'start{start_index}', disp=False, **options)
+    result['start_index'] = start_index
+    # 每個工作程序結束前清除自己的模擬暫存子目錄
+    cleanup_scratch()
+    return result
+
+def multi_start_local_optimization(population: List[Dict[str, float]], population_errors: Optional[List[float]] = None,
+                                   top_k: int = MULTISTART_TOP_K, mode: str = 'CM', maxiter: int = 500,
+                                   backend: Optional[str] = None, analytic_gradient: Optional[bool] = None,
+                                   workers: Optional[int] = None, solver: str = 'slsqp',
+                                   fd_scheme: str = FD_SCHEME, fd_step: float = FD_STEP,
+                                   min_separation: float = MULTISTART_MIN_SEPARATION,
+                                   dedup_tolerance: float = MULTISTART_DEDUP_TOLERANCE,
+                                   multi_fidelity: bool = False,
+                                   measured_data_path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    多起點局部優化：從 M03 最後一代族群 (last_search_statistics() 的 'population' / 'population_errors')
+    挑選至多 top_k 個彼此相距至少 min_separation 的個體，以程序池同時執行 SLSQP 精化。
+    每個起點有各自的歷史紀錄 (results/history_local_{時間戳}_start{索引}/)。
+    回傳依最終誤差排序的局部最佳解清單，每項包含 'params'、'error'、'success'、'message'、'iterations'、
+    'start_index'、'start_error'、歷史檔路徑，以及收斂到同一點 (距離小於 dedup_tolerance) 而被併入的
+    其他起點索引 'duplicates'。
+    workers: 程序池大小，None 時為 min(起點數, CPU 數)；1 時 (或 'remote' 後端) 在目前程序依序執行。
+    solver、fd_scheme、fd_step、multi_fidelity: 每個起點使用的局部優化演算法、有限差分與多階解析度設定，
+    見 local_optimization_log_scale()。
+    measured_data_path: 量測數據 CSV (各工作程序各自讀取)，預設為 output/m01_interpolated_data.csv。
+    """
+    logging.info(f"--- 開始 {mode} 模式多起點局部優化 (Log Scale) ---")
+    if solver not in LOCAL_SOLVERS:
+        logging.error(f"未知的局部優化演算法 '{solver}'，可用: {sorted(LOCAL_SOLVERS)}")
+        return []
+    if fd_scheme not in FD_SCHEMES:
+        logging.error(f"未知的有限差分方式 '{fd_scheme}'，可用: {list(FD_SCHEMES)}")
+        return []
+    starts = select_distinct_starts(population, population_errors, top_k, min_separation)
+    if not starts:
+        logging.error("族群中沒有可用的起點。")
+        return []
+    logging.info(f"由 {len(population)} 個個體中選出 {len(starts)} 個相異起點: {starts}")
+
+    options = {'fd_scheme': fd_scheme, 'fd_step': fd_step, 'multi_fidelity': multi_fidelity}
+    tasks = [(index, population[index], mode, maxiter, backend, analytic_gradient, solver, options, measured_data_path)
+             for index in starts]
+    workers = workers or min(len(tasks), os.cpu_count() or 1)
+    if workers > 1 and uses_remote_workers(backend):
+        # 協調者只能存在於單一程序；各起點的有限差分批次已由遠端工作程序平行評估
+        logging.warning("'remote' 後端的多起點優化在目前程序依序執行各起點。")
+        workers = 1
+    start_t = time.time()
+    if workers > 1:
+        # 先建立暫存根目錄，工作程序會繼承並各自建立私有子目錄
+        prepare_scratch()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_refine_start, tasks))
     else:
-        logging.error(f"局部優化未成功收斂。Message: {result.message}")
-        return None
+        results = [_refine_start(task) for task in tasks]
+    cleanup_scratch()
+    logging.info(f"多起點局部優化完成，{len(tasks)} 個起點、{workers} 個程序，耗時: {time.time() - start_t:.2f} 秒")
+
+    for result in results:
+        result['start_error'] = float(population_errors[result['start_index']]) if population_errors is not None else None
+    # 依誤差排序後合併收斂到同一點的結果，保留誤差最小者
+    optima: List[Dict[str, Any]] = []
+    for result in sorted(results, key=lambda r: r['error']):
+        duplicate_of = next((o for o in optima if _log_distance(result['params'], o['params']) < dedup_tolerance), None)
+        if duplicate_of is not None:
+            duplicate_of['duplicates'].append(result['start_index'])
+        else:
+            optima.append(dict(result, duplicates=[]))
+    for rank, optimum in enumerate(optima, 1):
+        logging.info(f"局部最佳解 #{rank}: 誤差 {optimum['error']:.6f} (起點 {optimum['start_index']}，"
+                     f"起點誤差 {optimum['start_error']}，合併起點 {optimum['duplicates']}，收斂: {optimum['success']})")
+    return optima
 
 # --- 主程式 (if __name__ == '__main__') ---
 if __name__ == '__main__':
@@ -1,14 +1,33 @@
 # M05_ngspice_runner.py (最終穩健版)
 # -*- coding: utf-8 -*-
 
+import sys
 import os
+import re
+import hashlib
 import logging
 import subprocess
 import time
-from typing import Optional, Tuple
+import numpy as np
+from typing import Optional, Tuple, Dict, List
 
 # --- 全域設定 ---
 NGSPICE_EXECUTABLE_PATH = r'D:\Ngspice\bin\ngspice.exe'
+# 模擬後端：'ngspice' (每次評估一個子程序)、'ngspice_pool' (M12 常駐程序池)、'remote' (M22 遠端工作程序)
+# 或 'numpy' (M11 內建 MNA 求解器，僅適用線性 R/L/C/K 電路)
+SIMULATION_BACKEND = 'ngspice'
+# 擬合評估結果快取 (M14)：相同範本、頻率軸與 (量化後) 參數直接重用先前的結果
+RESULT_CACHE_ENABLED = True
+# 擬合 Netlist 經由 stdin 交給 Ngspice ('ngspice -b' 未指定輸入檔時讀取 stdin)，不寫入任何 Netlist 檔案；
+# 設為 False 時改寫入 M16 私有暫存目錄中的槽位檔案
+NGSPICE_NETLIST_VIA_STDIN = True
+# 多組參數改以單一 Ngspice 程序的 .control 迴圈 (alterparam / reset / run / write) 依序評估，
+# 分攤啟動程序與解析電路的成本；設為 False 時每組參數各啟動一個程序
+NGSPICE_SWEEP_ENABLED = True
+# 單一掃描程序最多評估的參數組數 (限制單次執行時間與 rawfile 大小)
+NGSPICE_SWEEP_MAX_SETS = 64
+# 聯合擬合 (mode='CM+NM') 中各治具的權重：誤差為 sqrt(Σ w_m·E_m² / Σ w_m)，E_m 為各治具的 (加權) log-RMSE
+JOINT_MODE_WEIGHTS = {'CM': 1.0, 'NM': 1.0}
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 BASE_DIR = os.path.dirname(SCRIPT_DIR)
 LOG_DIR = os.path.join(BASE_DIR, 'logs')
@@ -16,6 +35,14 @@ NETLIST_DIR = os.path.join(BASE_DIR, 'netlist')
 RUNNABLE_DIR = os.path.join(NETLIST_DIR, 'runnable')
 LOG_FILE_PATH = os.path.join(LOG_DIR, 'm05_ngspice_runner.log')
 
+# --- 路徑修正 (後端分派時需以 'modules.' 導入 M06 / M11) ---
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from modules.m06_netlist_generator import fitting_modes, fitting_outputs
+from modules.m13_simulation_result import SimulationResult, read_rawfile, read_rawfile_plots, parse_text_output
+from modules.m16_scratch_space import get_scratch_space
+
 # --- 日誌設定 ---
 def setup_logging():
     os.makedirs(LOG_DIR, exist_ok=True)
@@ -32,33 +59,27 @@ def setup_logging():
 logger = setup_logging()
 
 # --- 核心功能 ---
-def run_ngspice_simulation(netlist_filename: str, timeout_seconds: int = 60) -> Tuple[Optional[str], Optional[str]]:
-    logger.info(f"M05 模組啟動：準備執行 Netlist 檔案 '{netlist_filename}'...")
+def build_ngspice_command(netlist_path: Optional[str], output_path: str, rawfile_path: Optional[str] = None) -> List[str]:
+    """
+    組合批次模式 (-b) 的 Ngspice 指令；同步執行與 M15 非同步排程器共用。
+    netlist_path 為 None 時不指定輸入檔，Ngspice 改由 stdin 讀取 Netlist。
+    """
+    command = [NGSPICE_EXECUTABLE_PATH, "-b", "-o", output_path]
+    if rawfile_path:
+        command[2:2] = ["-r", rawfile_path]
+    if netlist_path:
+        command.append(netlist_path)
+    return command
 
-    if not os.path.exists(NGSPICE_EXECUTABLE_PATH):
-        error_msg = f"致命錯誤：找不到 Ngspice 執行檔 -> {NGSPICE_EXECUTABLE_PATH}"
-        logger.critical(error_msg)
-        return (None, error_msg)
-
-    netlist_path = os.path.join(RUNNABLE_DIR, netlist_filename)
-    if not os.path.exists(netlist_path):
-        error_msg = f"錯誤：找不到指定的 Netlist 檔案 -> {netlist_path}"
-        logger.error(error_msg)
-        return (None, error_msg)
-
-    # 【修改】定義一個唯一的暫存輸出檔路徑
-    temp_output_filename = f"{netlist_filename}.log"
-    temp_output_path = os.path.join(RUNNABLE_DIR, temp_output_filename)
-
-    # 【修改】組合新的指令，使用 -o 參數讓 Ngspice 直接輸出到檔案
-    command = [NGSPICE_EXECUTABLE_PATH, "-b", "-o", temp_output_path, netlist_path]
+def _execute_ngspice(command: List[str], label: str, output_path: str, timeout_seconds: int,
+                     input_text: Optional[str] = None) -> Tuple[Optional[str], Optional[str]]:
+    """執行組合好的指令並讀回 -o 輸出檔內容，回傳 (stdout, stderr)。"""
     logger.info(f"組合指令: {' '.join(command)}")
-
-    stdout_content = None
     try:
         # 【修改】不再需要捕捉 stdout，因為結果已導入檔案
         result = subprocess.run(
             command,
+            input=input_text,
             capture_output=True, # 仍然捕捉 stderr
             text=True,
             timeout=timeout_seconds,
@@ -68,34 +89,456 @@ def run_ngspice_simulation(netlist_filename: str, timeout_seconds: int = 60) ->
         
         # 模擬結束後，檢查 stderr 是否有內容
         if result.stderr and result.stderr.strip():
-            error_msg = f"Netlist '{netlist_filename}' 模擬時 Ngspice 回傳了錯誤或警告。"
+            error_msg = f"Netlist '{label}' 模擬時 Ngspice 回傳了錯誤或警告。"
             logger.warning(error_msg)
             return (None, result.stderr)
         
         # 【修改】如果模擬程序成功，從暫存檔讀取輸出內容
-        if os.path.exists(temp_output_path):
-            with open(temp_output_path, 'r', encoding='utf-8') as f:
+        if os.path.exists(output_path):
+            with open(output_path, 'r', encoding='utf-8') as f:
                 stdout_content = f.read()
-            logger.info(f"Netlist '{netlist_filename}' 模擬成功，並從暫存檔讀取結果。")
+            logger.info(f"Netlist '{label}' 模擬成功，並從暫存檔讀取結果。")
             return (stdout_content, None)
         else:
             # 雖然很少見，但如果程序成功卻沒有產生輸出檔，也視為錯誤
-            error_msg = f"錯誤：Ngspice 執行完畢但未產生輸出檔 '{temp_output_filename}'。"
+            error_msg = f"錯誤：Ngspice 執行完畢但未產生輸出檔 '{os.path.basename(output_path)}'。"
             logger.error(error_msg)
             return (None, error_msg)
 
     except subprocess.TimeoutExpired:
-        error_msg = f"錯誤：模擬 '{netlist_filename}' 超過 {timeout_seconds} 秒，已強制中止。"
+        error_msg = f"錯誤：模擬 '{label}' 超過 {timeout_seconds} 秒，已強制中止。"
         logger.error(error_msg)
         return (None, error_msg)
     except Exception as e:
         error_msg = f"執行 Ngspice 時發生未預期的錯誤: {e}"
         logger.critical(error_msg, exc_info=True)
         return (None, error_msg)
-    finally:
-        # 【修改】無論成功失敗，最後都嘗試刪除暫存檔
-        if os.path.exists(temp_output_path):
-            os.remove(temp_output_path)
+
+def run_ngspice_simulation(netlist_filename: str, timeout_seconds: int = 60, rawfile_path: Optional[str] = None) -> Tuple[Optional[str], Optional[str]]:
+    """
+    rawfile_path: 指定時加上 '-r'，讓 Ngspice 另外寫出二進位 rawfile (由呼叫端讀取並刪除)。
+    -o 輸出的暫存檔放在 M16 的私有暫存目錄，多個工作程序同時執行時不會互相覆寫。
+    """
+    logger.info(f"M05 模組啟動：準備執行 Netlist 檔案 '{netlist_filename}'...")
+
+    if not os.path.exists(NGSPICE_EXECUTABLE_PATH):
+        error_msg = f"致命錯誤：找不到 Ngspice 執行檔 -> {NGSPICE_EXECUTABLE_PATH}"
+        logger.critical(error_msg)
+        return (None, error_msg)
+
+    netlist_path = os.path.join(RUNNABLE_DIR, netlist_filename)
+    if not os.path.exists(netlist_path):
+        error_msg = f"錯誤：找不到指定的 Netlist 檔案 -> {netlist_path}"
+        logger.error(error_msg)
+        return (None, error_msg)
+
+    # 暫存輸出檔在離開 with 區塊時刪除
+    with get_scratch_space().acquire() as job:
+        command = build_ngspice_command(netlist_path, job.log_path, rawfile_path)
+        return _execute_ngspice(command, netlist_filename, job.log_path, timeout_seconds)
+
+# --- 輸出解析 ---
+def parse_print_output(stdout: str) -> Optional[np.ndarray]:
+    """
+    解析 Ngspice 的文字輸出 (由 M13 統一解析器處理)，回傳 (F, 3) [頻率, 實部, 虛部]，失敗回傳 None。
+    """
+    result = parse_text_output(stdout)
+    return None if result is None else result.as_array()
+
+_OUTPUT_RE = re.compile(r'v\(\s*([^,\s)]+)\s*\)', re.IGNORECASE)
+
+def _printed_outputs(netlist_text: str) -> List[str]:
+    """取出 Netlist 中 .PRINT 指令列出的節點電壓，作為結果的預設輸出。"""
+    lines = [line for line in netlist_text.splitlines() if line.strip().upper().startswith('.PRINT')]
+    return [f"v({node.lower()})" for line in lines for node in _OUTPUT_RE.findall(line)]
+
+def load_rawfile_result(rawfile_path: str, netlist_text: str) -> Tuple[Optional[SimulationResult], Optional[str]]:
+    """讀取 rawfile，並以 Netlist 中 .PRINT 的第一個節點作為預設輸出。"""
+    result = read_rawfile(rawfile_path)
+    if result is None:
+        return None, f"無法讀取 rawfile '{rawfile_path}'。"
+    outputs = _printed_outputs(netlist_text)
+    if outputs:
+        result.default_output = outputs[0]
+    return result, None
+
+def read_netlist_text(netlist_path: str) -> str:
+    with open(netlist_path, 'r', encoding='utf-8', errors='ignore') as f:
+        return f.read()
+
+def run_ngspice_rawfile(netlist_filename: str, timeout_seconds: int = 60) -> Tuple[Optional[SimulationResult], Optional[str]]:
+    """
+    以 '-r' 執行 Ngspice 並直接解碼二進位 rawfile，省去逐行解析文字輸出。
+
+    Returns:
+        Tuple[Optional[SimulationResult], Optional[str]]: (result, error)。
+    """
+    with get_scratch_space().acquire() as job:
+        stdout, stderr = run_ngspice_simulation(netlist_filename, timeout_seconds, rawfile_path=job.raw_path)
+        if stdout is None:
+            return None, stderr
+        return load_rawfile_result(job.raw_path, read_netlist_text(os.path.join(RUNNABLE_DIR, netlist_filename)))
+
+def run_ngspice_deck(netlist_text: str, timeout_seconds: int = 60, label: str = 'deck') -> Tuple[Optional[SimulationResult], Optional[str]]:
+    """
+    執行 Netlist 文字並回傳 SimulationResult。NGSPICE_NETLIST_VIA_STDIN 時經由 stdin 串流 Netlist，
+    完全不產生 Netlist 檔案；否則寫入 M16 槽位的 Netlist 檔。log 與 rawfile 都放在私有暫存目錄。
+    """
+    if not os.path.exists(NGSPICE_EXECUTABLE_PATH):
+        error_msg = f"致命錯誤：找不到 Ngspice 執行檔 -> {NGSPICE_EXECUTABLE_PATH}"
+        logger.critical(error_msg)
+        return (None, error_msg)
+
+    with get_scratch_space().acquire() as job:
+        netlist_path = None if NGSPICE_NETLIST_VIA_STDIN else job.write_netlist(netlist_text)
+        command = build_ngspice_command(netlist_path, job.log_path, job.raw_path)
+        stdout, stderr = _execute_ngspice(command, f"{label} ({job.job_id})", job.log_path, timeout_seconds,
+                                          input_text=netlist_text if netlist_path is None else None)
+        if stdout is None:
+            return None, stderr
+        return load_rawfile_result(job.raw_path, netlist_text)
+
+# --- 多組參數掃描 (單一程序) ---
+def prepare_sweep_job(netlist_text: str, param_sets: List[Dict[str, float]], job) -> Tuple[List[str], Optional[str]]:
+    """
+    在 Netlist 加上逐組評估的 .control 區塊 (結果依序附加到 job.raw_path)，回傳 (指令, stdin 內容)；
+    同步執行與 M15 非同步排程器共用。只寫出 .PRINT 列出的向量。
+
+    Raises:
+        ValueError: 參數組為空或名稱不一致。
+    """
+    from modules.m06_netlist_generator import append_sweep_control
+    sweep_text = append_sweep_control(netlist_text, param_sets, job.raw_path, _printed_outputs(netlist_text) or None)
+    netlist_path = None if NGSPICE_NETLIST_VIA_STDIN else job.write_netlist(sweep_text)
+    command = build_ngspice_command(netlist_path, job.log_path)
+    return command, (sweep_text if netlist_path is None else None)
+
+def load_sweep_results(rawfile_path: str, netlist_text: str, set_count: int,
+                       error: Optional[str] = None) -> List[Tuple[Optional[SimulationResult], Optional[str]]]:
+    """
+    依序讀出掃描 rawfile 中的交流分析 plot，第 i 個 plot 即第 i 組參數的結果。
+    plot 數與參數組數不符時無法判斷是哪一組失敗，整批皆回傳 (None, error)。
+    """
+    plots = []
+    if os.path.exists(rawfile_path):
+        try:
+            plots = [p for p in read_rawfile_plots(rawfile_path) if p.plot_name.lower().startswith('ac analysis')]
+        except (OSError, ValueError) as e:
+            error = f"讀取掃描 rawfile 失敗: {e}"
+    if len(plots) != set_count:
+        message = f"掃描只產生 {len(plots)}/{set_count} 組結果。" + (f" {error}" if error else "")
+        return [(None, message)] * set_count
+    if error:
+        logger.warning(f"掃描已產生全部 {set_count} 組結果，忽略 Ngspice 的訊息: {error.strip()}")
+    outputs = _printed_outputs(netlist_text)
+    for plot in plots:
+        if outputs:
+            plot.default_output = outputs[0]
+    return [(plot, None) for plot in plots]
+
+def run_ngspice_sweep(netlist_text: str, param_sets: List[Dict[str, float]], timeout_seconds: int = 60,
+                      label: str = 'sweep') -> List[Tuple[Optional[SimulationResult], Optional[str]]]:
+    """
+    以單一 Ngspice 程序評估多組參數：netlist_text 需以 .param 宣告所有參數 (M06 build_fitting_netlist()
+    或 build_parametric_netlist())，每組參數經 alterparam / reset / run 後附加寫入同一個 rawfile，再拆回各組結果。
+
+    Args:
+        netlist_text (str): 參數化的 Netlist 文字。
+        param_sets (List[Dict[str, float]]): 各組參數值 (名稱需一致)。
+        timeout_seconds (int): 每組參數的逾時；整批的逾時為 timeout_seconds × 組數。
+
+    Returns:
+        List[Tuple[Optional[SimulationResult], Optional[str]]]: 與 param_sets 順序相同的 (result, error)。
+    """
+    if not param_sets:
+        return []
+    if not os.path.exists(NGSPICE_EXECUTABLE_PATH):
+        error_msg = f"致命錯誤：找不到 Ngspice 執行檔 -> {NGSPICE_EXECUTABLE_PATH}"
+        logger.critical(error_msg)
+        return [(None, error_msg)] * len(param_sets)
+
+    with get_scratch_space().acquire() as job:
+        try:
+            command, input_text = prepare_sweep_job(netlist_text, param_sets, job)
+        except ValueError as e:
+            return [(None, f"產生掃描 Netlist 失敗: {e}")] * len(param_sets)
+        _, stderr = _execute_ngspice(command, f"{label} ({job.job_id}, {len(param_sets)} 組)", job.log_path,
+                                     timeout_seconds * len(param_sets), input_text=input_text)
+        return load_sweep_results(job.raw_path, netlist_text, len(param_sets), stderr)
+
+def align_to_frequency(sim_data: np.ndarray, freq_points: np.ndarray) -> np.ndarray:
+    """Ngspice 的 .AC DEC 頻率點與目標軸不同，於對數頻率上內插實部與虛部，回傳 (F, 3)。"""
+    freq_points = np.asarray(freq_points, dtype=float)
+    log_f = np.log10(sim_data[:, 0])
+    real = np.interp(np.log10(freq_points), log_f, sim_data[:, 1])
+    imag = np.interp(np.log10(freq_points), log_f, sim_data[:, 2])
+    return np.column_stack([freq_points, real, imag])
+
+# --- 聯合擬合 (多治具) ---
+def fitting_sim_data(result: SimulationResult, freq_points: np.ndarray, mode: str) -> np.ndarray:
+    """由擬合 Netlist 的模擬結果取出阻抗並對齊到 freq_points：(F, 3)，聯合模式為各治具依序串接的 (K·F, 3)。"""
+    return np.vstack([align_to_frequency(result.as_array(name), freq_points) for name in fitting_outputs(mode)])
+
+def measured_impedance(measured_data, mode: str) -> np.ndarray:
+    """量測數據 (M01 的 DataFrame) 中擬合模式對應的 |Z|：'Z_{mode}' 欄位，聯合模式為各治具的欄位依序串接。"""
+    return np.concatenate([np.asarray(measured_data[f'Z_{name}'], dtype=float) for name in fitting_modes(mode)])
+
+def missing_measured_columns(measured_data, mode: str) -> List[str]:
+    """回傳量測數據缺少的擬合欄位 (例如聯合模式需要 'Z_CM' 與 'Z_NM')；不支援的模式引發 ValueError。"""
+    return [f'Z_{name}' for name in fitting_modes(mode) if f'Z_{name}' not in measured_data.columns]
+
+def fitting_weights(mode: str, freq_weights: Optional[np.ndarray], num_points: int) -> Optional[np.ndarray]:
+    """
+    擬合誤差的逐點權重。單一模式直接回傳 freq_weights (None 為等權重)；聯合模式把頻率權重正規化後
+    乘上各治具的 JOINT_MODE_WEIGHTS 再串接，使加權 RMSE 等於 sqrt(Σ w_m·E_m² / Σ w_m)。
+    """
+    modes = fitting_modes(mode)
+    if len(modes) == 1:
+        return freq_weights
+    base = np.ones(num_points) if freq_weights is None else np.asarray(freq_weights, dtype=float)
+    base = base / base.sum()
+    return np.concatenate([JOINT_MODE_WEIGHTS.get(name, 1.0) * base for name in modes])
+
+def stacked_indices(mode: str, indices: np.ndarray, num_points: int) -> np.ndarray:
+    """完整頻率軸 (num_points 點) 上的 indices 子集，對應到串接曲線 (K·F,) 中的索引。"""
+    return np.concatenate([np.asarray(indices) + k * num_points for k in range(len(fitting_modes(mode)))])
+
+def simulate_mode_errors(param_dict: Dict[str, float], measured_data, mode: str,
+                         backend: Optional[str] = None) -> Optional[Dict[str, float]]:
+    """
+    以量測數據的頻率軸模擬一次，將串接的曲線拆回各治具，回傳各自的 (頻率加權) log-RMSE，
+    供聯合擬合結束時記錄；模擬失敗時回傳 None。
+    """
+    freq_points = np.asarray(measured_data['Frequency_Hz'], dtype=float)
+    sim_data, _ = simulate_impedance(param_dict, freq_points, mode=mode, backend=backend)
+    if sim_data is None:
+        return None
+    freq_weights = measured_data['Weight'].values if 'Weight' in measured_data.columns else None
+    residual = np.log10(np.abs(sim_data[:, 1] + 1j * sim_data[:, 2])) - np.log10(measured_impedance(measured_data, mode))
+    modes = fitting_modes(mode)
+    return {name: float(np.sqrt(np.average(r**2, weights=freq_weights)))
+            for name, r in zip(modes, residual.reshape(len(modes), -1))}
+
+# --- 後端分派 ---
+def run_netlist(netlist_filename: str, timeout_seconds: int = 60, backend: Optional[str] = None) -> Tuple[Optional[str], Optional[str]]:
+    """
+    依 SIMULATION_BACKEND (或 backend 參數) 執行 'netlist/runnable/' 下的 Netlist，回傳 (stdout, stderr)。
+    """
+    backend = backend or SIMULATION_BACKEND
+    if backend == 'numpy':
+        from modules.m11_mna_solver import run_mna_simulation
+        return run_mna_simulation(netlist_filename, timeout_seconds)
+    return run_ngspice_simulation(netlist_filename, timeout_seconds)
+
+def simulate_netlist(netlist_filename: str, timeout_seconds: int = 60, backend: Optional[str] = None) -> Tuple[Optional[SimulationResult], Optional[str]]:
+    """
+    執行 'netlist/runnable/' 下的 Netlist 並回傳共用的 SimulationResult，下游模組不需再解析文字輸出。
+    'numpy' 後端直接由 M11 求解；其他後端以 Ngspice 的二進位 rawfile 讀回結果。
+    """
+    backend = backend or SIMULATION_BACKEND
+    if backend == 'numpy':
+        from modules.m11_mna_solver import simulate_netlist_file
+        return simulate_netlist_file(netlist_filename)
+    return run_ngspice_rawfile(netlist_filename, timeout_seconds)
+
+# --- 結果快取 ---
+_TEMPLATE_DIGESTS: Dict[str, str] = {}
+
+def result_cache_keys(param_dicts: List[Dict[str, float]], freq_points: np.ndarray, mode: str, backend: str):
+    """回傳 (快取物件, 各組參數的快取鍵)；停用快取時回傳 (None, None)。"""
+    if not RESULT_CACHE_ENABLED:
+        return None, None
+    from modules.m14_result_cache import get_result_cache
+    if mode not in _TEMPLATE_DIGESTS:
+        from modules.m06_netlist_generator import build_fitting_deck
+        _TEMPLATE_DIGESTS[mode] = hashlib.sha256(build_fitting_deck(mode).encode('utf-8')).hexdigest()[:16]
+    cache = get_result_cache()
+    context = f"{_TEMPLATE_DIGESTS[mode]}|{mode}|{backend}"
+    return cache, [cache.make_key(context, freq_points, p) for p in param_dicts]
+
+def curve_to_array(freq_points: np.ndarray, curve: np.ndarray) -> np.ndarray:
+    """複數阻抗曲線轉為 (F, 3) [頻率, 實部, 虛部]；聯合模式的 (K·F,) 曲線轉為 (K·F, 3)，頻率欄依治具重複。"""
+    freq_points = np.asarray(freq_points, dtype=float)
+    return np.column_stack([np.tile(freq_points, len(curve) // len(freq_points)), curve.real, curve.imag])
+
+def simulate_impedance(
+    param_dict: Dict[str, float],
+    freq_points: np.ndarray,
+    mode: str = 'CM',
+    backend: Optional[str] = None,
+    timeout_seconds: int = 60
+) -> Tuple[Optional[np.ndarray], Optional[str]]:
+    """
+    擬合流程的統一模擬入口：回傳 Tai_CM 模型在 freq_points 上的阻抗。
+    RESULT_CACHE_ENABLED 時先查詢 M14 結果快取，未命中才實際模擬。
+
+    Args:
+        param_dict (Dict[str, float]): 子電路參數值。
+        freq_points (np.ndarray): 目標頻率軸 (通常為 M01 的 401 點)。
+        mode (str): 'CM'、'NM' 或聯合模式 'CM+NM' (同一次模擬得到兩個治具的阻抗)。
+        backend (str): 'ngspice'、'ngspice_pool'、'numpy' 或 'remote' (M22 遠端工作程序)，未指定時使用 SIMULATION_BACKEND。
+
+    Returns:
+        Tuple[Optional[np.ndarray], Optional[str]]: (sim_data, error)。
+        sim_data 形狀為 (F, 3) [頻率, 實部, 虛部]，已對齊到 freq_points；聯合模式為各治具依序串接的 (K·F, 3)。
+    """
+    backend = backend or SIMULATION_BACKEND
+    cache, keys = result_cache_keys([param_dict], freq_points, mode, backend)
+    if cache is not None:
+        curve = cache.get(keys[0])
+        if curve is not None:
+            return curve_to_array(freq_points, curve), None
+
+    sim_data, error = _simulate_impedance_uncached(param_dict, freq_points, mode, backend, timeout_seconds)
+    if cache is not None and sim_data is not None:
+        cache.put(keys[0], sim_data[:, 1] + 1j * sim_data[:, 2])
+    return sim_data, error
+
+def _simulate_impedance_uncached(
+    param_dict: Dict[str, float],
+    freq_points: np.ndarray,
+    mode: str,
+    backend: str,
+    timeout_seconds: int
+) -> Tuple[Optional[np.ndarray], Optional[str]]:
+    if backend == 'numpy':
+        from modules.m11_mna_solver import simulate_impedance as simulate_mna
+        return simulate_mna(param_dict, freq_points, mode=mode)
+    if backend == 'ngspice_pool':
+        from modules.m12_ngspice_pool import get_shared_pool
+        return get_shared_pool().simulate_impedance(param_dict, freq_points, mode=mode)
+    if backend == 'remote':
+        from modules.m22_remote_workers import get_shared_coordinator
+        curves, error = get_shared_coordinator().map_curves(np.array([list(param_dict.values())]), list(param_dict), freq_points, mode)
+        if curves is None:
+            return None, error
+        if not np.all(np.isfinite(curves[0])):
+            return None, "遠端模擬失敗。"
+        return curve_to_array(freq_points, curves[0]), None
+
+    from modules.m06_netlist_generator import build_fitting_netlist
+    try:
+        netlist_text = build_fitting_netlist(param_dict, freq_points, mode=mode)
+    except (OSError, ValueError) as e:
+        return None, f"產生擬合 Netlist 失敗: {e}"
+    result, error = run_ngspice_deck(netlist_text, timeout_seconds, label=f"fit_{mode}")
+    if result is None:
+        return None, error
+    return fitting_sim_data(result, freq_points, mode), None
+
+def simulate_impedance_batch(
+    param_matrix: np.ndarray,
+    param_names: List[str],
+    freq_points: np.ndarray,
+    measured_z: Optional[np.ndarray] = None,
+    mode: str = 'CM',
+    return_curves: bool = False,
+    backend: Optional[str] = None,
+    weights: Optional[np.ndarray] = None
+) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+    """
+    族群批次評估入口：輸入 (P, D) 參數矩陣，回傳 P 個 log-RMSE 誤差與 (可選) P×F 複數阻抗曲線。
+    weights 為各頻率點的誤差權重 (M01 自適應取樣的 'Weight' 欄位)，None 表示等權重。
+    聯合模式的曲線為 P×(K·F)，measured_z 與 weights 為各治具依序串接 (見 measured_impedance() / fitting_weights())。
+    快取命中的候選解不再模擬；其餘的 'numpy' 後端會堆疊後一次求解，
+    'ngspice_pool' 後端分散給常駐程序池平行評估，'remote' 後端由 M22 協調者分給其他機器上的工作程序，
+    'ngspice' 後端由 M15 非同步排程器執行
+    (NGSPICE_SWEEP_ENABLED 時整個族群分成少數幾個 .control 掃描程序，而非每組一個程序)。
+    """
+    backend = backend or SIMULATION_BACKEND
+    param_matrix = np.atleast_2d(np.asarray(param_matrix, dtype=float))
+    param_dicts = [dict(zip(param_names, row)) for row in param_matrix]
+    curves = np.full((len(param_matrix), len(fitting_modes(mode)) * len(freq_points)), np.nan, dtype=complex)
+
+    cache, keys = result_cache_keys(param_dicts, freq_points, mode, backend)
+    pending = list(range(len(param_dicts)))
+    if cache is not None:
+        pending = []
+        for i, key in enumerate(keys):
+            curve = cache.get(key)
+            if curve is None:
+                pending.append(i)
+            else:
+                curves[i] = curve
+
+    if pending:
+        if backend == 'numpy':
+            from modules.m11_mna_solver import simulate_impedance_batch as simulate_mna_batch
+            _, solved = simulate_mna_batch(param_matrix[pending], param_names, freq_points, mode=mode, return_curves=True)
+            curves[pending] = solved
+        elif backend == 'remote':
+            from modules.m22_remote_workers import get_shared_coordinator
+            solved, error = get_shared_coordinator().map_curves(param_matrix[pending], param_names, freq_points, mode)
+            if solved is None:
+                logger.error(f"遠端批次模擬失敗: {error}")
+            else:
+                curves[pending] = solved
+        else:
+            if backend == 'ngspice_pool':
+                from modules.m12_ngspice_pool import get_shared_pool
+                results = get_shared_pool().map_impedance([param_dicts[i] for i in pending], freq_points, mode=mode)
+            else:
+                from modules.m15_async_scheduler import run_simulate_many
+                results = run_simulate_many([param_dicts[i] for i in pending], freq_points, mode=mode, backend=backend, use_cache=False)
+            for i, (sim_data, _) in zip(pending, results):
+                if sim_data is not None:
+                    curves[i] = sim_data[:, 1] + 1j * sim_data[:, 2]
+        if cache is not None:
+            cache.put_many([(keys[i], curves[i]) for i in pending])
+
+    errors = None
+    if measured_z is not None:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            errors = np.sqrt(np.average((np.log10(np.abs(curves)) - np.log10(measured_z))**2, axis=1, weights=weights))
+        errors[~np.isfinite(errors)] = 1e10
+    return errors, (curves if return_curves else None)
+
+def result_cache_summary() -> Optional[str]:
+    """回傳本程序結果快取的命中率摘要 (停用時回傳 None)，供 M03 / M04 結束時記錄。"""
+    if not RESULT_CACHE_ENABLED:
+        return None
+    from modules.m14_result_cache import get_result_cache
+    return get_result_cache().format_stats()
+
+def uses_remote_workers(backend: Optional[str] = None) -> bool:
+    """是否由 M22 協調者將模擬分給遠端工作程序 ('remote' 後端)；協調者只能存在於單一程序中。"""
+    return (backend or SIMULATION_BACKEND) == 'remote'
+
+def supports_gradient(backend: Optional[str] = None) -> bool:
+    """僅 'numpy' 後端能以伴隨法提供解析梯度；'ngspice' 後端需由呼叫端改用有限差分。"""
+    return (backend or SIMULATION_BACKEND) == 'numpy'
+
+def simulate_error_with_gradient(
+    param_dict: Dict[str, float],
+    freq_points: np.ndarray,
+    measured_z: np.ndarray,
+    mode: str = 'CM',
+    backend: Optional[str] = None,
+    weights: Optional[np.ndarray] = None
+) -> Tuple[Optional[Tuple[float, np.ndarray, np.ndarray]], Optional[str]]:
+    """
+    回傳 log-RMSE 誤差 (weights 為各頻率點的權重)、對 log10(參數) 的梯度與模擬曲線：((error, gradient, sim_data), error_msg)。
+    """
+    backend = backend or SIMULATION_BACKEND
+    if not supports_gradient(backend):
+        return None, f"後端 '{backend}' 不支援解析梯度。"
+    from modules.m11_mna_solver import log_rmse_with_gradient
+    return log_rmse_with_gradient(param_dict, freq_points, measured_z, mode=mode, weights=weights)
+
+def simulate_impedance_with_jacobian(
+    param_dict: Dict[str, float],
+    freq_points: np.ndarray,
+    mode: str = 'CM',
+    backend: Optional[str] = None
+) -> Tuple[Optional[Tuple[np.ndarray, np.ndarray]], Optional[str]]:
+    """
+    回傳複數阻抗與其對 log10(參數) 的逐頻率導數：((z (F,), dz (F, D)), error_msg)，供 M04 最小平方模式使用。
+    """
+    backend = backend or SIMULATION_BACKEND
+    if not supports_gradient(backend):
+        return None, f"後端 '{backend}' 不支援解析梯度。"
+    from modules.m11_mna_solver import impedance_with_jacobian
+    return impedance_with_jacobian(param_dict, freq_points, mode=mode)
 
 # if __name__ == '__main__' 區塊保持不變
 if __name__ == '__main__':
@@ -1,12 +1,22 @@
 # m07_plot_results.py (最終修正版，修正儲存路徑與示範區塊)
 # -*- coding: utf-8 -*-
 
+import sys
 import os
 import logging
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from typing import Tuple, Optional, List
+from typing import Tuple, Optional, List, Union
+
+# --- 路徑修正 ---
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from modules.m06_netlist_generator import fitting_modes
+from modules.m13_simulation_result import SimulationResult, parse_text_output
+from modules.m23_history_store import HistoryWriter, load_history
 
 # --- 全域設定 ---
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -33,49 +43,27 @@ logger = setup_logging()
 
 # --- 核心功能函式 ---
 
-def parse_ngspice_output(stdout: str) -> Optional[np.ndarray]:
-    lines = stdout.strip().split('\n')
-    data = []
-    try:
-        start_index = next(i for i, line in enumerate(lines) if 'Values' in line) + 1
-    except StopIteration:
-        logger.error("在 Ngspice 輸出中找不到 'Values' 標頭，無法解析。")
-        return None
-
-    for line in lines[start_index:]:
-        line = line.strip()
-        if not line or 'Total analysis time' in line:
-            break
-        try:
-            freq_str, complex_val_str = line.split(maxsplit=1)
-            real_str, imag_str = complex_val_str.split(',')
-            data.append([float(freq_str), float(real_str), float(imag_str)])
-        except (ValueError, IndexError) as e:
-            logger.warning(f"無法解析此行，已跳過: '{line}'. 錯誤: {e}")
-            continue
-            
-    if not data:
-        logger.error("未能從 Ngspice 輸出中解析出任何有效數據。")
-        return None
-        
-    return np.array(data)
-
 def calculate_rmse(y_true: np.ndarray, y_pred: np.ndarray) -> float:
     return np.sqrt(np.mean((y_true - y_pred)**2))
 
 def plot_and_calculate_error(
-    simulated_stdout: str,
+    simulated: Union[SimulationResult, str],
     measured_csv_path: str,
     output_plot_filename: str = "impedance_comparison.png",
     impedance_type: str = "CM"
 ) -> Optional[float]:
-    logger.info(f"開始解析 Ngspice 模擬數據...")
-    sim_data = parse_ngspice_output(simulated_stdout)
-    if sim_data is None: return None
-    
-    sim_freq = sim_data[:, 0]
-    sim_impedance_complex = sim_data[:, 1] + 1j * sim_data[:, 2]
-    sim_impedance_mag = np.abs(sim_impedance_complex)
+    """
+    simulated: M05 simulate_netlist() 回傳的 SimulationResult；傳入文字輸出時以 M13 的統一解析器處理。
+    """
+    if isinstance(simulated, str):
+        logger.info(f"開始解析 Ngspice 文字輸出...")
+        simulated = parse_text_output(simulated)
+    if simulated is None:
+        logger.error("未能取得任何有效的模擬數據。")
+        return None
+
+    sim_freq = simulated.frequency
+    sim_impedance_mag = simulated.magnitude()
 
     logger.info(f"讀取量測數據從: {measured_csv_path}")
     try:
@@ -91,8 +79,8 @@ def plot_and_calculate_error(
         return None
     measured_impedance_mag = measured_df[z_column].values
 
-    measured_impedance_mag[measured_impedance_mag < 1e-9] = 1e-9
-    sim_impedance_mag[sim_impedance_mag < 1e-9] = 1e-9
+    measured_impedance_mag = np.maximum(measured_impedance_mag, 1e-9)
+    sim_impedance_mag = np.maximum(sim_impedance_mag, 1e-9)
     error_db = 20 * np.log10(sim_impedance_mag) - 20 * np.log10(measured_impedance_mag)
     rmse_log_mag = calculate_rmse(np.log10(measured_impedance_mag), np.log10(sim_impedance_mag))
     logger.info(f"擬合結果的均方根誤差 (Log-Mag RMSE): {rmse_log_mag:.4f}")
@@ -127,6 +115,125 @@ def plot_and_calculate_error(
 
     return rmse_log_mag
 
+def plot_pareto_front(
+    archive_csv_path: str,
+    output_plot_filename: str = "pareto_front.png"
+) -> Optional[int]:
+    """
+    繪製 M03 pareto_search_optimization() 的 Pareto 存檔 (pareto_archive_*.csv)：
+    每一對目標 ('err_' 開頭的欄位) 畫一張散佈圖，並標出合併誤差 ('error' 欄) 最小的解；只有兩個目標時依序連成前緣曲線。
+    回傳前緣的解數，讀取失敗時回傳 None。
+    """
+    logger.info(f"讀取 Pareto 存檔從: {archive_csv_path}")
+    try:
+        archive = pd.read_csv(archive_csv_path)
+    except FileNotFoundError:
+        logger.error(f"找不到 Pareto 存檔: {archive_csv_path}")
+        return None
+    objective_columns = [column for column in archive.columns if column.startswith('err_')]
+    if len(objective_columns) < 2 or archive.empty:
+        logger.error(f"Pareto 存檔 '{archive_csv_path}' 至少需要兩個目標欄位與一個解。")
+        return None
+
+    pairs = [(i, j) for i in range(len(objective_columns)) for j in range(i + 1, len(objective_columns))]
+    best = int(archive['error'].values.argmin()) if 'error' in archive.columns else None
+    plt.style.use('seaborn-v0_8-whitegrid')
+    fig, axes = plt.subplots(1, len(pairs), figsize=(6 * len(pairs), 5.5), squeeze=False)
+    fig.suptitle(f'Pareto Front ({len(archive)} solutions)', fontsize=16)
+    for ax, (i, j) in zip(axes[0], pairs):
+        x_column, y_column = objective_columns[i], objective_columns[j]
+        front = archive.sort_values(x_column)
+        if len(objective_columns) == 2:
+            # 三個以上目標時兩兩投影的點並非同一條曲線，只在兩個目標時連線
+            ax.plot(front[x_column], front[y_column], color='0.6', linewidth=1, zorder=1)
+        ax.scatter(front[x_column], front[y_column], color='blue', s=18, label='Pareto archive', zorder=2)
+        if best is not None:
+            ax.scatter(archive[x_column].iloc[best], archive[y_column].iloc[best], color='red', marker='*', s=160,
+                       label='Best combined error', zorder=3)
+        ax.set_xlabel(f'{x_column[len("err_"):]} log-RMSE'); ax.set_ylabel(f'{y_column[len("err_"):]} log-RMSE')
+        ax.legend(); ax.grid(True, ls="-", color='0.85')
+
+    plt.tight_layout(rect=[0, 0, 1, 0.94])
+    os.makedirs(FIGURE_DIR, exist_ok=True)
+    full_plot_path = os.path.join(FIGURE_DIR, output_plot_filename)
+    try:
+        plt.savefig(full_plot_path, dpi=300)
+        logger.info(f"Pareto 前緣圖已儲存至: {full_plot_path}")
+    except Exception as e:
+        logger.error(f"儲存圖表失敗: {e}")
+    plt.close(fig)
+    return len(archive)
+
+
+def plot_history(
+    history_path: str,
+    measured_csv_path: str,
+    output_plot_filename: str = "optimization_history.png",
+    iteration: Optional[int] = None
+) -> Optional[float]:
+    """
+    繪製 M03 / M04 的歷史紀錄目錄 (M23 格式)：上方為第 iteration 筆紀錄 (預設為誤差最小者) 的模擬曲線與量測數據，
+    聯合模式依 index.json 記錄的 mode 拆成各治具；下方為誤差收斂曲線。只從 memory map 讀取該筆曲線。
+    回傳該筆紀錄的誤差，讀取失敗或該筆沒有曲線時回傳 None。
+    """
+    reader, err = load_history(history_path)
+    if err:
+        logger.error(err)
+        return None
+    if len(reader) == 0:
+        logger.error(f"歷史紀錄 '{history_path}' 沒有任何紀錄。")
+        return None
+    try:
+        measured_df = pd.read_csv(measured_csv_path)
+    except FileNotFoundError:
+        logger.error(f"找不到量測數據檔案: {measured_csv_path}")
+        return None
+    modes = fitting_modes(reader.meta.get('mode', 'CM'))
+    missing = [f'Z_{name}' for name in modes if f'Z_{name}' not in measured_df.columns]
+    if missing:
+        logger.error(f"量測數據中找不到 {missing} 欄位。")
+        return None
+
+    table = reader.table()
+    index = int(table['error'].values.argmin()) if iteration is None else iteration
+    curve = reader.curve(index)
+    if curve is None or np.isnan(curve).all():
+        logger.error(f"歷史紀錄 '{history_path}' 的第 {index} 筆沒有記錄模擬曲線。")
+        return None
+    error = float(table['error'].iloc[index])
+    logger.info(f"繪製歷史紀錄第 {index} 筆 (iteration {int(table['iteration'].iloc[index])}，誤差 {error:.6f})")
+
+    plt.style.use('seaborn-v0_8-whitegrid')
+    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(12, 10), gridspec_kw={'height_ratios': [3, 1]})
+    fig.suptitle(f'{reader.meta.get("mode", "CM")} Optimization History ({len(reader)} records)', fontsize=16)
+    colors = plt.rcParams['axes.prop_cycle'].by_key()['color']
+    # 聯合模式的曲線為各治具依序堆疊，頻率欄依治具重複
+    for k, (name, segment) in enumerate(zip(modes, np.split(curve, len(modes)))):
+        color = colors[k % len(colors)]
+        ax1.plot(measured_df['Frequency_Hz'], measured_df[f'Z_{name}'], label=f'Measured {name}', color=color, linewidth=2)
+        ax1.plot(segment[:, 0], np.abs(segment[:, 1] + 1j * segment[:, 2]), label=f'Simulated {name}', color=color, linestyle='--', linewidth=2)
+    ax1.set_xscale('log'); ax1.set_yscale('log')
+    ax1.set_xlabel('Frequency (Hz)'); ax1.set_ylabel('Impedance (Ohm)')
+    ax1.set_title(f'Record {index} (iteration {int(table["iteration"].iloc[index])}, error {error:.4e})')
+    ax1.legend(); ax1.grid(True, which="both", ls="-", color='0.85')
+
+    ax2.plot(table['iteration'], table['error'], color='gray', linewidth=1)
+    ax2.plot(table['iteration'], np.minimum.accumulate(table['error'].values), color='green', linewidth=1.5, label='Best so far')
+    ax2.scatter([table['iteration'].iloc[index]], [error], color='red', zorder=3)
+    ax2.set_yscale('log'); ax2.set_xlabel('Iteration'); ax2.set_ylabel('Error (log scale)')
+    ax2.set_title('Error Convergence'); ax2.legend(); ax2.grid(True, which="both", ls="-", color='0.85')
+
+    plt.tight_layout(rect=[0, 0, 1, 0.96])
+    os.makedirs(FIGURE_DIR, exist_ok=True)
+    full_plot_path = os.path.join(FIGURE_DIR, output_plot_filename)
+    try:
+        plt.savefig(full_plot_path, dpi=300)
+        logger.info(f"歷史紀錄圖已儲存至: {full_plot_path}")
+    except Exception as e:
+        logger.error(f"儲存圖表失敗: {e}")
+    plt.close(fig)
+    return error
+
 
 # --- 獨立執行示範 (已修正路徑) ---
 if __name__ == '__main__':
@@ -147,13 +254,11 @@ if __name__ == '__main__':
 
     R_fit, L_fit, C_fit = 4.8, 52e-6, 19e-12
     Z_sim_complex = R_fit + 1j * (2 * np.pi * freqs * L_fit - 1 / (2 * np.pi * freqs * C_fit))
-    ngspice_output_str = "Values\n"
-    for i in range(len(freqs)):
-        ngspice_output_str += f"{freqs[i]:.6e}\t{Z_sim_complex[i].real:.6e},{Z_sim_complex[i].imag:.6e}\n"
-    print("已生成示範用的 Ngspice 輸出內容。")
+    simulated_result = SimulationResult(freqs, {'v(in)': Z_sim_complex})
+    print("已生成示範用的模擬結果。")
 
     rmse_value = plot_and_calculate_error(
-        simulated_stdout=ngspice_output_str,
+        simulated=simulated_result,
         measured_csv_path=demo_measured_csv,
         output_plot_filename="M07_demo_plot_CM.png",
         impedance_type="CM"
@@ -167,3 +272,24 @@ if __name__ == '__main__':
         print(f"比較圖已儲存至: {final_path}")
     else:
         print(f"\n示範執行失敗，請檢查日誌檔案 '{LOG_FILE_PATH}'。")
+
+    # Pareto 前緣示範：CM 與 NM 誤差互相消長的存檔
+    demo_archive_csv = os.path.join(OUTPUT_DIR, 'demo_pareto_archive.csv')
+    err_cm = np.linspace(0.05, 0.3, 25)
+    err_nm = 0.02 / err_cm
+    pd.DataFrame({'error': np.sqrt((err_cm**2 + err_nm**2) / 2), 'err_CM': err_cm, 'err_NM': err_nm}).to_csv(demo_archive_csv, index=False)
+    count = plot_pareto_front(demo_archive_csv, output_plot_filename="M07_demo_pareto_front.png")
+    if count is not None:
+        print(f"Pareto 前緣圖 ({count} 個解) 已儲存至: {os.path.join(FIGURE_DIR, 'M07_demo_pareto_front.png')}")
+
+    # 歷史紀錄示範：R 由 2 逐步收斂到 4.8 的 CM 歷史紀錄
+    demo_history_path = os.path.join(OUTPUT_DIR, 'demo_history')
+    writer = HistoryWriter(demo_history_path, ['iteration', 'error', 'R', 'L', 'C'], meta={'mode': 'CM'})
+    for i, R_iter in enumerate(np.linspace(2, R_fit, 40)):
+        Z_iter = R_iter + 1j * (2 * np.pi * freqs * L_fit - 1 / (2 * np.pi * freqs * C_fit))
+        error = calculate_rmse(np.log10(Z_measured), np.log10(np.abs(Z_iter)))
+        writer.append([i, error, R_iter, L_fit, C_fit], np.column_stack([freqs, Z_iter.real, Z_iter.imag]))
+    writer.close()
+    best_error = plot_history(demo_history_path, demo_measured_csv, output_plot_filename="M07_demo_history.png")
+    if best_error is not None:
+        print(f"歷史紀錄圖 (最佳誤差 {best_error:.4f}) 已儲存至: {os.path.join(FIGURE_DIR, 'M07_demo_history.png')}")
@@ -9,13 +9,16 @@ import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Union
 
 # --- 路徑修正 ---
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
+from modules.m06_netlist_generator import fitting_modes
+from modules.m23_history_store import HistoryWriter, load_history
+
 # --- 全域設定 ---
 PROJECT_ROOT = Path(project_root)
 LOG_DIR = PROJECT_ROOT / 'logs'
@@ -42,23 +45,30 @@ setup_logging()
 
 # --- 主功能函式 ---
 def create_animation(
-    history_csv_path: Path,
-    history_npz_path: Path,
+    history_path: Union[str, Path],
     measured_data_path: Path,
     output_gif_path: Path,
     animation_step: int = 1,
     fps: int = 15
 ):
+    """
+    history_path: M03 / M04 寫出的歷史紀錄目錄 (M23 格式)。每一幀只從 memory map 讀取該次迭代的曲線；
+    聯合模式 (如 'CM+NM') 的曲線依 index.json 記錄的 mode 拆成各治具，各自與量測數據比較。
+    """
     logging.info("--- 開始建立最佳化過程動畫 ---")
     
+    reader, err = load_history(history_path)
+    if err:
+        logging.error(err)
+        return
     try:
-        df_history = pd.read_csv(history_csv_path)
-        curves_history = np.load(history_npz_path)
         df_measured = pd.read_csv(measured_data_path)
-        logging.info("所有歷史紀錄與量測數據載入成功。")
     except FileNotFoundError as e:
         logging.error(f"找不到必要的檔案: {e}")
         return
+    df_history = reader.table()
+    modes = fitting_modes(reader.meta.get('mode', 'CM'))
+    logging.info(f"所有歷史紀錄 ({len(reader)} 筆) 與量測數據載入成功。")
 
     total_iterations = len(df_history)
     param_names = [col for col in df_history.columns if col not in ['iteration', 'error']]
@@ -70,7 +80,12 @@ def create_animation(
     ax_err = fig.add_subplot(gs[0, 1])
     ax_param = fig.add_subplot(gs[1, 1])
     
-    ax_main.plot(df_measured['Frequency_Hz'], df_measured['Z_CM'], color='blue', label='Measured', lw=2)
+    colors = plt.rcParams['axes.prop_cycle'].by_key()['color']
+    sim_curve_lines = []
+    for k, name in enumerate(modes):
+        label = '' if len(modes) == 1 else f' {name}'
+        ax_main.plot(df_measured['Frequency_Hz'], df_measured[f'Z_{name}'], color=colors[k % len(colors)], label=f'Measured{label}', lw=2)
+        sim_curve_lines.append(ax_main.plot([], [], color=colors[k % len(colors)], linestyle='--', lw=2, alpha=0.8, label=f'Simulated{label}')[0])
     ax_main.set_xscale('log'); ax_main.set_yscale('log')
     ax_main.set_title('Impedance vs. Frequency', fontsize=14); ax_main.set_xlabel('Frequency (Hz)'); ax_main.set_ylabel('Impedance (Ohm)')
     ax_main.grid(True, which="both", ls="--", alpha=0.6)
@@ -85,23 +100,24 @@ def create_animation(
     ax_param.legend(fontsize='small', ncol=2)
     ax_param.grid(True, which="both", ls="--", alpha=0.6)
     
-    sim_curve_line, = ax_main.plot([], [], color='red', linestyle='--', lw=2, label='Simulated')
     error_dot, = ax_err.plot([], [], 'ro', markersize=8)
     title_text = ax_main.text(0.05, 0.05, '', transform=ax_main.transAxes, fontsize=12, bbox=dict(facecolor='white', alpha=0.8))
     ax_main.legend()
 
     def update(frame_num):
         iter_index = frame_indices[frame_num]
-        curve_data = curves_history[f'iter_{iter_index}']
-        sim_mag = np.abs(curve_data[:, 1] + 1j * curve_data[:, 2])
-        sim_curve_line.set_data(curve_data[:, 0], sim_mag)
+        curve_data = reader.curve(iter_index)
+        if curve_data is not None:
+            # 聯合模式的曲線為各治具依序堆疊，頻率欄依治具重複
+            for line, segment in zip(sim_curve_lines, np.split(curve_data, len(modes))):
+                line.set_data(segment[:, 0], np.abs(segment[:, 1] + 1j * segment[:, 2]))
         
         current_iter = df_history.loc[iter_index, 'iteration']
         current_error = df_history.loc[iter_index, 'error']
         error_dot.set_data([current_iter], [current_error])
         title_text.set_text(f'Iteration: {current_iter}\nError: {current_error:.4e}')
         
-        return sim_curve_line, error_dot, title_text
+        return (*sim_curve_lines, error_dot, title_text)
 
     logging.info(f"正在生成動畫，總共 {len(frame_indices)} 幀... 這可能需要幾分鐘時間。")
     anim = FuncAnimation(fig, update, frames=len(frame_indices), blit=True, interval=50)
@@ -133,32 +149,25 @@ if __name__ == '__main__':
     pd.DataFrame({'Frequency_Hz': freq_points, 'Z_CM': np.abs(Z_ideal_complex)}).to_csv(measured_data_path, index=False)
     
     RESULTS_DIR.mkdir(exist_ok=True)
-    history_csv_path = RESULTS_DIR / 'demo_history_params.csv'
-    history_npz_path = RESULTS_DIR / 'demo_history_curves.npz'
+    history_path = RESULTS_DIR / 'demo_history'
     
     total_iters = 100
-    curves_history_dict = {}
     current_params = np.array([100.0, 5e-6, 1e-12])
     
-    with open(history_csv_path, 'w', newline='') as f:
-        df_header = pd.DataFrame(columns=['iteration', 'error'] + param_names)
-        df_header.to_csv(f, index=False)
-        for i in range(total_iters):
-            progress = (i / (total_iters - 1))**2 if total_iters > 1 else 1
-            params_for_iter = current_params * (1 - progress) + np.array(true_params) * progress
-            sim_z_complex = 1 / (1/params_for_iter[0] + 1j*(w*params_for_iter[2] - 1/(w*params_for_iter[1])))
-            error = np.sqrt(np.mean((np.log10(np.abs(sim_z_complex)) - np.log10(np.abs(Z_ideal_complex)))**2))
-            row = pd.DataFrame([[i, error] + list(params_for_iter)], columns=df_header.columns)
-            row.to_csv(f, header=False, index=False)
-            curves_history_dict[f'iter_{i}'] = np.vstack([freq_points, sim_z_complex.real, sim_z_complex.imag]).T
-    np.savez_compressed(history_npz_path, **curves_history_dict)
+    writer = HistoryWriter(history_path, ['iteration', 'error'] + param_names, meta={'mode': 'CM'})
+    for i in range(total_iters):
+        progress = (i / (total_iters - 1))**2 if total_iters > 1 else 1
+        params_for_iter = current_params * (1 - progress) + np.array(true_params) * progress
+        sim_z_complex = 1 / (1/params_for_iter[0] + 1j*(w*params_for_iter[2] - 1/(w*params_for_iter[1])))
+        error = np.sqrt(np.mean((np.log10(np.abs(sim_z_complex)) - np.log10(np.abs(Z_ideal_complex)))**2))
+        writer.append([i, error] + list(params_for_iter), np.vstack([freq_points, sim_z_complex.real, sim_z_complex.imag]).T)
+    writer.close()
     logging.info("假的歷史檔案生成完畢。")
     
     # 呼叫主函式來生成動畫
     output_gif_path = FIGURE_DIR / 'M08_optimization_animation.gif'
     create_animation(
-        history_csv_path=history_csv_path,
-        history_npz_path=history_npz_path,
+        history_path=history_path,
         measured_data_path=measured_data_path,
         output_gif_path=output_gif_path,
         animation_step=2,
@@ -9,11 +9,18 @@
 2. 將傳入的參數字典安全地替換掉範本中的佔位符。
 3. 產生一個可用於 Ngspice 執行的最終 Netlist 檔案。
 4. 記錄完整的操作流程與任何可能的錯誤。
+5. 為擬合流程組合子電路範本與量測治具 (CM / NM)，供 M05 與 M11 共用；亦可只產生文字供 stdin 串流。
+   聯合模式 ('CM+NM') 在同一份 Netlist 中放入兩個治具與兩個電流源，一次交流分析同時得到兩條曲線；
+   M11 則改用只含子電路的埠 Netlist (build_port_deck())，以一次 LU 分解換算所有治具的阻抗。
+6. 產生多組參數的掃描 Netlist：於 .control 區塊中逐組 alterparam / reset / run / write，
+   讓一次 Ngspice 批次執行即可評估整批參數 (結果依序附加在同一個 rawfile 中)。
 """
 
 import os
 import logging
+import math
 import string # 導入用於安全範本替換的函式庫
+from typing import Optional, Dict, List, Tuple
 
 # --- 全域設定 ---
 # 定義專案根目錄
@@ -25,6 +32,8 @@ LOG_DIR = os.path.join(BASE_DIR, 'logs')
 NETLIST_DIR = os.path.join(BASE_DIR, 'netlist')
 TEMPLATE_DIR = os.path.join(NETLIST_DIR, 'templates') # 存放範本
 RUNNABLE_DIR = os.path.join(NETLIST_DIR, 'runnable')  # 存放可執行的 netlist
+DATA_DIR = os.path.join(BASE_DIR, 'data')
+FITTING_TEMPLATE_PATH = os.path.join(DATA_DIR, 'Tai_CM.txt') # 擬合用子電路範本
 
 # 定義日誌檔案路徑
 LOG_FILE_PATH = os.path.join(LOG_DIR, 'm06_netlist_generator.log')
@@ -105,6 +114,248 @@ def generate_netlist(template_filename: str, output_filename: str, parameters: d
         logger.error(f"產生 Netlist 時發生未預期的錯誤: {e}", exc_info=True)
         return False
 
+# --- 擬合用 Netlist (子電路範本 + 量測治具) ---
+# 以 1A 交流電流源注入 'in' 節點，V(in) 即為待測阻抗
+FITTING_HARNESS = {
+    'CM': "X_DUT in in 0 0 {subckt}",     # 共模：1,2 並聯為輸入，3,4 接地
+    'NM': "X_DUT in 0 out out {subckt}",  # 差模：1 為輸入、2 接地，3,4 短路
+}
+
+# 聯合擬合模式：以 '+' 連接多個治具，同一組參數同時擬合 CM 與 NM 兩條曲線
+JOINT_MODE = 'CM+NM'
+
+def fitting_modes(mode: str) -> List[str]:
+    """將擬合模式拆成量測治具串列，例如 'CM' → ['CM']、'CM+NM' → ['CM', 'NM']；不支援的模式引發 ValueError。"""
+    modes = mode.split('+')
+    unknown = [name for name in modes if name not in FITTING_HARNESS]
+    if unknown or len(set(modes)) != len(modes):
+        raise ValueError(f"不支援的模式 '{mode}'，可用模式: {list(FITTING_HARNESS)} 或以 '+' 連接，例如 '{JOINT_MODE}'")
+    return modes
+
+def harness_nets(mode: str) -> List[str]:
+    """單一治具中子電路各接腳所接的節點，例如 'NM' → ['in', '0', 'out', 'out']。"""
+    return FITTING_HARNESS[mode].split()[1:-1]
+
+def _output_nodes(modes: List[str]) -> List[str]:
+    return ['in'] if len(modes) == 1 else [f"in_{name.lower()}" for name in modes]
+
+def fitting_outputs(mode: str) -> List[str]:
+    """擬合 Netlist 輸出的向量名稱，依 fitting_modes() 的順序，例如 'CM+NM' → ['v(in_cm)', 'v(in_nm)']。"""
+    return [f"v({node})" for node in _output_nodes(fitting_modes(mode))]
+
+def read_fitting_template(template_path: str = FITTING_TEMPLATE_PATH) -> str:
+    """
+    讀取子電路範本。範本註解可能是 Big5 (cp950) 編碼，依序嘗試常見編碼。
+    """
+    with open(template_path, 'rb') as f:
+        raw = f.read()
+    for encoding in ('utf-8', 'cp950'):
+        try:
+            return raw.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return raw.decode('latin-1')
+
+def _normalize_subckt(template_content: str) -> Tuple[str, str]:
+    """
+    將範本轉為 Ngspice 可接受的寫法：
+    1. 移除沒有任何參數的 'PARAMS:' 尾綴。
+    2. 將多電感的 K 敘述 (LTspice 寫法) 展開為兩兩耦合的 K 敘述。
+    3. 移除註解行 (範本註解可能含非 UTF-8 字元)。
+
+    Returns:
+        Tuple[str, str]: (子電路名稱, 正規化後的子電路文字)
+    """
+    subckt_name = None
+    lines = []
+    for line in template_content.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith('*'):
+            continue
+        tokens = stripped.split()
+        head = tokens[0].upper()
+        if head == '.SUBCKT':
+            subckt_name = tokens[1]
+            if tokens[-1].upper() == 'PARAMS:':
+                tokens = tokens[:-1]
+            lines.append(' '.join(tokens))
+        elif head.startswith('K') and len(tokens) > 4:
+            inductors, coupling = tokens[1:-1], tokens[-1]
+            pair_index = 0
+            for i in range(len(inductors)):
+                for j in range(i + 1, len(inductors)):
+                    pair_index += 1
+                    lines.append(f"{tokens[0]}_{pair_index} {inductors[i]} {inductors[j]} {coupling}")
+        else:
+            lines.append(' '.join(tokens))
+
+    if subckt_name is None:
+        raise ValueError("範本中找不到 '.SUBCKT' 定義。")
+    return subckt_name, '\n'.join(lines)
+
+def build_fitting_deck(mode: str = 'CM', template_path: str = FITTING_TEMPLATE_PATH) -> str:
+    """
+    建立擬合用的電路主體：子電路 + 量測治具 + 輸出指令。
+    元件值仍保留 {參數} 佔位符，不含 .param 與 .AC，因此可被 M11 只解析一次後重複使用。
+    聯合模式 (如 'CM+NM') 的每個治具各有一個電流源與子電路實例，節點加上模式後綴 (in_cm、in_nm…)，
+    .PRINT 依序列出各治具的輸入節點。
+
+    Args:
+        mode (str): 'CM'、'NM' 或聯合模式 'CM+NM'，決定子電路的接腳連接方式。
+        template_path (str): 子電路範本路徑，預設為 data/Tai_CM.txt。
+
+    Returns:
+        str: 電路主體文字。
+    """
+    modes = fitting_modes(mode)
+    subckt_name, subckt_text = _normalize_subckt(read_fitting_template(template_path))
+    if len(modes) == 1:
+        harness = ["I_SRC 0 in AC 1", FITTING_HARNESS[mode].format(subckt=subckt_name)]
+    else:
+        harness = []
+        for name in modes:
+            suffix = name.lower()
+            nets = [net if net == '0' else f"{net}_{suffix}" for net in harness_nets(name)]
+            harness += [f"I_SRC_{name} 0 in_{suffix} AC 1", f"X_DUT_{name} {' '.join(nets)} {subckt_name}"]
+    outputs = ' '.join(f"V({node})" for node in _output_nodes(modes))
+    return '\n'.join([
+        f"* CM_Fitting_System fitting deck ({subckt_name}, mode={mode})",
+        subckt_text,
+        *harness,
+        f".PRINT AC {outputs}",
+    ])
+
+def build_port_deck(template_path: str = FITTING_TEMPLATE_PATH) -> Tuple[str, List[str]]:
+    """
+    建立只含子電路的埠電路主體：最後一個接腳接地作為參考，其餘接腳各自引出為埠 'p1'、'p2'…，不含電源。
+    M11 對各埠注入單位電流 (同一次 LU 分解的多個右端項) 求得埠阻抗矩陣，再依 FITTING_HARNESS 換算各治具的阻抗。
+    此換算假設子電路是浮接的 (內部沒有接地元件)。
+
+    Returns:
+        Tuple[str, List[str]]: (電路主體文字, 埠節點名稱)。
+
+    Raises:
+        ValueError: 子電路內部有接地的元件。
+    """
+    subckt_name, subckt_text = _normalize_subckt(read_fitting_template(template_path))
+    lines = subckt_text.splitlines()
+    header = [t.upper() for t in lines[0].split()]
+    pin_count = (header.index('PARAMS:') if 'PARAMS:' in header else len(header)) - 2
+    for line in lines[1:]:
+        tokens = line.split()
+        if tokens[0][0].upper() in ('R', 'L', 'C') and {t.lower() for t in tokens[1:3]} & {'0', 'gnd'}:
+            raise ValueError(f"子電路 '{subckt_name}' 內部有接地元件 ({tokens[0]})，無法以埠阻抗矩陣換算治具。")
+    ports = [f"p{i + 1}" for i in range(pin_count - 1)]
+    deck = '\n'.join([
+        f"* CM_Fitting_System port deck ({subckt_name})",
+        subckt_text,
+        f"X_DUT {' '.join(ports)} 0 {subckt_name}",
+        f".PRINT AC {' '.join(f'V({port})' for port in ports)}",
+    ])
+    return deck, ports
+
+def format_ac_line(freq_points) -> str:
+    """
+    依目標頻率軸產生 '.AC DEC' 指令，每十倍頻點數取足以涵蓋目標點數的最小整數。
+    """
+    f_start, f_stop = float(min(freq_points)), float(max(freq_points))
+    decades = max(math.log10(f_stop / f_start), 1e-12)
+    points_per_decade = max(1, math.ceil((len(freq_points) - 1) / decades))
+    return f".AC DEC {points_per_decade} {f_start:.6e} {f_stop:.6e}"
+
+def build_fitting_netlist(
+    param_dict: Dict[str, float],
+    freq_points,
+    mode: str = 'CM',
+    template_path: str = FITTING_TEMPLATE_PATH
+) -> str:
+    """
+    回傳以 .param 敘述寫入參數值的完整擬合 Netlist 文字，可直接經由 stdin 交給 Ngspice 而不必寫檔。
+    """
+    deck_lines = build_fitting_deck(mode, template_path).splitlines()
+    param_lines = [f".param {name}={float(value):.9e}" for name, value in param_dict.items()]
+    return '\n'.join(deck_lines[:1] + param_lines + deck_lines[1:] + [format_ac_line(freq_points), ".END", ""])
+
+def generate_fitting_netlist(
+    param_dict: Dict[str, float],
+    freq_points,
+    mode: str = 'CM',
+    output_filename: Optional[str] = None,
+    template_path: str = FITTING_TEMPLATE_PATH
+) -> Optional[str]:
+    """
+    以 .param 敘述寫入參數值，產生可直接交給 Ngspice 的擬合 Netlist。
+
+    Returns:
+        Optional[str]: 成功時回傳 'netlist/runnable/' 下的檔案名稱，失敗則回傳 None。
+    """
+    if output_filename is None:
+        output_filename = f"fit_{mode}_{os.getpid()}.cir"
+    try:
+        content = build_fitting_netlist(param_dict, freq_points, mode, template_path)
+        os.makedirs(RUNNABLE_DIR, exist_ok=True)
+        with open(os.path.join(RUNNABLE_DIR, output_filename), 'w', encoding='utf-8') as f:
+            f.write(content)
+        return output_filename
+    except Exception as e:
+        logger.error(f"產生擬合 Netlist 時發生錯誤: {e}", exc_info=True)
+        return None
+
+# --- 多組參數掃描 (.control 批次) ---
+def build_parametric_netlist(template_filename: str, parameters: dict) -> str:
+    """
+    讀取範本並回傳參數化的 Netlist 文字：數值參數的佔位符改為 {名稱} 並在標題後加上 .param 敘述，
+    之後可由 alterparam 改變；非數值參數 (例如 '1u') 仍直接替換為原字串。
+
+    Raises:
+        OSError: 範本無法讀取。
+        KeyError: 參數字典缺少範本所需的鍵。
+    """
+    with open(os.path.join(TEMPLATE_DIR, template_filename), 'r', encoding='utf-8') as f:
+        template_content = f.read()
+    numeric, substitutions = {}, {}
+    for name, value in parameters.items():
+        try:
+            numeric[name] = float(value)
+            substitutions[name] = f"{{{name}}}"
+        except (TypeError, ValueError):
+            substitutions[name] = value
+    lines = string.Template(template_content).substitute(substitutions).splitlines()
+    param_lines = [f".param {name}={value:.9e}" for name, value in numeric.items()]
+    return '\n'.join(lines[:1] + param_lines + lines[1:]) + '\n'
+
+def append_sweep_control(netlist_text: str, param_sets: List[Dict[str, float]], rawfile_path: str,
+                         outputs: Optional[List[str]] = None) -> str:
+    """
+    在 Netlist 的 .END 之前加入 .control 區塊：逐組 alterparam 所有參數、reset 後 run，
+    並以 appendwrite 將每組的交流分析依序附加到同一個 rawfile，最後 quit。
+    netlist_text 需已以 .param 宣告 param_sets 中的所有參數 (alterparam 只能修改已存在的參數)。
+
+    Args:
+        netlist_text (str): 以 .param 參數化、含 .AC 指令的 Netlist 文字。
+        param_sets (List[Dict[str, float]]): 各組參數值，第 i 組結果為 rawfile 中的第 i 個 plot。
+        rawfile_path (str): 結果 rawfile 的路徑 (需事先不存在，否則會附加在舊內容之後)。
+        outputs (Optional[List[str]]): 要寫出的向量，例如 ['v(in)']；None 時寫出所有向量。
+
+    Raises:
+        ValueError: param_sets 為空或各組的參數名稱不一致。
+    """
+    if not param_sets:
+        raise ValueError("param_sets 不可為空。")
+    names = set(param_sets[0])
+    if any(set(p) != names for p in param_sets[1:]):
+        raise ValueError("掃描的各組參數名稱必須一致。")
+    write_line = f"write {rawfile_path} {' '.join(outputs or [])}".rstrip()
+    control = ['.control', 'set filetype=binary', 'set appendwrite']
+    for param_dict in param_sets:
+        control += [f"alterparam {name} = {float(value):.9e}" for name, value in param_dict.items()]
+        control += ['reset', 'run', write_line, 'destroy all']
+    control += ['quit', '.endc']
+
+    lines = netlist_text.rstrip().splitlines()
+    end_index = next((i for i in range(len(lines) - 1, -1, -1) if lines[i].strip().lower() == '.end'), len(lines))
+    return '\n'.join(lines[:end_index] + control + ['.END', ''])
+
 # --- 主程式 (用於示範與測試) ---
 if __name__ == '__main__':
     print("正在執行 M06 模組 (Netlist Generator) 示範...")
@@ -0,0 +1,1228 @@
+# m11_mna_solver.py
+# -*- coding: utf-8 -*-
+
+"""
+模組 M11: NumPy MNA 交流求解器
+
+功能：
+1. 解析 Netlist (R / L / C / K / V / I / X 元件與 .SUBCKT、.param、.AC、.PRINT 指令)。
+2. 將電路編譯為固定稀疏樣式的 G、C、Γ 矩陣，系統矩陣為 Y(ω) = G + jωC + Γ/(jω)；
+   編譯結果以範本雜湊值快取於 'netlist/compiled/'。
+3. 在 NumPy 中一次解完整個頻率掃描，取代每次評估都啟動 Ngspice 子程序。
+4. 提供與 M05 run_ngspice_simulation() 相同介面的 run_mna_simulation()；simulate_netlist_batch()
+   則與 M05 run_ngspice_sweep() 相同，以同一份參數化 Netlist 一次求解多組參數。
+5. 提供與 Ngspice 輸出比對的精度驗證工具；capture_fitting_reference() 記錄 CM / NM / CM+NM 擬合 Netlist 的
+   Ngspice 參考數據 (含中央差分 Jacobian) 於 'data/ngspice_reference/'，check_fitting_reference() 以之檢查
+   Netlist 解析、編譯後 stamp 表與伴隨法三條計算路徑 (專案根目錄的 check_mna_regression.py 為其命令列)。
+6. 以伴隨法 (adjoint) 計算誤差對 log10(參數) 的解析梯度，供 M04 作為 jac；
+   逐頻率的阻抗 Jacobian 則供 M04 的最小平方模式使用。
+7. 聯合模式 ('CM+NM')：只求解子電路本身一次 (同一次 LU 分解、每個埠一個右端項) 得到埠阻抗矩陣，
+   再以小矩陣運算換算各治具的阻抗與梯度，曲線依模式順序串接為 (K·F,)。
+"""
+
+import sys
+import os
+import re
+import hashlib
+import logging
+import numpy as np
+from typing import Optional, List, Dict, Tuple, Any
+
+# --- 路徑修正 ---
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from modules.m06_netlist_generator import (build_fitting_deck, build_port_deck, fitting_modes, harness_nets,
+                                          FITTING_TEMPLATE_PATH)
+from modules.m13_simulation_result import SimulationResult
+
+# --- 全域設定 ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(SCRIPT_DIR)
+NETLIST_DIR = os.path.join(BASE_DIR, 'netlist')
+RUNNABLE_DIR = os.path.join(NETLIST_DIR, 'runnable')
+
+logger = logging.getLogger(__name__)
+
+GROUND_NODES = {'0', 'gnd'}
+SPICE_SUFFIXES = {
+    't': 1e12, 'g': 1e9, 'meg': 1e6, 'k': 1e3, 'mil': 25.4e-6,
+    'm': 1e-3, 'u': 1e-6, 'n': 1e-9, 'p': 1e-12, 'f': 1e-15
+}
+_NUMBER_RE = re.compile(r'^([+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)(meg|mil|[tgkmunpf])?', re.IGNORECASE)
+_PARAM_RE = re.compile(r'^\$?\{\s*([A-Za-z_]\w*)\s*\}$')
+_OUTPUT_RE = re.compile(r'v\(\s*([^,\s)]+)\s*\)', re.IGNORECASE)
+
+# --- 數值解析 ---
+def parse_spice_value(token: str) -> float:
+    """將 SPICE 數值字串 (例如 '100p'、'1Meg'、'1V') 轉為浮點數，單位字尾會被忽略。"""
+    match = _NUMBER_RE.match(token.strip())
+    if not match:
+        raise ValueError(f"無法解析的 SPICE 數值: '{token}'")
+    scale = SPICE_SUFFIXES[match.group(2).lower()] if match.group(2) else 1.0
+    return float(match.group(1)) * scale
+
+def _parse_value_or_param(token: str, scope: Dict[str, Any]):
+    """回傳數值，或在參數為符號參數時回傳參數名稱 (字串)。"""
+    match = _PARAM_RE.match(token)
+    if match:
+        name = match.group(1)
+        return scope.get(name, name)
+    return parse_spice_value(token)
+
+def _parse_assignments(tokens: List[str]) -> Dict[str, str]:
+    """解析 'name=value' 形式的參數列 (允許等號前後有空白)。"""
+    text = ' '.join(tokens).replace(' =', '=').replace('= ', '=')
+    assignments = {}
+    for item in text.split():
+        if '=' in item:
+            key, value = item.split('=', 1)
+            assignments[key] = value
+    return assignments
+
+# --- 電路結構 ---
+class CircuitElement:
+    """展開後的單一元件。value 為數值或符號參數名稱。"""
+    __slots__ = ('kind', 'name', 'nodes', 'value', 'extra')
+
+    def __init__(self, kind: str, name: str, nodes: List[str], value=None, extra=None):
+        self.kind = kind
+        self.name = name
+        self.nodes = nodes
+        self.value = value
+        self.extra = extra
+
+class MnaCircuit:
+    """
+    已展開 (flatten) 的電路描述。未知數編號與矩陣樣式由 compile_circuit() 建立。
+    """
+    def __init__(self, elements: List[CircuitElement], defaults: Dict[str, float],
+                 outputs: List[str], ac_spec: Optional[Tuple[str, int, float, float]], title: str = ''):
+        self.elements = elements
+        self.defaults = defaults
+        self.outputs = outputs
+        self.ac_spec = ac_spec
+        self.title = title
+        self.param_names = sorted({el.value for el in elements if isinstance(el.value, str)})
+
+    def frequency_points(self) -> Optional[np.ndarray]:
+        """依 .AC 指令重建 Ngspice 的頻率點 (DEC / OCT / LIN)。"""
+        if self.ac_spec is None:
+            return None
+        sweep, n, f_start, f_stop = self.ac_spec
+        if sweep == 'LIN':
+            return np.linspace(f_start, f_stop, n)
+        base = 10.0 if sweep == 'DEC' else 2.0
+        spans = np.log(f_stop / f_start) / np.log(base)
+        num_points = int(np.floor(spans * n + 1e-9)) + 1
+        return np.logspace(np.log10(f_start), np.log10(f_stop), num_points)
+
+# --- 編譯後電路 (固定稀疏樣式) ---
+# 單一批次堆疊的 (P·F, N, N) 複數矩陣記憶體上限，超過時自動分塊求解
+MAX_BATCH_BYTES = 256 * 2**20
+# 編譯格式版本，變更 stamp 結構時需遞增，使磁碟快取失效
+COMPILE_FORMAT_VERSION = 1
+COMPILED_DIR = os.path.join(NETLIST_DIR, 'compiled')
+
+# stamp 數值來源：1/v、v、-v、-k·sqrt(La·Lb)
+_SRC_INVERSE, _SRC_LINEAR, _SRC_NEGATIVE, _SRC_MUTUAL = 0, 1, 2, 3
+
+class CompiledCircuit:
+    """
+    編譯後的電路：固定的稀疏樣式 + 參數到矩陣位置的對應表。
+    系統矩陣為 Y(ω) = G + jωC + Γ/(jω)：
+      - G：電阻電導，以及電壓源 / 耦合電感分支的關聯項 (±1，存於 g0)。
+      - C：電容，以及耦合電感分支列上的 -L 與互感 -M。
+      - Γ：未參與 K 耦合的電感，以 1/L 直接蓋印在節點上，不需額外的分支電流。
+    完全耦合 (K=1) 的電感矩陣為奇異，Γ = L⁻¹ 不存在，因此耦合電感保留分支電流寫法。
+    每次評估只需計算各 stamp 的數值，再散佈 (scatter) 到固定的位置。
+    """
+    ARRAY_FIELDS = ('elem_param', 'elem_const', 'src_kind', 'src_a', 'src_b', 'src_c',
+                    'g_flat', 'g_sign', 'g_src', 'c_flat', 'c_sign', 'c_src',
+                    'gamma_flat', 'gamma_sign', 'gamma_src', 'g0', 'rhs', 'defaults')
+
+    def __init__(self, node_names: List[str], param_names: List[str], arrays: Dict[str, np.ndarray]):
+        self.node_names = list(node_names)
+        self.node_index = {name: i for i, name in enumerate(self.node_names)}
+        self.param_names = list(param_names)
+        for field in self.ARRAY_FIELDS:
+            setattr(self, field, arrays[field])
+        self.size = self.g0.shape[0]
+        self.is_symmetric = self._check_symmetric()
+
+    def _check_symmetric(self) -> bool:
+        """R/L/C/K 互易網路的 MNA 矩陣為複對稱 (Yᵀ = Y)，伴隨解可直接沿用同一個矩陣。"""
+        if not np.array_equal(self.g0, self.g0.T):
+            return False
+        for flat, sign, src in ((self.g_flat, self.g_sign, self.g_src), (self.c_flat, self.c_sign, self.c_src),
+                                (self.gamma_flat, self.gamma_sign, self.gamma_src)):
+            row, col = np.divmod(flat, self.size)
+            entries = sorted(zip(flat.tolist(), sign.tolist(), src.tolist()))
+            transposed = sorted(zip((col * self.size + row).tolist(), sign.tolist(), src.tolist()))
+            if entries != transposed:
+                return False
+        return True
+
+    def _node(self, name: str) -> int:
+        name = name.lower()
+        return -1 if name in GROUND_NODES else self.node_index[name]
+
+    def param_matrix(self, param_names: List[str], values) -> np.ndarray:
+        """
+        將呼叫端的 (P, D) 參數矩陣重新排列為電路的參數順序，缺少的參數使用 .param 預設值。
+        """
+        values = np.atleast_2d(np.asarray(values, dtype=float))
+        matrix = np.tile(self.defaults, (len(values), 1))
+        columns = {name: j for j, name in enumerate(param_names)}
+        for j, name in enumerate(self.param_names):
+            if name in columns:
+                matrix[:, j] = values[:, columns[name]]
+            elif np.isnan(self.defaults[j]):
+                raise KeyError(f"缺少電路參數 '{name}'")
+        return matrix
+
+    def param_entries(self, name: str) -> Dict[str, List[Tuple[int, int]]]:
+        """列出某個參數會改變的 G / C / Γ 矩陣位置 (列, 行)。"""
+        j = self.param_names.index(name)
+        elements = set(np.flatnonzero(self.elem_param == j))
+        sources = {s for s in range(len(self.src_kind))
+                   if {self.src_a[s], self.src_b[s], self.src_c[s]} & elements}
+        entries = {}
+        for label, flat, src in (('G', self.g_flat, self.g_src), ('C', self.c_flat, self.c_src),
+                                 ('Gamma', self.gamma_flat, self.gamma_src)):
+            entries[label] = sorted({divmod(int(f), self.size) for f, s in zip(flat, src) if s in sources})
+        return entries
+
+    def stamp_values(self, param_matrix: np.ndarray) -> np.ndarray:
+        """由 (P, D) 參數矩陣計算每個 stamp 來源的數值，回傳 (P, S)。"""
+        values = np.tile(self.elem_const, (len(param_matrix), 1))
+        mask = self.elem_param >= 0
+        values[:, mask] = param_matrix[:, self.elem_param[mask]]
+
+        kind, a = self.src_kind, self.src_a
+        stamps = np.zeros((len(param_matrix), len(kind)))
+        m = kind == _SRC_INVERSE
+        stamps[:, m] = 1.0 / values[:, a[m]]
+        m = kind == _SRC_LINEAR
+        stamps[:, m] = values[:, a[m]]
+        m = kind == _SRC_NEGATIVE
+        stamps[:, m] = -values[:, a[m]]
+        m = kind == _SRC_MUTUAL
+        stamps[:, m] = -values[:, a[m]] * np.sqrt(values[:, self.src_b[m]] * values[:, self.src_c[m]])
+        return stamps
+
+    def _scatter(self, flat: np.ndarray, sign: np.ndarray, src: np.ndarray, stamps: np.ndarray) -> np.ndarray:
+        num, nn = len(stamps), self.size * self.size
+        index = (np.arange(num)[:, None] * nn + flat[None, :]).ravel()
+        weights = (sign[None, :] * stamps[:, src]).ravel()
+        return np.bincount(index, weights=weights, minlength=num * nn).reshape(num, self.size, self.size)
+
+    def matrices(self, param_matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """回傳 (G, C, Γ)，形狀皆為 (P, N, N)。"""
+        stamps = self.stamp_values(param_matrix)
+        G = self._scatter(self.g_flat, self.g_sign, self.g_src, stamps) + self.g0
+        C = self._scatter(self.c_flat, self.c_sign, self.c_src, stamps)
+        Gamma = self._scatter(self.gamma_flat, self.gamma_sign, self.gamma_src, stamps)
+        return G, C, Gamma
+
+    def system_matrices(self, omega: np.ndarray, param_matrix: np.ndarray) -> np.ndarray:
+        """Y(ω) = G + jωC + Γ/(jω)，回傳 (P, F, N, N)。"""
+        G, C, Gamma = self.matrices(param_matrix)
+        jw = (1j * omega)[None, :, None, None]
+        A = jw * C[:, None]
+        A += G[:, None]
+        if self.gamma_flat.size:
+            A += Gamma[:, None] / jw
+        return A
+
+    def _solve_batches(self, omega: np.ndarray, param_matrix: np.ndarray, rhs: np.ndarray):
+        """
+        將 P 組參數 × F 個頻率的系統堆疊後求解 Y X = rhs (依 MAX_BATCH_BYTES 分塊)，rhs 為 (N, R) 的 R 個右端項，
+        共用每個頻率的同一次 LU 分解。逐塊產生 (start, stop, X)，X 形狀為 (p, F, N, R)；
+        矩陣奇異或參數無效的候選解以 NaN 表示，不影響同批次的其他候選解。
+        """
+        n, num, num_freq = self.size, len(param_matrix), len(omega)
+        chunk = max(1, MAX_BATCH_BYTES // (num_freq * n * n * 16))
+        for start in range(0, num, chunk):
+            stop = min(start + chunk, num)
+            with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+                A = self.system_matrices(omega, param_matrix[start:stop])
+            # 參數無效 (例如 R=0 或負電感開根號) 的候選解不送進 LAPACK
+            invalid = ~np.isfinite(A).reshape(len(A), -1).all(axis=1)
+            A[invalid] = np.eye(n)
+            b = np.broadcast_to(rhs, A.shape[:-2] + rhs.shape)
+            try:
+                x = np.linalg.solve(A, b)
+            except np.linalg.LinAlgError:
+                # 逐一重解，只讓奇異的候選解失敗
+                x = np.full(b.shape, np.nan, dtype=complex)
+                for j in range(len(A)):
+                    try:
+                        x[j] = np.linalg.solve(A[j], b[j])
+                    except np.linalg.LinAlgError:
+                        logger.warning(f"候選解 {start + j} 的 MNA 矩陣奇異。")
+            x[invalid] = np.nan
+            yield start, stop, x
+
+    def solve(self, freq_points: np.ndarray, param_matrix: np.ndarray, node: Optional[str] = None) -> np.ndarray:
+        """
+        將 P 組參數 × F 個頻率的系統堆疊為 (P·F, N, N) 張量一起求解 (依 MAX_BATCH_BYTES 分塊)。
+        矩陣奇異或參數無效的候選解以 NaN 表示，不影響同批次的其他候選解。
+
+        Returns:
+            np.ndarray: node 為 None 時回傳 (P, F, N) 的完整解，否則回傳 (P, F) 的節點電壓。
+        """
+        omega = 2 * np.pi * np.asarray(freq_points, dtype=float)
+        param_matrix = np.atleast_2d(np.asarray(param_matrix, dtype=float))
+        n, num, num_freq = self.size, len(param_matrix), len(omega)
+        index = None if node is None else self._node(node)
+        result = np.full((num, num_freq) if node is not None else (num, num_freq, n), np.nan, dtype=complex)
+        if index is not None and index < 0:
+            result[:] = 0
+            return result
+
+        for start, stop, x in self._solve_batches(omega, param_matrix, self.rhs[:, None]):
+            x = x[..., 0]
+            result[start:stop] = x if index is None else x[..., index]
+        return result
+
+    def port_selection(self, ports: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """回傳 (埠節點索引 (K,), 各埠注入單位電流的右端項 (N, K))。"""
+        rows = np.array([self._node(port) for port in ports])
+        if np.any(rows < 0):
+            raise ValueError("埠不可為接地節點")
+        rhs = np.zeros((self.size, len(rows)), dtype=complex)
+        rhs[rows, np.arange(len(rows))] = 1.0
+        return rows, rhs
+
+    def solve_ports(self, freq_points: np.ndarray, param_matrix: np.ndarray, ports: List[str]) -> np.ndarray:
+        """
+        埠阻抗矩陣：對 K 個埠節點各注入 1A (同一次 LU 分解的 K 個右端項)，Zp[a, b] 為埠 b 注入時埠 a 的電壓。
+        電路本身的電源 (rhs) 不參與。
+
+        Returns:
+            np.ndarray: (P, F, K, K)，求解失敗的候選解為 NaN。
+        """
+        omega = 2 * np.pi * np.asarray(freq_points, dtype=float)
+        param_matrix = np.atleast_2d(np.asarray(param_matrix, dtype=float))
+        rows, rhs = self.port_selection(ports)
+        result = np.full((len(param_matrix), len(omega), len(rows), len(rows)), np.nan, dtype=complex)
+        for start, stop, x in self._solve_batches(omega, param_matrix, rhs):
+            result[start:stop] = x[..., rows, :]
+        return result
+
+    def node_voltage(self, solution: np.ndarray, node: str) -> np.ndarray:
+        index = self._node(node)
+        if index < 0:
+            return np.zeros(solution.shape[:-1], dtype=complex)
+        return solution[..., index]
+
+    def stamp_jacobian(self, params: np.ndarray) -> np.ndarray:
+        """單組參數 (D,) 下，各 stamp 來源數值對 log10(參數) 的偏導數，回傳 (S, D)。"""
+        values = self.elem_const.copy()
+        mask = self.elem_param >= 0
+        values[mask] = params[self.elem_param[mask]]
+        # 元件值對 log10(p) 的導數：dv/dlog10(p) = p·ln10
+        dv = np.zeros((len(values), len(self.param_names)))
+        dv[np.flatnonzero(mask), self.elem_param[mask]] = values[mask] * np.log(10)
+
+        kind, a, b, c = self.src_kind, self.src_a, self.src_b, self.src_c
+        rows = np.arange(len(kind))
+        ds = np.zeros((len(kind), len(values)))
+        m = kind == _SRC_INVERSE
+        ds[rows[m], a[m]] = -1.0 / values[a[m]]**2
+        m = kind == _SRC_LINEAR
+        ds[rows[m], a[m]] = 1.0
+        m = kind == _SRC_NEGATIVE
+        ds[rows[m], a[m]] = -1.0
+        m = kind == _SRC_MUTUAL
+        mutual = np.sqrt(values[b[m]] * values[c[m]])
+        # s = -k·sqrt(La·Lb)：ds/dk = -sqrt(La·Lb)，ds/dLa = -k·Lb / (2·sqrt(La·Lb))
+        np.add.at(ds, (rows[m], a[m]), -mutual)
+        np.add.at(ds, (rows[m], b[m]), -values[a[m]] * values[c[m]] / (2 * mutual))
+        np.add.at(ds, (rows[m], c[m]), -values[a[m]] * values[b[m]] / (2 * mutual))
+        return ds @ dv
+
+    def solve_with_gradient(self, freq_points: np.ndarray, params: np.ndarray, node: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        伴隨法 (adjoint) 靈敏度：一次求解同時得到節點電壓與其對全部 log10(參數) 的導數。
+        由 Y x = b 與 Yᵀ λ = e_node 得 dV/dθ = -λᵀ (dY/dθ) x；
+        互易網路的 Y 為對稱矩陣，λ 只是同一次 LU 分解多一個右端項，成本約等於一次前向求解。
+
+        Args:
+            freq_points (np.ndarray): F 個頻率點。
+            params (np.ndarray): 電路參數順序的單組參數 (D,)。
+            node (str): 輸出節點。
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (V (F,), dV/dlog10(p) (F, D))。
+        """
+        omega = 2 * np.pi * np.asarray(freq_points, dtype=float)
+        params = np.asarray(params, dtype=float)
+        n, index = self.size, self._node(node)
+        if index < 0:
+            return np.zeros(len(omega), dtype=complex), np.zeros((len(omega), len(self.param_names)), dtype=complex)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            A = self.system_matrices(omega, params[None])[0]
+        if not np.isfinite(A).all():
+            raise ValueError("參數無效，系統矩陣含非有限值")
+
+        select = np.zeros(n, dtype=complex)
+        select[index] = 1.0
+        if self.is_symmetric:
+            rhs = np.broadcast_to(np.stack([self.rhs, select], axis=-1), (len(omega), n, 2))
+            solution = np.linalg.solve(A, rhs)
+            x, adjoint = solution[..., 0], solution[..., 1]
+        else:
+            x = np.linalg.solve(A, np.broadcast_to(self.rhs[:, None], (len(omega), n, 1)))[..., 0]
+            adjoint = np.linalg.solve(np.swapaxes(A, -1, -2), np.broadcast_to(select[:, None], (len(omega), n, 1)))[..., 0]
+
+        gradient = -self.adjoint_projection(omega, adjoint, x) @ self.stamp_jacobian(params)
+        return x[:, index], gradient
+
+    def adjoint_projection(self, omega: np.ndarray, adjoint: np.ndarray, x: np.ndarray) -> np.ndarray:
+        """
+        λᵀ (dY/ds) x 依 stamp 來源累加，回傳 (F, S)；C 與 Γ 的頻率權重分別為 jω 與 1/(jω)。
+        乘上 stamp_jacobian() 並取負號即為 λᵀ x 型輸出對 log10(參數) 的導數。
+        """
+        n, jw = self.size, 1j * omega
+        num_src = len(self.src_kind)
+        projected = np.zeros((len(omega), num_src), dtype=complex)
+        for flat, sign, src, weight in ((self.g_flat, self.g_sign, self.g_src, np.ones_like(jw)),
+                                        (self.c_flat, self.c_sign, self.c_src, jw),
+                                        (self.gamma_flat, self.gamma_sign, self.gamma_src, 1.0 / jw)):
+            if not flat.size:
+                continue
+            row, col = np.divmod(flat, n)
+            incidence = np.zeros((len(flat), num_src))
+            incidence[np.arange(len(flat)), src] = sign
+            projected += (adjoint[:, row] * x[:, col] * weight[:, None]) @ incidence
+        return projected
+
+def compile_circuit(circuit: MnaCircuit) -> CompiledCircuit:
+    """將展開後的電路編譯為固定稀疏樣式的 G / C / Γ stamp 表。"""
+    elements = circuit.elements
+    element_index = {el.name: e for e, el in enumerate(elements)}
+    coupled = {name for el in elements if el.kind == 'K' for name in el.nodes}
+    for name in coupled:
+        if name not in element_index or elements[element_index[name]].kind != 'L':
+            raise ValueError(f"K 耦合參照了不存在的電感 '{name}'")
+
+    node_names = []
+    for el in elements:
+        if el.kind in ('R', 'C', 'L', 'V', 'I'):
+            for node in el.nodes:
+                if node not in GROUND_NODES and node not in node_names:
+                    node_names.append(node)
+    node_index = {name: i for i, name in enumerate(node_names)}
+    branch_index = {}
+    for el in elements:
+        if el.kind == 'V' or (el.kind == 'L' and el.name in coupled):
+            branch_index[el.name] = len(node_names) + len(branch_index)
+    n = len(node_names) + len(branch_index)
+
+    param_names = circuit.param_names
+    elem_param = np.full(len(elements), -1, dtype=np.int64)
+    elem_const = np.zeros(len(elements))
+    for e, el in enumerate(elements):
+        if isinstance(el.value, str):
+            elem_param[e] = param_names.index(el.value)
+        elif el.value is not None:
+            elem_const[e] = el.value
+
+    sources = []  # (kind, a, b, c)
+    stamps = {'G': [], 'C': [], 'Gamma': []}
+    g0 = np.zeros((n, n))
+    rhs = np.zeros(n, dtype=complex)
+
+    def idx(node: str) -> int:
+        return -1 if node in GROUND_NODES else node_index[node]
+
+    def two_terminal(target: str, a: int, c: int, src: int):
+        for row, col, sign in ((a, a, 1.0), (c, c, 1.0), (a, c, -1.0), (c, a, -1.0)):
+            if row >= 0 and col >= 0:
+                stamps[target].append((row * n + col, sign, src))
+
+    for e, el in enumerate(elements):
+        if el.kind == 'K':
+            l_a, l_b = el.nodes
+            sources.append((_SRC_MUTUAL, e, element_index[l_a], element_index[l_b]))
+            k_a, k_b = branch_index[l_a], branch_index[l_b]
+            stamps['C'].append((k_a * n + k_b, 1.0, len(sources) - 1))
+            stamps['C'].append((k_b * n + k_a, 1.0, len(sources) - 1))
+            continue
+        a, c = idx(el.nodes[0]), idx(el.nodes[1])
+        if el.kind == 'R':
+            sources.append((_SRC_INVERSE, e, 0, 0))
+            two_terminal('G', a, c, len(sources) - 1)
+        elif el.kind == 'C':
+            sources.append((_SRC_LINEAR, e, 0, 0))
+            two_terminal('C', a, c, len(sources) - 1)
+        elif el.kind == 'L' and el.name not in coupled:
+            sources.append((_SRC_INVERSE, e, 0, 0))
+            two_terminal('Gamma', a, c, len(sources) - 1)
+        elif el.kind in ('L', 'V'):
+            k = branch_index[el.name]
+            if a >= 0: g0[a, k] += 1.0; g0[k, a] += 1.0
+            if c >= 0: g0[c, k] -= 1.0; g0[k, c] -= 1.0
+            if el.kind == 'L':
+                sources.append((_SRC_NEGATIVE, e, 0, 0))
+                stamps['C'].append((k * n + k, 1.0, len(sources) - 1))
+            else:
+                rhs[k] += el.extra
+        elif el.kind == 'I':
+            # 電流由 n+ 經電流源流向 n-
+            if a >= 0: rhs[a] -= el.extra
+            if c >= 0: rhs[c] += el.extra
+
+    arrays = {
+        'elem_param': elem_param, 'elem_const': elem_const,
+        'src_kind': np.array([s[0] for s in sources], dtype=np.int64),
+        'src_a': np.array([s[1] for s in sources], dtype=np.int64),
+        'src_b': np.array([s[2] for s in sources], dtype=np.int64),
+        'src_c': np.array([s[3] for s in sources], dtype=np.int64),
+        'g0': g0, 'rhs': rhs,
+        'defaults': np.array([circuit.defaults.get(name, np.nan) for name in param_names], dtype=float),
+    }
+    for label, prefix in (('G', 'g'), ('C', 'c'), ('Gamma', 'gamma')):
+        entries = stamps[label]
+        arrays[f'{prefix}_flat'] = np.array([s[0] for s in entries], dtype=np.int64)
+        arrays[f'{prefix}_sign'] = np.array([s[1] for s in entries], dtype=float)
+        arrays[f'{prefix}_src'] = np.array([s[2] for s in entries], dtype=np.int64)
+    compiled = CompiledCircuit(node_names, param_names, arrays)
+    logger.info(f"電路編譯完成：{compiled.size} 個未知數，{len(sources)} 個 stamp 來源，符號參數 {len(param_names)} 個。")
+    return compiled
+
+def compile_netlist(netlist_text: str, use_disk_cache: bool = True) -> CompiledCircuit:
+    """
+    解析並編譯 Netlist。結果以 Netlist 內容的 SHA-256 為鍵快取於 'netlist/compiled/'，
+    多個 DE 工作程序可共用同一份快取 (以 os.replace 原子寫入)。
+    """
+    digest = hashlib.sha256(f"{COMPILE_FORMAT_VERSION}\n{netlist_text}".encode('utf-8')).hexdigest()[:20]
+    cache_path = os.path.join(COMPILED_DIR, f"{digest}.npz")
+    if use_disk_cache and os.path.exists(cache_path):
+        try:
+            with np.load(cache_path, allow_pickle=False) as data:
+                arrays = {field: data[field] for field in CompiledCircuit.ARRAY_FIELDS}
+                return CompiledCircuit([str(x) for x in data['node_names']], [str(x) for x in data['param_names']], arrays)
+        except (OSError, KeyError, ValueError) as e:
+            logger.warning(f"編譯快取 '{cache_path}' 無法讀取，重新編譯: {e}")
+
+    compiled = compile_circuit(parse_netlist(netlist_text))
+    if use_disk_cache:
+        try:
+            os.makedirs(COMPILED_DIR, exist_ok=True)
+            temp_path = f"{cache_path}.{os.getpid()}.tmp.npz"
+            np.savez(temp_path, node_names=np.array(compiled.node_names, dtype=str),
+                     param_names=np.array(compiled.param_names, dtype=str),
+                     **{field: getattr(compiled, field) for field in CompiledCircuit.ARRAY_FIELDS})
+            os.replace(temp_path, cache_path)
+        except OSError as e:
+            logger.warning(f"無法寫入編譯快取 '{cache_path}': {e}")
+    return compiled
+
+# --- Netlist 解析 ---
+def _logical_lines(netlist_text: str) -> List[str]:
+    """移除註解並合併 '+' 續行。"""
+    lines = []
+    for raw in netlist_text.splitlines():
+        line = raw.split(';')[0].strip()
+        if not line or line.startswith('*'):
+            continue
+        if line.startswith('+') and lines:
+            lines[-1] += ' ' + line[1:].strip()
+        else:
+            lines.append(line)
+    return lines
+
+def parse_netlist(netlist_text: str) -> MnaCircuit:
+    """
+    解析 Netlist 文字並展開所有子電路，回傳 MnaCircuit。
+    第一行依 SPICE 慣例視為標題。
+    """
+    raw_lines = netlist_text.splitlines()
+    title = raw_lines[0].strip() if raw_lines else ''
+    lines = _logical_lines('\n'.join(raw_lines[1:]))
+
+    subckts = {}
+    top_level = []
+    defaults = {}
+    outputs = []
+    ac_spec = None
+    current = None
+    for line in lines:
+        tokens = line.split()
+        head = tokens[0].upper()
+        if head == '.SUBCKT':
+            upper = [t.upper() for t in tokens]
+            split_at = upper.index('PARAMS:') if 'PARAMS:' in upper else len(tokens)
+            current = {
+                'ports': [t.lower() for t in tokens[2:split_at]],
+                'params': _parse_assignments(tokens[split_at + 1:]),
+                'lines': []
+            }
+            subckts[tokens[1].upper()] = current
+        elif head == '.ENDS':
+            current = None
+        elif current is not None:
+            current['lines'].append(tokens)
+        elif head == '.PARAM':
+            for key, value in _parse_assignments(tokens[1:]).items():
+                defaults[key] = parse_spice_value(value.strip('{}'))
+        elif head == '.AC':
+            ac_spec = (tokens[1].upper(), int(parse_spice_value(tokens[2])),
+                       parse_spice_value(tokens[3]), parse_spice_value(tokens[4]))
+        elif head == '.PRINT':
+            for node in _OUTPUT_RE.findall(line):
+                if node.lower() not in outputs:
+                    outputs.append(node.lower())
+        elif head.startswith('.'):
+            if head != '.END':
+                logger.debug(f"忽略不支援的指令: {line}")
+        else:
+            top_level.append(tokens)
+
+    elements = []
+    _flatten(top_level, '', {}, {}, subckts, elements)
+    circuit = MnaCircuit(elements, defaults, outputs, ac_spec, title)
+    logger.info(f"Netlist 解析完成：{len(elements)} 個元件，符號參數 {len(circuit.param_names)} 個。")
+    return circuit
+
+def _flatten(lines: List[List[str]], prefix: str, node_map: Dict[str, str], scope: Dict[str, Any],
+             subckts: Dict[str, dict], elements: List[CircuitElement]):
+    """遞迴展開子電路，內部節點與元件名稱加上 'X名稱.' 前綴。"""
+    def node(name: str) -> str:
+        name = name.lower()
+        if name in GROUND_NODES:
+            return '0'
+        return node_map.get(name, prefix + name)
+
+    for tokens in lines:
+        name = tokens[0].lower()
+        kind = name[0].upper()
+        full_name = prefix + name
+        if kind in ('R', 'C', 'L'):
+            value = _parse_value_or_param(tokens[3], scope)
+            elements.append(CircuitElement(kind, full_name, [node(tokens[1]), node(tokens[2])], value))
+        elif kind == 'K':
+            inductors = [prefix + t.lower() for t in tokens[1:-1]]
+            coupling = _parse_value_or_param(tokens[-1], scope)
+            for i in range(len(inductors)):
+                for j in range(i + 1, len(inductors)):
+                    elements.append(CircuitElement('K', f"{full_name}:{i}{j}", [inductors[i], inductors[j]], coupling))
+        elif kind in ('V', 'I'):
+            upper = [t.upper() for t in tokens]
+            ac_value = 0.0
+            if 'AC' in upper:
+                pos = upper.index('AC')
+                magnitude = parse_spice_value(tokens[pos + 1]) if pos + 1 < len(tokens) else 1.0
+                phase = 0.0
+                if pos + 2 < len(tokens):
+                    try:
+                        phase = parse_spice_value(tokens[pos + 2])
+                    except ValueError:
+                        phase = 0.0
+                ac_value = magnitude * np.exp(1j * np.deg2rad(phase))
+            elements.append(CircuitElement(kind, full_name, [node(tokens[1]), node(tokens[2])], extra=ac_value))
+        elif kind == 'X':
+            upper = [t.upper() for t in tokens]
+            split_at = upper.index('PARAMS:') if 'PARAMS:' in upper else len(tokens)
+            sub_name = tokens[split_at - 1].upper()
+            if sub_name not in subckts:
+                raise ValueError(f"找不到子電路定義 '{tokens[split_at - 1]}' (元件 {full_name})")
+            sub = subckts[sub_name]
+            actual_nodes = tokens[1:split_at - 1]
+            if len(actual_nodes) != len(sub['ports']):
+                raise ValueError(f"子電路 '{sub_name}' 接腳數不符 (元件 {full_name})")
+            sub_scope = dict(scope)
+            for key, value in {**sub['params'], **_parse_assignments(tokens[split_at + 1:])}.items():
+                sub_scope[key] = _parse_value_or_param(value, scope)
+            sub_map = {port: node(actual) for port, actual in zip(sub['ports'], actual_nodes)}
+            _flatten(sub['lines'], full_name + '.', sub_map, sub_scope, subckts, elements)
+        else:
+            raise ValueError(f"不支援的元件類型: {name}")
+
+# --- 擬合介面 ---
+FAILED_ERROR = 1e10
+_FITTING_CIRCUIT_CACHE: Dict[Tuple[str, str], CompiledCircuit] = {}
+
+def get_fitting_circuit(mode: str = 'CM', template_path: str = FITTING_TEMPLATE_PATH) -> CompiledCircuit:
+    """取得擬合用的編譯後電路；同一程序內只編譯一次，跨程序則共用磁碟快取。"""
+    key = (os.path.abspath(template_path), mode)
+    if key not in _FITTING_CIRCUIT_CACHE:
+        _FITTING_CIRCUIT_CACHE[key] = compile_netlist(build_fitting_deck(mode, template_path))
+    return _FITTING_CIRCUIT_CACHE[key]
+
+def log_rmse(sim_z: np.ndarray, measured_z: np.ndarray, weights: Optional[np.ndarray] = None) -> np.ndarray:
+    """對數幅值均方根誤差，sim_z 可為 (F,) 或 (P, F)，沿最後一軸計算；weights 為各頻率點的權重 (M01 自適應取樣)。"""
+    return np.sqrt(np.average((np.log10(np.abs(sim_z)) - np.log10(measured_z))**2, axis=-1, weights=weights))
+
+def _solve_small(A: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """批次求解小型系統 A x = b (A 為 (…, m, m)，b 為 (m, r))；奇異或含非有限值的系統回傳 NaN。"""
+    valid = np.isfinite(A).all(axis=(-2, -1))
+    A = np.where(valid[..., None, None], A, np.eye(A.shape[-1]))
+    rhs = np.broadcast_to(b, A.shape[:-2] + b.shape)
+    try:
+        x = np.linalg.solve(A, rhs)
+    except np.linalg.LinAlgError:
+        x = np.full(rhs.shape, np.nan, dtype=complex)
+        for index in np.ndindex(*A.shape[:-2]):
+            try:
+                x[index] = np.linalg.solve(A[index], rhs[index])
+            except np.linalg.LinAlgError:
+                valid[index] = False
+    x[~valid] = np.nan
+    return x
+
+class JointFittingCircuit:
+    """
+    聯合模式 (如 'CM+NM') 的求解器。各治具只是同一個子電路接腳的不同連接方式，因此只需求解子電路本身：
+    以最後一個接腳為參考，對其餘 K 個接腳各注入 1A (同一次 LU 分解的 K 個右端項) 得到埠阻抗矩陣 Zp，
+    Yp = Zp⁻¹ 即浮接子電路的 (縮減) 不定導納矩陣。治具 h 的節點導納矩陣為 Y_h = Bᵀ Yp B，
+    B 為接腳 - 治具節點關聯矩陣扣除參考接腳後的 (K, M) 矩陣，治具阻抗為 (Y_h⁻¹)[in, in]。
+    除了一次 N×N 的分解之外只剩 K×K 以下的小矩陣運算，成本約為單一模式的一次求解。
+    """
+    def __init__(self, mode: str = 'CM+NM', template_path: str = FITTING_TEMPLATE_PATH):
+        deck, self.ports = build_port_deck(template_path)
+        self.circuit = compile_netlist(deck)
+        self.modes = fitting_modes(mode)
+        self.reductions = [self._reduction(harness_nets(name)) for name in self.modes]
+
+    @staticmethod
+    def _reduction(nets: List[str]) -> Tuple[np.ndarray, int]:
+        """回傳治具的 B 矩陣 (K, M) 與輸入節點 'in' 在治具節點中的索引；M 為接地以外的治具節點數。"""
+        names = list(dict.fromkeys(net for net in nets if net != '0'))
+        incidence = np.zeros((len(nets), len(names)))
+        for pin, net in enumerate(nets):
+            if net != '0':
+                incidence[pin, names.index(net)] = 1.0
+        # 埠電壓 = 接腳電壓 - 參考接腳 (最後一個) 電壓
+        return incidence[:-1] - incidence[-1], names.index('in')
+
+    def impedance(self, freq_points: np.ndarray, param_matrix: np.ndarray) -> np.ndarray:
+        """P 組參數 (電路參數順序) 下各治具的阻抗，回傳 (P, 模式數, F)；求解失敗的候選解為 NaN。"""
+        Zp = self.circuit.solve_ports(freq_points, param_matrix, self.ports)
+        with np.errstate(invalid='ignore', over='ignore'):
+            Yp = _solve_small(Zp, np.eye(len(self.ports)))
+            curves = []
+            for B, index in self.reductions:
+                select = np.zeros((B.shape[1], 1))
+                select[index] = 1.0
+                curves.append(_solve_small(B.T @ Yp @ B, select)[..., index, 0])
+        return np.stack(curves, axis=1)
+
+    def impedance_with_gradient(self, freq_points: np.ndarray, params: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        單組參數 (電路參數順序) 下各治具的阻抗及其對 log10(參數) 的導數。
+        Z_h = e_inᵀ Y_h⁻¹ e_in 對 Zp 的微分為 q_lᵀ dZp q_r (q_r = Yp B Y_h⁻¹ e_in，q_l 為轉置系統的對應量)，
+        dZp = -Λᵀ dY X，因此 dZ_h = -(Λ q_l)ᵀ dY (X q_r)，與單一模式的伴隨法共用同一個投影。
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (z (模式數, F), dz (模式數, F, D))。
+        """
+        omega = 2 * np.pi * np.asarray(freq_points, dtype=float)
+        params = np.asarray(params, dtype=float)
+        circuit = self.circuit
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            A = circuit.system_matrices(omega, params[None])[0]
+        if not np.isfinite(A).all():
+            raise ValueError("參數無效，系統矩陣含非有限值")
+        rows, rhs = circuit.port_selection(self.ports)
+        rhs = np.broadcast_to(rhs, (len(omega),) + rhs.shape)
+        X = np.linalg.solve(A, rhs)
+        adjoint = X if circuit.is_symmetric else np.linalg.solve(np.swapaxes(A, -1, -2), rhs)
+        Yp = np.linalg.inv(X[:, rows, :])
+        stamp_jacobian = circuit.stamp_jacobian(params)
+
+        z = np.zeros((len(self.modes), len(omega)), dtype=complex)
+        dz = np.zeros((len(self.modes), len(omega), len(circuit.param_names)), dtype=complex)
+        for k, (B, index) in enumerate(self.reductions):
+            M = B.T @ Yp @ B
+            select = np.zeros((len(omega), B.shape[1], 1))
+            select[:, index] = 1.0
+            u_right = np.linalg.solve(M, select)
+            u_left = np.linalg.solve(np.swapaxes(M, -1, -2), select)
+            right = (X @ (Yp @ (B @ u_right)))[..., 0]
+            left = (adjoint @ (np.swapaxes(Yp, -1, -2) @ (B @ u_left)))[..., 0]
+            z[k] = u_right[:, index, 0]
+            dz[k] = -circuit.adjoint_projection(omega, left, right) @ stamp_jacobian
+        return z, dz
+
+_JOINT_CIRCUIT_CACHE: Dict[Tuple[str, str], Optional[JointFittingCircuit]] = {}
+
+def get_joint_circuit(mode: str = 'CM+NM', template_path: str = FITTING_TEMPLATE_PATH) -> Optional[JointFittingCircuit]:
+    """
+    取得聯合模式的求解器 (同一程序內只建立一次)；子電路內部接地而無法以埠矩陣換算時回傳 None，
+    呼叫端改為逐一求解各治具。
+    """
+    key = (os.path.abspath(template_path), mode)
+    if key not in _JOINT_CIRCUIT_CACHE:
+        try:
+            _JOINT_CIRCUIT_CACHE[key] = JointFittingCircuit(mode, template_path)
+        except ValueError as e:
+            logger.warning(f"聯合模式 '{mode}' 改為逐一求解各治具: {e}")
+            _JOINT_CIRCUIT_CACHE[key] = None
+    return _JOINT_CIRCUIT_CACHE[key]
+
+def _fitting_curves(param_names: List[str], values, freq_points: np.ndarray, mode: str, template_path: str) -> np.ndarray:
+    """P 組參數的擬合阻抗曲線 (P, K·F)，聯合模式依模式順序串接各治具的曲線。"""
+    modes = fitting_modes(mode)
+    joint = get_joint_circuit(mode, template_path) if len(modes) > 1 else None
+    if joint is None:
+        return _separate_curves(param_names, values, freq_points, modes, template_path)
+    curves = joint.impedance(freq_points, joint.circuit.param_matrix(param_names, values))
+    curves = curves.reshape(len(curves), -1)
+    # 埠阻抗矩陣奇異 (例如耦合電容趨近 0 使埠之間失去交流路徑) 的候選解改以各治具分別求解
+    failed = np.flatnonzero(~np.all(np.isfinite(curves), axis=1))
+    if len(failed):
+        curves[failed] = _separate_curves(param_names, [values[i] for i in failed], freq_points, modes, template_path)
+    return curves
+
+def _separate_curves(param_names: List[str], values, freq_points: np.ndarray, modes: List[str],
+                     template_path: str) -> np.ndarray:
+    """逐一以各治具的擬合電路求解並串接 (P, K·F)。"""
+    curves = []
+    for name in modes:
+        circuit = get_fitting_circuit(name, template_path)
+        curves.append(circuit.solve(freq_points, circuit.param_matrix(param_names, values), node='in'))
+    return np.concatenate(curves, axis=-1)
+
+def _fitting_jacobian(param_names: List[str], values, freq_points: np.ndarray, mode: str,
+                      template_path: str) -> Tuple[np.ndarray, np.ndarray]:
+    """單組參數的擬合阻抗 (K·F,) 與其對 log10(參數) 的導數 (K·F, D)，欄位順序與 param_names 相同。"""
+    def reorder(dz: np.ndarray, circuit: CompiledCircuit) -> np.ndarray:
+        columns = {name: j for j, name in enumerate(circuit.param_names)}
+        jacobian = np.zeros((len(dz), len(param_names)), dtype=complex)
+        for i, name in enumerate(param_names):
+            if name in columns:
+                jacobian[:, i] = dz[:, columns[name]]
+        return jacobian
+
+    modes = fitting_modes(mode)
+    joint = get_joint_circuit(mode, template_path) if len(modes) > 1 else None
+    if joint is not None:
+        try:
+            z, dz = joint.impedance_with_gradient(freq_points, joint.circuit.param_matrix(param_names, [values])[0])
+            if np.all(np.isfinite(z)) and np.all(np.isfinite(dz)):
+                return z.ravel(), reorder(dz.reshape(-1, dz.shape[-1]), joint.circuit)
+        except np.linalg.LinAlgError:
+            pass
+        # 埠阻抗矩陣奇異時改以各治具分別求解
+    blocks = []
+    for name in modes:
+        circuit = get_fitting_circuit(name, template_path)
+        z, dz = circuit.solve_with_gradient(freq_points, circuit.param_matrix(param_names, [values])[0], node='in')
+        blocks.append((z, reorder(dz, circuit)))
+    return np.concatenate([z for z, _ in blocks]), np.concatenate([dz for _, dz in blocks])
+
+def _curve_table(freq_points: np.ndarray, curve: np.ndarray) -> np.ndarray:
+    """(F, 3) [頻率, 實部, 虛部]；聯合模式的 (K·F,) 曲線對應 (K·F, 3)，頻率欄依模式重複。"""
+    return np.column_stack([np.tile(freq_points, len(curve) // len(freq_points)), curve.real, curve.imag])
+
+def simulate_impedance(
+    param_dict: Dict[str, float],
+    freq_points: np.ndarray,
+    mode: str = 'CM',
+    template_path: str = FITTING_TEMPLATE_PATH
+) -> Tuple[Optional[np.ndarray], Optional[str]]:
+    """
+    以 MNA 直接計算擬合電路在指定頻率點的阻抗。
+
+    Returns:
+        Tuple[Optional[np.ndarray], Optional[str]]: (sim_data, error)。
+        sim_data 形狀為 (F, 3)，欄位依序為 頻率、實部、虛部，與 M03/M04 的曲線格式一致；
+        聯合模式為各治具依序串接的 (K·F, 3)。
+    """
+    try:
+        freq_points = np.asarray(freq_points, dtype=float)
+        z = _fitting_curves(list(param_dict), [list(param_dict.values())], freq_points, mode, template_path)[0]
+        if not np.all(np.isfinite(z)):
+            raise ValueError("解含有非有限值 (參數無效或矩陣奇異)")
+        return _curve_table(freq_points, z), None
+    except (KeyError, ValueError, np.linalg.LinAlgError) as e:
+        error_msg = f"MNA 求解失敗: {e}"
+        logger.error(error_msg)
+        return None, error_msg
+
+def simulate_impedance_batch(
+    param_matrix: np.ndarray,
+    param_names: List[str],
+    freq_points: np.ndarray,
+    measured_z: Optional[np.ndarray] = None,
+    mode: str = 'CM',
+    return_curves: bool = False,
+    template_path: str = FITTING_TEMPLATE_PATH,
+    weights: Optional[np.ndarray] = None
+) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+    """
+    族群批次評估入口：一次計算 P 組參數的阻抗曲線與誤差。
+
+    Args:
+        param_matrix (np.ndarray): 形狀為 (P, D) 的參數矩陣，欄位順序對應 param_names。
+        param_names (List[str]): D 個參數名稱。
+        freq_points (np.ndarray): F 個頻率點。
+        measured_z (np.ndarray): 量測阻抗幅值 (F,)，聯合模式為各模式串接的 (K·F,)；提供時回傳 log-RMSE 誤差。
+        return_curves (bool): 是否回傳 (P, F) (聯合模式為 (P, K·F)) 的複數阻抗曲線。
+        weights (np.ndarray): 各頻率點的誤差權重，長度與 measured_z 相同，None 表示等權重。
+
+    Returns:
+        Tuple[Optional[np.ndarray], Optional[np.ndarray]]: (errors, curves)。
+        求解失敗的候選解誤差為 FAILED_ERROR。
+    """
+    curves = _fitting_curves(param_names, param_matrix, np.asarray(freq_points, dtype=float), mode, template_path)
+
+    errors = None
+    if measured_z is not None:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            errors = log_rmse(curves, np.asarray(measured_z, dtype=float), weights)
+        errors[~np.isfinite(errors)] = FAILED_ERROR
+    return errors, (curves if return_curves else None)
+
+def impedance_with_jacobian(
+    param_dict: Dict[str, float],
+    freq_points: np.ndarray,
+    mode: str = 'CM',
+    template_path: str = FITTING_TEMPLATE_PATH
+) -> Tuple[Optional[Tuple[np.ndarray, np.ndarray]], Optional[str]]:
+    """
+    以伴隨法計算阻抗及其對 log10(參數) 的逐頻率導數。
+
+    Returns:
+        Tuple[Optional[Tuple[np.ndarray, np.ndarray]], Optional[str]]:
+        ((z (F,), dz (F, D)), error_msg)，聯合模式的列數為 K·F。dz 的欄位順序與 param_dict 相同，
+        電路中不存在的參數導數為 0。
+    """
+    try:
+        freq_points = np.asarray(freq_points, dtype=float)
+        z, jacobian = _fitting_jacobian(list(param_dict), list(param_dict.values()), freq_points, mode, template_path)
+        if not np.all(np.isfinite(z)):
+            raise ValueError("解含有非有限值 (參數無效或矩陣奇異)")
+        return (z, jacobian), None
+    except (KeyError, ValueError, np.linalg.LinAlgError) as e:
+        error_msg = f"MNA 梯度計算失敗: {e}"
+        logger.error(error_msg)
+        return None, error_msg
+
+def log_rmse_with_gradient(
+    param_dict: Dict[str, float],
+    freq_points: np.ndarray,
+    measured_z: np.ndarray,
+    mode: str = 'CM',
+    template_path: str = FITTING_TEMPLATE_PATH,
+    weights: Optional[np.ndarray] = None
+) -> Tuple[Optional[Tuple[float, np.ndarray, np.ndarray]], Optional[str]]:
+    """
+    計算 log-RMSE 誤差及其對 log10(參數) 的解析梯度 (伴隨法)，供 M04 作為 jac 使用。
+    weights 為各頻率點的誤差權重 (M01 自適應取樣)，None 表示等權重；聯合模式的 measured_z 與 weights
+    為各模式依序串接的 (K·F,)。
+
+    Returns:
+        Tuple[Optional[Tuple[float, np.ndarray, np.ndarray]], Optional[str]]:
+        ((error, gradient, sim_data), error_msg)。gradient 順序與 param_dict 相同，
+        sim_data 為 (F, 3) [頻率, 實部, 虛部] (聯合模式為 (K·F, 3))。
+    """
+    result, error_msg = impedance_with_jacobian(param_dict, freq_points, mode, template_path)
+    if result is None:
+        return None, error_msg
+    z, dz = result
+
+    # r = log10|Z| - log10|Zm|，dr/dθ = Re(dZ/Z) / ln10，dE/dθ = Σ w·r·dr/dθ / (Σw·E)
+    residual = np.log10(np.abs(z)) - np.log10(np.asarray(measured_z, dtype=float))
+    weights = np.ones(len(residual)) if weights is None else np.asarray(weights, dtype=float)
+    error = float(np.sqrt(np.average(residual**2, weights=weights)))
+    d_residual = (dz / z[:, None]).real / np.log(10)
+    gradient = (weights * residual) @ d_residual / (weights.sum() * max(error, 1e-300))
+    return (error, gradient, _curve_table(np.asarray(freq_points, dtype=float), z)), None
+
+# --- 與 Ngspice 相同介面 ---
+def format_print_output(freq_points: np.ndarray, columns: Dict[str, np.ndarray], title: str = '') -> str:
+    """將結果格式化為 Ngspice '.PRINT AC' 的表格輸出。"""
+    names = list(columns)
+    lines = [f"Circuit: {title}", "", f"No. of Data Rows : {len(freq_points)}",
+             "-" * 80, "Index   frequency       " + "".join(f"{n:<32}" for n in names), "-" * 80]
+    for i, freq in enumerate(freq_points):
+        values = "".join(f"{columns[n][i].real:.6e},\t{columns[n][i].imag:.5e}\t" for n in names)
+        lines.append(f"{i}\t{freq:.6e}\t{values}")
+    return "\n".join(lines) + "\n"
+
+def simulate_netlist_file(netlist_filename: str) -> Tuple[Optional[SimulationResult], Optional[str]]:
+    """
+    讀取 'netlist/runnable/' 下的 Netlist 並求解 .PRINT 列出的節點電壓，回傳 (SimulationResult, error)。
+    """
+    netlist_path = os.path.join(RUNNABLE_DIR, netlist_filename)
+    if not os.path.exists(netlist_path):
+        error_msg = f"錯誤：找不到指定的 Netlist 檔案 -> {netlist_path}"
+        logger.error(error_msg)
+        return (None, error_msg)
+    try:
+        with open(netlist_path, 'r', encoding='utf-8') as f:
+            circuit = parse_netlist(f.read())
+        freq_points = circuit.frequency_points()
+        if freq_points is None:
+            return (None, f"Netlist '{netlist_filename}' 缺少 .AC 指令。")
+        compiled = compile_circuit(circuit)
+        solution = compiled.solve(freq_points, compiled.param_matrix([], np.zeros((1, 0))))[0]
+        vectors = {f"v({node})": compiled.node_voltage(solution, node) for node in circuit.outputs}
+        return (SimulationResult(freq_points, vectors, title=circuit.title), None)
+    except (KeyError, ValueError, IndexError, np.linalg.LinAlgError) as e:
+        error_msg = f"MNA 求解 '{netlist_filename}' 失敗: {e}"
+        logger.error(error_msg)
+        return (None, error_msg)
+
+def simulate_netlist_batch(netlist_text: str, param_sets: List[Dict[str, float]]) -> List[Tuple[Optional[SimulationResult], Optional[str]]]:
+    """
+    以同一份參數化 Netlist (.param 宣告參數) 一次求解多組參數值，與 M05 run_ngspice_sweep() 相同介面：
+    依序回傳 (SimulationResult, error)，每個結果包含 .PRINT 列出的節點電壓。
+    """
+    if not param_sets:
+        return []
+    try:
+        circuit = parse_netlist(netlist_text)
+        freq_points = circuit.frequency_points()
+        if freq_points is None:
+            return [(None, "Netlist 缺少 .AC 指令。")] * len(param_sets)
+        compiled = compile_circuit(circuit)
+        names = list(param_sets[0])
+        matrix = compiled.param_matrix(names, [[p[name] for name in names] for p in param_sets])
+        voltages = {f"v({node})": compiled.solve(freq_points, matrix, node=node) for node in circuit.outputs}
+    except (KeyError, ValueError, IndexError, np.linalg.LinAlgError) as e:
+        error_msg = f"MNA 批次求解失敗: {e}"
+        logger.error(error_msg)
+        return [(None, error_msg)] * len(param_sets)
+
+    results = []
+    for i in range(len(param_sets)):
+        vectors = {name: values[i] for name, values in voltages.items()}
+        if not all(np.all(np.isfinite(v)) for v in vectors.values()):
+            results.append((None, f"第 {i} 組參數的解含有非有限值 (參數無效或矩陣奇異)。"))
+        else:
+            results.append((SimulationResult(freq_points, vectors, title=circuit.title), None))
+    return results
+
+def run_mna_simulation(netlist_filename: str, timeout_seconds: int = 60) -> Tuple[Optional[str], Optional[str]]:
+    """
+    與 M05 run_ngspice_simulation() 相同介面：讀取 'netlist/runnable/' 下的 Netlist，
+    回傳 (stdout, stderr)。timeout_seconds 僅為相容而保留，MNA 求解不需逾時控制。
+    """
+    result, error = simulate_netlist_file(netlist_filename)
+    if result is None:
+        return (None, error)
+    columns = {name: result.vectors[name] for name in result.names}
+    return (format_print_output(result.frequency, columns, result.title), None)
+
+# --- 精度驗證 ---
+def validate_against_ngspice(netlist_text: str, ngspice_data: np.ndarray, node: Optional[str] = None) -> Dict[str, float]:
+    """
+    以同一份 Netlist 比對 MNA 與 Ngspice 結果。
+
+    Args:
+        netlist_text (str): 完整 Netlist 文字 (數值已代入)。
+        ngspice_data (np.ndarray): Ngspice 輸出解析後的 (F, 3) 陣列 [頻率, 實部, 虛部]。
+        node (str): 比對的節點，預設為 .PRINT 的第一個輸出。
+
+    Returns:
+        Dict[str, float]: 最大/平均相對誤差與最大相位誤差 (度)。
+    """
+    circuit = parse_netlist(netlist_text)
+    compiled = compile_circuit(circuit)
+    node = node or circuit.outputs[0]
+    freq_points = ngspice_data[:, 0]
+    mna = compiled.solve(freq_points, compiled.param_matrix([], np.zeros((1, 0))), node=node)[0]
+    ref = ngspice_data[:, 1] + 1j * ngspice_data[:, 2]
+    rel_error = np.abs(mna - ref) / np.maximum(np.abs(ref), 1e-30)
+    phase_error = np.abs(np.angle(mna / ref, deg=True))
+    return {
+        'points': float(len(freq_points)),
+        'max_rel_error': float(rel_error.max()),
+        'mean_rel_error': float(rel_error.mean()),
+        'max_phase_error_deg': float(phase_error.max()),
+    }
+
+# --- Ngspice 參考數據回歸檢查 ---
+# 擬合 Netlist (M06 build_fitting_netlist) 經 Ngspice 模擬的參考結果，由 capture_fitting_reference() 產生
+REFERENCE_DIR = os.path.join(BASE_DIR, 'data', 'ngspice_reference')
+REFERENCE_MODES = ('CM', 'NM', 'CM+NM')
+REFERENCE_PARAMS = {
+    'Rdc': 0.05, 'dL3': 2e-9, 'dR4': 200.0, 'dC3': 1e-12, 'dR3': 5.0, 'C1': 2e-12, 'R2': 50.0,
+    'L1': 5e-6, 'L2': 5e-6, 'L3': 5e-6, 'L4': 5e-6, 'Rs1': 3e3, 'Rs2': 3e3, 'Rs3': 3e3, 'Rs4': 3e3,
+    'ck': 0.5e-12, 'Lp': 1e-9
+}
+# 參考頻率軸 (.AC DEC 由 M06 依此決定，比對時使用 Ngspice 實際輸出的頻率點，不做內插)
+REFERENCE_FREQ_RANGE = (1e6, 3e9, 401)
+# Ngspice 中央差分的 log10 參數步長，作為伴隨法 Jacobian 的參考 (截斷誤差約 1e-6，求解捨入誤差 / 步長亦在同一量級)
+REFERENCE_FD_STEP = 1e-3
+# 容許的最大相對誤差：阻抗逐點 |Z_mna - Z_ref| / |Z_ref|；Jacobian 逐參數 ||dZ_mna - dZ_ref|| / ||dZ_ref||，
+# 分母至少取整個 Jacobian 範數的 1e-4 倍，避免導數近乎為 0 的參數 (例如 CM 模式下的 ck) 只比到差分雜訊
+REFERENCE_TOLERANCE = {'impedance': 1e-6, 'jacobian': 1e-3}
+
+def fitting_reference_path(mode: str, reference_dir: str = REFERENCE_DIR) -> str:
+    return os.path.join(reference_dir, f"fitting_{mode.replace('+', '_')}.npz")
+
+def _ngspice_version(executable: str) -> str:
+    import subprocess
+    try:
+        output = subprocess.run([executable, '-v'], capture_output=True, text=True, timeout=30).stdout
+    except (OSError, subprocess.SubprocessError):
+        return ''
+    return next((line.strip() for line in output.splitlines() if 'ngspice' in line.lower()), '')
+
+def capture_fitting_reference(mode: str, path: Optional[str] = None, params: Optional[Dict[str, float]] = None,
+                              fd_step: float = REFERENCE_FD_STEP) -> Tuple[Optional[str], Optional[str]]:
+    """
+    以 M05 執行 Ngspice，記錄擬合 Netlist 在 params (預設 REFERENCE_PARAMS) 的各治具阻抗，
+    以及每個參數在 log10 空間 ±fd_step 的中央差分 (2D 次模擬)，存成 npz (不使用 pickle)。
+    回傳 (檔案路徑, 錯誤訊息)。
+    """
+    from modules.m05_ngspice_runner import run_ngspice_deck, NGSPICE_EXECUTABLE_PATH
+    from modules.m06_netlist_generator import build_fitting_netlist, fitting_outputs
+
+    params = dict(params or REFERENCE_PARAMS)
+    path = path or fitting_reference_path(mode)
+    freq_points = np.logspace(np.log10(REFERENCE_FREQ_RANGE[0]), np.log10(REFERENCE_FREQ_RANGE[1]), REFERENCE_FREQ_RANGE[2])
+    outputs = fitting_outputs(mode)
+
+    def run(values: Dict[str, float]) -> Tuple[Optional[np.ndarray], Optional[np.ndarray], Optional[str]]:
+        result, error = run_ngspice_deck(build_fitting_netlist(values, freq_points, mode), label=f"reference_{mode}")
+        if result is None:
+            return None, None, error
+        return result.frequency, np.array([result.vectors[name] for name in outputs]), None
+
+    frequency, z, error = run(params)
+    if z is None:
+        return None, f"Ngspice 模擬失敗: {error}"
+    names = list(params)
+    dz = np.zeros((len(names),) + z.shape, dtype=complex)
+    for j, name in enumerate(names):
+        shifted = []
+        for sign in (1, -1):
+            values = dict(params, **{name: params[name] * 10**(sign * fd_step)})
+            _, curve, error = run(values)
+            if curve is None:
+                return None, f"Ngspice 模擬失敗 ({name} 擾動): {error}"
+            shifted.append(curve)
+        dz[j] = (shifted[0] - shifted[1]) / (2 * fd_step)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez(path, mode=mode, frequency=frequency, outputs=np.array(outputs), param_names=np.array(names),
+             param_values=np.array([params[name] for name in names]), z=z, dz=dz, fd_step=fd_step,
+             deck=build_fitting_netlist(params, freq_points, mode), ngspice=_ngspice_version(NGSPICE_EXECUTABLE_PATH))
+    logger.info(f"已儲存 {mode} 模式的 Ngspice 參考數據 ({len(frequency)} 點，{len(names)} 個參數): {path}")
+    return path, None
+
+def check_fitting_reference(path: str, tolerance: Optional[Dict[str, float]] = None) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    以 capture_fitting_reference() 的 Ngspice 參考數據檢查三條 MNA 計算路徑 (皆在 Ngspice 實際輸出的頻率點上)：
+    'deck'：解析送給 Ngspice 的同一份 Netlist 文字 (validate_against_ngspice)；
+    'fitting'：simulate_impedance() 使用的編譯後 stamp 表 (聯合模式為埠阻抗矩陣)；
+    'adjoint'：impedance_with_jacobian() 的阻抗與逐頻率 Jacobian (對照 Ngspice 的中央差分)。
+    回傳 (報告, 錯誤訊息)；報告含各路徑的最大相對誤差與超出容許值的項目 'failures'。
+    """
+    tolerance = dict(REFERENCE_TOLERANCE, **(tolerance or {}))
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            reference = {key: data[key] for key in data.files}
+    except (OSError, ValueError) as e:
+        return None, f"無法讀取參考數據 '{path}': {e}"
+    mode, frequency, z_ref, dz_ref = str(reference['mode']), reference['frequency'], reference['z'], reference['dz']
+    params = dict(zip((str(name) for name in reference['param_names']), reference['param_values'].tolist()))
+
+    def rel_error(z: np.ndarray, ref: np.ndarray) -> float:
+        return float(np.max(np.abs(z - ref) / np.maximum(np.abs(ref), 1e-300)))
+
+    report = {'mode': mode, 'points': len(frequency), 'ngspice': str(reference['ngspice'])}
+    report['deck'] = max(validate_against_ngspice(str(reference['deck']), np.column_stack([frequency, z.real, z.imag]),
+                                                  node=_OUTPUT_RE.search(str(output)).group(1))['max_rel_error']
+                         for output, z in zip(reference['outputs'], z_ref))
+    sim_data, error = simulate_impedance(params, frequency, mode)
+    report['fitting'] = rel_error(sim_data[:, 1] + 1j * sim_data[:, 2], z_ref.ravel()) if sim_data is not None else float('inf')
+    result, error = impedance_with_jacobian(params, frequency, mode)
+    if result is None:
+        report['adjoint'] = report['jacobian'] = float('inf')
+    else:
+        z, dz = result
+        report['adjoint'] = rel_error(z, z_ref.ravel())
+        dz_ref = dz_ref.reshape(len(dz_ref), -1).T
+        scale = np.maximum(np.linalg.norm(dz_ref, axis=0), 1e-4 * np.linalg.norm(dz_ref))
+        report['jacobian'] = float(np.max(np.linalg.norm(dz - dz_ref, axis=0) / scale))
+    report['failures'] = [name for name, limit in (('deck', tolerance['impedance']), ('fitting', tolerance['impedance']),
+                                                   ('adjoint', tolerance['impedance']), ('jacobian', tolerance['jacobian']))
+                          if not report[name] <= limit]
+    return report, None
+
+# --- 主程式 (用於示範與精度驗證) ---
+if __name__ == '__main__':
+    import time
+    from modules.m13_simulation_result import parse_text_output
+
+    print("正在執行 M11 模組 (MNA Solver) 示範...")
+
+    # 1. 與 manual_debug.py 的 Ngspice 擷取結果 (manual_output.txt) 比對
+    reference_path = os.path.join(BASE_DIR, 'manual_output.txt')
+    manual_netlist = ("* cm template\nV1 1 0 AC 1\nR1 1 2 4.0728e+01\nL1 2 3 3.2454e-06\n"
+                      "C1 3 0 5.5526e-10\n.AC DEC 100 1e6 3e9\n.PRINT AC V(3)\n.END\n")
+    if os.path.exists(reference_path):
+        with open(reference_path, 'r', encoding='utf-8', errors='ignore') as f:
+            reference = parse_text_output(f.read()).as_array()
+        report = validate_against_ngspice(manual_netlist, reference)
+        print(f"與 Ngspice 比對 ({int(report['points'])} 點): 最大相對誤差 {report['max_rel_error']:.2e}，"
+              f"最大相位誤差 {report['max_phase_error_deg']:.2e} 度")
+        print("  (Ngspice 表格只保留 6~7 位有效數字，誤差約 1e-5 屬正常範圍)")
+
+    # 1b. 與擬合 Netlist 的 Ngspice 參考數據比對 (Netlist 解析、stamp 表、伴隨法三條路徑)
+    for mode in REFERENCE_MODES:
+        if not os.path.exists(fitting_reference_path(mode)):
+            continue
+        report, error = check_fitting_reference(fitting_reference_path(mode))
+        if report is None:
+            print(f"{mode} 參考數據比對失敗: {error}")
+            continue
+        print(f"{mode} 參考數據 ({report['points']} 點): Netlist {report['deck']:.2e}，stamp 表 {report['fitting']:.2e}，"
+              f"伴隨法 {report['adjoint']:.2e}，Jacobian {report['jacobian']:.2e}"
+              + (f"，超出容許值: {', '.join(report['failures'])}" if report['failures'] else ""))
+
+    # 2. Tai_CM 模型 401 點掃描
+    demo_params = dict(REFERENCE_PARAMS)
+    freq_points = np.logspace(6, np.log10(3e9), 401)
+    for mode in ('CM', 'NM'):
+        start_t = time.perf_counter()
+        sim_data, error = simulate_impedance(demo_params, freq_points, mode=mode)
+        elapsed = (time.perf_counter() - start_t) * 1e3
+        if sim_data is None:
+            print(f"{mode} 模擬失敗: {error}")
+            continue
+        z_mag = np.abs(sim_data[:, 1] + 1j * sim_data[:, 2])
+        print(f"{mode}: {len(freq_points)} 點求解耗時 {elapsed:.1f} ms，|Z| 範圍 {z_mag.min():.3e} ~ {z_mag.max():.3e} Ohm")
+
+    # 3. 伴隨法梯度與中央差分比對
+    sim_data, _ = simulate_impedance(demo_params, freq_points, mode='CM')
+    measured_z = np.abs(sim_data[:, 1] + 1j * sim_data[:, 2]) * (1 + 0.1 * np.sin(np.arange(len(freq_points))))
+    start_t = time.perf_counter()
+    (error, gradient, _), _ = log_rmse_with_gradient(demo_params, freq_points, measured_z, mode='CM')
+    elapsed = (time.perf_counter() - start_t) * 1e3
+    names, log_values, step = list(demo_params), np.log10(list(demo_params.values())), 1e-6
+    numeric = np.zeros(len(names))
+    for j in range(len(names)):
+        for sign in (1, -1):
+            shifted = log_values.copy()
+            shifted[j] += sign * step
+            (shifted_error, _, _), _ = log_rmse_with_gradient(dict(zip(names, 10**shifted)), freq_points, measured_z, mode='CM')
+            numeric[j] += sign * shifted_error / (2 * step)
+    deviation = np.max(np.abs(numeric - gradient)) / np.max(np.abs(gradient))
+    print(f"伴隨法梯度 ({len(names)} 個參數) 耗時 {elapsed:.1f} ms，與中央差分的最大相對偏差 {deviation:.2e}")
+
+    # 4. 聯合擬合 (CM+NM)：一次 LU 分解同時得到兩個治具的阻抗，與分別求解比對
+    rng = np.random.default_rng(0)
+    names = list(demo_params)
+    candidates = np.array(list(demo_params.values())) * 10**rng.uniform(-0.3, 0.3, (40, len(names)))
+    start_t = time.perf_counter()
+    _, separate = simulate_impedance_batch(candidates, names, freq_points, mode='CM', return_curves=True)
+    _, separate_nm = simulate_impedance_batch(candidates, names, freq_points, mode='NM', return_curves=True)
+    separate_elapsed = time.perf_counter() - start_t
+    start_t = time.perf_counter()
+    _, joint = simulate_impedance_batch(candidates, names, freq_points, mode='CM+NM', return_curves=True)
+    joint_elapsed = time.perf_counter() - start_t
+    reference = np.concatenate([separate, separate_nm], axis=1)
+    deviation = np.max(np.abs(joint - reference) / np.abs(reference))
+    print(f"聯合 CM+NM ({len(candidates)} 組): 耗時 {joint_elapsed:.2f} s (分別求解 {separate_elapsed:.2f} s)，"
+          f"最大相對偏差 {deviation:.2e}")
@@ -0,0 +1,430 @@
+# m12_ngspice_pool.py
+# -*- coding: utf-8 -*-
+
+"""
+模組 M12: 常駐 Ngspice 工作程序池
+
+功能：
+1. 以管線模式 ('ngspice -p') 啟動數個常駐的 Ngspice 程序，透過 stdin / stdout 傳送指令。
+2. 每個程序只在第一次評估時載入擬合 Netlist (預設以 circbyline 經由 stdin 逐行傳送，不寫檔)，
+   之後以 alterparam + reset + run 更新參數，省去每次評估的程序啟動、spinit 搜尋與電路解析；結果以 'write' 寫成二進位 rawfile 後由 M13 解碼。
+3. 提供健康檢查 (echo 哨兵)、程序當機時自動重啟，以及可設定的池大小。
+4. 內建與相同協定相容的替身程式 (以 M11 計算)，可在沒有 Ngspice 的環境下測試：
+   python m12_ngspice_pool.py --stub
+"""
+
+import sys
+import os
+import re
+import time
+import queue
+import logging
+import threading
+import subprocess
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Tuple
+
+# --- 路徑修正 ---
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from modules.m05_ngspice_runner import NGSPICE_EXECUTABLE_PATH, RUNNABLE_DIR, fitting_sim_data
+from modules.m13_simulation_result import SimulationResult, read_rawfile, write_rawfile
+from modules.m06_netlist_generator import generate_fitting_netlist, build_fitting_netlist, format_ac_line, fitting_outputs
+from modules.m16_scratch_space import get_scratch_space, ScratchJob
+
+# --- 全域設定 ---
+# 池大小 (常駐程序數)，預設保留一個核心給主程序
+NGSPICE_POOL_SIZE = max(1, (os.cpu_count() or 2) - 1)
+# 啟動與健康檢查的逾時 (秒)
+STARTUP_TIMEOUT_SECONDS = 30
+# 單次評估的逾時 (秒)，逾時的程序會被強制終止並重啟
+JOB_TIMEOUT_SECONDS = 60
+# 程序當機時，同一個評估最多重試的次數
+MAX_JOB_RETRIES = 1
+# 背景健康檢查間隔 (秒)，None 表示不啟動背景檢查
+HEALTH_CHECK_INTERVAL_SECONDS = 30.0
+# 以 'circbyline' 逐行經由 stdin 載入電路，不寫入 Netlist 檔案；False 時寫入 M16 暫存槽位後 source
+POOL_NETLIST_VIA_STDIN = True
+# 每個指令區塊結尾的哨兵字串
+SENTINEL = '@@M12_DONE@@'
+
+logger = logging.getLogger(__name__)
+
+_ERROR_LINE_RE = re.compile(r'^\s*(error|fatal)\b', re.IGNORECASE)
+
+# --- 單一工作程序 ---
+class NgspiceWorker:
+    """
+    一個常駐的 'ngspice -p' 程序。背景執行緒持續讀取 stdout，
+    指令區塊以 'echo 哨兵' 結尾，讀到哨兵即代表該區塊執行完畢。
+    """
+    def __init__(self, worker_id: int, command: List[str]):
+        self.worker_id = worker_id
+        self.command = list(command)
+        self.process = None
+        self.lines = None
+        self.loaded_key = None
+        self.sequence = 0
+        self.restarts = 0
+
+    def start(self, timeout: float = STARTUP_TIMEOUT_SECONDS) -> bool:
+        """啟動程序並等待第一次 echo 回應，略過啟動時的 spinit 警告等訊息。"""
+        self.stop()
+        self.lines = queue.Queue()
+        self.loaded_key = None
+        try:
+            self.process = subprocess.Popen(
+                self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                text=True, encoding='utf-8', errors='replace', bufsize=1
+            )
+        except OSError as e:
+            logger.error(f"Worker {self.worker_id} 無法啟動 '{' '.join(self.command)}': {e}")
+            self.process = None
+            return False
+        threading.Thread(target=self._reader, args=(self.process, self.lines), daemon=True).start()
+        _, error = self.execute(['set nomoremode'], timeout)
+        if error:
+            logger.error(f"Worker {self.worker_id} 啟動後沒有回應: {error}")
+            self.stop()
+            return False
+        logger.info(f"Worker {self.worker_id} 已啟動 (PID {self.process.pid})。")
+        return True
+
+    @staticmethod
+    def _reader(process: subprocess.Popen, lines: queue.Queue):
+        for line in process.stdout:
+            lines.put(line.rstrip('\n'))
+        lines.put(None)  # EOF：程序已結束
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def execute(self, commands: List[str], timeout: float = JOB_TIMEOUT_SECONDS) -> Tuple[Optional[List[str]], Optional[str]]:
+        """
+        送出一個指令區塊並收集輸出，直到讀到本區塊的哨兵。
+
+        Returns:
+            Tuple[Optional[List[str]], Optional[str]]: (輸出行, error)。程序當機或逾時時 error 不為 None。
+        """
+        if not self.is_alive():
+            return None, "程序未執行"
+        self.sequence += 1
+        token = f"{SENTINEL}{self.sequence}"
+        try:
+            self.process.stdin.write('\n'.join(commands + [f"echo {token}"]) + '\n')
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            return None, f"寫入指令失敗: {e}"
+
+        output = []
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                line = self.lines.get(timeout=max(remaining, 0.0))
+            except queue.Empty:
+                self.stop()
+                return None, f"逾時 ({timeout} 秒)，程序已終止"
+            if line is None:
+                return None, f"程序意外結束 (exit code {self.process.poll()})"
+            if line.strip() == token:
+                return output, None
+            output.append(line)
+
+    def ping(self, timeout: float = STARTUP_TIMEOUT_SECONDS) -> bool:
+        """健康檢查：程序存活且能在時限內回應 echo。"""
+        return self.is_alive() and self.execute([], timeout)[1] is None
+
+    def stop(self):
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            try:
+                self.process.stdin.write('quit\n')
+                self.process.stdin.flush()
+                self.process.wait(timeout=2)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+                self.process.wait()
+        for stream in (self.process.stdin, self.process.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+        self.process = None
+
+# --- 工作程序池 ---
+class NgspicePool:
+    """
+    固定大小的常駐 Ngspice 程序池。閒置的 worker 放在佇列中，評估時取出、用完放回；
+    取出時若程序已結束會先重啟，評估途中當機則重啟後重試 (最多 max_retries 次)。
+    """
+    def __init__(self, size: int = NGSPICE_POOL_SIZE, command: Optional[List[str]] = None,
+                 job_timeout: float = JOB_TIMEOUT_SECONDS, max_retries: int = MAX_JOB_RETRIES,
+                 health_check_interval: Optional[float] = HEALTH_CHECK_INTERVAL_SECONDS):
+        self.size = max(1, int(size))
+        self.command = command or [NGSPICE_EXECUTABLE_PATH, '-p']
+        self.job_timeout = job_timeout
+        self.max_retries = max_retries
+        self.health_check_interval = health_check_interval
+        self.workers = [NgspiceWorker(i, self.command) for i in range(self.size)]
+        self.idle = queue.Queue()
+        self._stop_event = threading.Event()
+        self._monitor = None
+        self.started = False
+
+    def start(self) -> bool:
+        """啟動全部 worker；至少一個成功即視為可用。"""
+        alive = 0
+        for worker in self.workers:
+            if worker.start():
+                alive += 1
+            self.idle.put(worker)
+        self.started = alive > 0
+        if self.started and self.health_check_interval:
+            self._stop_event.clear()
+            self._monitor = threading.Thread(target=self._monitor_loop, daemon=True)
+            self._monitor.start()
+        logger.info(f"Ngspice 程序池啟動：{alive}/{self.size} 個 worker 可用。")
+        return self.started
+
+    def close(self):
+        self._stop_event.set()
+        for worker in self.workers:
+            worker.stop()
+        self.started = False
+        logger.info("Ngspice 程序池已關閉。")
+
+    def __enter__(self) -> 'NgspicePool':
+        if not self.started:
+            self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _restart(self, worker: NgspiceWorker) -> bool:
+        worker.restarts += 1
+        logger.warning(f"Worker {worker.worker_id} 無回應或已當機，重新啟動 (第 {worker.restarts} 次)。")
+        return worker.start()
+
+    def health_check(self) -> Dict[int, bool]:
+        """檢查目前閒置的 worker，無回應者重新啟動；忙碌中的 worker 略過。"""
+        checked = []
+        while True:
+            try:
+                checked.append(self.idle.get_nowait())
+            except queue.Empty:
+                break
+        status = {}
+        for worker in checked:
+            healthy = worker.ping() or self._restart(worker)
+            status[worker.worker_id] = healthy
+            self.idle.put(worker)
+        return status
+
+    def _monitor_loop(self):
+        while not self._stop_event.wait(self.health_check_interval):
+            self.health_check()
+
+    def _load_commands(self, worker: NgspiceWorker, job: ScratchJob, param_dict: Dict[str, float],
+                       freq_points: np.ndarray, mode: str) -> Optional[List[str]]:
+        """第一次評估 (或電路改變) 時載入擬合 Netlist (circbyline 或 source)，之後只送 alterparam。"""
+        key = (mode, format_ac_line(freq_points), tuple(param_dict))
+        if worker.loaded_key == key:
+            return [f"alterparam {name} = {float(value):.9e}" for name, value in param_dict.items()] + ['reset']
+        try:
+            netlist_text = build_fitting_netlist(param_dict, freq_points, mode=mode)
+        except (OSError, ValueError) as e:
+            logger.error(f"產生擬合 Netlist 失敗: {e}")
+            return None
+        worker.loaded_key = key
+        if POOL_NETLIST_VIA_STDIN:
+            return [f"circbyline {line}" for line in netlist_text.splitlines() if line.strip()]
+        return [f"source {job.write_netlist(netlist_text)}"]
+
+    def simulate_impedance(self, param_dict: Dict[str, float], freq_points: np.ndarray, mode: str = 'CM') -> Tuple[Optional[np.ndarray], Optional[str]]:
+        """
+        與 M05 simulate_impedance() 相同介面：回傳 ((F, 3) [頻率, 實部, 虛部], error)；聯合模式為 (K·F, 3)。
+        """
+        if not self.started:
+            return None, "Ngspice 程序池尚未啟動。"
+        worker = self.idle.get()
+        job = get_scratch_space().acquire()
+        rawfile_path = job.raw_path
+        try:
+            error = None
+            for _ in range(self.max_retries + 1):
+                if not worker.is_alive() and not self._restart(worker):
+                    return None, f"Worker {worker.worker_id} 無法重新啟動。"
+                commands = self._load_commands(worker, job, param_dict, freq_points, mode)
+                if commands is None:
+                    return None, "產生擬合 Netlist 失敗。"
+                write_line = f"write {rawfile_path} {' '.join(fitting_outputs(mode))}"
+                output, error = worker.execute(commands + ['run', write_line, 'destroy all'], self.job_timeout)
+                if output is not None:
+                    break
+                logger.warning(f"Worker {worker.worker_id} 評估失敗: {error}")
+            if output is None:
+                return None, error
+
+            errors = [line for line in output if _ERROR_LINE_RE.match(line)]
+            if errors:
+                # 參數使電路無法求解時，重新 source 以免殘留狀態影響下一次評估
+                worker.loaded_key = None
+                return None, '\n'.join(errors)
+            result = read_rawfile(rawfile_path) if os.path.exists(rawfile_path) else None
+            if result is None:
+                return None, "無法讀取 Ngspice rawfile。"
+            return fitting_sim_data(result, freq_points, mode), None
+        finally:
+            # 歸還暫存槽位時會刪除本次的 rawfile，避免下一次評估失敗時誤讀舊結果
+            job.release()
+            self.idle.put(worker)
+
+    def map_impedance(self, param_dicts: List[Dict[str, float]], freq_points: np.ndarray, mode: str = 'CM') -> List[Tuple[Optional[np.ndarray], Optional[str]]]:
+        """以池內全部 worker 平行評估多組參數，回傳順序與輸入相同。"""
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            return list(executor.map(lambda p: self.simulate_impedance(p, freq_points, mode), param_dicts))
+
+# --- 程序內共用的程序池 (供 M05 'ngspice_pool' 後端使用) ---
+_SHARED_POOL: Optional[NgspicePool] = None
+_SHARED_POOL_LOCK = threading.Lock()
+
+def get_shared_pool(size: int = NGSPICE_POOL_SIZE) -> NgspicePool:
+    """取得 (必要時建立並啟動) 本程序共用的程序池。"""
+    global _SHARED_POOL
+    with _SHARED_POOL_LOCK:
+        if _SHARED_POOL is None or not _SHARED_POOL.started:
+            _SHARED_POOL = NgspicePool(size=size)
+            _SHARED_POOL.start()
+        return _SHARED_POOL
+
+def close_shared_pool():
+    global _SHARED_POOL
+    with _SHARED_POOL_LOCK:
+        if _SHARED_POOL is not None:
+            _SHARED_POOL.close()
+            _SHARED_POOL = None
+
+# --- 替身程式 (與 'ngspice -p' 相同協定，以 M11 計算) ---
+def run_stub_interpreter(stdin=None, stdout=None):
+    """
+    支援 source / circbyline / alterparam / reset / run / print / write / echo / destroy / set / quit 指令，
+    print 與 Ngspice 的表格格式一致，write 寫出二進位 rawfile，供無 Ngspice 的環境測試程序池。
+    """
+    from modules.m11_mna_solver import parse_netlist, compile_circuit, format_print_output
+
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    stdout.write("Warning: can't find the initialization file spinit.\n")
+    stdout.flush()
+
+    circuit = compiled = solution = None
+    params, pending, circuit_lines = {}, {}, []
+    append_write = False
+    for raw in stdin:
+        line = raw.strip()
+        if not line:
+            continue
+        command, _, argument = line.partition(' ')
+        command = command.lower()
+        try:
+            if command == 'quit':
+                break
+            elif command == 'echo':
+                stdout.write(argument + '\n')
+            elif command in ('source', 'circbyline'):
+                if command == 'source':
+                    with open(argument.strip(), 'r', encoding='utf-8') as f:
+                        netlist_text = f.read()
+                else:
+                    circuit_lines.append(argument)
+                    if argument.strip().lower() != '.end':
+                        continue
+                    netlist_text, circuit_lines = '\n'.join(circuit_lines), []
+                circuit = parse_netlist(netlist_text)
+                compiled = compile_circuit(circuit)
+                params, pending, solution = dict(circuit.defaults), {}, None
+                stdout.write(f"\nCircuit: {circuit.title}\n\n")
+            elif command == 'alterparam':
+                name, _, value = argument.replace(' ', '').partition('=')
+                pending[name] = float(value)
+            elif command == 'reset':
+                params.update(pending)
+                pending = {}
+            elif command == 'run':
+                if compiled is None:
+                    stdout.write("Error: there aren't any circuits loaded.\n")
+                else:
+                    freq_points = circuit.frequency_points()
+                    matrix = compiled.param_matrix(list(params), [list(params.values())])
+                    solution = (freq_points, compiled.solve(freq_points, matrix)[0])
+            elif command in ('print', 'write'):
+                if solution is None:
+                    stdout.write(f"Error: no vectors to {command}.\n")
+                else:
+                    freq_points, values = solution
+                    nodes = re.findall(r'v\(\s*([^)\s]+)\s*\)', argument, re.IGNORECASE)
+                    columns = {f"v({n.lower()})": compiled.node_voltage(values, n) for n in nodes}
+                    if command == 'print':
+                        stdout.write(format_print_output(freq_points, columns, circuit.title))
+                    else:
+                        write_rawfile(argument.split()[0], SimulationResult(freq_points, columns, title=circuit.title),
+                                      append=append_write)
+            elif command == 'set':
+                append_write = append_write or argument.strip().lower() == 'appendwrite'
+            elif command == 'destroy':
+                pass
+            else:
+                stdout.write(f"Error: {command}: no such command available in ngspice stub\n")
+        except (OSError, KeyError, ValueError) as e:
+            stdout.write(f"Error: {e}\n")
+        stdout.flush()
+
+# --- 主程式 (以替身程式示範程序池) ---
+if __name__ == '__main__':
+    if '--stub' in sys.argv:
+        run_stub_interpreter()
+        sys.exit(0)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - [%(levelname)s] - (%(module)s) - %(message)s')
+    print("正在執行 M12 模組 (Ngspice Worker Pool) 示範 (替身程式)...")
+    stub_command = [sys.executable, os.path.abspath(__file__), '--stub']
+    demo_params = {
+        'Rdc': 0.05, 'dL3': 2e-9, 'dR4': 200.0, 'dC3': 1e-12, 'dR3': 5.0, 'C1': 2e-12, 'R2': 50.0,
+        'L1': 5e-6, 'L2': 5e-6, 'L3': 5e-6, 'L4': 5e-6, 'Rs1': 3e3, 'Rs2': 3e3, 'Rs3': 3e3, 'Rs4': 3e3,
+        'ck': 0.5e-12, 'Lp': 1e-9
+    }
+    freq_points = np.logspace(6, np.log10(3e9), 401)
+    rng = np.random.default_rng(0)
+    candidates = [{k: v * rng.uniform(0.8, 1.25) for k, v in demo_params.items()} for _ in range(8)]
+
+    # 1. 每次評估啟動一個新程序 (對照組)
+    start_t = time.perf_counter()
+    for params in candidates[:3]:
+        filename = generate_fitting_netlist(params, freq_points, output_filename='pool_demo_oneshot.cir')
+        script = f"source {os.path.join(RUNNABLE_DIR, filename)}\nrun\nwrite {os.path.join(RUNNABLE_DIR, 'pool_demo_oneshot.raw')} v(in)\nquit\n"
+        subprocess.run(stub_command, input=script, capture_output=True, text=True, check=False)
+    oneshot = (time.perf_counter() - start_t) / 3
+    print(f"每次評估啟動新程序：平均 {oneshot * 1e3:.0f} ms / 次")
+
+    # 2. 常駐程序池
+    with NgspicePool(size=2, command=stub_command, health_check_interval=None) as pool:
+        pool.simulate_impedance(candidates[0], freq_points)  # 第一次評估需 source 電路
+        start_t = time.perf_counter()
+        results = pool.map_impedance(candidates, freq_points)
+        pooled = (time.perf_counter() - start_t) / len(candidates)
+        print(f"常駐程序池 (2 個 worker)：平均 {pooled * 1e3:.0f} ms / 次，成功 {sum(r[0] is not None for r in results)}/{len(results)}")
+
+        # 3. 模擬當機：強制終止 worker 後，下一次評估會自動重啟並重試
+        pool.workers[0].process.kill()
+        pool.workers[0].process.wait()
+        print(f"健康檢查 (終止 worker 0 後)：{pool.health_check()}")
+        sim_data, error = pool.simulate_impedance(candidates[1], freq_points)
+        reference = results[1][0]
+        same = sim_data is not None and np.allclose(sim_data, reference)
+        print(f"重啟後評估結果與先前一致：{same}，worker 重啟次數：{[w.restarts for w in pool.workers]}")
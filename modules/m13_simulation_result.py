@@ -0,0 +1,288 @@
+# m13_simulation_result.py
+# -*- coding: utf-8 -*-
+
+"""
+模組 M13: 模擬結果型別與 Ngspice rawfile 讀取器
+
+功能：
+1. 定義所有模擬後端 (Ngspice / 程序池 / M11) 共用的結果型別 SimulationResult。
+2. 以 np.frombuffer 直接將 Ngspice 二進位 rawfile ('-r' 或 'write' 指令) 解碼為複數陣列，
+   不再逐行解析文字輸出；同時支援 ASCII rawfile。
+3. 寫出二進位 rawfile (供 M12 替身程式與測試使用)。
+4. 統一的文字輸出解析器 ('.PRINT' 表格 / 'Values' 區塊)，作為無 rawfile 時的後備方案。
+"""
+
+import re
+import logging
+import numpy as np
+from datetime import datetime
+from typing import Optional, List, Dict, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# --- 共用結果型別 ---
+class SimulationResult:
+    """
+    一次交流分析的結果：頻率軸 + 各輸出向量 (複數)。
+    default_output 為預設的阻抗向量 (通常是 .PRINT 的第一個輸出)。
+    """
+    def __init__(self, frequency: np.ndarray, vectors: Dict[str, np.ndarray],
+                 title: str = '', plot_name: str = 'AC Analysis', default_output: Optional[str] = None):
+        self.frequency = np.asarray(frequency, dtype=float)
+        self.vectors = {name.lower(): np.asarray(values) for name, values in vectors.items()}
+        self.title = title
+        self.plot_name = plot_name
+        self.default_output = (default_output or next(iter(self.vectors), '')).lower()
+
+    def __len__(self) -> int:
+        return len(self.frequency)
+
+    def __contains__(self, name: str) -> bool:
+        return name.lower() in self.vectors
+
+    @property
+    def names(self) -> List[str]:
+        return list(self.vectors)
+
+    def vector(self, name: Optional[str] = None) -> np.ndarray:
+        """取出指定向量 (未指定時為 default_output)。"""
+        name = (name or self.default_output).lower()
+        # rawfile 的節點電壓可能記為 'v(in)' 或 'in'，兩種寫法互相對應
+        inner = name[2:-1] if name.startswith('v(') and name.endswith(')') else name
+        for candidate in (name, inner, f"v({inner})"):
+            if candidate in self.vectors:
+                return self.vectors[candidate]
+        raise KeyError(f"模擬結果中沒有向量 '{name}'，可用向量: {self.names}")
+
+    def magnitude(self, name: Optional[str] = None) -> np.ndarray:
+        return np.abs(self.vector(name))
+
+    def as_array(self, name: Optional[str] = None) -> np.ndarray:
+        """轉為 M03/M04 曲線歷史使用的 (F, 3) [頻率, 實部, 虛部] 陣列。"""
+        values = self.vector(name)
+        return np.column_stack([self.frequency, values.real, values.imag])
+
+    @classmethod
+    def from_array(cls, data: np.ndarray, name: str = 'v(in)', title: str = '') -> 'SimulationResult':
+        """由 (F, 3) [頻率, 實部, 虛部] 陣列建立結果。"""
+        data = np.asarray(data, dtype=float)
+        return cls(data[:, 0], {name: data[:, 1] + 1j * data[:, 2]}, title=title)
+
+# --- rawfile 讀取 ---
+_HEADER_KEYS = ('title', 'date', 'plotname', 'flags', 'no. variables', 'no. points', 'command', 'option')
+
+def _parse_header(buffer: bytes, start: int) -> Tuple[Dict[str, str], List[Tuple[str, str]], str, int]:
+    """
+    解析一個 plot 的 ASCII 標頭，回傳 (欄位, 變數清單 [(名稱, 類型)], 資料格式 'binary'/'values', 資料起點)。
+    """
+    fields, variables = {}, []
+    position = start
+    in_variables = False
+    while position < len(buffer):
+        end = buffer.find(b'\n', position)
+        if end < 0:
+            raise ValueError("rawfile 標頭不完整")
+        line = buffer[position:end].decode('latin-1').rstrip('\r')
+        position = end + 1
+        key, _, value = line.partition(':')
+        key_lower = key.strip().lower()
+        if key_lower in ('binary', 'values') and not line.startswith(('\t', ' ')):
+            return fields, variables, key_lower, position
+        if key_lower == 'variables' and not line.startswith(('\t', ' ')):
+            in_variables = True
+            continue
+        if in_variables and line.startswith(('\t', ' ')):
+            parts = line.split()
+            if len(parts) >= 3:
+                variables.append((parts[1], parts[2]))
+            continue
+        if key_lower in _HEADER_KEYS:
+            fields[key_lower] = value.strip()
+            in_variables = False
+    raise ValueError("rawfile 中找不到 'Binary:' 或 'Values:' 區段")
+
+def _read_ascii_values(buffer: bytes, start: int, num_points: int, num_vars: int, is_complex: bool) -> Tuple[np.ndarray, int]:
+    """讀取 ASCII rawfile 的 'Values:' 區段。每個點為 '索引 值' 後接 num_vars-1 行的值。"""
+    tokens = []
+    position = start
+    needed = num_points * num_vars
+    while len(tokens) < needed and position < len(buffer):
+        end = buffer.find(b'\n', position)
+        end = len(buffer) if end < 0 else end
+        line = buffer[position:end].decode('latin-1').strip()
+        position = end + 1
+        if not line:
+            continue
+        parts = line.split()
+        tokens.append(parts[-1])
+    if len(tokens) < needed:
+        raise ValueError(f"ASCII rawfile 資料不足：預期 {needed} 筆，實得 {len(tokens)} 筆")
+    if is_complex:
+        pairs = np.array([t.split(',') for t in tokens], dtype=float)
+        data = (pairs[:, 0] + 1j * pairs[:, 1]).reshape(num_points, num_vars)
+    else:
+        data = np.array(tokens, dtype=float).reshape(num_points, num_vars)
+    return data, position
+
+def read_rawfile_plots(source: Union[str, bytes]) -> List[SimulationResult]:
+    """
+    讀取 rawfile 中的所有 plot (一個檔案可依序包含多個分析)。
+
+    Args:
+        source (Union[str, bytes]): rawfile 路徑或完整內容。
+    """
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            buffer = f.read()
+    else:
+        buffer = bytes(source)
+
+    plots = []
+    position = 0
+    while position < len(buffer) and buffer[position:].strip():
+        fields, variables, data_format, position = _parse_header(buffer, position)
+        num_points = int(fields.get('no. points', '0'))
+        num_vars = int(fields.get('no. variables', len(variables)))
+        is_complex = 'complex' in fields.get('flags', '').lower()
+
+        if data_format == 'binary':
+            width = 16 if is_complex else 8
+            count = num_points * num_vars * (2 if is_complex else 1)
+            raw = np.frombuffer(buffer, dtype='<f8', count=count, offset=position)
+            position += num_points * num_vars * width
+            data = raw.view('<c16') if is_complex else raw
+            data = data.reshape(num_points, num_vars)
+        else:
+            data, position = _read_ascii_values(buffer, position, num_points, num_vars, is_complex)
+
+        names = [name for name, _ in variables]
+        frequency = data[:, 0].real if num_vars else np.zeros(0)
+        vectors = {name: data[:, j] for j, name in enumerate(names) if j > 0}
+        plots.append(SimulationResult(frequency, vectors, title=fields.get('title', ''),
+                                      plot_name=fields.get('plotname', '')))
+    return plots
+
+def read_rawfile(source: Union[str, bytes], plot_name: Optional[str] = 'AC Analysis') -> Optional[SimulationResult]:
+    """
+    讀取 rawfile 並回傳最後一個符合 plot_name 的 plot (plot_name 為 None 時回傳最後一個)。
+    """
+    try:
+        plots = read_rawfile_plots(source)
+    except (OSError, ValueError) as e:
+        logger.error(f"讀取 rawfile 失敗: {e}")
+        return None
+    for plot in reversed(plots):
+        if plot_name is None or plot.plot_name.lower().startswith(plot_name.lower()):
+            return plot
+    logger.error(f"rawfile 中找不到 '{plot_name}' 的 plot。")
+    return None
+
+def write_rawfile(path: str, result: SimulationResult, append: bool = False):
+    """
+    以 Ngspice 的二進位格式寫出交流分析結果 (所有向量皆為複數)。
+    append 為 True 時附加在既有檔案之後 (等同 Ngspice 的 'set appendwrite')，讀取時為多個 plot。
+    """
+    names = ['frequency'] + result.names
+    header = [
+        f"Title: {result.title}",
+        f"Date: {datetime.now().strftime('%a %b %d %H:%M:%S %Y')}",
+        f"Plotname: {result.plot_name}",
+        "Flags: complex",
+        f"No. Variables: {len(names)}",
+        f"No. Points: {len(result)}",
+        "Variables:",
+    ]
+    header.append(f"\t0\tfrequency\tfrequency\tgrid=3")
+    header += [f"\t{j}\t{name}\t{'current' if name.startswith('i(') else 'voltage'}" for j, name in enumerate(names[1:], 1)]
+    header.append("Binary:")
+    data = np.column_stack([result.frequency.astype(complex)] + [result.vectors[n] for n in result.names])
+    with open(path, 'ab' if append else 'wb') as f:
+        f.write(('\n'.join(header) + '\n').encode('latin-1'))
+        f.write(np.ascontiguousarray(data, dtype='<c16').tobytes())
+
+# --- 文字輸出解析 (後備方案) ---
+_NUMBER = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?'
+# '.PRINT AC' 表格：'索引  頻率  實部,  虛部'
+_PRINT_ROW_RE = re.compile(rf'^[ \t]*\d+[ \t]+({_NUMBER})[ \t]+({_NUMBER}),?[ \t]+({_NUMBER})', re.MULTILINE)
+# 'Values' 區塊：'頻率  實部,虛部'
+_VALUES_ROW_RE = re.compile(rf'^[ \t]*({_NUMBER})[ \t]+({_NUMBER})[ \t]*,[ \t]*({_NUMBER})[ \t]*$', re.MULTILINE)
+_COLUMN_RE = re.compile(r'^[ \t]*Index[ \t]+frequency[ \t]+(\S+)', re.IGNORECASE | re.MULTILINE)
+
+def parse_text_output(stdout: str) -> Optional[SimulationResult]:
+    """
+    解析 Ngspice 的文字輸出，不依賴特定標頭 ('Index' / 'Values' 皆可)：
+    以整段文字的正規表示式一次擷取數據列，重複的分頁標頭自然被略過，只保留第一個輸出欄位。
+    """
+    if not stdout:
+        return None
+    rows = _PRINT_ROW_RE.findall(stdout) or _VALUES_ROW_RE.findall(stdout)
+    if not rows:
+        logger.error("在 Ngspice 輸出中找不到任何數據列。")
+        return None
+    column = _COLUMN_RE.search(stdout)
+    return SimulationResult.from_array(np.array(rows, dtype=float), name=column.group(1) if column else 'v(out)')
+
+# --- 主程式 (微基準測試：逐行文字解析 vs 二進位 rawfile) ---
+if __name__ == '__main__':
+    import io
+    import os
+    import time
+    import tempfile
+    import pandas as pd
+
+    def legacy_pandas_parse(stdout: str) -> np.ndarray:
+        """原 M02 的解析方式：找到 'Index' 標頭後以 pandas 讀取空白分隔表格。"""
+        lines = stdout.splitlines()
+        start = next(i for i, line in enumerate(lines) if 'Index' in line and 'frequency' in line) + 2
+        df = pd.read_csv(io.StringIO("\n".join(lines[start:])), sep=r'\s+', header=None)
+        return df.iloc[:, 1:4].apply(lambda c: c.astype(str).str.rstrip(',').astype(float)).values
+
+    def legacy_line_parse(stdout: str) -> np.ndarray:
+        """原 M04 / M07 的解析方式：'Values' 標頭後逐行以逗號切割。"""
+        lines = stdout.strip().split('\n')
+        start = next(i for i, line in enumerate(lines) if 'Values' in line) + 1
+        data = []
+        for line in lines[start:]:
+            line = line.strip()
+            if not line:
+                break
+            freq_str, complex_val_str = line.split(maxsplit=1)
+            real_str, imag_str = complex_val_str.split(',')
+            data.append([float(freq_str), float(real_str), float(imag_str)])
+        return np.array(data)
+
+    def best_of(func, repeat: int = 5) -> float:
+        timings = []
+        for _ in range(repeat):
+            start_t = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start_t)
+        return min(timings)
+
+    print("正在執行 M13 模組 (Simulation Result / Rawfile) 微基準測試...")
+    temp_dir = tempfile.mkdtemp()
+    for num_points in (401, 10000):
+        freq = np.logspace(6, np.log10(3e9), num_points)
+        z = 50.0 + 1j * 2 * np.pi * freq * 1e-6
+        result = SimulationResult(freq, {'v(in)': z}, title='benchmark')
+
+        print_table = "Index   frequency       v(in)\n" + "-" * 80 + "\n" + "".join(
+            f"{i}\t{f:.6e}\t{v.real:.6e},\t{v.imag:.6e}\t\n" for i, (f, v) in enumerate(zip(freq, z)))
+        values_block = "Values\n" + "".join(f"{f:.6e}\t{v.real:.6e},{v.imag:.6e}\n" for f, v in zip(freq, z))
+        raw_path = os.path.join(temp_dir, f"bench_{num_points}.raw")
+        write_rawfile(raw_path, result)
+
+        loaded = read_rawfile(raw_path)
+        assert np.array_equal(loaded.vector('v(in)'), z) and np.array_equal(loaded.frequency, freq)
+        assert np.allclose(parse_text_output(print_table).as_array(), legacy_line_parse(values_block), rtol=1e-5)
+
+        timings = {
+            'pandas 表格 (原 M02)': best_of(lambda: legacy_pandas_parse(print_table)),
+            '逐行切割 (原 M04/M07)': best_of(lambda: legacy_line_parse(values_block)),
+            '統一文字解析': best_of(lambda: parse_text_output(print_table)),
+            '二進位 rawfile': best_of(lambda: read_rawfile(raw_path)),
+        }
+        print(f"\n{num_points} 點：")
+        baseline = timings['逐行切割 (原 M04/M07)']
+        for label, seconds in timings.items():
+            print(f"  {label:<18} {seconds * 1e3:8.3f} ms  (相對逐行切割 {baseline / seconds:6.1f}x)")
@@ -0,0 +1,258 @@
+# m14_result_cache.py
+# -*- coding: utf-8 -*-
+
+"""
+模組 M14: 模擬結果快取
+
+功能：
+1. 以 (範本雜湊值, 頻率軸, 模式, 後端, 參數) 作為內容定址的快取鍵。預設以參數的精確數值為鍵，
+   只有完全重複的候選解 (DE 族群、多起點、重試的工作) 共用結果；可設定相對容差改為量化後的鍵。
+2. 兩層快取：程序內的 LRU 記憶體快取，以及 'results/cache/' 下的 SQLite 磁碟快取，
+   可跨次執行保留，並可由多個 DE 工作程序同時讀寫 (WAL 模式)。
+3. 記錄命中率統計 (記憶體命中 / 磁碟命中 / 未命中)。
+"""
+
+import os
+import math
+import struct
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Optional, List, Dict, Tuple
+
+# --- 全域設定 ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(SCRIPT_DIR)
+CACHE_DIR = os.path.join(BASE_DIR, 'results', 'cache')
+CACHE_DB_PATH = os.path.join(CACHE_DIR, 'simulation_cache.sqlite')
+# 參數量化的相對容差：相對差異小於此值的兩組參數視為相同；0 表示以精確數值為鍵。
+# 若要啟用，需遠小於 M04 有限差分步長的相對變化 (FD_STEP·ln10 ≈ 2.3e-6)，否則差分點會取回鄰近點的曲線，
+# 使梯度失真，小於容差的線搜尋步長也會得到相同的誤差
+CACHE_RELATIVE_TOLERANCE = 0.0
+# 記憶體 LRU 快取的最大筆數
+MAX_MEMORY_ENTRIES = 4096
+# 磁碟快取的最大筆數，超過時刪除最早寫入的項目
+MAX_DISK_ENTRIES = 200000
+# 每寫入多少筆檢查一次磁碟快取大小
+PRUNE_EVERY = 1000
+# 快取鍵格式版本，變更鍵或資料格式時需遞增
+CACHE_FORMAT_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+def quantize_parameters(param_dict: Dict[str, float], rtol: float = CACHE_RELATIVE_TOLERANCE) -> Tuple[Tuple[str, int, int], ...]:
+    """
+    將參數以對數刻度量化為 (名稱, 正負號, 索引)，索引 = round(ln|p| / ln(1 + rtol))。
+    相對差異遠小於 rtol 的參數會落在同一個索引；rtol <= 0 時索引為 |p| 的 IEEE 754 位元樣式 (精確比對)。
+    零與非有限值以正負號 0 / 2 表示。
+    """
+    step = math.log1p(rtol) if rtol > 0 else None
+    quantized = []
+    for name in sorted(param_dict):
+        value = float(param_dict[name])
+        if value == 0.0:
+            quantized.append((name, 0, 0))
+        elif not math.isfinite(value):
+            quantized.append((name, 2, 0 if math.isnan(value) else int(math.copysign(1, value))))
+        else:
+            index = (int.from_bytes(struct.pack('<d', abs(value)), 'little') if step is None
+                     else int(round(math.log(abs(value)) / step)))
+            quantized.append((name, 1 if value > 0 else -1, index))
+    return tuple(quantized)
+
+def array_digest(values: np.ndarray) -> str:
+    return hashlib.sha256(np.ascontiguousarray(values, dtype='<f8').tobytes()).hexdigest()[:16]
+
+class ResultCache:
+    """
+    兩層 (記憶體 LRU + SQLite) 的模擬結果快取，值為 (F,) 複數阻抗曲線。
+    SQLite 連線依 PID 建立，fork 出的 DE 工作程序會自動開啟自己的連線。
+    """
+    def __init__(self, db_path: Optional[str] = CACHE_DB_PATH, max_memory_entries: int = MAX_MEMORY_ENTRIES,
+                 rtol: float = CACHE_RELATIVE_TOLERANCE, max_disk_entries: int = MAX_DISK_ENTRIES):
+        self.db_path = db_path
+        self.max_memory_entries = max_memory_entries
+        self.rtol = rtol
+        self.max_disk_entries = max_disk_entries
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0}
+        self._connection = None
+        self._connection_pid = None
+        self._writes_since_prune = 0
+
+    # --- 鍵 ---
+    def make_key(self, context: str, freq_points: np.ndarray, param_dict: Dict[str, float]) -> str:
+        """
+        context 為範本雜湊值、模式與後端等組成的字串；頻率軸以內容雜湊值表示。
+        """
+        quantized = quantize_parameters(param_dict, self.rtol)
+        text = f"{CACHE_FORMAT_VERSION}|{self.rtol:.3e}|{context}|{array_digest(freq_points)}|{quantized}"
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    # --- 磁碟層 ---
+    def _db(self) -> Optional[sqlite3.Connection]:
+        if self.db_path is None:
+            return None
+        if self._connection is None or self._connection_pid != os.getpid():
+            try:
+                os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+                connection = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+                connection.execute('PRAGMA journal_mode=WAL')
+                connection.execute('PRAGMA synchronous=NORMAL')
+                connection.execute('CREATE TABLE IF NOT EXISTS results ('
+                                   'key TEXT PRIMARY KEY, points INTEGER, data BLOB, accessed REAL)')
+                connection.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"無法開啟磁碟快取 '{self.db_path}'，僅使用記憶體快取: {e}")
+                self.db_path = None
+                return None
+            self._connection, self._connection_pid = connection, os.getpid()
+        return self._connection
+
+    def _disk_get(self, key: str) -> Optional[np.ndarray]:
+        connection = self._db()
+        if connection is None:
+            return None
+        try:
+            row = connection.execute('SELECT points, data FROM results WHERE key = ?', (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"讀取磁碟快取失敗: {e}")
+            return None
+        if row is None:
+            return None
+        points, data = row
+        return np.frombuffer(data, dtype='<c16', count=points).copy()
+
+    def _disk_put_many(self, items: List[Tuple[str, np.ndarray]]):
+        connection = self._db()
+        if connection is None or not items:
+            return
+        now = time.time()
+        rows = [(key, len(curve), np.ascontiguousarray(curve, dtype='<c16').tobytes(), now) for key, curve in items]
+        try:
+            with connection:
+                connection.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)', rows)
+            self._writes_since_prune += len(rows)
+            if self._writes_since_prune >= PRUNE_EVERY:
+                self._writes_since_prune = 0
+                self._prune(connection)
+        except sqlite3.Error as e:
+            # 其他工作程序長時間鎖定資料庫時放棄寫入，不影響模擬結果
+            logger.warning(f"寫入磁碟快取失敗: {e}")
+
+    def _prune(self, connection: sqlite3.Connection):
+        count = connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        if count > self.max_disk_entries:
+            with connection:
+                connection.execute('DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY accessed LIMIT ?)',
+                                   (count - self.max_disk_entries,))
+            logger.info(f"磁碟快取超過 {self.max_disk_entries} 筆，已刪除 {count - self.max_disk_entries} 筆最舊項目。")
+
+    # --- 記憶體層 ---
+    def _memory_put(self, key: str, curve: np.ndarray):
+        self.memory[key] = curve
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+
+    # --- 公開介面 ---
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """依序查詢記憶體與磁碟層；磁碟命中時回填記憶體層。"""
+        with self.lock:
+            curve = self.memory.get(key)
+            if curve is not None:
+                self.memory.move_to_end(key)
+                self.counters['memory_hits'] += 1
+                return curve
+            curve = self._disk_get(key)
+            if curve is not None:
+                self._memory_put(key, curve)
+                self.counters['disk_hits'] += 1
+                return curve
+            self.counters['misses'] += 1
+            return None
+
+    def put(self, key: str, curve: np.ndarray):
+        self.put_many([(key, curve)])
+
+    def put_many(self, items: List[Tuple[str, np.ndarray]]):
+        """寫入多筆結果 (磁碟層一次交易完成)。含非有限值的結果不快取。"""
+        items = [(key, np.asarray(curve, dtype=complex)) for key, curve in items if np.all(np.isfinite(curve))]
+        with self.lock:
+            for key, curve in items:
+                self._memory_put(key, curve)
+            self.counters['stores'] += len(items)
+            self._disk_put_many(items)
+
+    def stats(self) -> Dict[str, float]:
+        """回傳本程序的命中統計與命中率。"""
+        counters = dict(self.counters)
+        lookups = counters['memory_hits'] + counters['disk_hits'] + counters['misses']
+        counters['lookups'] = lookups
+        counters['hit_rate'] = (counters['memory_hits'] + counters['disk_hits']) / lookups if lookups else 0.0
+        counters['memory_entries'] = len(self.memory)
+        return counters
+
+    def format_stats(self) -> str:
+        s = self.stats()
+        return (f"快取查詢 {s['lookups']} 次，命中率 {s['hit_rate']:.1%} "
+                f"(記憶體 {s['memory_hits']}、磁碟 {s['disk_hits']}、未命中 {s['misses']})")
+
+    def clear(self, disk: bool = False):
+        with self.lock:
+            self.memory.clear()
+            connection = self._db() if disk else None
+            if connection is not None:
+                with connection:
+                    connection.execute('DELETE FROM results')
+
+# --- 程序內共用的快取 ---
+_SHARED_CACHE: Optional[ResultCache] = None
+
+def get_result_cache() -> ResultCache:
+    global _SHARED_CACHE
+    if _SHARED_CACHE is None:
+        _SHARED_CACHE = ResultCache()
+    return _SHARED_CACHE
+
+# --- 主程式 (示範) ---
+if __name__ == '__main__':
+    import tempfile
+
+    print("正在執行 M14 模組 (Result Cache) 示範...")
+    db_path = os.path.join(tempfile.mkdtemp(), 'demo_cache.sqlite')
+    freq_points = np.logspace(6, np.log10(3e9), 401)
+    params = {'R1': 50.0, 'L1': 1e-6, 'C1': 1e-10}
+
+    def fake_simulation(p: Dict[str, float]) -> np.ndarray:
+        w = 2 * np.pi * freq_points
+        return p['R1'] + 1j * (w * p['L1'] - 1 / (w * p['C1']))
+
+    cache = ResultCache(db_path=db_path)
+    for attempt in range(3):
+        # 第 2、3 次為重複的候選解，應命中同一筆
+        key = cache.make_key('demo|CM|numpy', freq_points, params)
+        if cache.get(key) is None:
+            cache.put(key, fake_simulation(params))
+    print(f"同一程序：{cache.format_stats()}")
+
+    # 新的快取物件 (模擬下一次執行或另一個工作程序)：應由磁碟層命中
+    second = ResultCache(db_path=db_path)
+    key = second.make_key('demo|CM|numpy', freq_points, params)
+    curve = second.get(key)
+    print(f"跨程序：{second.format_stats()}，資料一致：{curve is not None and np.array_equal(curve, fake_simulation(params))}")
+
+    # 精確鍵：有限差分大小的偏移 (M04 FD_STEP 對應的相對變化約 2.3e-6) 不應命中
+    moved = dict(params, R1=params['R1'] * 10**1e-6)
+    print(f"參數偏移 2.3e-6 時命中：{second.get(second.make_key('demo|CM|numpy', freq_points, moved)) is not None}")
+
+    # 設定相對容差時，差異遠小於容差的參數共用同一筆
+    tolerant = ResultCache(db_path=None, rtol=1e-9)
+    tolerant.put(tolerant.make_key('demo|CM|numpy', freq_points, params), fake_simulation(params))
+    nearby = {k: v * (1 + 1e-13) for k, v in params.items()}
+    print(f"rtol=1e-9，參數偏移 1e-13 時命中：{tolerant.get(tolerant.make_key('demo|CM|numpy', freq_points, nearby)) is not None}")
@@ -0,0 +1,416 @@
+# m15_async_scheduler.py
+# -*- coding: utf-8 -*-
+
+"""
+模組 M15: 非同步模擬排程器
+
+功能：
+1. 以 asyncio 子程序同時執行多個 Ngspice 批次模擬，並以 Semaphore 限制同時執行的數量。
+2. simulate_many(): 輸入多組參數，依提交順序回傳 (sim_data, error)；共用 M05 的結果快取。
+3. simulate_netlists(): 同時執行多個已產生的 Netlist 檔案；simulate_sweep(): 以 .control 掃描評估
+   一份參數化 Netlist 的多組參數 ('numpy' 後端改由 M11 批次求解，供 M02 敏感度分析)。
+4. 每個工作各自套用逾時；逾時或外層取消時會終止子程序並清除暫存檔，不留下孤兒程序。
+   擬合 Netlist 經由 stdin 串流，log 與 rawfile 放在 M16 的私有暫存槽位。
+5. 'numpy' 與 'ngspice_pool' 後端以執行緒池執行，介面與 'ngspice' 後端相同。
+   'ngspice' 後端在 M05 NGSPICE_SWEEP_ENABLED 時把待模擬的參數分成 (至多) 同時執行數個區塊，
+   每個區塊以一個 .control 掃描程序評估；掃描中未產生結果的參數組再以單次模擬重試。
+6. run_simulate_many() / run_simulate_netlists() / run_simulate_sweep(): 給同步程式碼 (M02、M05 批次評估) 使用的包裝。
+"""
+
+import sys
+import os
+import time
+import asyncio
+import logging
+import math
+import functools
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Tuple
+
+# --- 路徑修正 ---
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+import modules.m05_ngspice_runner as m05
+from modules.m13_simulation_result import SimulationResult
+from modules.m16_scratch_space import get_scratch_space
+
+# --- 全域設定 ---
+# 預設同時執行的模擬數 (每個 Ngspice 程序為單執行緒)
+DEFAULT_MAX_CONCURRENCY = os.cpu_count() or 1
+# 單一工作的預設逾時 (秒)
+JOB_TIMEOUT_SECONDS = 60
+
+logger = logging.getLogger(__name__)
+
+# --- 子程序 ---
+async def run_subprocess(command: List[str], timeout_seconds: float = JOB_TIMEOUT_SECONDS,
+                         input_text: Optional[str] = None) -> Tuple[Optional[Tuple[int, str, str]], Optional[str]]:
+    """
+    以 asyncio 子程序執行指令，回傳 ((returncode, stdout, stderr), error)。input_text 會寫入子程序的 stdin。
+    逾時或所在的工作被取消時，子程序一律會被終止並回收。
+    """
+    stdin = asyncio.subprocess.PIPE if input_text is not None else None
+    try:
+        process = await asyncio.create_subprocess_exec(*command, stdin=stdin, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    except OSError as e:
+        return None, f"無法啟動程序 '{command[0]}': {e}"
+    try:
+        data = input_text.encode('utf-8') if input_text is not None else None
+        stdout, stderr = await asyncio.wait_for(process.communicate(data), timeout_seconds)
+        return (process.returncode, stdout.decode('utf-8', errors='replace'), stderr.decode('utf-8', errors='replace')), None
+    except asyncio.TimeoutError:
+        return None, f"錯誤：程序超過 {timeout_seconds} 秒，已強制中止。"
+    finally:
+        if process.returncode is None:
+            process.kill()
+            # 讀完管線至 EOF 再回收，避免事件迴圈關閉後才清理 transport
+            await process.communicate()
+
+async def _run_ngspice_job(netlist_path: Optional[str], netlist_text: str, label: str,
+                           timeout_seconds: float) -> Tuple[Optional[SimulationResult], Optional[str]]:
+    """在 M16 私有暫存槽位中執行一次 Ngspice；netlist_path 為 None 時經由 stdin 傳送 netlist_text。"""
+    if not os.path.exists(m05.NGSPICE_EXECUTABLE_PATH):
+        return None, f"致命錯誤：找不到 Ngspice 執行檔 -> {m05.NGSPICE_EXECUTABLE_PATH}"
+    # 離開 with 區塊 (含逾時與取消) 時刪除 log 與 rawfile 並歸還槽位
+    with get_scratch_space().acquire() as job:
+        command = m05.build_ngspice_command(netlist_path, job.log_path, job.raw_path)
+        completed, error = await run_subprocess(command, timeout_seconds, input_text=netlist_text if netlist_path is None else None)
+        if completed is None:
+            return None, f"模擬 '{label}' 失敗: {error}"
+        _, _, stderr = completed
+        # 與同步版本一致：stderr 有內容即視為錯誤
+        if stderr.strip():
+            return None, stderr
+        if not os.path.exists(job.log_path):
+            return None, f"錯誤：Ngspice 執行完畢但未產生輸出檔 '{os.path.basename(job.log_path)}'。"
+        return m05.load_rawfile_result(job.raw_path, netlist_text)
+
+async def run_ngspice_async(netlist_filename: str, timeout_seconds: float = JOB_TIMEOUT_SECONDS) -> Tuple[Optional[SimulationResult], Optional[str]]:
+    """
+    M05 run_ngspice_rawfile() 的非同步版本：以 '-b -r' 執行 'netlist/runnable/' 下的 Netlist 並解碼 rawfile。
+    """
+    netlist_path = os.path.join(m05.RUNNABLE_DIR, netlist_filename)
+    if not os.path.exists(netlist_path):
+        return None, f"錯誤：找不到指定的 Netlist 檔案 -> {netlist_path}"
+    return await _run_ngspice_job(netlist_path, m05.read_netlist_text(netlist_path), netlist_filename, timeout_seconds)
+
+async def run_ngspice_deck_async(netlist_text: str, timeout_seconds: float = JOB_TIMEOUT_SECONDS,
+                                 label: str = 'deck') -> Tuple[Optional[SimulationResult], Optional[str]]:
+    """M05 run_ngspice_deck() 的非同步版本：預設經由 stdin 串流 Netlist，不產生 Netlist 檔案。"""
+    if m05.NGSPICE_NETLIST_VIA_STDIN:
+        return await _run_ngspice_job(None, netlist_text, label, timeout_seconds)
+    with get_scratch_space().acquire() as job:
+        return await _run_ngspice_job(job.write_netlist(netlist_text), netlist_text, label, timeout_seconds)
+
+async def run_ngspice_sweep_async(netlist_text: str, param_sets: List[Dict[str, float]],
+                                  timeout_seconds: float = JOB_TIMEOUT_SECONDS,
+                                  label: str = 'sweep') -> List[Tuple[Optional[SimulationResult], Optional[str]]]:
+    """M05 run_ngspice_sweep() 的非同步版本：一個程序依序評估多組參數，整批逾時為 timeout_seconds × 組數。"""
+    if not param_sets:
+        return []
+    if not os.path.exists(m05.NGSPICE_EXECUTABLE_PATH):
+        return [(None, f"致命錯誤：找不到 Ngspice 執行檔 -> {m05.NGSPICE_EXECUTABLE_PATH}")] * len(param_sets)
+    with get_scratch_space().acquire() as job:
+        try:
+            command, input_text = m05.prepare_sweep_job(netlist_text, param_sets, job)
+        except ValueError as e:
+            return [(None, f"產生掃描 Netlist 失敗: {e}")] * len(param_sets)
+        completed, error = await run_subprocess(command, timeout_seconds * len(param_sets), input_text=input_text)
+        if completed is not None:
+            error = completed[2].strip() or None
+        else:
+            error = f"掃描 '{label}' 失敗: {error}"
+        return m05.load_sweep_results(job.raw_path, netlist_text, len(param_sets), error)
+
+# --- 單一工作 ---
+async def _in_thread(function, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(function, *args, **kwargs))
+
+async def _simulate_one(param_dict: Dict[str, float], freq_points: np.ndarray, mode: str, backend: str,
+                        timeout_seconds: float) -> Tuple[Optional[np.ndarray], Optional[str]]:
+    if backend == 'numpy':
+        from modules.m11_mna_solver import simulate_impedance as simulate_mna
+        return await asyncio.wait_for(_in_thread(simulate_mna, param_dict, freq_points, mode=mode), timeout_seconds)
+    if backend == 'ngspice_pool':
+        from modules.m12_ngspice_pool import get_shared_pool
+        # 常駐程序池自行處理單次評估的逾時與重啟
+        return await _in_thread(get_shared_pool().simulate_impedance, param_dict, freq_points, mode=mode)
+
+    from modules.m06_netlist_generator import build_fitting_netlist
+    netlist_text = build_fitting_netlist(param_dict, freq_points, mode=mode)
+    result, error = await run_ngspice_deck_async(netlist_text, timeout_seconds, label=f"fit_{mode}")
+    if result is None:
+        return None, error
+    return m05.fitting_sim_data(result, freq_points, mode), None
+
+async def _simulate_sweep(param_sets: List[Dict[str, float]], freq_points: np.ndarray, mode: str,
+                          timeout_seconds: float) -> List[Tuple[Optional[np.ndarray], Optional[str]]]:
+    from modules.m06_netlist_generator import build_fitting_netlist
+    try:
+        netlist_text = build_fitting_netlist(param_sets[0], freq_points, mode=mode)
+    except (OSError, ValueError) as e:
+        return [(None, f"產生擬合 Netlist 失敗: {e}")] * len(param_sets)
+    results = await run_ngspice_sweep_async(netlist_text, param_sets, timeout_seconds, label=f"fit_{mode}")
+    return [(None, error) if result is None else (m05.fitting_sim_data(result, freq_points, mode), None)
+            for result, error in results]
+
+def uses_ngspice_sweep(backend: Optional[str] = None) -> bool:
+    """多組參數是否以 .control 掃描評估 ('ngspice' 後端且 M05 NGSPICE_SWEEP_ENABLED)。"""
+    return (backend or m05.SIMULATION_BACKEND) == 'ngspice' and m05.NGSPICE_SWEEP_ENABLED
+
+def sweep_chunks(indices: List[int], max_concurrency: int) -> List[List[int]]:
+    """把待模擬的索引均分成至多 max_concurrency 個區塊，每塊不超過 M05 的 NGSPICE_SWEEP_MAX_SETS 組。"""
+    if not indices:
+        return []
+    size = math.ceil(len(indices) / max(1, min(max_concurrency, len(indices))))
+    size = max(1, min(size, m05.NGSPICE_SWEEP_MAX_SETS))
+    return [indices[i:i + size] for i in range(0, len(indices), size)]
+
+async def _bounded_sweep(semaphore: asyncio.Semaphore, param_sets: List[Dict[str, float]], freq_points: np.ndarray,
+                         mode: str, timeout_seconds: float) -> List[Tuple[Optional[np.ndarray], Optional[str]]]:
+    """在 Semaphore 限制下執行一個掃描區塊；例外轉為整塊的 (None, error)，取消則向外傳遞。"""
+    async with semaphore:
+        try:
+            return await _simulate_sweep(param_sets, freq_points, mode, timeout_seconds)
+        except Exception as e:
+            error = f"掃描區塊發生未預期的錯誤: {e}"
+            logger.error(error, exc_info=True)
+            return [(None, error)] * len(param_sets)
+
+async def _bounded(semaphore: asyncio.Semaphore, index: int, coroutine_factory, timeout_seconds: float):
+    """在 Semaphore 限制下執行一個工作；逾時與例外轉為 (None, error)，取消則向外傳遞。"""
+    async with semaphore:
+        try:
+            return await coroutine_factory()
+        except asyncio.TimeoutError:
+            error = f"工作 {index} 超過 {timeout_seconds} 秒，已中止。"
+        except Exception as e:
+            error = f"工作 {index} 發生未預期的錯誤: {e}"
+            logger.error(error, exc_info=True)
+        logger.warning(error)
+        return None, error
+
+async def gather_in_order(coroutines) -> list:
+    """
+    依提交順序收集結果。asyncio.gather 被取消時，會在第一個子工作結束後就立即返回；
+    此處會等所有子工作都完成取消與清理 (終止子程序、刪除暫存檔) 後才把取消向外傳遞。
+    """
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        return list(await asyncio.gather(*tasks))
+    except BaseException as e:
+        pending = [task for task in tasks if not task.done()]
+        # 被取消時 gather 已取消所有子工作；再次取消會中斷子工作 finally 中的清理
+        if not isinstance(e, asyncio.CancelledError):
+            for task in pending:
+                task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+        raise
+
+# --- 公開介面 ---
+async def simulate_many(
+    param_sets: List[Dict[str, float]],
+    freq_points: np.ndarray,
+    mode: str = 'CM',
+    max_concurrency: Optional[int] = None,
+    timeout_seconds: float = JOB_TIMEOUT_SECONDS,
+    backend: Optional[str] = None,
+    use_cache: bool = True
+) -> List[Tuple[Optional[np.ndarray], Optional[str]]]:
+    """
+    同時模擬多組參數，依提交順序回傳 (sim_data, error) 串列。
+
+    Args:
+        param_sets: 子電路參數字典串列。
+        freq_points: 目標頻率軸。
+        mode: 'CM'、'NM' 或聯合模式 'CM+NM'。
+        max_concurrency: 同時執行的工作數上限，預設為 CPU 核心數。
+        timeout_seconds: 單一工作的逾時 (秒)，逾時的工作回傳 (None, error)，不影響其他工作；
+                         掃描區塊的逾時為 timeout_seconds × 區塊組數。
+        backend: 'ngspice'、'ngspice_pool' 或 'numpy'，未指定時使用 M05 的 SIMULATION_BACKEND。
+        use_cache: 是否查詢並寫入 M05 的結果快取。
+
+    Returns:
+        List[Tuple[Optional[np.ndarray], Optional[str]]]: sim_data 為 (F, 3) [頻率, 實部, 虛部]，
+        聯合模式為各治具依序串接的 (K·F, 3)。
+    """
+    backend = backend or m05.SIMULATION_BACKEND
+    freq_points = np.asarray(freq_points, dtype=float)
+    results: List[Tuple[Optional[np.ndarray], Optional[str]]] = [(None, None)] * len(param_sets)
+
+    cache, keys = m05.result_cache_keys(param_sets, freq_points, mode, backend) if use_cache else (None, None)
+    pending = list(range(len(param_sets)))
+    if cache is not None:
+        pending = []
+        for i, key in enumerate(keys):
+            curve = cache.get(key)
+            if curve is None:
+                pending.append(i)
+            else:
+                results[i] = (m05.curve_to_array(freq_points, curve), None)
+
+    limit = max(1, max_concurrency or DEFAULT_MAX_CONCURRENCY)
+    semaphore = asyncio.Semaphore(limit)
+    remaining = pending
+    if uses_ngspice_sweep(backend) and len(pending) > 1:
+        chunks = sweep_chunks(pending, limit)
+        swept = await gather_in_order(
+            _bounded_sweep(semaphore, [param_sets[i] for i in chunk], freq_points, mode, timeout_seconds) for chunk in chunks
+        )
+        for chunk, chunk_results in zip(chunks, swept):
+            for i, result in zip(chunk, chunk_results):
+                results[i] = result
+        remaining = [i for i in pending if results[i][0] is None]
+        if remaining:
+            logger.warning(f"{len(remaining)}/{len(pending)} 組參數未在掃描中完成，改以單次模擬重試。")
+
+    solved = await gather_in_order(
+        _bounded(semaphore, i, functools.partial(_simulate_one, param_sets[i], freq_points, mode, backend, timeout_seconds), timeout_seconds)
+        for i in remaining
+    )
+    for i, result in zip(remaining, solved):
+        results[i] = result
+    if cache is not None:
+        cache.put_many([(keys[i], results[i][0][:, 1] + 1j * results[i][0][:, 2]) for i in pending if results[i][0] is not None])
+    return results
+
+async def simulate_netlists(
+    netlist_filenames: List[str],
+    max_concurrency: Optional[int] = None,
+    timeout_seconds: float = JOB_TIMEOUT_SECONDS,
+    backend: Optional[str] = None
+) -> List[Tuple[Optional[SimulationResult], Optional[str]]]:
+    """
+    同時執行 'netlist/runnable/' 下的多個 Netlist，依提交順序回傳 (SimulationResult, error) 串列。
+    """
+    backend = backend or m05.SIMULATION_BACKEND
+
+    def factory(filename: str):
+        if backend == 'numpy':
+            from modules.m11_mna_solver import simulate_netlist_file
+            return lambda: asyncio.wait_for(_in_thread(simulate_netlist_file, filename), timeout_seconds)
+        return lambda: run_ngspice_async(filename, timeout_seconds)
+
+    semaphore = asyncio.Semaphore(max(1, max_concurrency or DEFAULT_MAX_CONCURRENCY))
+    return await gather_in_order(
+        _bounded(semaphore, i, factory(filename), timeout_seconds) for i, filename in enumerate(netlist_filenames)
+    )
+
+async def simulate_sweep(
+    netlist_text: str,
+    param_sets: List[Dict[str, float]],
+    max_concurrency: Optional[int] = None,
+    timeout_seconds: float = JOB_TIMEOUT_SECONDS,
+    label: str = 'sweep',
+    backend: Optional[str] = None
+) -> List[Tuple[Optional[SimulationResult], Optional[str]]]:
+    """
+    以 .control 掃描評估一份參數化 Netlist (M06 build_parametric_netlist()) 的多組參數，
+    分成至多 max_concurrency 個 Ngspice 程序同時執行，依輸入順序回傳 (SimulationResult, error) 串列。
+    'numpy' 後端改由 M11 一次批次求解；不支援掃描的後端整批回傳 (None, error)，由呼叫端改為逐一模擬。
+    """
+    backend = backend or m05.SIMULATION_BACKEND
+    if backend == 'numpy':
+        from modules.m11_mna_solver import simulate_netlist_batch
+        return await _in_thread(simulate_netlist_batch, netlist_text, param_sets)
+    if not uses_ngspice_sweep(backend):
+        return [(None, f"後端 '{backend}' 不支援 .control 掃描。")] * len(param_sets)
+
+    limit = max(1, max_concurrency or DEFAULT_MAX_CONCURRENCY)
+    semaphore = asyncio.Semaphore(limit)
+    chunks = sweep_chunks(list(range(len(param_sets))), limit)
+
+    async def run_chunk(chunk: List[int]):
+        async with semaphore:
+            return await run_ngspice_sweep_async(netlist_text, [param_sets[i] for i in chunk], timeout_seconds, label)
+
+    swept = await gather_in_order(run_chunk(chunk) for chunk in chunks)
+    return [result for chunk_results in swept for result in chunk_results]
+
+def run_coroutine(coroutine):
+    """
+    由同步程式碼執行協程。呼叫端已在事件迴圈中 (例如 Jupyter) 時改在獨立執行緒中執行，
+    避免 'asyncio.run() cannot be called from a running event loop'。
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+def run_simulate_many(param_sets: List[Dict[str, float]], freq_points: np.ndarray, **kwargs) -> List[Tuple[Optional[np.ndarray], Optional[str]]]:
+    """simulate_many() 的同步包裝。"""
+    return run_coroutine(simulate_many(param_sets, freq_points, **kwargs))
+
+def run_simulate_netlists(netlist_filenames: List[str], **kwargs) -> List[Tuple[Optional[SimulationResult], Optional[str]]]:
+    """simulate_netlists() 的同步包裝。"""
+    return run_coroutine(simulate_netlists(netlist_filenames, **kwargs))
+
+def run_simulate_sweep(netlist_text: str, param_sets: List[Dict[str, float]], **kwargs) -> List[Tuple[Optional[SimulationResult], Optional[str]]]:
+    """simulate_sweep() 的同步包裝。"""
+    return run_coroutine(simulate_sweep(netlist_text, param_sets, **kwargs))
+
+# --- 主程式 (示範) ---
+if __name__ == '__main__':
+    print("正在執行 M15 模組 (Async Scheduler) 示範...")
+
+    # 1. 提交順序與循序執行一致 ('numpy' 後端，不使用快取)
+    demo_params = {
+        'Rdc': 0.05, 'dL3': 2e-9, 'dR4': 200.0, 'dC3': 1e-12, 'dR3': 5.0, 'C1': 2e-12, 'R2': 50.0,
+        'L1': 5e-6, 'L2': 5e-6, 'L3': 5e-6, 'L4': 5e-6, 'Rs1': 3e3, 'Rs2': 3e3, 'Rs3': 3e3, 'Rs4': 3e3,
+        'ck': 0.5e-12, 'Lp': 1e-9
+    }
+    freq_points = np.logspace(6, np.log10(3e9), 401)
+    rng = np.random.default_rng(0)
+    param_sets = [{k: v * 10**rng.uniform(-0.3, 0.3) for k, v in demo_params.items()} for _ in range(16)]
+    from modules.m11_mna_solver import simulate_impedance as simulate_mna
+    sequential = [simulate_mna(p, freq_points)[0] for p in param_sets]
+    start_t = time.perf_counter()
+    results = run_simulate_many(param_sets, freq_points, backend='numpy', use_cache=False)
+    elapsed = (time.perf_counter() - start_t) * 1e3
+    in_order = all(np.allclose(sim_data, expected) for (sim_data, _), expected in zip(results, sequential))
+    print(f"numpy 後端 {len(param_sets)} 組：{elapsed:.1f} ms，結果順序與循序執行一致：{in_order}")
+
+    # 2. 逾時：逾時的工作回傳錯誤，其他工作不受影響
+    sleeper = [sys.executable, '-c', 'import time; time.sleep(30)']
+    quick = [sys.executable, '-c', 'print("ok")']
+
+    async def timeout_demo():
+        return await gather_in_order([run_subprocess(sleeper, 1.0), run_subprocess(quick, 10.0)])
+
+    start_t = time.perf_counter()
+    (slow, slow_error), (fast, _) = run_coroutine(timeout_demo())
+    print(f"逾時工作：{slow_error}；同批正常工作輸出 {fast[1].strip()!r}，總耗時 {time.perf_counter() - start_t:.1f} s")
+
+    # 3. 取消：外層取消時所有子程序都會被終止
+    async def cancel_demo():
+        task = asyncio.ensure_future(gather_in_order([run_subprocess(sleeper, 60) for _ in range(4)]))
+        await asyncio.sleep(1.0)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return True
+        return False
+
+    start_t = time.perf_counter()
+    print(f"取消 4 個執行中的工作：{run_coroutine(cancel_demo())}，耗時 {time.perf_counter() - start_t:.1f} s")
+
+    # 4. 實際 Ngspice 並行執行 (需要 Ngspice)
+    if os.path.exists(m05.NGSPICE_EXECUTABLE_PATH):
+        for sweep in (False, True):
+            m05.NGSPICE_SWEEP_ENABLED = sweep
+            for concurrency in (1, DEFAULT_MAX_CONCURRENCY):
+                start_t = time.perf_counter()
+                results = run_simulate_many(param_sets, freq_points, backend='ngspice', max_concurrency=concurrency, use_cache=False)
+                failures = sum(sim_data is None for sim_data, _ in results)
+                print(f"ngspice 後端 ({'.control 掃描' if sweep else '每組一個程序'})，同時 {concurrency} 個："
+                      f"{time.perf_counter() - start_t:.2f} s，失敗 {failures} 組")
+    else:
+        print(f"找不到 Ngspice ({m05.NGSPICE_EXECUTABLE_PATH})，略過實際 Ngspice 並行測試。")
@@ -0,0 +1,275 @@
+# m16_scratch_space.py
+# -*- coding: utf-8 -*-
+
+"""
+模組 M16: 模擬暫存空間管理
+
+功能：
+1. 每次執行建立一個執行根目錄 (優先放在記憶體檔案系統 /dev/shm，否則使用系統暫存目錄)，
+   每個工作程序在其中擁有私有的子目錄，DE 的多個工作程序不會互相覆寫 Netlist、log 與 rawfile。
+2. 以「槽位」重複使用暫存檔：同一時間一個槽位只屬於一個工作 (具唯一的工作編號)，
+   Netlist 透過該槽位常駐開啟的檔案代號覆寫，不必每次評估都建立與刪除檔案。
+3. 執行結束時一次清除整個執行根目錄；啟動時順便清除已結束程序遺留的目錄。
+4. 子程序 (fork 或 spawn) 透過環境變數 CMFIT_SCRATCH_ROOT 找到同一個執行根目錄；
+   啟動工作程序池前應先呼叫 prepare_scratch()。
+"""
+
+import os
+import re
+import uuid
+import atexit
+import shutil
+import logging
+import tempfile
+import itertools
+import threading
+import multiprocessing.util
+from typing import Optional, List, Dict
+
+# --- 全域設定 ---
+# 暫存空間的候選位置，依序選擇第一個可寫入的目錄 (/dev/shm 為記憶體檔案系統，不佔用磁碟 I/O)
+SCRATCH_BASE_CANDIDATES = ['/dev/shm', tempfile.gettempdir()]
+# 子程序以此環境變數取得本次執行的根目錄
+SCRATCH_ROOT_ENV = 'CMFIT_SCRATCH_ROOT'
+# 執行根目錄名稱前綴，格式為 '{前綴}{擁有者 PID}-{隨機碼}'
+SCRATCH_PREFIX = 'cmfit-'
+
+logger = logging.getLogger(__name__)
+
+_ROOT_NAME_RE = re.compile(rf'^{re.escape(SCRATCH_PREFIX)}(\d+)-[0-9a-f]+$')
+
+def scratch_base() -> str:
+    """回傳第一個可寫入的候選目錄。"""
+    for candidate in SCRATCH_BASE_CANDIDATES:
+        if os.path.isdir(candidate) and os.access(candidate, os.W_OK):
+            return candidate
+    return tempfile.gettempdir()
+
+def _is_process_alive(pid: int) -> bool:
+    if os.name != 'posix':
+        return True  # 非 POSIX 系統無法可靠判斷，一律保留
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def purge_stale_roots(base: Optional[str] = None) -> List[str]:
+    """刪除擁有者程序已結束 (例如當機) 而遺留的執行根目錄，回傳被刪除的路徑。"""
+    base = base or scratch_base()
+    removed = []
+    try:
+        names = os.listdir(base)
+    except OSError:
+        return removed
+    for name in names:
+        match = _ROOT_NAME_RE.match(name)
+        if match and not _is_process_alive(int(match.group(1))):
+            path = os.path.join(base, name)
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(path)
+    if removed:
+        logger.info(f"已清除 {len(removed)} 個遺留的暫存目錄。")
+    return removed
+
+# --- 工作與槽位 ---
+class ScratchJob:
+    """
+    一次模擬使用的暫存檔 (netlist / log / raw)。離開 with 區塊時刪除輸出檔並歸還槽位，
+    以免下一個工作在模擬失敗時誤讀舊的 rawfile。
+    """
+    def __init__(self, space: 'ScratchSpace', slot: int, job_id: str):
+        self.space = space
+        self.slot = slot
+        self.job_id = job_id
+        stem = os.path.join(space.directory, f"slot{slot}")
+        self.netlist_path = f"{stem}.cir"
+        self.log_path = f"{stem}.log"
+        self.raw_path = f"{stem}.raw"
+
+    def write_netlist(self, content: str) -> str:
+        """以槽位常駐的檔案代號覆寫 Netlist，回傳路徑。"""
+        return self.space._write_slot(self.slot, self.netlist_path, content)
+
+    def clear_outputs(self):
+        for path in (self.log_path, self.raw_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"無法刪除暫存檔 '{path}': {e}")
+
+    def release(self):
+        self.space.release(self)
+
+    def __enter__(self) -> 'ScratchJob':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+class ScratchSpace:
+    """
+    單一程序的私有暫存目錄 ('{執行根目錄}/w{PID}')，以槽位管理同時進行的工作。
+    """
+    def __init__(self, root: str):
+        self.root = root
+        self.pid = os.getpid()
+        self.directory = os.path.join(root, f"w{self.pid}")
+        os.makedirs(self.directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.free_slots: List[int] = []
+        self.slot_count = 0
+        self.handles: Dict[int, object] = {}
+        self.job_ids = itertools.count()
+
+    def acquire(self) -> ScratchJob:
+        """取得一個閒置槽位，並配發唯一的工作編號 ('{PID}-{序號}')。"""
+        with self.lock:
+            if self.free_slots:
+                slot = self.free_slots.pop()
+            else:
+                slot = self.slot_count
+                self.slot_count += 1
+            job = ScratchJob(self, slot, f"{self.pid}-{next(self.job_ids)}")
+        job.clear_outputs()
+        return job
+
+    def release(self, job: ScratchJob):
+        job.clear_outputs()
+        with self.lock:
+            self.free_slots.append(job.slot)
+
+    def _write_slot(self, slot: int, path: str, content: str) -> str:
+        handle = self.handles.get(slot)
+        if handle is None or handle.closed or not os.path.exists(path):
+            if handle is not None:
+                handle.close()
+            handle = open(path, 'w', encoding='utf-8')
+            self.handles[slot] = handle
+        handle.seek(0)
+        handle.truncate()
+        handle.write(content)
+        handle.flush()
+        return path
+
+    def cleanup(self):
+        """關閉檔案代號並刪除本程序的私有目錄。"""
+        with self.lock:
+            for handle in self.handles.values():
+                try:
+                    handle.close()
+                except OSError:
+                    pass
+            self.handles.clear()
+            self.free_slots.clear()
+            self.slot_count = 0
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+# --- 執行根目錄與程序內共用的暫存空間 ---
+_SHARED_SPACE: Optional[ScratchSpace] = None
+_OWNED_ROOT: Optional[str] = None
+_OWNER_PID: Optional[int] = None  # fork 會複製全域變數，需以 PID 判斷目前程序是否為擁有者
+_SHARED_LOCK = threading.Lock()
+
+def _run_root() -> str:
+    """取得本次執行的根目錄；尚未建立時由目前程序建立並成為擁有者。"""
+    global _OWNED_ROOT, _OWNER_PID
+    root = os.environ.get(SCRATCH_ROOT_ENV)
+    if root and os.path.isdir(root):
+        return root
+    base = scratch_base()
+    purge_stale_roots(base)
+    root = os.path.join(base, f"{SCRATCH_PREFIX}{os.getpid()}-{uuid.uuid4().hex[:8]}")
+    os.makedirs(root, exist_ok=True)
+    os.environ[SCRATCH_ROOT_ENV] = root
+    if _OWNER_PID != os.getpid():
+        # multiprocessing 的工作程序結束時不會執行 atexit，另以 Finalize 確保清除
+        atexit.register(cleanup_scratch)
+        multiprocessing.util.Finalize(None, cleanup_scratch, exitpriority=10)
+    _OWNED_ROOT, _OWNER_PID = root, os.getpid()
+    logger.info(f"建立模擬暫存目錄: {root}")
+    return root
+
+def get_scratch_space() -> ScratchSpace:
+    """取得 (必要時建立) 目前程序的暫存空間；fork 出的工作程序會建立自己的子目錄。"""
+    global _SHARED_SPACE
+    with _SHARED_LOCK:
+        if _SHARED_SPACE is None or _SHARED_SPACE.pid != os.getpid() or not os.path.isdir(_SHARED_SPACE.directory):
+            _SHARED_SPACE = ScratchSpace(_run_root())
+            if _OWNER_PID != os.getpid():
+                # multiprocessing 的工作程序結束時不會執行 atexit，改以 Finalize 清除自己的子目錄
+                multiprocessing.util.Finalize(None, _SHARED_SPACE.cleanup, exitpriority=10)
+        return _SHARED_SPACE
+
+def prepare_scratch() -> str:
+    """
+    在啟動工作程序池之前呼叫，先建立執行根目錄並寫入環境變數，
+    讓之後 fork / spawn / forkserver 產生的工作程序共用同一個根目錄。
+    """
+    return get_scratch_space().root
+
+def cleanup_scratch():
+    """
+    執行結束時的批次清除：擁有者程序刪除整個執行根目錄，其他程序只刪除自己的子目錄。
+    之後若再取得暫存空間會建立新的根目錄。
+    """
+    global _SHARED_SPACE, _OWNED_ROOT, _OWNER_PID
+    with _SHARED_LOCK:
+        if _SHARED_SPACE is not None and _SHARED_SPACE.pid == os.getpid():
+            _SHARED_SPACE.cleanup()
+        _SHARED_SPACE = None
+        if _OWNER_PID == os.getpid() and _OWNED_ROOT is not None:
+            shutil.rmtree(_OWNED_ROOT, ignore_errors=True)
+            if os.environ.get(SCRATCH_ROOT_ENV) == _OWNED_ROOT:
+                os.environ.pop(SCRATCH_ROOT_ENV, None)
+            logger.info(f"已清除模擬暫存目錄: {_OWNED_ROOT}")
+            _OWNED_ROOT, _OWNER_PID = None, None
+
+# --- 主程式 (示範) ---
+if __name__ == '__main__':
+    import time
+    from concurrent.futures import ProcessPoolExecutor
+
+    print("正在執行 M16 模組 (Scratch Space) 示範...")
+    space = get_scratch_space()
+    print(f"暫存位置: {space.root} (基底 {scratch_base()})")
+
+    # 1. 槽位重複使用：循序的工作共用同一組檔案，同時進行的工作取得不同槽位
+    with space.acquire() as first:
+        with space.acquire() as second:
+            print(f"同時進行的工作：{first.job_id} -> 槽位 {first.slot}，{second.job_id} -> 槽位 {second.slot}")
+    with space.acquire() as third:
+        print(f"歸還後的新工作：{third.job_id} -> 槽位 {third.slot}")
+
+    # 2. 以常駐檔案代號覆寫 Netlist 與每次建立新檔案的比較
+    content = "* demo\n" + "R1 1 0 1k\n" * 200
+    with space.acquire() as job:
+        start_t = time.perf_counter()
+        for _ in range(2000):
+            job.write_netlist(content)
+        reused = (time.perf_counter() - start_t) / 2000
+    start_t = time.perf_counter()
+    for i in range(2000):
+        path = os.path.join(space.directory, f"oneshot_{i}.cir")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.remove(path)
+    oneshot = (time.perf_counter() - start_t) / 2000
+    print(f"覆寫 Netlist：重用檔案代號 {reused * 1e6:.1f} us / 次，建立並刪除檔案 {oneshot * 1e6:.1f} us / 次")
+
+    # 3. 子程序各自取得私有目錄，結束時由擁有者一次清除
+    def worker_directory(_) -> str:
+        with get_scratch_space().acquire() as job:
+            job.write_netlist("* worker\n")
+            return os.path.dirname(job.netlist_path)
+
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        directories = set(executor.map(worker_directory, range(8)))
+    print(f"子程序使用的私有目錄數：{len(directories)}，皆位於同一執行根目錄：{all(d.startswith(space.root) for d in directories)}")
+    print(f"子程序結束後根目錄內容: {sorted(os.listdir(space.root))}")
+    cleanup_scratch()
+    print(f"批次清除後根目錄仍存在：{os.path.exists(space.root)}")
@@ -0,0 +1,233 @@
+# m17_global_sensitivity.py
+# -*- coding: utf-8 -*-
+
+"""
+模組 M17: 全域敏感度分析 (Morris / Sobol)
+
+功能：
+1. Morris 基本效應 (elementary effects)：在 p 階格點上產生 r 條軌跡，每條 D+1 點，
+   估計 μ*、μ 與 σ，μ* 以自助法 (bootstrap) 估計信賴區間。
+2. Saltelli / Sobol 指標：以擾亂的 Sobol 低差異序列產生 A、B 矩陣與 D 個 AB_i 混合矩陣，
+   以 Saltelli (2010) 估計一階指標 S1、Jansen 估計總效應指標 ST，並以自助法估計信賴區間。
+3. 取樣在單位超立方體中進行，再以對數 (或線性) 刻度對應到參數範圍。
+4. run_sensitivity_study()：一開始就產生完整的樣本矩陣，依區塊交給呼叫端的批次評估函式
+   (例如 M02 透過 M15 同時執行的 .control 掃描)；主要指標的信賴區間收斂後提前停止。
+"""
+
+import math
+import logging
+import numpy as np
+from scipy.stats import norm, qmc
+from typing import Optional, List, Dict, Tuple, Callable
+
+# --- 全域設定 ---
+# Morris 格點階數 p (需為偶數，步長 Δ = p / (2(p-1)))
+MORRIS_NUM_LEVELS = 4
+# 自助法重抽次數與信賴水準
+BOOTSTRAP_RESAMPLES = 200
+CONFIDENCE_LEVEL = 0.95
+# 提前停止門檻：主要指標 (Morris μ*、Sobol ST) 的信賴區間半寬 ÷ 最大指標值
+CONVERGENCE_TOLERANCE = 0.1
+# 提前停止前至少要評估的區塊數
+MIN_BLOCKS = 2
+
+logger = logging.getLogger(__name__)
+
+METHODS = ('morris', 'sobol')
+# 各方法用於排序與判斷收斂的主要指標
+PRIMARY_INDEX = {'morris': 'mu_star', 'sobol': 'ST'}
+
+# --- 取樣 ---
+def scale_samples(unit: np.ndarray, bounds: List[Tuple[float, float]], log_scale: bool = True) -> np.ndarray:
+    """將 [0, 1] 的樣本對應到參數範圍；log_scale 時在 log10 空間內均勻分布。"""
+    lower, upper = np.asarray(bounds, dtype=float).T
+    if log_scale:
+        return 10**(np.log10(lower) + unit * (np.log10(upper) - np.log10(lower)))
+    return lower + unit * (upper - lower)
+
+def morris_sample(num_params: int, num_trajectories: int, num_levels: int = MORRIS_NUM_LEVELS,
+                  seed: Optional[int] = None) -> np.ndarray:
+    """
+    產生 Morris 軌跡，回傳 (r, D+1, D) 的單位樣本。每條軌跡自格點上的隨機起點出發，
+    依隨機順序每次只改變一個參數 Δ (方向隨機)，相鄰兩點即為該參數的一個基本效應。
+    """
+    rng = np.random.default_rng(seed)
+    delta = num_levels / (2 * (num_levels - 1))
+    # 起點取在 [0, 1-Δ] 的格點上，x 與 x+Δ 都落在格點內
+    starts = np.arange(num_levels // 2) / (num_levels - 1)
+    trajectories = np.empty((num_trajectories, num_params + 1, num_params))
+    for t in range(num_trajectories):
+        low = rng.choice(starts, size=num_params)
+        increasing = rng.random(num_params) < 0.5
+        point = np.where(increasing, low, low + delta)
+        trajectories[t, 0] = point
+        for k, j in enumerate(rng.permutation(num_params), 1):
+            point = point.copy()
+            point[j] += delta if increasing[j] else -delta
+            trajectories[t, k] = point
+    return trajectories
+
+def saltelli_sample(num_params: int, num_base: int, seed: Optional[int] = None) -> np.ndarray:
+    """
+    產生 Saltelli 樣本，回傳 (N, D+2, D) 的單位樣本：每個基底樣本依序為 A、B、AB_1 … AB_D
+    (AB_i 為 A 的第 i 欄換成 B 的第 i 欄)。N 會進位到 2 的次方以保持 Sobol 序列的均勻性。
+    """
+    m = max(0, math.ceil(math.log2(max(1, num_base))))
+    base = qmc.Sobol(d=2 * num_params, scramble=True, seed=seed).random_base2(m)
+    A, B = base[:, :num_params], base[:, num_params:]
+    design = np.empty((len(base), num_params + 2, num_params))
+    design[:, 0], design[:, 1] = A, B
+    for i in range(num_params):
+        design[:, i + 2] = A
+        design[:, i + 2, i] = B[:, i]
+    return design
+
+# --- 指標估計 ---
+def _bootstrap(statistic: Callable[[np.ndarray], np.ndarray], count: int, seed: Optional[int]) -> np.ndarray:
+    """以重抽的樣本索引重新計算統計量，回傳信賴區間半寬。"""
+    rng = np.random.default_rng(seed)
+    samples = np.array([statistic(rng.integers(0, count, count)) for _ in range(BOOTSTRAP_RESAMPLES)])
+    return norm.ppf(0.5 + CONFIDENCE_LEVEL / 2) * np.nanstd(samples, axis=0, ddof=1)
+
+def morris_indices(trajectories: np.ndarray, outputs: np.ndarray, seed: Optional[int] = None) -> Dict[str, np.ndarray]:
+    """
+    由軌跡樣本 (r, D+1, D) 與輸出 (r, D+1) 計算 Morris 指標；含 NaN 的軌跡會被略過。
+
+    Returns:
+        Dict[str, np.ndarray]: 'mu'、'mu_star'、'sigma'、'mu_star_conf'，各為 (D,)。
+    """
+    valid = np.all(np.isfinite(outputs), axis=1)
+    trajectories, outputs = trajectories[valid], outputs[valid]
+    num_params = trajectories.shape[2]
+    effects = np.empty((len(trajectories), num_params))
+    for t in range(len(trajectories)):
+        steps = np.diff(trajectories[t], axis=0)            # (D, D)，每列只有一個非零元素
+        changed = np.argmax(np.abs(steps), axis=1)
+        effects[t, changed] = np.diff(outputs[t]) / steps[np.arange(num_params), changed]
+
+    if len(effects) < 2:
+        nan = np.full(num_params, np.nan)
+        return {'mu': nan, 'mu_star': nan, 'sigma': nan, 'mu_star_conf': nan}
+    return {
+        'mu': effects.mean(axis=0),
+        'mu_star': np.abs(effects).mean(axis=0),
+        'sigma': effects.std(axis=0, ddof=1),
+        'mu_star_conf': _bootstrap(lambda idx: np.abs(effects[idx]).mean(axis=0), len(effects), seed),
+    }
+
+def _sobol_estimates(outputs: np.ndarray) -> np.ndarray:
+    """回傳 (2, D) 的 [S1, ST]。輸出先扣除平均值，避免大偏移量放大 S1 估計的變異。"""
+    outputs = outputs - np.mean(outputs[:, :2])
+    f_a, f_b, f_ab = outputs[:, 0], outputs[:, 1], outputs[:, 2:]
+    variance = np.var(np.concatenate([f_a, f_b]), ddof=1)
+    if not variance > 0:
+        return np.zeros((2, f_ab.shape[1]))
+    first = np.mean(f_b[:, None] * (f_ab - f_a[:, None]), axis=0) / variance
+    total = 0.5 * np.mean((f_a[:, None] - f_ab)**2, axis=0) / variance
+    return np.vstack([first, total])
+
+def sobol_indices(outputs: np.ndarray, seed: Optional[int] = None) -> Dict[str, np.ndarray]:
+    """
+    由 Saltelli 樣本的輸出 (N, D+2) 計算 Sobol 指標；含 NaN 的基底樣本會被略過。
+
+    Returns:
+        Dict[str, np.ndarray]: 'S1'、'S1_conf'、'ST'、'ST_conf'，各為 (D,)。
+    """
+    outputs = outputs[np.all(np.isfinite(outputs), axis=1)]
+    num_params = outputs.shape[1] - 2
+    if len(outputs) < 2:
+        nan = np.full(num_params, np.nan)
+        return {'S1': nan, 'S1_conf': nan, 'ST': nan, 'ST_conf': nan}
+    first, total = _sobol_estimates(outputs)
+    conf = _bootstrap(lambda idx: _sobol_estimates(outputs[idx]), len(outputs), seed)
+    return {'S1': first, 'S1_conf': conf[0], 'ST': total, 'ST_conf': conf[1]}
+
+def relative_confidence(method: str, indices: Dict[str, np.ndarray]) -> float:
+    """主要指標的最大信賴區間半寬 ÷ 最大指標值，作為收斂判斷依據。"""
+    primary = PRIMARY_INDEX[method]
+    values, conf = indices[primary], indices[f"{primary}_conf"]
+    scale = np.nanmax(np.abs(values)) if np.any(np.isfinite(values)) else np.nan
+    if not scale > 0:
+        return math.inf
+    return float(np.nanmax(conf) / scale)
+
+# --- 分析流程 ---
+def run_sensitivity_study(
+    method: str,
+    num_params: int,
+    evaluate: Callable[[np.ndarray], np.ndarray],
+    max_samples: Optional[int] = None,
+    block_size: Optional[int] = None,
+    tolerance: float = CONVERGENCE_TOLERANCE,
+    seed: Optional[int] = None
+) -> Tuple[Dict[str, np.ndarray], Dict[str, float]]:
+    """
+    執行全域敏感度分析。樣本矩陣一開始即全部產生，再依區塊交給 evaluate 批次評估；
+    每個區塊後重新估計指標，主要指標的相對信賴區間小於 tolerance 時提前停止。
+
+    Args:
+        method (str): 'morris' 或 'sobol'。
+        num_params (int): 參數個數 D。
+        evaluate (Callable): 輸入 (M, D) 單位樣本，回傳 (M,) 輸出 (失敗以 NaN 表示)。
+        max_samples (int): 最多評估的軌跡數 (Morris，預設 64) 或基底樣本數 (Sobol，預設 512)。
+        block_size (int): 每個區塊的軌跡數 / 基底樣本數 (預設 Morris 8、Sobol 64)。
+        tolerance (float): 提前停止門檻。
+        seed (int): 亂數種子。
+
+    Returns:
+        Tuple[Dict[str, np.ndarray], Dict[str, float]]: (指標, 摘要)。摘要包含 'evaluations'、
+        'base_samples'、'relative_confidence' 與 'converged' (1.0 / 0.0)。
+    """
+    if method not in METHODS:
+        raise ValueError(f"不支援的方法 '{method}'，可用方法: {list(METHODS)}")
+    if method == 'morris':
+        design = morris_sample(num_params, max_samples or 64, seed=seed)
+        block_size = block_size or 8
+    else:
+        design = saltelli_sample(num_params, max_samples or 512, seed=seed)
+        block_size = block_size or 64
+    points_per_base = design.shape[1]
+    outputs = np.full(design.shape[:2], np.nan)
+
+    indices, confidence, done = {}, math.inf, 0
+    for block, start in enumerate(range(0, len(design), block_size), 1):
+        stop = min(start + block_size, len(design))
+        values = np.asarray(evaluate(design[start:stop].reshape(-1, num_params)), dtype=float)
+        outputs[start:stop] = values.reshape(stop - start, points_per_base)
+        done = stop
+        if method == 'morris':
+            indices = morris_indices(design[:done], outputs[:done], seed=seed)
+        else:
+            indices = sobol_indices(outputs[:done], seed=seed)
+        confidence = relative_confidence(method, indices)
+        logger.info(f"{method} 區塊 {block}：已評估 {done * points_per_base} 點，相對信賴區間 {confidence:.3f}")
+        if block >= MIN_BLOCKS and confidence < tolerance:
+            logger.info(f"{method} 指標的信賴區間已收斂 (< {tolerance})，提前停止。")
+            break
+
+    summary = {
+        'evaluations': float(done * points_per_base),
+        'base_samples': float(done),
+        'relative_confidence': confidence,
+        'converged': float(confidence < tolerance),
+    }
+    return indices, summary
+
+# --- 主程式 (示範) ---
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - [%(levelname)s] - (%(module)s) - %(message)s')
+    print("正在執行 M17 模組 (Global Sensitivity) 示範...")
+
+    # Ishigami 函數：解析解 S1 ≈ [0.314, 0.442, 0]、ST ≈ [0.558, 0.442, 0.244]
+    def ishigami(unit: np.ndarray) -> np.ndarray:
+        x = -np.pi + 2 * np.pi * unit
+        return np.sin(x[:, 0]) + 7 * np.sin(x[:, 1])**2 + 0.1 * x[:, 2]**4 * np.sin(x[:, 0])
+
+    indices, summary = run_sensitivity_study('sobol', 3, ishigami, max_samples=4096, block_size=256, seed=0)
+    print(f"Sobol S1 = {np.round(indices['S1'], 3)} ± {np.round(indices['S1_conf'], 3)}")
+    print(f"Sobol ST = {np.round(indices['ST'], 3)} ± {np.round(indices['ST_conf'], 3)}")
+    print(f"評估次數 {summary['evaluations']:.0f}，收斂：{bool(summary['converged'])}")
+
+    indices, summary = run_sensitivity_study('morris', 3, ishigami, max_samples=200, block_size=20, seed=0)
+    print(f"Morris μ* = {np.round(indices['mu_star'], 2)} ± {np.round(indices['mu_star_conf'], 2)}，σ = {np.round(indices['sigma'], 2)}")
+    print(f"評估次數 {summary['evaluations']:.0f}，收斂：{bool(summary['converged'])}")
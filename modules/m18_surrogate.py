@@ -0,0 +1,232 @@
+# m18_surrogate.py
+# -*- coding: utf-8 -*-
+
+"""
+模組 M18: 代理模型輔助的全域搜尋
+
+功能：
+1. SurrogateModel：以 RBF 插值 (scipy.interpolate.RBFInterpolator，含平滑項) 擬合已完成的真實模擬
+   (正規化的 log10 參數 → log10 誤差)。新資料加入後由背景執行緒重新訓練，
+   預測一律使用最近一次訓練完成的模型，不會阻塞 DE 的主迴圈。
+2. select_promising()：依預測誤差相對於父代誤差的改善量排序，只挑出每一代最有希望的一部分候選解
+   交給真正的模擬器；其餘候選解由 M03 視為未改善 (不取代父代)。
+3. run_surrogate_benchmark()：在多組量測資料 (例如 801CM、3216CM) 上以相同種子分別執行一般 DE 與
+   代理模型 DE，比較一般 DE 達到相同最終誤差所需的真實模擬次數。
+"""
+
+import os
+import math
+import time
+import logging
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+from scipy.interpolate import RBFInterpolator
+from typing import Optional, List, Dict, Tuple
+
+# --- 全域設定 ---
+# 每一代交給真實模擬器的候選解比例
+SURROGATE_EVAL_FRACTION = 0.1
+# 訓練資料至少需要 (參數數量 + 1) × 此倍數筆才開始篩選
+SURROGATE_MIN_POINTS_FACTOR = 2
+# 只以最近的 N 筆資料訓練 (全域 RBF 的訓練成本為 O(N^3))
+SURROGATE_MAX_POINTS = 600
+# RBF 核函數與平滑項 (log10 誤差帶有模擬雜訊，不做精確插值)
+SURROGATE_KERNEL = 'thin_plate_spline'
+SURROGATE_SMOOTHING = 1e-3
+# 誤差大於等於此值視為模擬失敗 (M03 以 1e10 表示失敗)，不納入訓練
+FAILED_ERROR = 1e10
+
+logger = logging.getLogger(__name__)
+
+class SurrogateModel:
+    """
+    以背景執行緒增量訓練的 RBF 代理模型。參數先取 log10，再依搜尋範圍正規化到 [0, 1]，
+    目標值為 log10(誤差)。
+
+    注意：每一代使用的模型版本取決於背景訓練的進度，因此代理模型模式的 DE 結果不保證可重現。
+    """
+    def __init__(self, lower: np.ndarray, upper: np.ndarray):
+        self.log_lower = np.log10(np.asarray(lower, dtype=float))
+        self.log_span = np.log10(np.asarray(upper, dtype=float)) - self.log_lower
+        self.min_points = SURROGATE_MIN_POINTS_FACTOR * (len(self.log_lower) + 1)
+        self.points: List[np.ndarray] = []
+        self.values: List[np.ndarray] = []
+        self.data_version = 0
+        self.model = None
+        self.trained_version = 0  # 背景執行緒最近處理過的資料版本 (資料不足時也會更新)
+        self.lock = threading.Lock()
+        self.pending = threading.Event()
+        self.stopped = False
+        self.thread = threading.Thread(target=self._train_loop, name='surrogate-trainer', daemon=True)
+        self.thread.start()
+
+    def _normalize(self, params: np.ndarray) -> np.ndarray:
+        return (np.log10(params) - self.log_lower) / self.log_span
+
+    def add(self, params: np.ndarray, errors: np.ndarray):
+        """加入一批真實模擬結果 (params 形狀為 (S, D))，並通知背景執行緒重新訓練。"""
+        errors = np.asarray(errors, dtype=float)
+        valid = np.isfinite(errors) & (errors > 0) & (errors < FAILED_ERROR)
+        if not np.any(valid):
+            return
+        with self.lock:
+            self.points.append(self._normalize(np.asarray(params, dtype=float)[valid]))
+            self.values.append(np.log10(errors[valid]))
+            self.data_version += 1
+        self.pending.set()
+
+    def _train_loop(self):
+        while True:
+            self.pending.wait()
+            self.pending.clear()
+            if self.stopped:
+                return
+            with self.lock:
+                points, values, version = list(self.points), list(self.values), self.data_version
+            model = self._fit(np.vstack(points), np.concatenate(values))
+            with self.lock:
+                if model is not None:
+                    self.model = model
+                self.trained_version = version
+
+    def _fit(self, x: np.ndarray, y: np.ndarray) -> Optional[RBFInterpolator]:
+        x, y = x[-SURROGATE_MAX_POINTS:], y[-SURROGATE_MAX_POINTS:]
+        # RBF 無法處理重複的點，同一點只保留最近一次的結果
+        _, last_index = np.unique(x[::-1], axis=0, return_index=True)
+        keep = np.sort(len(x) - 1 - last_index)
+        if len(keep) < self.min_points:
+            return None
+        try:
+            return RBFInterpolator(x[keep], y[keep], kernel=SURROGATE_KERNEL, smoothing=SURROGATE_SMOOTHING)
+        except (np.linalg.LinAlgError, ValueError) as e:
+            logger.warning(f"代理模型訓練失敗，沿用前一版模型: {e}")
+            return None
+
+    def predict(self, params: np.ndarray) -> Optional[np.ndarray]:
+        """以最近一次訓練完成的模型預測 log10 誤差；尚無模型時回傳 None。"""
+        with self.lock:
+            model = self.model
+        if model is None:
+            return None
+        return model(self._normalize(np.asarray(params, dtype=float)))
+
+    def wait_until_trained(self, timeout: float = 10.0) -> bool:
+        """等待背景執行緒處理完目前所有資料 (示範用)。"""
+        deadline = time.monotonic() + timeout
+        while self.trained_version < self.data_version and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return self.trained_version >= self.data_version
+
+    def close(self):
+        self.stopped = True
+        self.pending.set()
+        self.thread.join(timeout=5)
+
+def select_promising(predicted_log_errors: np.ndarray, parent_errors: np.ndarray,
+                     fraction: float = SURROGATE_EVAL_FRACTION) -> np.ndarray:
+    """
+    DE 的試驗解 i 只與父代 i 競爭，因此依「預測誤差相對於父代誤差的改善量」排序，
+    回傳應交給真實模擬器的候選解索引 (至少一個，依原順序排列)。
+    """
+    count = max(1, int(math.ceil(fraction * len(predicted_log_errors))))
+    improvement = predicted_log_errors - np.log10(np.maximum(parent_errors, 1e-300))
+    return np.sort(np.argsort(improvement, kind='stable')[:count])
+
+# --- 效能比較 ---
+def evaluations_to_reach(errors: List[float], evaluations: List[int], target: float) -> Optional[int]:
+    """回傳歷史中第一次達到 target 誤差時累計的真實模擬次數；始終未達到時回傳 None。"""
+    for error, count in zip(errors, evaluations):
+        if error <= target * (1 + 1e-9):
+            return count
+    return None
+
+def _measured_frame(data_path: str, mode: str, freq_scale: float = 1.0, num_points: int = 401) -> pd.DataFrame:
+    """
+    仿照 M01，將兩欄 (頻率, 阻抗) 的量測檔以對數頻率軸插值；頻率範圍取量測檔本身的範圍，
+    freq_scale 將檔案中的頻率換算為 Hz (例如以 MHz 記錄的檔案為 1e6)。
+    """
+    source = pd.read_csv(data_path, sep=r'\s+', header=None, names=['Frequency', 'Impedance'], engine='python')
+    source['Frequency'] *= freq_scale
+    freq = np.logspace(np.log10(source['Frequency'].min()), np.log10(source['Frequency'].max()), num_points)
+    return pd.DataFrame({'Frequency_Hz': freq, f'Z_{mode}': np.interp(freq, source['Frequency'], source['Impedance'])})
+
+def run_surrogate_benchmark(data_paths: List[str], param_bounds: Dict[str, Tuple[float, float]], mode: str = 'CM',
+                            maxiter: int = 100, popsize: int = 10, seed: int = 0, backend: Optional[str] = None,
+                            fraction: float = SURROGATE_EVAL_FRACTION, freq_scales: Optional[List[float]] = None) -> pd.DataFrame:
+    """
+    在每組量測資料上以相同設定與種子分別執行一般 DE 與代理模型 DE，回傳比較表：
+    代理模型的最終誤差與真實模擬次數、一般 DE 第一次達到相同誤差時的真實模擬次數，以及節省倍數。
+    freq_scales: 各量測檔頻率欄換算為 Hz 的倍數，預設皆為 1。
+    """
+    from modules.m03_global_search import global_search_optimization, last_search_statistics
+
+    rows = []
+    for data_path, freq_scale in zip(data_paths, freq_scales or [1.0] * len(data_paths)):
+        dataset = os.path.splitext(os.path.basename(data_path))[0]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            measured_path = os.path.join(tmp_dir, 'measured.csv')
+            _measured_frame(data_path, mode, freq_scale).to_csv(measured_path, index=False)
+            runs = {}
+            for surrogate in (False, True):
+                global_search_optimization(param_bounds, mode=mode, maxiter=maxiter, popsize=popsize, tol=0.0,
+                                           backend=backend, vectorized=True, seed=seed, checkpoint_every=None,
+                                           surrogate=surrogate, surrogate_fraction=fraction,
+                                           measured_data_path=measured_path)
+                runs[surrogate] = last_search_statistics()
+        plain, assisted = runs[False], runs[True]
+        target = assisted['errors'][-1]
+        surrogate_evals = assisted['evaluations'][-1]
+        plain_evals = evaluations_to_reach(plain['errors'], plain['evaluations'], target)
+        rows.append({
+            'dataset': dataset,
+            'final_error': target,
+            'surrogate_evaluations': surrogate_evals,
+            'plain_evaluations': plain_evals if plain_evals is not None else plain['evaluations'][-1],
+            'plain_reached': plain_evals is not None,
+            'plain_final_error': plain['errors'][-1],
+            'saving_factor': (plain_evals / surrogate_evals) if plain_evals is not None else np.nan,
+        })
+        logger.info(f"{dataset}: 代理模型以 {surrogate_evals} 次真實模擬達到誤差 {target:.6f}；"
+                    f"一般 DE {'需要 ' + str(plain_evals) + ' 次' if plain_evals is not None else '在相同代數內未達到'}")
+    return pd.DataFrame(rows)
+
+# --- 主程式 (示範) ---
+if __name__ == '__main__':
+    import sys
+    project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    if project_root not in sys.path:
+        sys.path.insert(0, project_root)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - [%(levelname)s] - (%(module)s) - %(message)s')
+    print("正在執行 M18 模組 (Surrogate) 示範...")
+
+    # 1. 代理模型在二次函數上的排序能力
+    rng = np.random.default_rng(0)
+    lower, upper = np.full(4, 1e-3), np.full(4, 1e3)
+    surrogate = SurrogateModel(lower, upper)
+    truth = lambda p: 1e-3 + np.sum(np.log10(p) ** 2, axis=1)
+    samples = 10 ** rng.uniform(-3, 3, size=(200, 4))
+    surrogate.add(samples, truth(samples))
+    surrogate.wait_until_trained()
+    candidates = 10 ** rng.uniform(-3, 3, size=(40, 4))
+    chosen = select_promising(surrogate.predict(candidates), np.ones(40), fraction=0.25)
+    best_true = np.argsort(truth(candidates))[:10]
+    print(f"真實最佳 10 個候選解中被代理模型選中：{len(set(chosen) & set(best_true))} 個")
+    surrogate.close()
+
+    # 2. 801CM / 3216CM 上與一般 DE 比較真實模擬次數 ('numpy' 後端)
+    data_dir = os.path.join(project_root, 'data')
+    datasets = [os.path.join(data_dir, name) for name in ('801CM.txt', '3216CM.txt')]
+    freq_scales = [1.0, 1e6]  # 801CM 的頻率單位為 Hz，3216CM 為 MHz
+    demo_params = {
+        'Rdc': 0.05, 'dL3': 2e-9, 'dR4': 200.0, 'dC3': 1e-12, 'dR3': 5.0, 'C1': 2e-12, 'R2': 50.0,
+        'L1': 5e-6, 'L2': 5e-6, 'L3': 5e-6, 'L4': 5e-6, 'Rs1': 3e3, 'Rs2': 3e3, 'Rs3': 3e3, 'Rs4': 3e3,
+        'ck': 0.5e-12, 'Lp': 1e-9
+    }
+    bounds = {name: (value / 10, value * 10) for name, value in demo_params.items()}
+    if all(os.path.exists(path) for path in datasets):
+        table = run_surrogate_benchmark(datasets, bounds, maxiter=60, popsize=8, backend='numpy', freq_scales=freq_scales)
+        print(table.to_string(index=False))
+    else:
+        print(f"找不到量測資料 {datasets}，略過比較。")
@@ -0,0 +1,591 @@
+# m19_global_optimizers.py
+# -*- coding: utf-8 -*-
+
+"""
+模組 M19: 可替換的全域最佳化引擎
+
+功能：
+1. GlobalOptimizer 介面：solve() 執行搜尋並回傳 OptimizeResult，每代結束時以與 SciPy 相同格式的
+   intermediate_result (x、fun、nit、nfev、convergence、population、population_energies) 呼叫 callback，
+   M03 的歷史紀錄 (M23 的 history_* 目錄) 與檢查點因此不必依引擎修改；
+   capture_state() / restore_state() 提供檢查點所需的完整狀態。
+2. 'de'：包裝 SciPy 的 DifferentialEvolutionSolver (best1bin、deferred 更新)，即 M03 原本的搜尋方式。
+3. 'cmaes'：(μ/μ_w, λ)-CMA-ES，在依範圍正規化到 [0, 1] 的 log10 參數空間中搜尋，
+   以 ask/tell 迴圈每代將整批樣本交給批次評估函式；超出範圍的樣本以修補後的點評估並加上二次懲罰。
+4. create_optimizer()：依名稱由 GLOBAL_OPTIMIZERS 建立引擎。
+5. NSGA2Optimizer：多目標 NSGA-II (非支配排序 + 擁擠距離)，objective_batch 回傳每個樣本的多個目標值，
+   每代整批交給批次評估；另維護一個有大小上限的 Pareto 存檔 (歷來所有非支配解)。
+   多目標引擎不列入 GLOBAL_OPTIMIZERS，由 M03 的 pareto_search_optimization() 直接使用。
+"""
+
+import json
+import math
+import inspect
+import logging
+import numpy as np
+from scipy.optimize import OptimizeResult
+# 直接使用 DE 求解器物件 (differential_evolution 的內部實作)，才能存取並還原族群、隨機狀態等檢查點所需的狀態
+from scipy.optimize._differentialevolution import DifferentialEvolutionSolver
+from typing import Optional, List, Dict, Tuple, Any, Callable
+
+# --- 全域設定 ---
+# CMA-ES 初始步長 (相對於正規化後的 [0, 1] 範圍)
+CMAES_SIGMA0 = 0.3
+# 超出範圍的二次懲罰係數 (乘上與範圍的距離平方)
+CMAES_BOUND_PENALTY = 1.0
+# 步長 σ·sqrt(max C_ii) 小於此值時視為收斂
+CMAES_TOLX = 1e-11
+# 共變異數矩陣條件數上限，超過時視為數值退化而停止
+CMAES_MAX_CONDITION = 1e14
+# NSGA-II 的 SBX 交配機率與分佈指數、多項式突變的分佈指數 (Deb 等人建議的預設值)
+NSGA2_CROSSOVER_PROB = 0.9
+NSGA2_CROSSOVER_ETA = 15.0
+NSGA2_MUTATION_ETA = 20.0
+# Pareto 存檔的大小上限，超過時依擁擠距離剔除最擁擠的解
+NSGA2_ARCHIVE_SIZE = 200
+
+logger = logging.getLogger(__name__)
+
+# --- SciPy DifferentialEvolutionSolver 相容層 ---
+# DE 引擎用到的 SciPy 私有介面全部集中於此，依版本檢查後使用 (requirements.txt 固定 scipy==1.13.1，較新版本亦可執行)。
+# DifferentialEvolutionSolver 的隨機數參數在較新的 SciPy 由 seed 改名為 rng
+_DE_RNG_KEYWORD = 'rng' if 'rng' in inspect.signature(DifferentialEvolutionSolver.__init__).parameters else 'seed'
+# 較新的 SciPy 在各代之間保留選取候選解用的洗牌索引；1.13 每次選取時以區域陣列重新洗牌，狀態全在隨機數產生器中
+_DE_SHUFFLE_ATTR = '_random_population_index'
+
+def _de_private_state(solver: DifferentialEvolutionSolver) -> Dict[str, Any]:
+    """求解器在各代之間保留、不屬於公開屬性的狀態 (目前版本沒有的項目不記錄)。"""
+    state = {}
+    if hasattr(solver, _DE_SHUFFLE_ATTR):
+        state['random_population_index'] = getattr(solver, _DE_SHUFFLE_ATTR).tolist()
+    if hasattr(solver, '_nfev'):
+        state['nfev'] = int(solver._nfev)
+    return state
+
+def _de_restore_private_state(solver: DifferentialEvolutionSolver, state: Dict[str, Any]):
+    if hasattr(solver, _DE_SHUFFLE_ATTR):
+        if 'random_population_index' in state:
+            setattr(solver, _DE_SHUFFLE_ATTR, np.array(state['random_population_index'], dtype=int))
+        else:
+            # 檢查點來自沒有洗牌索引的 SciPy 版本：依目前版本的初始值重建，續跑仍可執行但不保證與未中斷時相同
+            setattr(solver, _DE_SHUFFLE_ATTR, np.arange(len(solver.population)))
+    if hasattr(solver, '_nfev') and 'nfev' in state:
+        solver._nfev = state['nfev']
+
+def _de_rescore_population(solver: DifferentialEvolutionSolver, evaluate: Callable, bounds: List[Tuple[float, float]]):
+    """
+    重新計算整個族群的能量並把最佳解移到第 0 個位置 (求解器以 population[0] 為 best)。
+    有 SciPy 的私有方法時使用之 (同時累計 nfev)，否則以 evaluate (輸入 (D, S) 實際參數) 自行計算。
+    """
+    if hasattr(solver, '_calculate_population_energies') and hasattr(solver, '_promote_lowest_energy'):
+        solver.population_energies = solver._calculate_population_energies(solver.population)
+        solver._promote_lowest_energy()
+        return
+    lower, upper = np.array(bounds, dtype=float).T
+    energies = np.asarray(evaluate((lower + solver.population * (upper - lower)).T), dtype=float)
+    best = int(np.argmin(energies))
+    solver.population[[0, best]] = solver.population[[best, 0]]
+    energies[[0, best]] = energies[[best, 0]]
+    solver.population_energies = energies
+
+class GlobalOptimizer:
+    """
+    全域最佳化引擎的共同介面。
+
+    Args:
+        objective_batch: 批次目標函式，輸入形狀 (D, S) 的參數矩陣，回傳 S 個誤差。
+        objective: 單點目標函式 (僅 DE 的非 vectorized 模式使用)。
+        bounds: 各參數的 (下限, 上限)。
+        rng: 隨機數產生器，其狀態由 capture_state() 一併保存。
+        callback: 每代結束時以 intermediate_result 呼叫。
+    """
+    name = ''
+    display_name = ''
+
+    def __init__(self, objective_batch: Callable, bounds: List[Tuple[float, float]], maxiter: int, popsize: int, tol: float,
+                 rng: np.random.Generator, callback: Optional[Callable] = None, objective: Optional[Callable] = None,
+                 vectorized: bool = True):
+        self.objective_batch = objective_batch
+        self.objective = objective
+        self.bounds = bounds
+        self.maxiter = maxiter
+        self.popsize = popsize
+        self.tol = tol
+        self.rng = rng
+        self.callback = callback
+        self.vectorized = vectorized
+        self.rescored = False
+
+    def solve(self) -> OptimizeResult:
+        raise NotImplementedError
+
+    def rescore(self):
+        """
+        目標函式改變 (例如 M20 提高頻率解析度) 後，以新的目標函式重新評估目前保留的解，
+        避免舊誤差與新誤差互相比較。於 callback 中呼叫；該代以舊誤差判斷的收斂條件不再適用。
+        """
+        raise NotImplementedError
+
+    def capture_state(self) -> Dict[str, Any]:
+        """回傳可 JSON 序列化的完整搜尋狀態 (含隨機數產生器)。"""
+        raise NotImplementedError
+
+    def restore_state(self, state: Dict[str, Any]) -> Optional[str]:
+        """還原 capture_state() 的結果；與目前設定不相容時回傳錯誤訊息。"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self) -> 'GlobalOptimizer':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+# --- 差分演化 ---
+class DifferentialEvolutionOptimizer(GlobalOptimizer):
+    """SciPy 差分演化 (best1bin、deferred 更新)；非 vectorized 模式以 workers=-1 多程序評估。"""
+    name = 'de'
+    display_name = 'Differential Evolution'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.solver = DifferentialEvolutionSolver(
+            self.objective_batch if self.vectorized else self.objective,
+            self.bounds,
+            strategy='best1bin',
+            maxiter=self.maxiter,
+            popsize=self.popsize,
+            tol=self.tol,
+            mutation=(0.5, 1),
+            recombination=0.7,
+            updating='deferred',
+            workers=1 if self.vectorized else -1,
+            vectorized=self.vectorized,
+            callback=self.callback,
+            **{_DE_RNG_KEYWORD: self.rng}
+        )
+
+    def solve(self) -> OptimizeResult:
+        return self.solver.solve()
+
+    def rescore(self):
+        # SciPy 在 callback 之後才以 population_energies 判斷收斂，更新後即以新誤差判斷
+        if self.vectorized:
+            evaluate = self.objective_batch
+        else:
+            evaluate = lambda params: np.array([self.objective(column) for column in params.T])
+        _de_rescore_population(self.solver, evaluate, self.bounds)
+
+    def capture_state(self) -> Dict[str, Any]:
+        """
+        除了族群與能量外，較新的 SciPy 在各代之間還保留了選取候選解用的洗牌索引 (見相容層)，
+        連同隨機數產生器的狀態一起還原，續跑的結果才會與未中斷的執行完全相同。
+        """
+        solver = self.solver
+        return {
+            'population': solver.population.tolist(),  # [0, 1] 正規化後的族群
+            'population_energies': solver.population_energies.tolist(),
+            'rng_state': self.rng.bit_generator.state,
+            **_de_private_state(solver),
+        }
+
+    def restore_state(self, state: Dict[str, Any]) -> Optional[str]:
+        solver = self.solver
+        population = np.array(state['population'], dtype=float)
+        if population.shape != solver.population.shape:
+            return f"檢查點的族群形狀 {population.shape} 與目前設定 {solver.population.shape} 不符 (popsize 或參數數量不同)。"
+        solver.population = population
+        solver.population_energies = np.array(state['population_energies'], dtype=float)
+        solver.feasible = np.ones(len(population), dtype=bool)
+        solver.constraint_violation = np.zeros((len(population), 1))
+        _de_restore_private_state(solver, state)
+        self.rng.bit_generator.state = state['rng_state']
+        return None
+
+    def close(self):
+        # 關閉 workers=-1 時建立的程序池
+        self.solver.__exit__(None, None, None)
+
+# --- CMA-ES ---
+class CMAESOptimizer(GlobalOptimizer):
+    """
+    (μ/μ_w, λ)-CMA-ES (Hansen, "The CMA Evolution Strategy: A Tutorial", 2016)。
+    每代樣本數 λ = max(popsize, 4 + ⌊3 ln D⌋)；搜尋變數為 log10 參數依範圍正規化到 [0, 1]，
+    L/C 等相差數個數量級的參數因此具有相同的尺度，參數間的相關性則由共變異數矩陣學習。
+    """
+    name = 'cmaes'
+    display_name = 'CMA-ES'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        lower, upper = np.array(self.bounds, dtype=float).T
+        self.log_lower = np.log10(lower)
+        self.log_span = np.log10(upper) - self.log_lower
+        n = len(self.bounds)
+        self.dimension = n
+        self.lam = max(int(self.popsize), 4 + int(3 * math.log(n)))
+        self.mu = self.lam // 2
+        weights = math.log(self.mu + 0.5) - np.log(np.arange(1, self.mu + 1))
+        self.weights = weights / weights.sum()
+        self.mueff = 1.0 / np.sum(self.weights ** 2)
+        self.cc = (4 + self.mueff / n) / (n + 4 + 2 * self.mueff / n)
+        self.cs = (self.mueff + 2) / (n + self.mueff + 5)
+        self.c1 = 2 / ((n + 1.3) ** 2 + self.mueff)
+        self.cmu = min(1 - self.c1, 2 * (self.mueff - 2 + 1 / self.mueff) / ((n + 2) ** 2 + self.mueff))
+        self.damps = 1 + 2 * max(0.0, math.sqrt((self.mueff - 1) / (n + 1)) - 1) + self.cs
+        self.chi_n = math.sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n ** 2))
+        # 動態狀態 (檢查點保存的內容)
+        self.mean = np.full(n, 0.5)
+        self.sigma = CMAES_SIGMA0
+        self.cov = np.eye(n)
+        self.pc = np.zeros(n)
+        self.ps = np.zeros(n)
+        self.basis = np.eye(n)
+        self.scales = np.ones(n)
+        self.eigen_eval = 0
+        self.nfev = 0
+        self.best_x = None
+        self.best_f = np.inf
+
+    def _to_params(self, unit: np.ndarray) -> np.ndarray:
+        return 10 ** (self.log_lower + unit * self.log_span)
+
+    def ask(self) -> np.ndarray:
+        """產生 λ 個正規化空間中的樣本 (λ, D)。"""
+        z = self.rng.standard_normal((self.lam, self.dimension))
+        return self.mean + self.sigma * (z * self.scales) @ self.basis.T
+
+    def evaluate(self, samples: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """以批次目標函式評估整代樣本，回傳 (誤差, 含越界懲罰的適應值)。"""
+        repaired = np.clip(samples, 0.0, 1.0)
+        errors = np.asarray(self.objective_batch(self._to_params(repaired).T), dtype=float)
+        self.nfev += len(samples)
+        penalty = CMAES_BOUND_PENALTY * np.sum((samples - repaired) ** 2, axis=1)
+        return errors, errors + penalty
+
+    def tell(self, samples: np.ndarray, fitness: np.ndarray):
+        """依適應值排序更新平均、演化路徑、共變異數矩陣與步長。"""
+        n = self.dimension
+        order = np.argsort(fitness, kind='stable')
+        selected = samples[order[:self.mu]]
+        old_mean = self.mean
+        self.mean = self.weights @ selected
+        step = (self.mean - old_mean) / self.sigma
+        inv_sqrt_cov = self.basis @ np.diag(1 / self.scales) @ self.basis.T
+        self.ps = (1 - self.cs) * self.ps + math.sqrt(self.cs * (2 - self.cs) * self.mueff) * inv_sqrt_cov @ step
+        generations = self.nfev / self.lam
+        hsig = (np.linalg.norm(self.ps) / math.sqrt(1 - (1 - self.cs) ** (2 * generations)) / self.chi_n) < 1.4 + 2 / (n + 1)
+        self.pc = (1 - self.cc) * self.pc + hsig * math.sqrt(self.cc * (2 - self.cc) * self.mueff) * step
+        deviations = (selected - old_mean) / self.sigma
+        self.cov = ((1 - self.c1 - self.cmu) * self.cov
+                    + self.c1 * (np.outer(self.pc, self.pc) + (1 - hsig) * self.cc * (2 - self.cc) * self.cov)
+                    + self.cmu * deviations.T @ np.diag(self.weights) @ deviations)
+        self.sigma *= math.exp((self.cs / self.damps) * (np.linalg.norm(self.ps) / self.chi_n - 1))
+        # 特徵分解的成本為 O(D^3)，依 Hansen 的建議每隔數代才更新一次
+        if self.nfev - self.eigen_eval > self.lam / (self.c1 + self.cmu) / n / 10:
+            self.eigen_eval = self.nfev
+            self.cov = np.triu(self.cov) + np.triu(self.cov, 1).T
+            eigenvalues, self.basis = np.linalg.eigh(self.cov)
+            self.scales = np.sqrt(np.maximum(eigenvalues, 1e-20))
+
+    def rescore(self):
+        # 只有歷來最佳解跨代保留；重新評估時不計入 nfev，以免改變步長調整所用的代數
+        if self.best_x is not None:
+            self.best_f = float(np.asarray(self.objective_batch(self._to_params(self.best_x)[:, None]), dtype=float)[0])
+        self.rescored = True
+
+    def _stop_message(self, errors: np.ndarray) -> Optional[str]:
+        if np.all(np.isfinite(errors)) and np.std(errors) <= self.tol * np.abs(np.mean(errors)):
+            return 'Optimization terminated successfully.'
+        if self.sigma * math.sqrt(np.max(np.diag(self.cov))) < CMAES_TOLX:
+            return 'Step size below tolerance.'
+        if np.max(self.scales) ** 2 > CMAES_MAX_CONDITION * np.min(self.scales) ** 2:
+            return 'Covariance matrix condition number exceeded.'
+        return None
+
+    def solve(self) -> OptimizeResult:
+        message, success, nit = 'Maximum number of iterations has been exceeded.', False, 0
+        for nit in range(1, self.maxiter + 1):
+            samples = self.ask()
+            errors, fitness = self.evaluate(samples)
+            best = int(np.argmin(errors))
+            if errors[best] < self.best_f:
+                self.best_f, self.best_x = float(errors[best]), np.clip(samples[best], 0.0, 1.0)
+            self.tell(samples, fitness)
+            stop = self._stop_message(errors)
+            self.rescored = False
+            if self.callback:
+                spread = np.std(errors) / (np.abs(np.mean(errors)) + np.finfo(float).eps)
+                intermediate = OptimizeResult(
+                    x=self._to_params(self.best_x), fun=self.best_f, nit=nit, nfev=self.nfev,
+                    convergence=self.tol / (spread + np.finfo(float).eps),
+                    population=self._to_params(np.clip(samples, 0.0, 1.0)), population_energies=errors,
+                )
+                if self.callback(intermediate_result=intermediate):
+                    message = 'callback function requested stop early'
+                    break
+            if stop and not self.rescored:
+                message, success = stop, True
+                break
+        return OptimizeResult(x=self._to_params(self.best_x), fun=self.best_f, nit=nit, nfev=self.nfev,
+                              success=success, message=message)
+
+    def capture_state(self) -> Dict[str, Any]:
+        return {
+            'mean': self.mean.tolist(), 'sigma': self.sigma, 'cov': self.cov.tolist(),
+            'pc': self.pc.tolist(), 'ps': self.ps.tolist(), 'basis': self.basis.tolist(), 'scales': self.scales.tolist(),
+            'eigen_eval': self.eigen_eval, 'nfev': self.nfev, 'lam': self.lam,
+            'best_x': None if self.best_x is None else self.best_x.tolist(), 'best_f': self.best_f,
+            'rng_state': self.rng.bit_generator.state,
+        }
+
+    def restore_state(self, state: Dict[str, Any]) -> Optional[str]:
+        if state.get('lam') != self.lam or len(state['mean']) != self.dimension:
+            return f"檢查點的樣本數或參數數量與目前設定不符 (λ={state.get('lam')}，目前 {self.lam})。"
+        self.mean, self.sigma = np.array(state['mean']), float(state['sigma'])
+        self.cov, self.pc, self.ps = np.array(state['cov']), np.array(state['pc']), np.array(state['ps'])
+        self.basis, self.scales = np.array(state['basis']), np.array(state['scales'])
+        self.eigen_eval, self.nfev = state['eigen_eval'], state['nfev']
+        self.best_x = None if state['best_x'] is None else np.array(state['best_x'])
+        self.best_f = float(state['best_f'])
+        self.rng.bit_generator.state = state['rng_state']
+        return None
+
+GLOBAL_OPTIMIZERS = {cls.name: cls for cls in (DifferentialEvolutionOptimizer, CMAESOptimizer)}
+
+# --- 多目標 NSGA-II ---
+def non_dominated_sort(objectives: np.ndarray) -> np.ndarray:
+    """
+    非支配排序 (Deb et al., "A Fast and Elitist Multiobjective Genetic Algorithm: NSGA-II", 2002)：
+    objectives 為 (N, M)，回傳每個解所屬的前緣編號 (0 為非支配前緣)。
+    """
+    objectives = np.asarray(objectives, dtype=float)
+    # dominates[i, j]：解 i 支配解 j (每個目標都不差且至少一個較好)
+    dominates = (np.all(objectives[:, None, :] <= objectives[None, :, :], axis=2)
+                 & np.any(objectives[:, None, :] < objectives[None, :, :], axis=2))
+    dominated_count = dominates.sum(axis=0)
+    ranks = np.full(len(objectives), -1)
+    front = np.flatnonzero(dominated_count == 0)
+    rank = 0
+    while len(front):
+        ranks[front] = rank
+        dominated_count -= dominates[front].sum(axis=0)
+        dominated_count[ranks >= 0] = -1
+        front = np.flatnonzero(dominated_count == 0)
+        rank += 1
+    return ranks
+
+def crowding_distance(objectives: np.ndarray) -> np.ndarray:
+    """同一前緣內各解的擁擠距離：各目標上相鄰兩解的正規化間距總和，兩端的解為無限大。"""
+    objectives = np.asarray(objectives, dtype=float)
+    count = len(objectives)
+    distance = np.zeros(count)
+    if count <= 2:
+        return np.full(count, np.inf)
+    for column in objectives.T:
+        order = np.argsort(column, kind='stable')
+        span = column[order[-1]] - column[order[0]]
+        distance[order[0]] = distance[order[-1]] = np.inf
+        if span > 0:
+            distance[order[1:-1]] += (column[order[2:]] - column[order[:-2]]) / span
+    return distance
+
+def _rank_and_crowding(objectives: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """回傳 (前緣編號, 所屬前緣內的擁擠距離)。"""
+    ranks = non_dominated_sort(objectives)
+    crowding = np.zeros(len(objectives))
+    for rank in np.unique(ranks):
+        members = np.flatnonzero(ranks == rank)
+        crowding[members] = crowding_distance(objectives[members])
+    return ranks, crowding
+
+class NSGA2Optimizer(GlobalOptimizer):
+    """
+    NSGA-II：每代以二元競賽 (前緣編號優先、擁擠距離次之) 選出親代，SBX 交配與多項式突變產生同樣數量的子代，
+    親子合併後依前緣與擁擠距離保留 N 個解。搜尋變數與 CMA-ES 相同，為依範圍正規化到 [0, 1] 的 log10 參數。
+    族群大小 N = popsize × D (與 DE 相同，取偶數)；NSGA-II 沒有單一誤差的收斂條件，固定執行 maxiter 代 (tol 不使用)。
+
+    Args:
+        objective_batch: 輸入 (D, S) 參數矩陣，回傳 (S, M) 的目標值 (越小越好)。
+        scalarize: 將 (S, M) 目標值合併為 S 個純量誤差的函式，用於 intermediate_result 的 x / fun /
+                   population_energies (沿用單目標引擎的歷史紀錄格式)；預設為各目標的均方根。
+        archive_size: Pareto 存檔的大小上限。
+    """
+    name = 'nsga2'
+    display_name = 'NSGA-II'
+
+    def __init__(self, *args, scalarize: Optional[Callable] = None, archive_size: int = NSGA2_ARCHIVE_SIZE, **kwargs):
+        super().__init__(*args, **kwargs)
+        lower, upper = np.array(self.bounds, dtype=float).T
+        self.log_lower = np.log10(lower)
+        self.log_span = np.log10(upper) - self.log_lower
+        self.dimension = len(self.bounds)
+        self.size = max(4, int(self.popsize) * self.dimension)
+        self.size += self.size % 2
+        self.scalarize = scalarize or (lambda objectives: np.sqrt(np.mean(objectives ** 2, axis=1)))
+        self.archive_size = archive_size
+        self.mutation_prob = 1.0 / self.dimension
+        self.population = None
+        self.objectives = None
+        self.archive_x = np.empty((0, self.dimension))
+        self.archive_f = None
+        self.nfev = 0
+
+    def _to_params(self, unit: np.ndarray) -> np.ndarray:
+        return 10 ** (self.log_lower + unit * self.log_span)
+
+    def evaluate(self, samples: np.ndarray) -> np.ndarray:
+        """以批次目標函式評估 (S, D) 的正規化樣本，回傳 (S, M) 目標值；非有限值視為最差。"""
+        objectives = np.atleast_2d(np.asarray(self.objective_batch(self._to_params(samples).T), dtype=float))
+        self.nfev += len(samples)
+        objectives[~np.isfinite(objectives)] = np.finfo(float).max
+        return objectives
+
+    def initial_population(self) -> np.ndarray:
+        """拉丁超立方取樣的初始族群 (與 SciPy DE 的預設初始化相同)。"""
+        segments = (self.rng.uniform(size=(self.size, self.dimension)) + np.arange(self.size)[:, None]) / self.size
+        return np.column_stack([self.rng.permutation(column) for column in segments.T])
+
+    def select_parents(self, ranks: np.ndarray, crowding: np.ndarray) -> np.ndarray:
+        """二元競賽選出 N 個親代索引。"""
+        first, second = self.rng.integers(len(ranks), size=(2, self.size))
+        better = (ranks[first] < ranks[second]) | ((ranks[first] == ranks[second]) & (crowding[first] > crowding[second]))
+        return np.where(better, first, second)
+
+    def variation(self, parents: np.ndarray) -> np.ndarray:
+        """SBX 交配與多項式突變 (Deb & Agrawal, 1995)，子代截斷於 [0, 1]。"""
+        mothers, fathers = parents[0::2], parents[1::2]
+        u = self.rng.uniform(size=mothers.shape)
+        beta = np.where(u <= 0.5, (2 * u) ** (1 / (NSGA2_CROSSOVER_ETA + 1)),
+                        (1 / (2 * (1 - u))) ** (1 / (NSGA2_CROSSOVER_ETA + 1)))
+        # 每對親代以 NSGA2_CROSSOVER_PROB 的機率交配，交配時每個變數再各以 1/2 的機率交換
+        crossed = ((self.rng.uniform(size=(len(mothers), 1)) < NSGA2_CROSSOVER_PROB)
+                   & (self.rng.uniform(size=mothers.shape) < 0.5))
+        beta = np.where(crossed, beta, 1.0)
+        children = np.vstack([0.5 * ((1 + beta) * mothers + (1 - beta) * fathers),
+                              0.5 * ((1 - beta) * mothers + (1 + beta) * fathers)])
+        u = self.rng.uniform(size=children.shape)
+        delta = np.where(u < 0.5, (2 * u) ** (1 / (NSGA2_MUTATION_ETA + 1)) - 1,
+                         1 - (2 * (1 - u)) ** (1 / (NSGA2_MUTATION_ETA + 1)))
+        mutated = self.rng.uniform(size=children.shape) < self.mutation_prob
+        return np.clip(children + mutated * delta, 0.0, 1.0)
+
+    def update_archive(self, samples: np.ndarray, objectives: np.ndarray):
+        """將新的解併入 Pareto 存檔，只保留非支配且不重複的解；超過上限時逐一剔除擁擠距離最小者。"""
+        archive_x = np.vstack([self.archive_x, samples])
+        archive_f = objectives if self.archive_f is None else np.vstack([self.archive_f, objectives])
+        front = np.flatnonzero(non_dominated_sort(archive_f) == 0)
+        _, unique = np.unique(archive_f[front], axis=0, return_index=True)
+        keep = front[np.sort(unique)]
+        while len(keep) > self.archive_size:
+            keep = np.delete(keep, np.argmin(crowding_distance(archive_f[keep])))
+        self.archive_x, self.archive_f = archive_x[keep], archive_f[keep]
+
+    def _intermediate(self, nit: int) -> OptimizeResult:
+        archive_scores = self.scalarize(self.archive_f)
+        best = int(np.argmin(archive_scores))
+        return OptimizeResult(
+            x=self._to_params(self.archive_x[best]), fun=float(archive_scores[best]), nit=nit, nfev=self.nfev,
+            convergence=0.0, population=self._to_params(self.population),
+            population_energies=self.scalarize(self.objectives), population_objectives=self.objectives,
+            archive_x=self._to_params(self.archive_x), archive_f=self.archive_f,
+        )
+
+    def solve(self) -> OptimizeResult:
+        self.population = self.initial_population()
+        self.objectives = self.evaluate(self.population)
+        self.update_archive(self.population, self.objectives)
+        message, nit = 'Maximum number of generations reached.', 0
+        for nit in range(1, self.maxiter + 1):
+            ranks, crowding = _rank_and_crowding(self.objectives)
+            offspring = self.variation(self.population[self.select_parents(ranks, crowding)])
+            offspring_objectives = self.evaluate(offspring)
+            self.update_archive(offspring, offspring_objectives)
+            merged_x = np.vstack([self.population, offspring])
+            merged_f = np.vstack([self.objectives, offspring_objectives])
+            ranks, crowding = _rank_and_crowding(merged_f)
+            # 依前緣編號由小到大、同前緣內擁擠距離由大到小保留 N 個解
+            survivors = np.lexsort((-crowding, ranks))[:self.size]
+            self.population, self.objectives = merged_x[survivors], merged_f[survivors]
+            if self.callback and self.callback(intermediate_result=self._intermediate(nit)):
+                message = 'callback function requested stop early'
+                break
+        result = self._intermediate(nit)
+        result.update(success=True, message=message)
+        return result
+
+def create_optimizer(name: str, *args, **kwargs) -> Tuple[Optional[GlobalOptimizer], Optional[str]]:
+    """依名稱建立全域最佳化引擎，回傳 (引擎, 錯誤訊息)。"""
+    optimizer_class = GLOBAL_OPTIMIZERS.get(name)
+    if optimizer_class is None:
+        return None, f"未知的全域最佳化引擎 '{name}'，可用: {sorted(GLOBAL_OPTIMIZERS)}"
+    return optimizer_class(*args, **kwargs), None
+
+# --- 主程式 (示範) ---
+if __name__ == '__main__':
+    print("正在執行 M19 模組 (Global Optimizers) 示範...")
+
+    # 在跨越數個數量級、參數間高度相關的對數尺度測試函數上比較兩種引擎的評估次數
+    true_log = np.array([-9.0, -6.0, -12.0, 2.0, 3.5, -1.0])
+    rotation = np.linalg.qr(np.random.default_rng(1).standard_normal((6, 6)))[0]
+    conditioning = np.diag(np.logspace(0, 2, 6))
+
+    def rotated_ellipsoid(population: np.ndarray) -> np.ndarray:
+        delta = (np.log10(population.T) - true_log) @ rotation.T @ conditioning
+        return np.sqrt(np.mean(delta ** 2, axis=1))
+
+    bounds = [(10 ** (v - 2), 10 ** (v + 2)) for v in true_log]
+    for name in GLOBAL_OPTIMIZERS:
+        counts = {'nfev': 0}
+
+        def counted(population: np.ndarray) -> np.ndarray:
+            counts['nfev'] += population.shape[1]
+            return rotated_ellipsoid(population)
+
+        with create_optimizer(name, counted, bounds, maxiter=3000, popsize=15, tol=1e-8,
+                              rng=np.random.default_rng(0), vectorized=True)[0] as optimizer:
+            if isinstance(optimizer, DifferentialEvolutionOptimizer):
+                optimizer.solver.polish = False
+            result = optimizer.solve()
+        print(f"{optimizer.display_name:>24}: 誤差 {result.fun:.2e}，評估 {counts['nfev']} 次，代數 {result.nit}，{result.message}")
+
+    # DE 檢查點：第 15 代以 capture_state() 存成 JSON 後中止，另建引擎以 restore_state() 續跑，結果須與未中斷的執行完全相同
+    # (capture_state / restore_state / rescore 用到 SciPy 私有介面，此段用來確認 requirements.txt 固定的 SciPy 版本)
+    def run_de(stop_at: Optional[int] = None, maxiter: int = 30, state: Optional[Dict[str, Any]] = None):
+        saved = {}
+
+        def on_generation(intermediate_result):
+            if intermediate_result.nit == stop_at:
+                saved['state'] = json.loads(json.dumps(optimizer.capture_state()))
+                return True
+
+        optimizer = DifferentialEvolutionOptimizer(rotated_ellipsoid, bounds, maxiter=maxiter, popsize=15, tol=0.0,
+                                                   rng=np.random.default_rng(0), callback=on_generation, vectorized=True)
+        optimizer.solver.polish = False
+        if state is not None:
+            optimizer.restore_state(state)
+        with optimizer:
+            result = optimizer.solve()
+        return result, saved.get('state')
+
+    uninterrupted, _ = run_de()
+    _, checkpoint = run_de(stop_at=15)
+    resumed, _ = run_de(maxiter=15, state=checkpoint)
+    print(f"{'DE checkpoint':>24}: 續跑結果與未中斷的執行{'相同' if np.array_equal(resumed.x, uninterrupted.x) else '不同'} "
+          f"(誤差 {resumed.fun:.6e} / {uninterrupted.fun:.6e})")
+
+    # NSGA-II：兩個互相衝突的目標 (與兩組目標參數在 log10 空間的距離)，真正的 Pareto 前緣為兩點間的線段
+    other_log = true_log + 1.0
+
+    def two_targets(population: np.ndarray) -> np.ndarray:
+        log_p = np.log10(population.T)
+        return np.column_stack([np.sqrt(np.mean((log_p - true_log) ** 2, axis=1)),
+                                np.sqrt(np.mean((log_p - other_log) ** 2, axis=1))])
+
+    optimizer = NSGA2Optimizer(two_targets, bounds, maxiter=100, popsize=10, tol=0.0, rng=np.random.default_rng(0))
+    result = optimizer.solve()
+    gap = np.max(np.abs(result.archive_f.sum(axis=1) - 1.0))
+    print(f"{optimizer.display_name:>24}: Pareto 存檔 {len(result.archive_f)} 個解，評估 {result.nfev} 次，"
+          f"與理論前緣 (f1 + f2 = 1) 的最大偏差 {gap:.2e}")
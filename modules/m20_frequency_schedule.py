@@ -0,0 +1,203 @@
+# m20_frequency_schedule.py
+# -*- coding: utf-8 -*-
+
+"""
+模組 M20: 多階解析度的頻率排程
+
+功能：
+1. coarse_frequency_indices()：自 M01 的完整頻率軸 (401 點) 挑出對數等間距的稀疏子集，
+   並保留量測阻抗共振峰 / 谷附近的所有頻率點，避免稀疏取樣跳過窄共振而誤導早期的搜尋。
+2. FrequencySchedule：由粗到細的頻率子集序列 (預設 41 點 → 121 點 → 完整頻率軸)。
+   M03 每代結束時以族群誤差呼叫 update()：族群的相對分散度降到門檻以下 (逐漸收斂)、
+   到達該階段的代數上限，或族群即將滿足收斂條件時，切換到下一個 (或完整的) 頻率軸。
+   M04 則依序在各階段的子集上執行局部優化，最後一段一律使用完整頻率軸。
+3. peak_region_indices()：量測阻抗峰值附近的頻率點 (沒有共振峰 / 谷時取 |Z| 最大值附近)，供 M03 Pareto 搜尋的共振區目標。
+4. quadrature_weights()：非等間距頻率點在 log10 頻率上的梯形積分權重。M01 的自適應取樣輸出此權重 ('Weight' 欄位)，
+   M03 / M04 以加權 RMSE 近似原本在密集對數等間距頻率軸上的 RMSE。
+
+M06 的 .AC DEC 每十倍頻點數由頻率點數與頻寬推算，M11 的 MNA 求解成本與頻率點數成正比，
+因此在子集上評估時，模擬與誤差計算的成本都隨之縮小。
+注意：ngspice 後端以 .AC DEC 模擬後再內插回頻率點，共振區的密集點在 ngspice 上是由較稀疏的掃描內插而來；
+numpy (MNA) 後端則直接在每個頻率點求解。
+"""
+
+import logging
+import numpy as np
+from scipy.signal import find_peaks
+from typing import Optional, List, Tuple
+
+# --- 全域設定 ---
+# 各粗略階段的對數等間距點數 (不含共振區額外保留的點)；最後一段一律為完整頻率軸
+FIDELITY_POINTS = (41, 121)
+# 各粗略階段最晚在 maxiter 的此比例代數時切換到下一階段
+FIDELITY_DEADLINES = (0.3, 0.6)
+# 族群誤差的相對標準差 (std / mean) 低於此值時提前切換到下一階段
+FIDELITY_ADVANCE_SPREAD = 0.05
+# 每個粗略階段至少停留的代數 (切換後族群分散度通常仍低於門檻，避免連續跳階)
+FIDELITY_MIN_GENERATIONS = 5
+# 共振峰 / 谷的最小顯著度 (log10|Z| 的十倍數)
+RESONANCE_PROMINENCE = 0.1
+# 共振峰 / 谷兩側各保留此寬度 (十倍頻) 內的所有頻率點
+RESONANCE_HALF_WIDTH = 0.05
+# 最多保留的共振區數量 (依顯著度由大到小)
+RESONANCE_MAX_REGIONS = 6
+# 尋找共振前以此點數的移動平均平滑 log10|Z|，避免量測雜訊被當成共振
+RESONANCE_SMOOTHING = 5
+
+logger = logging.getLogger(__name__)
+
+def resonance_indices(freq_points: np.ndarray, measured_z: np.ndarray) -> np.ndarray:
+    """
+    回傳量測阻抗共振峰 / 谷 (log10|Z| 的局部極值) 附近 RESONANCE_HALF_WIDTH 十倍頻內的頻率點索引。
+    measured_z 為 (K, F) 時 (聯合擬合各治具的量測阻抗) 回傳各列共振區的聯集。
+    """
+    if np.ndim(measured_z) > 1:
+        return np.unique(np.concatenate([resonance_indices(freq_points, row) for row in measured_z]))
+    log_f = np.log10(np.asarray(freq_points, dtype=float))
+    log_z = np.log10(np.abs(np.asarray(measured_z)))
+    pad = RESONANCE_SMOOTHING // 2
+    smoothed = np.convolve(np.pad(log_z, pad, mode='edge'), np.ones(RESONANCE_SMOOTHING) / RESONANCE_SMOOTHING, mode='valid')
+    peaks, prominences = [], []
+    for sign in (1, -1):
+        found, properties = find_peaks(sign * smoothed, prominence=RESONANCE_PROMINENCE)
+        peaks.extend(found)
+        prominences.extend(properties['prominences'])
+    strongest = np.array(peaks, dtype=int)[np.argsort(prominences)[::-1][:RESONANCE_MAX_REGIONS]]
+    regions = [np.flatnonzero(np.abs(log_f - log_f[peak]) <= RESONANCE_HALF_WIDTH) for peak in strongest]
+    return np.unique(np.concatenate(regions)) if regions else np.array([], dtype=int)
+
+def peak_region_indices(freq_points: np.ndarray, measured_z: np.ndarray) -> np.ndarray:
+    """
+    量測阻抗峰值附近的頻率點索引 (M03 Pareto 搜尋的共振區目標)：有共振峰 / 谷時同 resonance_indices()；
+    頻帶內沒有局部極值 (例如峰值落在頻帶邊緣) 時，改取 |Z| 最大值 RESONANCE_HALF_WIDTH 十倍頻內的點。
+    measured_z 為 (K, F) 時回傳各列的聯集。
+    """
+    if np.ndim(measured_z) > 1:
+        return np.unique(np.concatenate([peak_region_indices(freq_points, row) for row in measured_z]))
+    indices = resonance_indices(freq_points, measured_z)
+    if len(indices):
+        return indices
+    log_f = np.log10(np.asarray(freq_points, dtype=float))
+    peak = int(np.argmax(np.abs(np.asarray(measured_z))))
+    return np.flatnonzero(np.abs(log_f - log_f[peak]) <= RESONANCE_HALF_WIDTH)
+
+def coarse_frequency_indices(freq_points: np.ndarray, measured_z: np.ndarray, num_points: int) -> np.ndarray:
+    """
+    自完整頻率軸挑出約 num_points 個對數等間距的頻率點 (取最接近的既有頻率點，含兩端)，
+    再加上共振區的所有點；回傳遞增的索引。num_points 不小於頻率點數時回傳完整頻率軸。
+    """
+    count = len(freq_points)
+    if num_points >= count:
+        return np.arange(count)
+    log_f = np.log10(np.asarray(freq_points, dtype=float))
+    targets = np.linspace(log_f[0], log_f[-1], num_points)
+    uniform = np.abs(log_f[:, None] - targets[None, :]).argmin(axis=0)
+    return np.union1d(uniform, resonance_indices(freq_points, measured_z))
+
+def quadrature_weights(freq_points: np.ndarray) -> np.ndarray:
+    """
+    梯形積分權重 (總和為 1)：w_i 為第 i 點兩側相鄰區間在 log10 頻率上的半寬和除以總頻寬。
+    Σ w_i r_i² 即 r² 的分段線性內插在 log10 頻率上的平均，近似密集對數等間距頻率軸上的 mean(r²)。
+    """
+    log_f = np.log10(np.asarray(freq_points, dtype=float))
+    if len(log_f) < 2 or log_f[-1] == log_f[0]:
+        return np.full(len(log_f), 1.0 / max(len(log_f), 1))
+    spacing = np.diff(log_f)
+    weights = np.zeros(len(log_f))
+    weights[:-1] += spacing / 2
+    weights[1:] += spacing / 2
+    return weights / weights.sum()
+
+class FrequencySchedule:
+    """
+    由粗到細的頻率子集序列。stages[-1] 一律為完整頻率軸；點數不少於下一階段 (或完整頻率軸) 的粗略階段會被略過。
+
+    Args:
+        freq_points: 完整頻率軸。
+        measured_z: 完整頻率軸上的量測阻抗 (用於保留共振區)；聯合擬合時為 (K, F)，保留各治具的共振區。
+        maxiter: 全域搜尋的總代數，用來換算各階段的代數上限。
+        tol: 全域搜尋的收斂容許值；族群滿足 std <= tol × |mean| 時直接切換到完整頻率軸，
+             使最佳化引擎只會在完整頻率軸上判定收斂。
+    """
+    def __init__(self, freq_points: np.ndarray, measured_z: np.ndarray, maxiter: int = 1000, tol: float = 0.01,
+                 points: Tuple[int, ...] = FIDELITY_POINTS, deadlines: Tuple[float, ...] = FIDELITY_DEADLINES,
+                 advance_spread: float = FIDELITY_ADVANCE_SPREAD):
+        count = len(freq_points)
+        self.stages: List[np.ndarray] = []
+        for num_points in sorted(points):
+            indices = coarse_frequency_indices(freq_points, measured_z, num_points)
+            if len(indices) < count and (not self.stages or len(indices) > len(self.stages[-1])):
+                self.stages.append(indices)
+        self.stages.append(np.arange(count))
+        self.deadlines = [int(round(fraction * maxiter)) for fraction in deadlines]
+        self.tol = tol
+        self.advance_spread = advance_spread
+        self.level = 0
+        self.level_start = 0  # 進入目前階段的代數
+
+    @property
+    def indices(self) -> np.ndarray:
+        return self.stages[self.level]
+
+    @property
+    def is_full(self) -> bool:
+        return self.level == len(self.stages) - 1
+
+    def describe(self) -> str:
+        return ' → '.join(str(len(stage)) for stage in self.stages) + ' 點'
+
+    def set_level(self, level: int, level_start: int = 0) -> Optional[str]:
+        """直接指定階段與進入該階段的代數 (從檢查點續跑時使用)，超出範圍時回傳錯誤訊息。"""
+        if not 0 <= level < len(self.stages):
+            return f"頻率排程階段 {level} 超出範圍 (共 {len(self.stages)} 階段)。"
+        self.level, self.level_start = level, level_start
+        return None
+
+    def update(self, generation: int, energies: np.ndarray) -> bool:
+        """
+        依第 generation 代結束時的族群誤差決定是否切換階段，切換時回傳 True。
+        呼叫端需在切換後改用新的 indices，並以新的頻率軸重新評估最佳化引擎保留的解。
+        """
+        if self.is_full:
+            return False
+        energies = np.asarray(energies, dtype=float)
+        spread = np.std(energies) / (np.abs(np.mean(energies)) + np.finfo(float).eps)
+        deadline = self.deadlines[min(self.level, len(self.deadlines) - 1)] if self.deadlines else 0
+        if spread <= self.tol:
+            self.level = len(self.stages) - 1
+        elif generation >= deadline or (spread <= self.advance_spread
+                                        and generation - self.level_start >= FIDELITY_MIN_GENERATIONS):
+            self.level += 1
+        else:
+            return False
+        self.level_start = generation
+        logger.info(f"第 {generation} 代：族群相對分散度 {spread:.4f}，頻率解析度提高為 {len(self.indices)} 點。")
+        return True
+
+# --- 主程式 (示範) ---
+if __name__ == '__main__':
+    print("正在執行 M20 模組 (Frequency Schedule) 示範...")
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    # 與 M01 相同的 401 點頻率軸，阻抗在 80 MHz 附近有一個窄共振峰
+    freq = np.logspace(6, np.log10(3e9), 401)
+    omega = 2 * np.pi * freq
+    z_parallel = 1 / (1 / (1j * omega * 1e-6) + 1j * omega * 4e-12 + 1 / 2e4)
+    z = np.abs(z_parallel + 1j * omega * 1e-9 + 0.5)
+
+    schedule = FrequencySchedule(freq, z, maxiter=100, tol=0.01)
+    print(f"頻率排程: {schedule.describe()}")
+    peak = freq[np.argmax(z)]
+    for stage in schedule.stages:
+        near = np.sum(np.abs(np.log10(freq[stage]) - np.log10(peak)) <= RESONANCE_HALF_WIDTH)
+        print(f"  {len(stage):3d} 點，其中共振峰 ({peak / 1e6:.1f} MHz) ±{RESONANCE_HALF_WIDTH} 十倍頻內 {near} 點")
+
+    # 模擬族群誤差逐代收斂：分散度先降到提前切換門檻，之後達到收斂條件
+    rng = np.random.default_rng(0)
+    for generation in range(1, 101):
+        spread = 0.3 * np.exp(-generation / 15)
+        energies = 0.2 * (1 + spread * rng.standard_normal(30))
+        if schedule.update(generation, energies):
+            print(f"  第 {generation:3d} 代切換至 {len(schedule.indices)} 點")
+        if schedule.is_full:
+            break
@@ -0,0 +1,555 @@
+# m21_job_queue.py
+# -*- coding: utf-8 -*-
+
+"""
+模組 M21: 多元件擬合工作佇列
+
+功能：
+1. JobQueue：以本機 SQLite 檔案 (預設 results/fit_jobs.sqlite) 保存擬合工作，每筆工作為「一個元件 × 一種模式」
+   (CM、NM 或聯合模式 CM+NM)，含優先權、預估成本、重試次數與狀態 (pending / running / done / failed)。
+   取得工作 (claim) 在 BEGIN IMMEDIATE 交易中完成，多個工作程序同時取用也不會拿到同一筆工作。
+2. 可續跑：每筆工作有自己的工作目錄 (results/jobs/job_{編號}/)，存放對齊後的量測 CSV、M03 檢查點與
+   全域搜尋結果。執行中的工作定期更新心跳；工作程序中斷後，recover_stale_jobs() 把心跳逾時的工作放回佇列，
+   重新執行時由 M03 檢查點接續 (全域搜尋已完成時直接從局部優化開始)。
+3. run_scheduler()：啟動與核心數相同的工作程序，依「優先權由高到低、預估成本由小到大」取用工作；
+   長時間的全域搜尋 (預估成本 ≥ LONG_JOB_COST) 最多同時佔用 workers - 1 個核心，
+   保留至少一個核心給只需局部優化的短工作，小型擬合不必排在長時間的 DE 之後。
+4. enqueue_directory()：掃描量測資料目錄中的 {元件}CM.txt / {元件}NM.txt (M01 的兩欄格式，
+   以 MHz 記錄的檔案自動換算)，為每個元件建立工作。
+5. queue_statistics()：各狀態的工作數、平均擬合時間與吞吐量 (fits/hour)。
+6. 命令列介面：
+     python modules/m21_job_queue.py enqueue data/ [--joint] [--kind local] [--priority 5]
+     python modules/m21_job_queue.py run [--workers 4]
+     python modules/m21_job_queue.py status
+     python modules/m21_job_queue.py export results/fit_results.csv
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import socket
+import sqlite3
+import logging
+import argparse
+import threading
+import multiprocessing
+from contextlib import closing
+from typing import Optional, List, Dict, Tuple, Any
+
+import numpy as np
+import pandas as pd
+
+# --- 路徑修正 ---
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from modules.m01_align_interpolate import read_measurement_file, align_measurement_files
+from modules.m06_netlist_generator import fitting_modes
+
+# --- 全域設定 ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(SCRIPT_DIR)
+RESULTS_DIR = os.path.join(BASE_DIR, 'results')
+DEFAULT_DB_PATH = os.path.join(RESULTS_DIR, 'fit_jobs.sqlite')
+# 各工作的工作目錄 (量測 CSV、檢查點、階段結果)
+JOBS_DIR = os.path.join(RESULTS_DIR, 'jobs')
+
+# 每筆工作預設最多執行次數 (含第一次)
+DEFAULT_MAX_ATTEMPTS = 3
+# 執行中的工作每隔此秒數更新心跳；超過 STALE_AFTER_SECONDS 沒有心跳視為工作程序已中斷
+HEARTBEAT_INTERVAL = 30.0
+STALE_AFTER_SECONDS = 120.0
+# 沒有可取用的工作 (但仍有工作執行中) 時，工作程序每隔此秒數重新查詢
+POLL_INTERVAL = 2.0
+# 預估成本 (模擬次數) 不小於此值的工作視為長工作 (全域搜尋)
+LONG_JOB_COST = 10000
+
+# 量測檔名格式：{元件}CM.txt / {元件}NM.txt
+MEASUREMENT_PATTERN = re.compile(r'^(?P<device>.+?)(?P<mode>CM|NM)\.txt$', re.IGNORECASE)
+JOB_KINDS = ('global', 'local')
+JOB_STATUSES = ('pending', 'running', 'done', 'failed')
+
+# 未指定參數範圍時的標稱值與範圍倍數 (標稱值 ÷/× DEFAULT_RANGE_FACTOR)
+DEFAULT_NOMINAL_PARAMS = {
+    'Rdc': 0.05, 'dL3': 2e-9, 'dR4': 200.0, 'dC3': 1e-12, 'dR3': 5.0, 'C1': 2e-12, 'R2': 50.0,
+    'L1': 5e-6, 'L2': 5e-6, 'L3': 5e-6, 'L4': 5e-6, 'Rs1': 3e3, 'Rs2': 3e3, 'Rs3': 3e3, 'Rs4': 3e3,
+    'ck': 0.5e-12, 'Lp': 1e-9
+}
+DEFAULT_RANGE_FACTOR = 10.0
+# 工作設定的預設值；'global' 為 M03 全域搜尋後以 M04 精化，'local' 只從 initial_params 執行 M04
+DEFAULT_JOB_SETTINGS = {
+    'kind': 'global',
+    'maxiter': 200,
+    'popsize': 10,
+    'optimizer': 'de',
+    'local_maxiter': 300,
+    'backend': None,
+    'seed': None,
+    'freq_scale': None,
+    'initial_params': None,
+    'param_bounds': None,
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    device TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    files TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    estimated_cost REAL NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    worker TEXT,
+    heartbeat_at REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    elapsed REAL,
+    result TEXT,
+    error TEXT,
+    UNIQUE (device, mode)
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, priority DESC, estimated_cost, id);
+"""
+
+logger = logging.getLogger(__name__)
+
+def estimate_cost(mode: str, settings: Dict[str, Any]) -> float:
+    """
+    工作的預估成本 (以單一治具曲線的模擬次數計)：全域搜尋約 popsize·D·(maxiter + 1) 次，
+    局部優化約 local_maxiter·(D + 1) 次，聯合模式每次模擬包含 K 個治具。只用於排序與區分長 / 短工作。
+    """
+    dimension = len(settings.get('param_bounds') or settings.get('initial_params') or DEFAULT_NOMINAL_PARAMS)
+    cost = settings['local_maxiter'] * (dimension + 1)
+    if settings['kind'] == 'global':
+        cost += settings['popsize'] * dimension * (settings['maxiter'] + 1)
+    return float(cost * len(fitting_modes(mode)))
+
+def job_work_dir(job_id: int) -> str:
+    return os.path.join(JOBS_DIR, f'job_{job_id}')
+
+# --- SQLite 工作佇列 ---
+class JobQueue:
+    """
+    SQLite 工作佇列。每次操作各自開啟連線 (WAL 模式)，可在多個程序與心跳執行緒中同時使用。
+    """
+    def __init__(self, db_path: str = DEFAULT_DB_PATH):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None：由程式自行以 BEGIN IMMEDIATE 控制交易，claim 的查詢與更新之間不會被其他程序插入
+        conn = sqlite3.connect(self.db_path, timeout=30.0, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _to_job(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        for key in ('files', 'settings', 'result'):
+            if job.get(key):
+                job[key] = json.loads(job[key])
+        return job
+
+    def enqueue(self, device: str, mode: str, files: Dict[str, str], settings: Optional[Dict[str, Any]] = None,
+                priority: int = 0, max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> Tuple[Optional[int], Optional[str]]:
+        """
+        新增一筆工作，回傳 (工作編號, 錯誤訊息)。同一元件與模式已有工作時不重複新增 (回傳 (None, 說明))。
+        settings 未指定的項目使用 DEFAULT_JOB_SETTINGS。
+        """
+        settings = {**DEFAULT_JOB_SETTINGS, **(settings or {})}
+        if settings['kind'] not in JOB_KINDS:
+            return None, f"未知的工作類型 '{settings['kind']}'，可用: {list(JOB_KINDS)}"
+        try:
+            missing = [name for name in fitting_modes(mode) if name not in files]
+        except ValueError as e:
+            return None, str(e)
+        if missing:
+            return None, f"元件 {device} 缺少 {mode} 模式所需的量測檔: {missing}"
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO jobs (device, mode, files, settings, priority, estimated_cost, max_attempts, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (device, mode, json.dumps(files), json.dumps(settings), int(priority), estimate_cost(mode, settings),
+                 int(max_attempts), time.time()))
+            if cursor.rowcount == 0:
+                return None, f"元件 {device} 的 {mode} 工作已在佇列中。"
+            return cursor.lastrowid, None
+
+    def claim(self, worker: str, max_long_jobs: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        取用下一筆工作並標記為執行中：優先權由高到低、預估成本由小到大、建立順序。
+        執行中的長工作已達 max_long_jobs 時只取用短工作。沒有可取用的工作時回傳 None。
+        """
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                query, args = "SELECT * FROM jobs WHERE status = 'pending'", []
+                if max_long_jobs is not None:
+                    long_running = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'running' AND estimated_cost >= ?",
+                                                (LONG_JOB_COST,)).fetchone()[0]
+                    if long_running >= max_long_jobs:
+                        query += " AND estimated_cost < ?"
+                        args.append(LONG_JOB_COST)
+                row = conn.execute(query + " ORDER BY priority DESC, estimated_cost ASC, id ASC LIMIT 1", args).fetchone()
+                if row is None:
+                    conn.execute('COMMIT')
+                    return None
+                conn.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, heartbeat_at = ?, "
+                             "started_at = COALESCE(started_at, ?), error = NULL WHERE id = ?", (worker, now, now, row['id']))
+                conn.execute('COMMIT')
+            except sqlite3.Error:
+                conn.execute('ROLLBACK')
+                raise
+        job = self._to_job(row)
+        job['attempts'] += 1
+        return job
+
+    def heartbeat(self, job_id: int, worker: str):
+        with closing(self._connect()) as conn:
+            conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                         (time.time(), job_id, worker))
+
+    def complete(self, job_id: int, result: Dict[str, Any], elapsed: float):
+        with closing(self._connect()) as conn:
+            conn.execute("UPDATE jobs SET status = 'done', result = ?, finished_at = ?, elapsed = ? WHERE id = ?",
+                         (json.dumps(result), time.time(), elapsed, job_id))
+
+    def fail(self, job_id: int, error: str, elapsed: float) -> str:
+        """記錄失敗；尚未用完重試次數時放回佇列。回傳新的狀態 ('pending' 或 'failed')。"""
+        with closing(self._connect()) as conn:
+            conn.execute("UPDATE jobs SET status = CASE WHEN attempts < max_attempts THEN 'pending' ELSE 'failed' END, "
+                         "error = ?, finished_at = ?, elapsed = ?, worker = NULL WHERE id = ?",
+                         (error, time.time(), elapsed, job_id))
+            return conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+
+    def recover_stale_jobs(self, stale_after: float = STALE_AFTER_SECONDS) -> int:
+        """將心跳逾時 (工作程序已中斷) 的執行中工作放回佇列；已用完重試次數者標記為失敗。回傳處理的筆數。"""
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts < max_attempts THEN 'pending' ELSE 'failed' END, "
+                "error = '工作程序中斷 (心跳逾時)', worker = NULL WHERE status = 'running' AND heartbeat_at < ?",
+                (time.time() - stale_after,))
+            if cursor.rowcount:
+                logger.warning(f"{cursor.rowcount} 筆執行中的工作心跳逾時，已放回佇列。")
+            return cursor.rowcount
+
+    def requeue_failed(self) -> int:
+        """將失敗的工作重新放回佇列 (重試次數歸零)，回傳筆數。"""
+        with closing(self._connect()) as conn:
+            return conn.execute("UPDATE jobs SET status = 'pending', attempts = 0 WHERE status = 'failed'").rowcount
+
+    def counts(self) -> Dict[str, int]:
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {status: 0 for status in JOB_STATUSES}
+        counts.update({status: count for status, count in rows})
+        return counts
+
+    def jobs(self, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        with closing(self._connect()) as conn:
+            if status:
+                rows = conn.execute("SELECT * FROM jobs WHERE status = ? ORDER BY id", (status,)).fetchall()
+            else:
+                rows = conn.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+        return [self._to_job(row) for row in rows]
+
+def queue_statistics(queue: JobQueue, since: Optional[float] = None) -> Dict[str, Any]:
+    """
+    佇列統計：各狀態的工作數、完成工作的平均擬合時間，以及吞吐量 (fits/hour)：
+    since 之後完成的工作數除以 (最後完成時間 - since)；未指定 since 時從最早開始的完成工作起算。
+    """
+    stats: Dict[str, Any] = dict(queue.counts())
+    done = [job for job in queue.jobs('done') if since is None or job['finished_at'] >= since]
+    stats['completed'] = len(done)
+    stats['mean_fit_seconds'] = float(np.mean([job['elapsed'] for job in done])) if done else None
+    stats['fits_per_hour'] = None
+    if done:
+        start = since if since is not None else min(job['started_at'] for job in done)
+        span = max(job['finished_at'] for job in done) - start
+        if span > 0:
+            stats['fits_per_hour'] = len(done) / span * 3600
+    return stats
+
+def format_statistics(stats: Dict[str, Any]) -> str:
+    text = ', '.join(f"{status} {stats[status]}" for status in JOB_STATUSES)
+    if stats['completed']:
+        text += f"；完成 {stats['completed']} 筆，平均每筆 {stats['mean_fit_seconds']:.1f} 秒"
+        if stats['fits_per_hour'] is not None:
+            text += f"，吞吐量 {stats['fits_per_hour']:.1f} fits/hour"
+    return text
+
+# --- 建立工作 ---
+def scan_measurements(data_dir: str) -> Dict[str, Dict[str, str]]:
+    """掃描目錄中的 {元件}CM.txt / {元件}NM.txt，回傳 {元件: {模式: 路徑}}；略過不是兩欄數值的檔案 (如 Tai_CM.txt 網表)。"""
+    devices: Dict[str, Dict[str, str]] = {}
+    for filename in sorted(os.listdir(data_dir)):
+        match = MEASUREMENT_PATTERN.match(filename)
+        path = os.path.join(data_dir, filename)
+        if match is None or read_measurement_file(path) is None:
+            continue
+        devices.setdefault(match.group('device'), {})[match.group('mode').upper()] = os.path.abspath(path)
+    return devices
+
+def enqueue_directory(queue: JobQueue, data_dir: str, modes: Optional[List[str]] = None, joint: bool = False,
+                      settings: Optional[Dict[str, Any]] = None, priority: int = 0,
+                      max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> Tuple[List[int], List[str]]:
+    """
+    為目錄中的每個元件建立工作：modes 預設為該元件有量測檔的 'CM' / 'NM'，joint=True 時
+    另為同時有兩個量測檔的元件建立聯合模式 'CM+NM' 工作。回傳 (新增的工作編號, 略過的說明)。
+    """
+    added, skipped = [], []
+    for device, files in scan_measurements(data_dir).items():
+        device_modes = list(modes) if modes else [name for name in ('CM', 'NM') if name in files]
+        if joint and 'CM+NM' not in device_modes and {'CM', 'NM'} <= set(files):
+            device_modes.append('CM+NM')
+        for mode in device_modes:
+            needed = {name: files[name] for name in files if name in mode.split('+')}
+            job_id, message = queue.enqueue(device, mode, needed, settings, priority, max_attempts)
+            if job_id is None:
+                skipped.append(message)
+            else:
+                added.append(job_id)
+    logger.info(f"自 '{data_dir}' 新增 {len(added)} 筆工作，略過 {len(skipped)} 筆。")
+    return added, skipped
+
+# --- 執行工作 ---
+def _final_errors(params: Dict[str, float], measured_path: str, mode: str,
+                  backend: Optional[str]) -> Tuple[Optional[float], Optional[Dict[str, float]]]:
+    """以完整頻率軸計算最終的 (合併) 誤差與聯合模式下各治具的誤差。"""
+    from modules.m05_ngspice_runner import simulate_impedance_batch, measured_impedance, fitting_weights, simulate_mode_errors
+    measured_data = pd.read_csv(measured_path)
+    freq_points = measured_data['Frequency_Hz'].values
+    errors, _ = simulate_impedance_batch(np.array([list(params.values())]), list(params), freq_points,
+                                         measured_impedance(measured_data, mode), mode=mode, backend=backend,
+                                         weights=fitting_weights(mode, None, len(freq_points)))
+    mode_errors = simulate_mode_errors(params, measured_data, mode, backend) if len(fitting_modes(mode)) > 1 else None
+    return float(errors[0]), mode_errors
+
+def run_fit_job(job: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    執行一筆工作：對齊量測檔 → (kind='global') M03 全域搜尋 → M04 局部優化，回傳 (結果, 錯誤訊息)。
+    M03 以工作目錄中的檢查點續跑；全域搜尋的結果寫入 global_result.json，重試時直接從局部優化開始。
+    M03 未在 maxiter 代內收斂時，以最後一代的最佳個體作為局部優化的起點；最終保留起點與 M04 結果中
+    完整頻率軸誤差較低者。
+    """
+    from modules.m03_global_search import global_search_optimization, last_search_statistics
+    from modules.m04_local_optimize import local_optimization_log_scale
+
+    settings, mode = job['settings'], job['mode']
+    work_dir = job_work_dir(job['id'])
+    os.makedirs(work_dir, exist_ok=True)
+    measured_path = os.path.join(work_dir, 'measured.csv')
+    if not os.path.exists(measured_path) and align_measurement_files(job['files'], measured_path, settings['freq_scale']) is None:
+        return None, f"無法對齊量測檔: {job['files']}"
+
+    tag = f"job{job['id']}"
+    nominal = settings['initial_params'] or DEFAULT_NOMINAL_PARAMS
+    bounds = {name: tuple(bound) for name, bound in (settings['param_bounds'] or {
+        name: (value / DEFAULT_RANGE_FACTOR, value * DEFAULT_RANGE_FACTOR) for name, value in nominal.items()}).items()}
+    start_params = dict(nominal)
+    if settings['kind'] == 'global':
+        stage_path = os.path.join(work_dir, 'global_result.json')
+        if os.path.exists(stage_path):
+            with open(stage_path, 'r', encoding='utf-8') as f:
+                start_params = json.load(f)
+            logger.info(f"工作 {job['id']}：沿用已完成的全域搜尋結果。")
+        else:
+            checkpoint_path = os.path.join(work_dir, 'checkpoint.json')
+            found = global_search_optimization(
+                bounds, mode=mode, maxiter=settings['maxiter'], popsize=settings['popsize'], backend=settings['backend'],
+                vectorized=True, seed=settings['seed'], checkpoint_path=checkpoint_path,
+                resume_from=checkpoint_path if os.path.exists(checkpoint_path) else None,
+                measured_data_path=measured_path, optimizer=settings['optimizer'], history_tag=tag)
+            if found is None:
+                stats = last_search_statistics()
+                # 確認統計來自本工作的搜尋 (同一程序先前的工作也會留下統計)
+                if not stats.get('population') or not os.path.basename(stats.get('history_path') or '').endswith(f'_{tag}'):
+                    return None, "M03 全域搜尋失敗"
+                found = stats['population'][0]
+            start_params = {name: float(found[name]) for name in bounds}
+            with open(stage_path, 'w', encoding='utf-8') as f:
+                json.dump(start_params, f)
+
+    polished = local_optimization_log_scale(start_params, mode=mode, maxiter=settings['local_maxiter'],
+                                            backend=settings['backend'], measured_data_path=measured_path, history_tag=tag)
+    params = {name: float(value) for name, value in start_params.items()}
+    error, mode_errors = _final_errors(params, measured_path, mode, settings['backend'])
+    if polished is not None:
+        # M04 未收斂時也可能回傳改善後的參數；以完整頻率軸的誤差保留起點與局部優化結果中較佳者
+        polished = {name: float(value) for name, value in polished.items()}
+        polished_error, polished_mode_errors = _final_errors(polished, measured_path, mode, settings['backend'])
+        if polished_error < error:
+            params, error, mode_errors = polished, polished_error, polished_mode_errors
+        else:
+            polished = None
+    if not np.isfinite(error):
+        return None, "最終參數的模擬失敗"
+    return {'params': params, 'error': error, 'mode_errors': mode_errors, 'polished': polished is not None}, None
+
+class _Heartbeat(threading.Thread):
+    """工作執行期間定期更新心跳的背景執行緒。"""
+    def __init__(self, queue: JobQueue, job_id: int, worker: str):
+        super().__init__(daemon=True)
+        self.queue, self.job_id, self.worker = queue, job_id, worker
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(HEARTBEAT_INTERVAL):
+            self.queue.heartbeat(self.job_id, self.worker)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+def _configure_worker(workers: int):
+    """每個工作程序只分得 1/workers 的核心：縮減 M15 同時執行的 Ngspice 數與 M12 程序池大小。"""
+    import modules.m15_async_scheduler as m15
+    import modules.m12_ngspice_pool as m12
+    share = max(1, (os.cpu_count() or 1) // workers)
+    m15.DEFAULT_MAX_CONCURRENCY = share
+    m12.NGSPICE_POOL_SIZE = share
+
+def _worker_loop(db_path: str, workers: int, max_long_jobs: Optional[int]):
+    """工作程序：反覆取用並執行工作，佇列中沒有待執行與執行中的工作時結束。"""
+    _configure_worker(workers)
+    queue = JobQueue(db_path)
+    worker = f'{socket.gethostname()}:{os.getpid()}'
+    while True:
+        job = queue.claim(worker, max_long_jobs)
+        if job is None:
+            counts = queue.counts()
+            if counts['pending'] == 0 and counts['running'] == 0:
+                return
+            # 其他工作程序的工作仍在執行 (失敗時可能放回佇列) 或長工作已佔滿名額：稍候再查詢
+            queue.recover_stale_jobs()
+            time.sleep(POLL_INTERVAL)
+            continue
+        logger.info(f"[{worker}] 開始工作 {job['id']}: {job['device']} {job['mode']} ({job['settings']['kind']}，第 {job['attempts']} 次)")
+        heartbeat = _Heartbeat(queue, job['id'], worker)
+        heartbeat.start()
+        start_t = time.time()
+        try:
+            result, error = run_fit_job(job)
+        except Exception as e:
+            # 擬合流程中未預期的例外只讓這筆工作失敗 (依重試次數放回佇列)，不中斷工作程序
+            logger.exception(f"工作 {job['id']} 發生未預期的錯誤")
+            result, error = None, f"{type(e).__name__}: {e}"
+        finally:
+            heartbeat.stop()
+        elapsed = time.time() - start_t
+        if result is not None:
+            queue.complete(job['id'], result, elapsed)
+            logger.info(f"[{worker}] 完成工作 {job['id']}: 誤差 {result['error']:.6f}，耗時 {elapsed:.1f} 秒")
+        else:
+            status = queue.fail(job['id'], error, elapsed)
+            logger.warning(f"[{worker}] 工作 {job['id']} 失敗 ({'稍後重試' if status == 'pending' else '已達重試上限'}): {error}")
+
+def run_scheduler(db_path: str = DEFAULT_DB_PATH, workers: Optional[int] = None) -> Dict[str, Any]:
+    """
+    以 workers 個工作程序 (預設為 CPU 核心數) 執行佇列中的所有工作，全部結束後回傳本次執行的 queue_statistics()。
+    workers > 1 時長工作最多同時佔用 workers - 1 個工作程序。
+    """
+    workers = max(1, workers or os.cpu_count() or 1)
+    queue = JobQueue(db_path)
+    queue.recover_stale_jobs()
+    max_long_jobs = workers - 1 if workers > 1 else None
+    logger.info(f"開始執行工作佇列 '{db_path}'：{workers} 個工作程序，長工作最多 {max_long_jobs or workers} 個。")
+    since = time.time()
+    processes = [multiprocessing.Process(target=_worker_loop, args=(db_path, workers, max_long_jobs)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    stats = queue_statistics(queue, since)
+    logger.info(f"工作佇列執行完畢：{format_statistics(stats)}")
+    return stats
+
+def export_results(queue: JobQueue, output_path: str) -> int:
+    """將完成的工作整理成一列一個元件 × 模式的 CSV (誤差、各治具誤差與參數)，回傳筆數。"""
+    rows = []
+    for job in queue.jobs('done'):
+        result = job['result']
+        row = {'job_id': job['id'], 'device': job['device'], 'mode': job['mode'], 'error': result['error'],
+               'elapsed': job['elapsed'], 'attempts': job['attempts']}
+        row.update({f'error_{name}': value for name, value in (result.get('mode_errors') or {}).items()})
+        row.update(result['params'])
+        rows.append(row)
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    pd.DataFrame(rows).to_csv(output_path, index=False)
+    return len(rows)
+
+# --- 命令列介面 ---
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='多元件擬合工作佇列 (SQLite)')
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help='佇列資料庫路徑')
+    commands = parser.add_subparsers(dest='command')
+
+    enqueue = commands.add_parser('enqueue', help='為目錄中的量測檔 ({元件}CM.txt / {元件}NM.txt) 建立工作')
+    enqueue.add_argument('data_dir')
+    enqueue.add_argument('--modes', nargs='+', help="擬合模式，例如 CM NM CM+NM (預設為有量測檔的 CM / NM)")
+    enqueue.add_argument('--joint', action='store_true', help='另為同時有 CM 與 NM 量測檔的元件建立 CM+NM 工作')
+    enqueue.add_argument('--kind', choices=JOB_KINDS, default=DEFAULT_JOB_SETTINGS['kind'])
+    enqueue.add_argument('--priority', type=int, default=0)
+    enqueue.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS)
+    enqueue.add_argument('--maxiter', type=int, default=DEFAULT_JOB_SETTINGS['maxiter'])
+    enqueue.add_argument('--popsize', type=int, default=DEFAULT_JOB_SETTINGS['popsize'])
+    enqueue.add_argument('--local-maxiter', type=int, default=DEFAULT_JOB_SETTINGS['local_maxiter'])
+    enqueue.add_argument('--optimizer', default=DEFAULT_JOB_SETTINGS['optimizer'])
+    enqueue.add_argument('--backend', help="模擬後端 (預設為 M05 的 SIMULATION_BACKEND)")
+    enqueue.add_argument('--seed', type=int)
+    enqueue.add_argument('--freq-scale', type=float, help='量測檔頻率換算為 Hz 的倍數 (預設自動判斷 Hz / MHz)')
+    enqueue.add_argument('--params', help='JSON 檔：{"initial_params": {...}, "param_bounds": {...}}')
+
+    run = commands.add_parser('run', help='執行佇列中的所有工作並回報吞吐量')
+    run.add_argument('--workers', type=int, help='工作程序數 (預設為 CPU 核心數)')
+
+    commands.add_parser('status', help='顯示各狀態的工作數與吞吐量')
+    commands.add_parser('requeue', help='將失敗的工作重新放回佇列')
+    export = commands.add_parser('export', help='將完成的擬合結果匯出為 CSV')
+    export.add_argument('output_csv')
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 0
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - [%(levelname)s] - (%(module)s) - %(message)s')
+    queue = JobQueue(args.db)
+
+    if args.command == 'enqueue':
+        settings = {'kind': args.kind, 'maxiter': args.maxiter, 'popsize': args.popsize, 'local_maxiter': args.local_maxiter,
+                    'optimizer': args.optimizer, 'backend': args.backend, 'seed': args.seed, 'freq_scale': args.freq_scale}
+        if args.params:
+            with open(args.params, 'r', encoding='utf-8') as f:
+                settings.update({key: value for key, value in json.load(f).items() if key in ('initial_params', 'param_bounds')})
+        added, skipped = enqueue_directory(queue, args.data_dir, args.modes, args.joint, settings, args.priority, args.max_attempts)
+        print(f"新增 {len(added)} 筆工作，略過 {len(skipped)} 筆。")
+        for message in skipped:
+            print(f"  {message}")
+    elif args.command == 'run':
+        stats = run_scheduler(args.db, args.workers)
+        print(format_statistics(stats))
+    elif args.command == 'status':
+        print(format_statistics(queue_statistics(queue)))
+        for job in queue.jobs():
+            error = f"{job['result']['error']:.6f}" if job['result'] else (job['error'] or '')
+            print(f"  #{job['id']:<4} {job['device']:<10} {job['mode']:<6} {job['status']:<8} "
+                  f"第 {job['attempts']}/{job['max_attempts']} 次  {error}")
+    elif args.command == 'requeue':
+        print(f"已將 {queue.requeue_failed()} 筆失敗的工作放回佇列。")
+    elif args.command == 'export':
+        print(f"已匯出 {export_results(queue, args.output_csv)} 筆結果至 {args.output_csv}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
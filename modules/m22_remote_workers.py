@@ -0,0 +1,690 @@
+# m22_remote_workers.py
+# -*- coding: utf-8 -*-
+
+"""
+模組 M22: 跨機器的分散式模擬 (協調者 / 遠端工作程序)
+
+功能：
+1. RemoteCoordinator：M05 'remote' 模擬後端的協調者。在 TCP (如 '0.0.0.0:5790') 或 Unix socket
+   ('unix:/tmp/m22.sock'，本機測試用) 上等待遠端工作程序連線，將 M03 / M04 交給 M05 的每批參數矩陣
+   切成數個區塊 (約為工作程序數 × REMOTE_CHUNKS_PER_WORKER 塊) 放入佇列，由工作程序主動拉取。
+2. RemoteWorker：連線到協調者，反覆拉取區塊，以本機的模擬後端 (預設 'numpy'；也可為 'ngspice' /
+   'ngspice_pool') 經由 M05 simulate_impedance_batch() 批次模擬，每完成一塊即回傳該塊的阻抗曲線，
+   協調者在 M05 依原本的權重與頻率子集計算誤差。
+3. 容錯：工作程序每 REMOTE_HEARTBEAT_INTERVAL 秒送出心跳；斷線或超過 REMOTE_WORKER_TIMEOUT 秒
+   沒有任何訊息的工作程序視為失效，其執行中的區塊重新放回佇列前端交給其他工作程序。
+   同一區塊最多指派 REMOTE_MAX_CHUNK_ATTEMPTS 次，仍失敗時該塊的候選解視為模擬失敗 (誤差 1e10)。
+4. 工作竊取：佇列已空時，閒置的工作程序會取得其他程序執行超過 REMOTE_STEAL_AFTER 秒的區塊副本
+   (每塊最多 REMOTE_MAX_COPIES 份)，先回傳者為準，避免整批評估等待最慢的機器。
+5. 通訊協定：每則訊息為 8 位元組長度前綴 + JSON 標頭 + numpy 陣列的原始位元組，不使用 pickle，
+   收到的資料不會被當成程式碼執行；可選的 REMOTE_AUTH_TOKEN 供工作程序連線時驗證。
+6. 命令列：
+     python modules/m22_remote_workers.py worker --connect 192.168.1.10:5790 [--backend numpy] [--persistent]
+     python modules/m22_remote_workers.py demo [--workers 3]    # 本機多個工作程序的測試
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import atexit
+import socket
+import struct
+import logging
+import argparse
+import threading
+import multiprocessing
+from collections import deque
+from typing import Optional, List, Dict, Tuple, Any
+
+import numpy as np
+
+# --- 路徑修正 ---
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from modules.m06_netlist_generator import fitting_modes
+
+# --- 全域設定 ---
+# M05 'remote' 後端的協調者位址：'主機:埠' (TCP) 或 'unix:路徑' (Unix socket)
+REMOTE_COORDINATOR_ADDRESS = '0.0.0.0:5790'
+# 非 None 時，工作程序連線須提供相同的字串
+REMOTE_AUTH_TOKEN: Optional[str] = None
+# 每批參數矩陣切成約 (工作程序數 × 此值) 個區塊
+REMOTE_CHUNKS_PER_WORKER = 4
+# 工作程序送出心跳的間隔 (秒)
+REMOTE_HEARTBEAT_INTERVAL = 5.0
+# 超過此秒數沒有任何訊息的工作程序視為失效
+REMOTE_WORKER_TIMEOUT = 20.0
+# 沒有可指派的區塊時，協調者最多保留工作程序的拉取請求此秒數後回覆 'wait'
+REMOTE_POLL_SECONDS = 2.0
+# 佇列已空時，執行超過此秒數的區塊可被閒置的工作程序竊取
+REMOTE_STEAL_AFTER = 1.0
+# 同一區塊同時執行的最多份數 (含原本的指派)
+REMOTE_MAX_COPIES = 2
+# 同一區塊最多指派的次數 (工作程序斷線或回報錯誤時重新指派)
+REMOTE_MAX_CHUNK_ATTEMPTS = 3
+# 沒有任何工作程序連線超過此秒數時，放棄目前的批次評估
+REMOTE_WAIT_FOR_WORKERS = 60.0
+# 工作程序連線失敗時的重試間隔與總等待時間 (秒)
+REMOTE_RECONNECT_INTERVAL = 2.0
+REMOTE_CONNECT_TIMEOUT = 300.0
+# 單則訊息的大小上限 (位元組)
+REMOTE_MAX_MESSAGE_BYTES = 256 * 1024 * 1024
+
+_FRAME = struct.Struct('!II')
+
+logger = logging.getLogger(__name__)
+
+# --- 通訊協定 ---
+def parse_address(address: str) -> Tuple[int, Any]:
+    """'主機:埠' → (AF_INET, (主機, 埠))；'unix:路徑' → (AF_UNIX, 路徑)。"""
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[len('unix:'):]
+    host, _, port = address.rpartition(':')
+    return socket.AF_INET, (host or '0.0.0.0', int(port))
+
+def send_message(sock: socket.socket, header: Dict[str, Any], arrays: Optional[Dict[str, np.ndarray]] = None):
+    """送出一則訊息：(標頭長度, 資料長度) + JSON 標頭 + 依序串接的陣列位元組 (形狀與型別記錄在標頭)。"""
+    specs, blobs = [], []
+    for name, array in (arrays or {}).items():
+        array = np.ascontiguousarray(array)
+        specs.append({'name': name, 'dtype': array.dtype.str, 'shape': list(array.shape)})
+        blobs.append(array.tobytes())
+    head = json.dumps({**header, 'arrays': specs}).encode('utf-8')
+    payload = b''.join(blobs)
+    sock.sendall(_FRAME.pack(len(head), len(payload)) + head + payload)
+
+def _recv_exact(sock: socket.socket, size: int) -> Optional[bytes]:
+    buffer = bytearray()
+    while len(buffer) < size:
+        data = sock.recv(min(size - len(buffer), 1 << 20))
+        if not data:
+            return None
+        buffer.extend(data)
+    return bytes(buffer)
+
+def recv_message(sock: socket.socket) -> Tuple[Optional[Dict[str, Any]], Dict[str, np.ndarray]]:
+    """接收一則訊息，回傳 (標頭, {名稱: 陣列})；對方關閉連線時回傳 (None, {})。格式錯誤時拋出 ConnectionError。"""
+    prefix = _recv_exact(sock, _FRAME.size)
+    if prefix is None:
+        return None, {}
+    head_size, payload_size = _FRAME.unpack(prefix)
+    if head_size + payload_size > REMOTE_MAX_MESSAGE_BYTES:
+        raise ConnectionError(f"訊息大小 {head_size + payload_size} 位元組超過上限。")
+    head = _recv_exact(sock, head_size)
+    payload = _recv_exact(sock, payload_size) if payload_size else b''
+    if head is None or payload is None:
+        return None, {}
+    try:
+        header = json.loads(head.decode('utf-8'))
+        arrays, offset = {}, 0
+        for spec in header.pop('arrays', []):
+            dtype, shape = np.dtype(spec['dtype']), tuple(spec['shape'])
+            count = int(np.prod(shape))
+            arrays[spec['name']] = np.frombuffer(payload, dtype=dtype, count=count, offset=offset).reshape(shape).copy()
+            offset += count * dtype.itemsize
+    except (ValueError, KeyError, TypeError) as e:
+        raise ConnectionError(f"無法解析訊息: {e}")
+    return header, arrays
+
+# --- 協調者 ---
+class _Batch:
+    """一次 map_curves() 呼叫：參數矩陣、結果曲線與尚未完成的區塊數。"""
+    def __init__(self, batch_id: int, params: np.ndarray, param_names: List[str], freq_points: np.ndarray, mode: str):
+        self.batch_id = batch_id
+        self.params = params
+        self.param_names = list(param_names)
+        self.freq_points = np.asarray(freq_points, dtype=float)
+        self.mode = mode
+        self.curves = np.full((len(params), len(fitting_modes(mode)) * len(freq_points)), np.nan, dtype=complex)
+        self.remaining = 0
+        self.finished = threading.Event()
+
+class _Chunk:
+    def __init__(self, batch: _Batch, chunk_id: int, indices: np.ndarray):
+        self.batch = batch
+        self.key = (batch.batch_id, chunk_id)
+        self.indices = indices
+        self.attempts = 0
+        self.holders = set()
+        self.assigned_at = None
+        self.done = False
+
+class _WorkerConnection:
+    def __init__(self, worker_id: int, sock: socket.socket, name: str):
+        self.worker_id = worker_id
+        self.sock = sock
+        self.name = name
+        self.send_lock = threading.Lock()
+        self.last_seen = time.time()
+        self.chunks = set()
+        self.completed = 0
+        self.released = False
+
+    def send(self, header: Dict[str, Any], arrays: Optional[Dict[str, np.ndarray]] = None):
+        with self.send_lock:
+            send_message(self.sock, header, arrays)
+
+    def disconnect(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+class RemoteCoordinator:
+    """
+    協調者：接受工作程序連線並分派區塊。每個連線由一個執行緒處理 (拉取請求、心跳與結果)，
+    另一個監控執行緒中斷心跳逾時的連線；佇列與指派狀態由同一把鎖保護。
+    """
+    def __init__(self, address: str = REMOTE_COORDINATOR_ADDRESS, auth_token: Optional[str] = REMOTE_AUTH_TOKEN):
+        self.requested_address = address
+        self.address = address
+        self.auth_token = auth_token
+        self.lock = threading.Lock()
+        self.work_ready = threading.Condition(self.lock)
+        self.pending = deque()
+        self.in_flight: Dict[Tuple[int, int], _Chunk] = {}
+        self.workers: Dict[int, _WorkerConnection] = {}
+        self.server = None
+        self.started = False
+        self.closed = False
+        self._next_batch_id = 0
+        self._next_worker_id = 0
+        self.reassigned = 0
+        self.stolen = 0
+
+    def start(self) -> Optional[str]:
+        """開始監聽；成功回傳 None，失敗回傳錯誤訊息。埠號為 0 時由系統指定，實際位址見 self.address。"""
+        family, target = parse_address(self.requested_address)
+        try:
+            if family == socket.AF_UNIX and os.path.exists(target):
+                os.remove(target)
+            self.server = socket.socket(family, socket.SOCK_STREAM)
+            if family == socket.AF_INET:
+                self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.server.bind(target)
+            self.server.listen()
+        except OSError as e:
+            return f"協調者無法監聽 '{self.requested_address}': {e}"
+        if family == socket.AF_INET:
+            host, port = self.server.getsockname()[:2]
+            self.address = f"{host}:{port}"
+        self.started, self.closed = True, False
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        threading.Thread(target=self._monitor_loop, daemon=True).start()
+        logger.info(f"協調者開始於 '{self.address}' 等待遠端工作程序。")
+        return None
+
+    def release_workers(self, disconnect: bool = False):
+        """通知目前連線的工作程序結束 (persistent 工作程序會重新連線)。"""
+        with self.lock:
+            workers = list(self.workers.values())
+        for worker in workers:
+            worker.released = True
+            try:
+                worker.send({'type': 'shutdown'})
+            except OSError:
+                pass
+            if disconnect:
+                worker.disconnect()
+
+    def close(self):
+        """通知所有工作程序結束並關閉連線。"""
+        with self.lock:
+            self.closed = True
+            self.work_ready.notify_all()
+        self.release_workers()
+        # 給工作程序一點時間讀取結束通知並自行斷線，之後強制關閉剩餘的連線
+        deadline = time.time() + REMOTE_POLL_SECONDS
+        while self.worker_count() > 0 and time.time() < deadline:
+            time.sleep(0.05)
+        self.release_workers(disconnect=True)
+        if self.server is not None:
+            self.server.close()
+        family, target = parse_address(self.requested_address)
+        if family == socket.AF_UNIX and os.path.exists(target):
+            os.remove(target)
+        self.started = False
+        logger.info(f"協調者已關閉 (重新指派 {self.reassigned} 個區塊，竊取 {self.stolen} 個區塊)。")
+
+    def worker_count(self) -> int:
+        with self.lock:
+            return len(self.workers)
+
+    def wait_for_workers(self, count: int, timeout: float) -> bool:
+        deadline = time.time() + timeout
+        while self.worker_count() < count:
+            if time.time() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    # --- 連線處理 ---
+    def _accept_loop(self):
+        while not self.closed:
+            try:
+                sock, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(sock,), daemon=True).start()
+
+    def _serve(self, sock: socket.socket):
+        worker = None
+        try:
+            hello, _ = recv_message(sock)
+            if hello is None or hello.get('type') != 'hello':
+                return
+            if self.auth_token is not None and hello.get('token') != self.auth_token:
+                send_message(sock, {'type': 'rejected', 'reason': '驗證字串不符'})
+                logger.warning(f"拒絕工作程序 '{hello.get('name')}' 的連線：驗證字串不符。")
+                return
+            with self.lock:
+                self._next_worker_id += 1
+                worker = _WorkerConnection(self._next_worker_id, sock, str(hello.get('name')))
+                self.workers[worker.worker_id] = worker
+                self.work_ready.notify_all()
+            logger.info(f"工作程序 '{worker.name}' 已連線 (後端 {hello.get('backend')}，目前 {self.worker_count()} 個)。")
+            while True:
+                header, arrays = recv_message(sock)
+                if header is None:
+                    break
+                worker.last_seen = time.time()
+                kind = header.get('type')
+                if kind == 'request':
+                    chunk = self._next_chunk(worker)
+                    if chunk is None:
+                        worker.send({'type': 'wait'})
+                    else:
+                        batch = chunk.batch
+                        worker.send({'type': 'task', 'batch': batch.batch_id, 'chunk': chunk.key[1], 'mode': batch.mode,
+                                     'param_names': batch.param_names},
+                                    {'params': batch.params[chunk.indices], 'freq_points': batch.freq_points})
+                elif kind == 'result':
+                    self._finish_chunk(worker, header, arrays.get('curves'))
+                elif kind == 'bye':
+                    break
+        except (OSError, ConnectionError) as e:
+            if worker is not None and not worker.released:
+                logger.warning(f"工作程序 '{worker.name}' 連線中斷: {e}")
+        finally:
+            if worker is not None:
+                self._drop_worker(worker)
+            sock.close()
+
+    def _monitor_loop(self):
+        while not self.closed:
+            time.sleep(REMOTE_HEARTBEAT_INTERVAL)
+            now = time.time()
+            with self.lock:
+                stale = [worker for worker in self.workers.values() if now - worker.last_seen > REMOTE_WORKER_TIMEOUT]
+            for worker in stale:
+                logger.warning(f"工作程序 '{worker.name}' 超過 {REMOTE_WORKER_TIMEOUT:.0f} 秒沒有心跳，視為失效。")
+                # 關閉 socket 後，該連線的執行緒收到錯誤並由 _drop_worker() 重新指派其區塊
+                worker.disconnect()
+
+    # --- 分派 ---
+    def _assign(self, worker: _WorkerConnection, chunk: _Chunk):
+        if not chunk.holders:
+            chunk.assigned_at = time.time()
+        chunk.attempts += 1
+        chunk.holders.add(worker.worker_id)
+        self.in_flight[chunk.key] = chunk
+        worker.chunks.add(chunk.key)
+
+    def _steal_candidate(self, worker: _WorkerConnection) -> Optional[_Chunk]:
+        """佇列已空時挑選可竊取的區塊：執行最久、尚未達副本上限且不在此工作程序手上。"""
+        now = time.time()
+        candidates = [chunk for chunk in self.in_flight.values()
+                      if not chunk.done and chunk.holders and worker.worker_id not in chunk.holders
+                      and len(chunk.holders) < REMOTE_MAX_COPIES
+                      and now - chunk.assigned_at >= REMOTE_STEAL_AFTER]
+        return min(candidates, key=lambda chunk: chunk.assigned_at) if candidates else None
+
+    def _next_chunk(self, worker: _WorkerConnection) -> Optional[_Chunk]:
+        deadline = time.time() + REMOTE_POLL_SECONDS
+        with self.work_ready:
+            while not self.closed:
+                while self.pending:
+                    chunk = self.pending.popleft()
+                    if not chunk.done:
+                        self._assign(worker, chunk)
+                        return chunk
+                chunk = self._steal_candidate(worker)
+                if chunk is not None:
+                    self.stolen += 1
+                    self._assign(worker, chunk)
+                    return chunk
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.work_ready.wait(min(remaining, REMOTE_STEAL_AFTER))
+        return None
+
+    def _complete(self, chunk: _Chunk):
+        chunk.done = True
+        self.in_flight.pop(chunk.key, None)
+        chunk.batch.remaining -= 1
+        if chunk.batch.remaining == 0:
+            chunk.batch.finished.set()
+
+    def _retry_or_fail(self, chunk: _Chunk, reason: str):
+        """區塊沒有任何工作程序在執行時：未達指派上限則放回佇列前端，否則該塊視為模擬失敗。"""
+        if chunk.holders or chunk.done:
+            return
+        if chunk.attempts >= REMOTE_MAX_CHUNK_ATTEMPTS:
+            logger.error(f"區塊 {chunk.key} 已指派 {chunk.attempts} 次仍未完成 ({reason})，其候選解視為模擬失敗。")
+            self._complete(chunk)
+        else:
+            self.reassigned += 1
+            self.pending.appendleft(chunk)
+            self.work_ready.notify_all()
+
+    def _finish_chunk(self, worker: _WorkerConnection, header: Dict[str, Any], curves: Optional[np.ndarray]):
+        key = (header.get('batch'), header.get('chunk'))
+        with self.lock:
+            worker.chunks.discard(key)
+            chunk = self.in_flight.get(key)
+            if chunk is None or chunk.done:
+                return  # 已由其他副本完成
+            chunk.holders.discard(worker.worker_id)
+            if header.get('error') or curves is None or curves.shape != (len(chunk.indices), chunk.batch.curves.shape[1]):
+                logger.warning(f"工作程序 '{worker.name}' 回報區塊 {key} 失敗: {header.get('error') or '曲線形狀不符'}")
+                self._retry_or_fail(chunk, header.get('error') or '曲線形狀不符')
+                return
+            chunk.batch.curves[chunk.indices] = curves
+            worker.completed += 1
+            self._complete(chunk)
+
+    def _drop_worker(self, worker: _WorkerConnection):
+        with self.lock:
+            if self.workers.pop(worker.worker_id, None) is None:
+                return
+            orphaned = 0
+            for key in list(worker.chunks):
+                chunk = self.in_flight.get(key)
+                if chunk is None or chunk.done:
+                    continue
+                chunk.holders.discard(worker.worker_id)
+                if not chunk.holders:
+                    orphaned += 1
+                    self._retry_or_fail(chunk, f"工作程序 '{worker.name}' 失效")
+            worker.chunks.clear()
+        if worker.released:
+            logger.info(f"工作程序 '{worker.name}' 已結束 (完成 {worker.completed} 個區塊)。")
+        else:
+            logger.warning(f"工作程序 '{worker.name}' 已離線 (完成 {worker.completed} 個區塊)，"
+                           f"重新指派 {orphaned} 個執行中的區塊；剩餘 {self.worker_count()} 個工作程序。")
+
+    # --- 批次評估 ---
+    def map_curves(self, param_matrix: np.ndarray, param_names: List[str], freq_points: np.ndarray,
+                   mode: str = 'CM') -> Tuple[Optional[np.ndarray], Optional[str]]:
+        """
+        將 (P, D) 參數矩陣分給遠端工作程序模擬，回傳 (P×(K·F) 複數阻抗曲線, 錯誤訊息)；
+        個別候選解模擬失敗時該列為 NaN。沒有工作程序連線超過 REMOTE_WAIT_FOR_WORKERS 秒時回傳 (None, 錯誤訊息)。
+        """
+        if not self.started:
+            error = self.start()
+            if error:
+                return None, error
+        params = np.atleast_2d(np.asarray(param_matrix, dtype=float))
+        with self.work_ready:
+            self._next_batch_id += 1
+            batch = _Batch(self._next_batch_id, params, param_names, freq_points, mode)
+            count = max(1, min(len(params), max(1, len(self.workers)) * REMOTE_CHUNKS_PER_WORKER))
+            chunks = [_Chunk(batch, i, indices) for i, indices in enumerate(np.array_split(np.arange(len(params)), count))]
+            batch.remaining = len(chunks)
+            self.pending.extend(chunks)
+            self.work_ready.notify_all()
+
+        idle_since = None
+        while not batch.finished.wait(0.5):
+            if self.worker_count() > 0:
+                idle_since = None
+                continue
+            idle_since = idle_since or time.time()
+            if time.time() - idle_since > REMOTE_WAIT_FOR_WORKERS:
+                with self.lock:
+                    for chunk in chunks:
+                        chunk.done = True
+                        self.in_flight.pop(chunk.key, None)
+                    self.pending = deque(chunk for chunk in self.pending if chunk.batch is not batch)
+                return None, f"超過 {REMOTE_WAIT_FOR_WORKERS:.0f} 秒沒有遠端工作程序連線到 '{self.address}'。"
+        return batch.curves, None
+
+# --- 程序內共用的協調者 (供 M05 'remote' 後端使用) ---
+_SHARED_COORDINATOR: Optional[RemoteCoordinator] = None
+_SHARED_COORDINATOR_LOCK = threading.Lock()
+
+def get_shared_coordinator(address: Optional[str] = None) -> RemoteCoordinator:
+    """取得 (必要時建立並啟動) 本程序共用的協調者，位址預設為 REMOTE_COORDINATOR_ADDRESS。程序結束時通知工作程序結束。"""
+    global _SHARED_COORDINATOR
+    with _SHARED_COORDINATOR_LOCK:
+        if _SHARED_COORDINATOR is None or not _SHARED_COORDINATOR.started:
+            _SHARED_COORDINATOR = RemoteCoordinator(address or REMOTE_COORDINATOR_ADDRESS)
+            if _SHARED_COORDINATOR.start() is None:
+                atexit.register(close_shared_coordinator)
+        return _SHARED_COORDINATOR
+
+def close_shared_coordinator():
+    global _SHARED_COORDINATOR
+    with _SHARED_COORDINATOR_LOCK:
+        if _SHARED_COORDINATOR is not None and _SHARED_COORDINATOR.started:
+            _SHARED_COORDINATOR.close()
+        _SHARED_COORDINATOR = None
+
+# --- 遠端工作程序 ---
+class RemoteWorker:
+    """
+    遠端工作程序：連線到協調者後反覆拉取區塊、以本機後端模擬並回傳曲線，另有背景執行緒定期送出心跳。
+    persistent=False 時收到協調者的結束通知即結束；連線意外中斷時在 connect_timeout 秒內持續重新連線。
+    persistent=True 時協調者結束後仍持續等待下一個協調者 (例如下一次最佳化)。
+    """
+    def __init__(self, address: str, backend: str = 'numpy', name: Optional[str] = None,
+                 connect_timeout: float = REMOTE_CONNECT_TIMEOUT, persistent: bool = False,
+                 auth_token: Optional[str] = REMOTE_AUTH_TOKEN):
+        self.address = address
+        self.backend = backend
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:4]}'
+        self.connect_timeout = connect_timeout
+        self.persistent = persistent
+        self.auth_token = auth_token
+        self.completed = 0
+
+    def simulate_chunk(self, params: np.ndarray, param_names: List[str], freq_points: np.ndarray, mode: str) -> np.ndarray:
+        from modules.m05_ngspice_runner import simulate_impedance_batch
+        _, curves = simulate_impedance_batch(params, param_names, freq_points, mode=mode, return_curves=True, backend=self.backend)
+        return curves
+
+    def _connect(self) -> Optional[socket.socket]:
+        family, target = parse_address(self.address)
+        if family == socket.AF_INET and target[0] in ('', '0.0.0.0'):
+            target = ('127.0.0.1', target[1])
+        deadline = None if self.persistent else time.time() + self.connect_timeout
+        while deadline is None or time.time() < deadline:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            try:
+                sock.connect(target)
+                return sock
+            except OSError:
+                sock.close()
+                time.sleep(REMOTE_RECONNECT_INTERVAL)
+        return None
+
+    def _heartbeat_loop(self, sock: socket.socket, send_lock: threading.Lock, stopped: threading.Event):
+        while not stopped.wait(REMOTE_HEARTBEAT_INTERVAL):
+            try:
+                with send_lock:
+                    send_message(sock, {'type': 'heartbeat'})
+            except OSError:
+                return
+
+    def _session(self, sock: socket.socket) -> bool:
+        """處理一次連線，收到結束通知時回傳 True，連線中斷時拋出 OSError / ConnectionError。"""
+        send_lock, stopped = threading.Lock(), threading.Event()
+        send_message(sock, {'type': 'hello', 'name': self.name, 'backend': self.backend, 'token': self.auth_token})
+        heartbeat = threading.Thread(target=self._heartbeat_loop, args=(sock, send_lock, stopped), daemon=True)
+        heartbeat.start()
+        try:
+            while True:
+                with send_lock:
+                    send_message(sock, {'type': 'request'})
+                header, arrays = recv_message(sock)
+                if header is None:
+                    raise ConnectionError("協調者關閉了連線。")
+                if header['type'] == 'rejected':
+                    logger.error(f"協調者拒絕連線: {header.get('reason')}")
+                    return True
+                if header['type'] == 'shutdown':
+                    return True
+                if header['type'] != 'task':
+                    continue
+                reply = {'type': 'result', 'batch': header['batch'], 'chunk': header['chunk']}
+                try:
+                    curves = self.simulate_chunk(arrays['params'], header['param_names'], arrays['freq_points'], header['mode'])
+                    result_arrays = {'curves': np.asarray(curves, dtype=complex)}
+                except Exception as e:
+                    # 模擬程式的例外只讓這個區塊失敗 (由協調者重新指派)，工作程序繼續服務
+                    logger.exception(f"區塊 ({header['batch']}, {header['chunk']}) 模擬失敗")
+                    reply['error'], result_arrays = f"{type(e).__name__}: {e}", None
+                with send_lock:
+                    send_message(sock, reply, result_arrays)
+                if result_arrays is not None:
+                    self.completed += 1
+        finally:
+            stopped.set()
+
+    def run(self) -> int:
+        """連線並持續服務，回傳完成的區塊數。"""
+        while True:
+            sock = self._connect()
+            if sock is None:
+                logger.error(f"{self.connect_timeout:.0f} 秒內無法連線到協調者 '{self.address}'，工作程序結束。")
+                return self.completed
+            logger.info(f"工作程序 '{self.name}' 已連線到 '{self.address}' (後端 {self.backend})。")
+            try:
+                shutdown = self._session(sock)
+            except (OSError, ConnectionError) as e:
+                logger.warning(f"與協調者的連線中斷 ({e})，嘗試重新連線。")
+                shutdown = False
+            finally:
+                sock.close()
+            if shutdown and not self.persistent:
+                logger.info(f"工作程序 '{self.name}' 結束，共完成 {self.completed} 個區塊。")
+                return self.completed
+
+def run_worker(address: str, backend: str = 'numpy', name: Optional[str] = None,
+               connect_timeout: float = REMOTE_CONNECT_TIMEOUT, persistent: bool = False,
+               auth_token: Optional[str] = REMOTE_AUTH_TOKEN) -> int:
+    return RemoteWorker(address, backend, name, connect_timeout, persistent, auth_token).run()
+
+# --- 示範 (本機多個工作程序) ---
+class _SlowWorker(RemoteWorker):
+    """示範用：每個區塊額外延遲，模擬較慢的機器。"""
+    def simulate_chunk(self, params, param_names, freq_points, mode):
+        time.sleep(3.0)
+        return super().simulate_chunk(params, param_names, freq_points, mode)
+
+class _CrashingWorker(RemoteWorker):
+    """示範用：拿到第二個區塊時程序直接結束，模擬機器當機。"""
+    def simulate_chunk(self, params, param_names, freq_points, mode):
+        if self.completed >= 1:
+            os._exit(1)
+        return super().simulate_chunk(params, param_names, freq_points, mode)
+
+def _demo_worker(address: str, kind: str, name: str):
+    import modules.m05_ngspice_runner as m05
+    # 示範比較的是實際模擬時間，不使用 M14 結果快取
+    m05.RESULT_CACHE_ENABLED = False
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - [%(levelname)s] - (%(module)s) - %(message)s')
+    worker_class = {'normal': RemoteWorker, 'slow': _SlowWorker, 'crash': _CrashingWorker}[kind]
+    worker_class(address, backend='numpy', name=name, connect_timeout=30).run()
+
+def run_demo(workers: int = 3):
+    import modules.m05_ngspice_runner as m05
+    m05.RESULT_CACHE_ENABLED = False
+
+    nominal = {'Rdc': 0.05, 'dL3': 2e-9, 'dR4': 200.0, 'dC3': 1e-12, 'dR3': 5.0, 'C1': 2e-12, 'R2': 50.0,
+               'L1': 5e-6, 'L2': 5e-6, 'L3': 5e-6, 'L4': 5e-6, 'Rs1': 3e3, 'Rs2': 3e3, 'Rs3': 3e3, 'Rs4': 3e3,
+               'ck': 0.5e-12, 'Lp': 1e-9}
+    names = list(nominal)
+    rng = np.random.default_rng(0)
+    params = np.array(list(nominal.values())) * 10 ** rng.uniform(-0.5, 0.5, (240, len(names)))
+    freq = np.logspace(6, np.log10(3e9), 401)
+    start_t = time.time()
+    _, expected = m05.simulate_impedance_batch(params, names, freq, mode='CM+NM', return_curves=True, backend='numpy')
+    print(f"本機 'numpy' 後端批次模擬 {len(params)} 組 (CM+NM)：{time.time() - start_t:.2f} 秒")
+
+    def check(label, curves, error, reassigned, stolen):
+        if curves is None:
+            print(f"  {label}: 失敗 - {error}")
+            return
+        deviation = np.nanmax(np.abs(curves - expected) / np.abs(expected))
+        print(f"  {label}: {len(curves)} 組，與本機計算的最大相對差異 {deviation:.2e}，"
+              f"重新指派 {coordinator.reassigned - reassigned} 塊，竊取 {coordinator.stolen - stolen} 塊")
+
+    socket_path = os.path.join(project_root, 'results', f'm22_demo_{os.getpid()}.sock')
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    address = f'unix:{socket_path}' if hasattr(socket, 'AF_UNIX') else '127.0.0.1:0'
+    coordinator = RemoteCoordinator(address)
+    error = coordinator.start()
+    if error:
+        print(error)
+        return
+
+    scenarios = [
+        ('1. 全部正常', ['normal'] * workers),
+        ('2. 一個工作程序在第二個區塊時當機 (區塊重新指派)', ['crash'] + ['normal'] * (workers - 1)),
+        ('3. 一個較慢的工作程序 (工作竊取)', ['slow'] + ['normal'] * (workers - 1)),
+    ]
+    processes = []
+    for label, kinds in scenarios:
+        print(f"\n--- {label} ---")
+        # 換成這個情境的工作程序組合
+        coordinator.release_workers()
+        while coordinator.worker_count() > 0:
+            time.sleep(0.1)
+        for i, kind in enumerate(kinds):
+            process = multiprocessing.Process(target=_demo_worker, args=(coordinator.address, kind, f'{kind}-{i}'))
+            process.start()
+            processes.append(process)
+        coordinator.wait_for_workers(len(kinds), timeout=60)
+        start_t, reassigned, stolen = time.time(), coordinator.reassigned, coordinator.stolen
+        curves, error = coordinator.map_curves(params, names, freq, mode='CM+NM')
+        check(f"耗時 {time.time() - start_t:.2f} 秒", curves, error, reassigned, stolen)
+    coordinator.close()
+    for process in processes:
+        process.join(timeout=10)
+        if process.is_alive():
+            process.terminate()
+
+# --- 命令列介面 ---
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='M05 remote 後端的遠端工作程序')
+    commands = parser.add_subparsers(dest='command')
+    worker = commands.add_parser('worker', help='連線到協調者並提供模擬')
+    worker.add_argument('--connect', default=REMOTE_COORDINATOR_ADDRESS, help="協調者位址 ('主機:埠' 或 'unix:路徑')")
+    worker.add_argument('--backend', default='numpy', help="本機模擬後端 ('numpy'、'ngspice' 或 'ngspice_pool')")
+    worker.add_argument('--name', help='工作程序名稱 (預設為 主機:PID)')
+    worker.add_argument('--token', default=REMOTE_AUTH_TOKEN, help='協調者要求的驗證字串')
+    worker.add_argument('--connect-timeout', type=float, default=REMOTE_CONNECT_TIMEOUT)
+    worker.add_argument('--persistent', action='store_true', help='協調者結束後繼續等待下一個協調者')
+    demo = commands.add_parser('demo', help='以本機多個工作程序測試分派、當機重新指派與工作竊取')
+    demo.add_argument('--workers', type=int, default=3)
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 0
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - [%(levelname)s] - (%(module)s) - %(message)s')
+    if args.command == 'worker':
+        run_worker(args.connect, args.backend, args.name, args.connect_timeout, args.persistent, args.token)
+    elif args.command == 'demo':
+        print("正在執行 M22 模組 (Remote Workers) 示範...")
+        run_demo(max(2, args.workers))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
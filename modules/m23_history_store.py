@@ -0,0 +1,262 @@
+# m23_history_store.py
+# -*- coding: utf-8 -*-
+
+"""
+模組 M23: 分塊、只附加的最佳化歷史紀錄
+
+功能：
+1. HistoryWriter：M03 / M04 回呼每次迭代的 (iteration, error, 參數...) 與模擬曲線先放在記憶體緩衝區，
+   累積 HISTORY_CHUNK_ROWS 筆或距上次寫入超過 HISTORY_FLUSH_SECONDS 秒時，寫成一個區塊：
+   params_{編號}.npy (n, C) float64 與 curves_{編號}.npy (n, R, 3) float64，再更新 index.json。
+   區塊與索引皆先寫暫存檔再取代，程序當機時最多遺失尚未寫入的緩衝筆數，已寫入的區塊不會損毀；
+   記憶體只保留緩衝區，不再隨迭代次數成長。
+2. 曲線形狀改變時 (例如 M20 多階解析度切換頻率點數) 先結束目前區塊，每個區塊各自記錄曲線形狀；
+   沒有曲線的迭代 (例如 DE 以 workers=-1 在子程序評估) 在區塊中以 NaN 填補。
+3. truncate()：從檢查點續跑時捨棄檢查點之後才寫入的紀錄。
+4. HistoryReader：以 memory map 讀取區塊，table() 回傳所有迭代的參數表 (DataFrame)，
+   curve(i) 只讀取第 i 次迭代的曲線，不必載入全部曲線。M07 與 M08 皆透過此介面讀取歷史紀錄。
+
+歷史紀錄為一個目錄 (如 'results/history_20261018-120000/')：
+    index.json          欄位名稱、總筆數、各區塊的起始迭代 / 筆數 / 檔名 / 曲線形狀與附加資訊 (mode 等)
+    params_00000.npy    第一個區塊的參數表
+    curves_00000.npy    第一個區塊的曲線
+"""
+
+import os
+import json
+import time
+import bisect
+import logging
+import numpy as np
+import pandas as pd
+from typing import Optional, List, Dict, Tuple, Any, Sequence
+
+# --- 全域設定 ---
+# 每個區塊的最多筆數
+HISTORY_CHUNK_ROWS = 64
+# 緩衝區最久保留的秒數，超過即寫入 (None 表示只依筆數寫入)
+HISTORY_FLUSH_SECONDS = 30.0
+HISTORY_FORMAT_VERSION = 1
+INDEX_FILENAME = 'index.json'
+
+logger = logging.getLogger(__name__)
+
+def _replace_atomically(path: str, write):
+    """以 write(檔案物件) 寫入 path 的暫存檔後取代 path。"""
+    partial_path = f'{path}.partial'
+    with open(partial_path, 'wb') as f:
+        write(f)
+    os.replace(partial_path, path)
+
+def _load_index(path: str) -> Dict[str, Any]:
+    with open(os.path.join(path, INDEX_FILENAME), 'r', encoding='utf-8') as f:
+        index = json.load(f)
+    if index.get('version') != HISTORY_FORMAT_VERSION:
+        raise ValueError(f"歷史紀錄 '{path}' 的格式版本 {index.get('version')} 不受支援 (預期 {HISTORY_FORMAT_VERSION})。")
+    return index
+
+class HistoryWriter:
+    """
+    只附加的歷史紀錄寫入器。columns 為參數表的欄位 (通常為 ['iteration', 'error'] + 參數名稱)，
+    meta 為寫入 index.json 的附加資訊 (如 {'mode': 'CM+NM'})。resume=True 時開啟既有的歷史紀錄繼續寫入。
+    """
+    def __init__(self, path: str, columns: Sequence[str], meta: Optional[Dict[str, Any]] = None,
+                 chunk_rows: int = HISTORY_CHUNK_ROWS, flush_seconds: Optional[float] = HISTORY_FLUSH_SECONDS,
+                 resume: bool = False):
+        self.path = str(path)
+        self.chunk_rows = max(1, int(chunk_rows))
+        self.flush_seconds = flush_seconds
+        if resume:
+            index = _load_index(self.path)
+            if index['columns'] != list(columns):
+                raise ValueError(f"歷史紀錄 '{self.path}' 的欄位與目前的參數不一致。")
+            self.columns, self.meta, self.chunks = index['columns'], index.get('meta', {}), index['chunks']
+        else:
+            os.makedirs(self.path, exist_ok=True)
+            self.columns, self.meta, self.chunks = list(columns), dict(meta or {}), []
+            self._write_index()
+        self.rows = sum(chunk['rows'] for chunk in self.chunks)
+        self._buffer_rows: List[np.ndarray] = []
+        self._buffer_curves: List[Optional[np.ndarray]] = []
+        self._buffer_shape: Optional[Tuple[int, ...]] = None
+        self._last_flush = time.time()
+
+    def __len__(self) -> int:
+        return self.rows + len(self._buffer_rows)
+
+    def _write_index(self):
+        index = {'version': HISTORY_FORMAT_VERSION, 'columns': self.columns, 'rows': sum(c['rows'] for c in self.chunks),
+                 'chunks': self.chunks, 'meta': self.meta}
+        _replace_atomically(os.path.join(self.path, INDEX_FILENAME),
+                            lambda f: f.write(json.dumps(index, ensure_ascii=False, indent=1).encode('utf-8')))
+
+    def append(self, values: Sequence[float], curve: Optional[np.ndarray] = None):
+        """加入一筆紀錄 (values 依 columns 順序) 與對應的曲線 (形狀通常為 (F, 3))。"""
+        values = np.asarray(values, dtype=float)
+        if values.shape != (len(self.columns),):
+            raise ValueError(f"歷史紀錄需要 {len(self.columns)} 個欄位，收到 {values.shape}。")
+        if curve is not None:
+            curve = np.asarray(curve, dtype=float)
+            if self._buffer_shape is not None and curve.shape != self._buffer_shape:
+                # 曲線形狀改變 (例如頻率點數改變)：先結束目前的區塊
+                self.flush()
+            self._buffer_shape = curve.shape
+        self._buffer_rows.append(values)
+        self._buffer_curves.append(curve)
+        if len(self._buffer_rows) >= self.chunk_rows or (
+                self.flush_seconds is not None and time.time() - self._last_flush >= self.flush_seconds):
+            self.flush()
+
+    def _write_chunk(self, start: int, params: np.ndarray, curves: Optional[np.ndarray]) -> Dict[str, Any]:
+        """以新的編號寫入一個區塊的檔案，回傳其索引項目 (尚未加入索引)。"""
+        number = max((int(chunk['params'][len('params_'):-len('.npy')]) for chunk in self.chunks), default=-1) + 1
+        chunk = {'start': start, 'rows': len(params), 'params': f'params_{number:05d}.npy', 'curves': None, 'curve_shape': None}
+        _replace_atomically(os.path.join(self.path, chunk['params']), lambda f: np.save(f, params))
+        if curves is not None:
+            chunk['curves'], chunk['curve_shape'] = f'curves_{number:05d}.npy', list(curves.shape[1:])
+            _replace_atomically(os.path.join(self.path, chunk['curves']), lambda f: np.save(f, curves))
+        return chunk
+
+    def flush(self):
+        """將緩衝區寫成一個新區塊並更新索引。"""
+        self._last_flush = time.time()
+        if not self._buffer_rows:
+            return
+        params = np.vstack(self._buffer_rows)
+        curves = None
+        if self._buffer_shape is not None:
+            curves = np.full((len(params),) + self._buffer_shape, np.nan)
+            for i, curve in enumerate(self._buffer_curves):
+                if curve is not None:
+                    curves[i] = curve
+        self.chunks.append(self._write_chunk(self.rows, params, curves))
+        self.rows += len(params)
+        self._write_index()
+        self._buffer_rows, self._buffer_curves, self._buffer_shape = [], [], None
+
+    def truncate(self, count: int):
+        """只保留前 count 筆紀錄 (從檢查點續跑時捨棄檢查點之後寫入的紀錄)。"""
+        self.flush()
+        kept = [chunk for chunk in self.chunks if chunk['start'] + chunk['rows'] <= count]
+        removed = [chunk for chunk in self.chunks if chunk['start'] + chunk['rows'] > count]
+        for chunk in removed:
+            if chunk['start'] < count:
+                # 跨越截斷點的區塊：前段另存為新區塊，舊檔與其他被捨棄的區塊一起在索引更新後刪除
+                keep = count - chunk['start']
+                params = np.load(os.path.join(self.path, chunk['params']))[:keep]
+                curves = np.load(os.path.join(self.path, chunk['curves']))[:keep] if chunk['curves'] else None
+                kept.append(self._write_chunk(chunk['start'], params, curves))
+        self.chunks = kept
+        self.rows = sum(chunk['rows'] for chunk in kept)
+        self._write_index()
+        # 索引更新後才刪除不再引用的區塊檔，中途當機時索引仍指向完整的舊區塊
+        for chunk in removed:
+            for key in ('params', 'curves'):
+                if chunk[key]:
+                    os.remove(os.path.join(self.path, chunk[key]))
+
+    def close(self):
+        self.flush()
+
+class HistoryReader:
+    """
+    讀取 HistoryWriter 寫入的歷史紀錄 (寫入中的紀錄也可讀取，只包含已寫入的區塊)。
+    區塊以 memory map 開啟，curve(i) 只讀取單一迭代的曲線。
+    """
+    def __init__(self, path: str):
+        self.path = str(path)
+        index = _load_index(self.path)
+        self.columns: List[str] = index['columns']
+        self.meta: Dict[str, Any] = index.get('meta', {})
+        self.chunks: List[Dict[str, Any]] = index['chunks']
+        self._starts = [chunk['start'] for chunk in self.chunks]
+        self._arrays: Dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return sum(chunk['rows'] for chunk in self.chunks)
+
+    @property
+    def param_names(self) -> List[str]:
+        return [name for name in self.columns if name not in ('iteration', 'error')]
+
+    def _array(self, filename: str) -> np.ndarray:
+        if filename not in self._arrays:
+            self._arrays[filename] = np.load(os.path.join(self.path, filename), mmap_mode='r')
+        return self._arrays[filename]
+
+    def _locate(self, i: int) -> Tuple[Dict[str, Any], int]:
+        count = len(self)
+        if not -count <= i < count:
+            raise IndexError(f"迭代索引 {i} 超出範圍 (共 {count} 筆)。")
+        i %= count
+        chunk = self.chunks[bisect.bisect_right(self._starts, i) - 1]
+        return chunk, i - chunk['start']
+
+    def table(self) -> pd.DataFrame:
+        """所有迭代的參數表，欄位同寫入時的 columns。"""
+        if not self.chunks:
+            return pd.DataFrame(columns=self.columns)
+        return pd.DataFrame(np.vstack([self._array(chunk['params']) for chunk in self.chunks]), columns=self.columns)
+
+    def row(self, i: int) -> Dict[str, float]:
+        chunk, offset = self._locate(i)
+        return dict(zip(self.columns, np.array(self._array(chunk['params'])[offset], dtype=float)))
+
+    def curve(self, i: int) -> Optional[np.ndarray]:
+        """第 i 次迭代的曲線 (複製出的陣列)；該區塊沒有記錄曲線時回傳 None，該次迭代缺曲線時為 NaN。"""
+        chunk, offset = self._locate(i)
+        if not chunk['curves']:
+            return None
+        return np.array(self._array(chunk['curves'])[offset])
+
+def load_history(path: str) -> Tuple[Optional[HistoryReader], Optional[str]]:
+    """開啟歷史紀錄目錄，回傳 (reader, 錯誤訊息)。"""
+    try:
+        return HistoryReader(path), None
+    except FileNotFoundError:
+        return None, f"找不到歷史紀錄: {path}"
+    except (OSError, ValueError, KeyError) as e:
+        return None, f"無法讀取歷史紀錄 '{path}': {e}"
+
+# --- 主程式 (示範) ---
+if __name__ == '__main__':
+    import tempfile
+    print("正在執行 M23 模組 (History Store) 示範...")
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    columns = ['iteration', 'error'] + [f'p{i}' for i in range(17)]
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        # 1. 寫入速度：與原本每次迭代附加一列 CSV 的作法比較
+        total = 2000
+        curves = rng.standard_normal((8, 401, 3))
+        rows = rng.standard_normal((total, len(columns)))
+        rows[:, 0] = np.arange(total)
+        start_t = time.time()
+        csv_path = os.path.join(tmp, 'history.csv')
+        pd.DataFrame(columns=columns).to_csv(csv_path, index=False)
+        for i in range(total):
+            pd.DataFrame([rows[i]], columns=columns).to_csv(csv_path, mode='a', header=False, index=False)
+        csv_seconds = time.time() - start_t
+        start_t = time.time()
+        writer = HistoryWriter(os.path.join(tmp, 'history'), columns, meta={'mode': 'CM'})
+        for i in range(total):
+            writer.append(rows[i], curves[i % 8])
+        writer.close()
+        store_seconds = time.time() - start_t
+        print(f"{total} 次迭代：逐列附加 CSV (不含曲線) {csv_seconds:.2f} 秒，分塊歷史紀錄 (含曲線) {store_seconds:.2f} 秒，"
+              f"共 {len(writer.chunks)} 個區塊")
+
+        # 2. 隨機讀取與參數表
+        reader = HistoryReader(os.path.join(tmp, 'history'))
+        assert len(reader) == total and np.array_equal(reader.curve(1234), curves[1234 % 8])
+        assert np.array_equal(reader.table().values, rows)
+        print(f"讀取：{len(reader)} 筆，curve(1234) 與寫入的曲線一致，參數表 {reader.table().shape}")
+
+        # 3. 曲線形狀改變、缺曲線與截斷
+        writer = HistoryWriter(os.path.join(tmp, 'history'), columns, resume=True)
+        writer.append(rows[0], curves[0][:41])
+        writer.append(rows[1], None)
+        writer.truncate(1500)
+        reader = HistoryReader(os.path.join(tmp, 'history'))
+        print(f"截斷至 1500 筆後：{len(reader)} 筆，{len(reader.chunks)} 個區塊，最後一筆 iteration = {reader.row(-1)['iteration']:.0f}")